@@ -124,7 +124,6 @@ ensure_sql_connections_exist=True
 http_server_header=Zato
 zeromq_connect_sleep=0.1
 aws_host=
-fifo_response_buffer_size=0.2 # In MB
 jwt_secret=zato+secret://zato.server_conf.misc.jwt_secret
 enforce_service_invokes=False
 return_tracebacks=True
@@ -134,6 +133,12 @@ return_json_schema_errors=False
 sftp_genkey_command=dropbearkey
 posix_ipc_skip_platform=darwin
 service_invoker_allow_internal="pub.zato.ping", "/zato/api/invoke/service_name"
+url_path_cache_max_size=10000
+invoke_all_max_concurrency=20
+invoke_all_deadline=60 # In seconds
+http_stream_chunk_size=65536 # In bytes
+kvdb_use_wal=True
+kvdb_wal_compact_threshold=100000
 
 [events]
 fs_data_path = {{events_fs_data_path}}
@@ -430,6 +430,9 @@ class CACHE:
     class DEFAULT:
         MAX_SIZE = 10000
         MAX_ITEM_SIZE = 10000 # In characters for string/unicode, bytes otherwise
+        MAX_BYTES = 0 # Approximate memory used by all entries, 0 means no limit
+        SYNC_BATCH_INTERVAL = 0.005 # In seconds, how long state changes are buffered before being sent to other workers
+        SYNC_BATCH_MAX_SIZE = 1000 # A batch is sent right away if it has this many state changes
 
     class PERSISTENT_STORAGE:
         NO_PERSISTENT_STORAGE = NameId('No persistent storage', 'no-persistent-storage')
@@ -517,6 +520,7 @@ class KVDB(Attrs):
 class SCHEDULER:
 
     InitialSleepTime = 0.1
+    JobPoolSize = 100
     DefaultHost = '127.0.0.1'
     DefaultPort = 31530
     EmbeddedIndicator      = 'zato_embedded'
@@ -1144,6 +1148,16 @@ class IPC:
 # ################################################################################################################################
 # ################################################################################################################################
 
+class INVOKE_ALL:
+
+    # Used when all servers, or all the processes of a server, are invoked
+    class DEFAULT:
+        MAX_CONCURRENCY = 20 # How many servers or processes may be invoked at a time
+        DEADLINE = 60 # In seconds, how long all of the invocations may take together
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class WEB_SOCKET:
 
     AUDIT_KEY = 'wsx-connection'
@@ -1156,6 +1170,8 @@ class WEB_SOCKET:
         INTERACT_UPDATE_INTERVAL = 60 # 60 minutes = 1 hour
         PINGS_MISSED_THRESHOLD = 2
         PING_INTERVAL = 30
+        BROADCAST_CONCURRENCY = 100
+        BROADCAST_MAX_IN_FLIGHT = 10
 
     class PATTERN:
         BY_EXT_ID = 'zato.by-ext-id.{}'
@@ -1586,6 +1602,10 @@ class HL7:
         # At most that many bytes will be read from a socket at a time
         read_buffer_size = 2048
 
+        # How many messages from the same connection an MLLP channel processes concurrently,
+        # responses are always sent in the order that messages were received in.
+        pipeline_size = 1
+
         # We wait at most that many milliseconds for data from a socket in each iteration of the main loop
         recv_timeout = 250
 
@@ -1652,6 +1672,12 @@ class SIMPLE_IO:
     HTTP_SOAP_FORMAT[HL7.Const.Version.v2.id] = HL7.Const.Version.v2.name
     HTTP_SOAP_FORMAT[DATA_FORMAT.FORM_DATA] = 'Form data'
 
+    # Data formats that lists of output elements can be streamed in
+    STREAM_FORMAT = {DATA_FORMAT.JSON, DATA_FORMAT.CSV}
+
+    class DEFAULT:
+        STREAM_CHUNK_SIZE = 65536 # In bytes, how much of a streamed response is sent at a time
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -1682,6 +1708,12 @@ class ZatoKVDB:
     DefaultSyncThreshold = 3_000
     DefaultSyncInterval  = 3
 
+    # How many records a write-ahead log may have before it is compacted into a snapshot
+    DefaultCompactThreshold = 100_000
+
+    # Appended to paths of snapshots to obtain paths of their write-ahead logs
+    WALSuffix = '.wal'
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -1707,6 +1739,13 @@ class StatsKey:
     PerKeyMin   = 'min'
     PerKeyMax   = 'max'
     PerKeyMean  = 'mean'
+    PerKeyCount = 'count'
+
+    PerKeyP50 = 'p50'
+    PerKeyP90 = 'p90'
+    PerKeyP99 = 'p99'
+
+    PerKeyHistogram = 'histogram'
 
     PerKeyValue         = 'value'
     PerKeyLastTimestamp = 'last_timestamp'
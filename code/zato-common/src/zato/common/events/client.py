@@ -12,15 +12,11 @@ from datetime import datetime
 from logging import getLogger
 
 # gevent
-from gevent import sleep
+from gevent import sleep, spawn
 from gevent.lock import RLock
 
-# orjson
-from orjson import dumps
-
 # Zato
-from zato.common.events.common import Action
-from zato.common.typing_ import asdict
+from zato.common.events.common import Action, batch_header, Default, encode_event
 from zato.common.util.api import new_cid
 from zato.common.util.json_ import json_loads
 from zato.common.util.tcp import read_from_socket, SocketReaderCtx, wait_until_port_taken
@@ -63,6 +59,29 @@ class Client:
         self.is_connected = False
         self.lock = RLock()
 
+        # Events are sent in batches of that many events ..
+        self.batch_size = Default.batch_size
+
+        # .. or once in that many seconds ..
+        self.flush_interval = Default.flush_interval
+
+        # .. and if a batch cannot be sent as quickly as new events arrive, events beyond that many are dropped.
+        self.max_buffered = Default.max_buffered
+
+        # Events encoded and waiting to be sent. A new buffer is used while the previous one is being sent.
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.is_flushing = False
+
+        # Background flushing runs until this is False
+        self.keep_running = True
+
+        # Counters of events
+        self.total_pushed = 0
+        self.total_sent = 0
+        self.total_dropped = 0
+        self.total_batches = 0
+
 # ################################################################################################################################
 
     def connect(self):
@@ -90,16 +109,19 @@ class Client:
 
 # ################################################################################################################################
 
-    def send(self, action, data=b''):
-        # type: (bytes) -> None
+    def send(self, action, data=b'', end=b'\n'):
+        # type: (bytes, bytes, bytes) -> bool
         with self.lock:
             try:
-                self.socket.sendall(action + data + b'\n')
+                self.socket.sendall(action + data + end)
             except Exception as e:
                 self.is_connected = False
                 logger.info('Socket send error `%s` -> %s', e.args, self.remote_addr_str)
                 self.close()
                 self.connect()
+                return False
+            else:
+                return True
 
 # ################################################################################################################################
 
@@ -140,22 +162,73 @@ class Client:
 # ################################################################################################################################
 
     def push(self, ctx):
+        """ Adds an event to the current batch, sending the batch if it is full. If the previous batch is still
+        being sent and the current one is at max_buffered already, the event is dropped.
+        """
         # type: (PushCtx) -> None
 
-        # Serialise the context to dict ..
-        data = asdict(ctx)
+        # The server cannot keep up with us ..
+        if self.buffered >= self.max_buffered:
+            self.total_dropped += 1
+            return
 
-        # .. now to JSON ..
-        data = dumps(data)
+        # .. otherwise, add the event to the current batch ..
+        self.buffer += encode_event(ctx)
+        self.buffered += 1
+        self.total_pushed += 1
 
-        # .. and send it across (there will be no response).
-        self.send(Action.Push, data)
+        # .. and send it if it is full, unless the previous one is still being sent.
+        if self.buffered >= self.batch_size and not self.is_flushing:
+            self.flush()
+
+# ################################################################################################################################
+
+    def flush(self):
+        """ Sends all the events buffered so far in one frame (there will be no response).
+        """
+        with self.lock:
+
+            if not self.buffered:
+                return
+
+            # New events will go to a new buffer while we are sending this one ..
+            buffer, buffered = self.buffer, self.buffered
+            self.buffer = bytearray()
+            self.buffered = 0
+            self.is_flushing = True
+
+            try:
+                # .. the frame begins with its length, which is why, unlike other actions, it does not end with a newline ..
+                is_sent = self.send(Action.PushBatch, batch_header.pack(len(buffer), buffered) + buffer, b'')
+            finally:
+                self.is_flushing = False
+
+            # .. and if it could not be sent, its events are lost.
+            if is_sent:
+                self.total_sent += buffered
+                self.total_batches += 1
+            else:
+                self.total_dropped += buffered
+
+# ################################################################################################################################
+
+    def _flush_in_background(self):
+
+        while self.keep_running:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.info('Flush error `%s` -> %s', e.args, self.remote_addr_str)
 
 # ################################################################################################################################
 
     def get_table(self):
 
-        # Request the tabulated data ..
+        # Make sure that the server has all the events that we have ..
+        self.flush()
+
+        # .. request the tabulated data ..
         self.send(Action.GetTable)
 
         # .. wait for the reply ..
@@ -172,7 +245,10 @@ class Client:
 
     def sync_state(self):
 
-        # Request that the database sync its state with persistent storage ..
+        # Send all the events that we have ..
+        self.flush()
+
+        # .. request that the database sync its state with persistent storage ..
         self.send(Action.SyncState)
 
         # .. wait for the reply
@@ -193,8 +269,11 @@ class Client:
         # .. do connect now ..
         self.connect()
 
-        # .. and ping the remote end to confirm that we have connectivity.
+        # .. ping the remote end to confirm that we have connectivity ..
         self.ping()
 
+        # .. and send events in background if there are not enough of them to fill a batch.
+        _ = spawn(self._flush_in_background)
+
 # ################################################################################################################################
 # ################################################################################################################################
@@ -7,6 +7,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from struct import Struct
 from typing import Optional as optional
 
 # Zato
@@ -26,6 +27,27 @@ class Default:
     # .. or once in that many seconds.
     sync_interval = 30
 
+    # Partitions with at least that many files are compacted into one file ..
+    compact_min_files = 10
+
+    # .. which is checked once in that many seconds.
+    compact_interval = 60
+
+    # Statistics of each minute are kept for that many milliseconds ..
+    rollup_minute_retention = 1000 * 60 * 60 * 6
+
+    # .. and statistics of each hour for that many, after which only statistics of each day are kept.
+    rollup_hour_retention = 1000 * 60 * 60 * 24 * 31
+
+    # Clients send events in batches of that many events ..
+    batch_size = 1000
+
+    # .. or once in that many seconds ..
+    flush_interval = 1
+
+    # .. and if the server cannot keep up, events beyond that many are dropped.
+    max_buffered = 100_000
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -50,6 +72,7 @@ class Action:
     GetTable       = b'04'
     GetTableReply  = b'05'
     SyncState      = b'06'
+    PushBatch      = b'07'
 
     LenAction = len(Ping)
 
@@ -79,3 +102,78 @@ class PushCtx:
 
 # ################################################################################################################################
 # ################################################################################################################################
+
+# Each batch begins with the length of its events, in bytes, and the number of events ..
+batch_header = Struct('<II')
+
+# .. and each event in a batch is a header with its numbers and lengths of its text fields, followed by the text fields.
+event_int_fields = ('event_type', 'object_type', 'total_time_ms')
+event_text_fields = ('id', 'cid', 'timestamp', 'source_type', 'source_id', 'object_id', 'recipient_type', 'recipient_id')
+event_header = Struct('<3q8I')
+
+# Length of text fields that are None
+none_length = 0xFFFF_FFFF
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def encode_event(ctx, _event_header_pack=event_header.pack, _none_length=none_length):
+    """ Encodes a PushCtx, or any other object with the same attributes, as an event of a batch.
+    """
+    # type: (PushCtx) -> bytes
+
+    texts = []
+    lengths = []
+
+    for name in event_text_fields:
+        value = getattr(ctx, name, None)
+        if value is None:
+            lengths.append(_none_length)
+        else:
+            value = str(value).encode('utf8')
+            texts.append(value)
+            lengths.append(len(value))
+
+    return _event_header_pack(
+        getattr(ctx, 'event_type', None) or 0,
+        getattr(ctx, 'object_type', None) or 0,
+        getattr(ctx, 'total_time_ms', None) or 0,
+        *lengths
+    ) + b''.join(texts)
+
+# ################################################################################################################################
+
+def decode_batch(data, _unpack_from=event_header.unpack_from, _header_size=event_header.size, _none_length=none_length):
+    """ Decodes all the events of a batch, returning a list of dicts, one per event.
+    """
+    # type: (bytes) -> list
+
+    out = []
+    data = memoryview(data)
+    data_len = len(data)
+    offset = 0
+
+    while offset < data_len:
+
+        event_type, object_type, total_time_ms, *lengths = _unpack_from(data, offset)
+        offset += _header_size
+
+        event = {
+            'event_type': event_type,
+            'object_type': object_type,
+            'total_time_ms': total_time_ms,
+        }
+
+        for name, length in zip(event_text_fields, lengths):
+            if length == _none_length:
+                event[name] = None
+            else:
+                event[name] = str(data[offset:offset+length], 'utf8')
+                offset += length
+
+        out.append(event)
+
+    return out
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -70,7 +70,7 @@ class InRAMStore:
 
     def should_sync(self):
         # type: () -> bool
-        sync_by_threshold = self.num_events_since_sync % self.sync_threshold == 0
+        sync_by_threshold = self.num_events_since_sync >= self.sync_threshold
         sync_by_time = (utcnow() - self.last_sync_time).total_seconds() >= self.sync_interval
 
         return sync_by_threshold or sync_by_time
@@ -82,11 +82,12 @@ class InRAMStore:
 
 # ################################################################################################################################
 
-    def post_modify_state(self):
+    def post_modify_state(self, num_events=1):
+        # type: (int) -> None
 
         # .. update counters ..
-        self.num_events_since_sync += 1
-        self.total_events += 1
+        self.num_events_since_sync += num_events
+        self.total_events += num_events
 
         # .. check if sync is needed only if our class implements the method ..
         if self.sync_state:
@@ -103,8 +104,8 @@ class InRAMStore:
 
 # ################################################################################################################################
 
-    def access_state(self, opcode, data):
-        # type: (str, object) -> None
+    def access_state(self, opcode, data, num_events=1):
+        # type: (str, object, int) -> None
         with self.update_lock:
 
             # Maps the incoming upcode to an actual function to handle data ..
@@ -114,7 +115,7 @@ class InRAMStore:
             func(data)
 
             # .. update metadata and, possibly, sync state (storage).
-            self.post_modify_state()
+            self.post_modify_state(num_events)
 
 # ################################################################################################################################
 # ################################################################################################################################
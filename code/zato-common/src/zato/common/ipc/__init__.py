@@ -11,11 +11,19 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import os
 from datetime import datetime
+from pickle import dumps, HIGHEST_PROTOCOL, loads
+from struct import Struct
 from tempfile import gettempdir
 
 # Zato
 from zato.common.api import DATA_FORMAT, NO_DEFAULT_VALUE
-from zato.common.util.api import get_logger_for_class, make_repr, new_cid, spawn_greenlet
+from zato.common.util.api import get_logger_for_class, make_repr, new_cid
+
+# ################################################################################################################################
+
+# Each frame is a pickled object preceded by its length, as a 4-byte unsigned integer in network byte order
+frame_header = Struct('!I')
+frame_header_size = frame_header.size
 
 # ################################################################################################################################
 
@@ -31,7 +39,7 @@ class Request:
         self.request_id = request_id or 'ipc.{}'.format(new_cid())
         self.target_pid = None
         self.reply_to_tag = ''
-        self.reply_to_fifo = ''
+        self.needs_response = True
         self.in_reply_to = ''
         self.socket = None
         self.creation_time_utc = datetime.utcnow()
@@ -50,65 +58,41 @@ class Request:
 
 # ################################################################################################################################
 
-class IPCBase:
-    """ Base class for core IPC objects.
+class IPCEndpoint:
+    """ A participant in IPC conversations, i.e. either a client or a server. Both sides exchange
+    length-prefixed frames over a Unix domain socket that stays open for as long as the processes run.
     """
     def __init__(self, name, pid):
-
-        # ZeroMQ
-        import zmq.green as zmq
-
         self.name = name
         self.pid = pid
-        self.ctx = zmq.Context()
-        self.socket = None
-        spawn_greenlet(self.set_up_sockets)
         self.keep_running = True
         self.logger = get_logger_for_class(self.__class__)
-        self.log_connected()
 
     def __repr__(self):
         return make_repr(self)
 
-    def set_up_sockets(self):
-        raise NotImplementedError('Needs to be implemented in subclasses')
+    @staticmethod
+    def get_address(name):
+        return os.path.join(gettempdir(), 'zato-ipc-{}.sock'.format(name))
 
-    def log_connected(self):
-        raise NotImplementedError('Needs to be implemented in subclasses')
+    def send_frame(self, socket, data, _dumps=dumps, _protocol=HIGHEST_PROTOCOL, _pack=frame_header.pack):
+        data = _dumps(data, _protocol)
+        socket.sendall(_pack(len(data)) + data)
 
-    def close(self):
-        raise NotImplementedError('Needs to be implemented in subclasses')
+    def _recv_exactly(self, socket, size):
+        buff = bytearray()
+        while len(buff) < size:
+            data = socket.recv(size - len(buff))
+            if not data:
+                raise EOFError('IPC socket closed by peer')
+            buff += data
+        return buff
 
-# ################################################################################################################################
-
-class IPCEndpoint(IPCBase):
-    """ A participant in IPC conversations, i.e. either publisher or subscriber.
-    """
-    socket_method = None
-    socket_type = None
-
-    def __init__(self, name, pid):
-        self.address = self.get_address(name)
-        super(IPCEndpoint, self).__init__(name, pid)
-
-    def get_address(self, address):
-        return 'ipc://{}'.format(os.path.join(gettempdir(), 'zato-ipc-{}'.format(address)))
-
-    def set_up_sockets(self):
-
-        # ZeroMQ
-        import zmq.green as zmq
-
-        self.socket = self.ctx.socket(getattr(zmq, self.socket_type.upper()))
-        self.socket.setsockopt(zmq.LINGER, 0)
-        getattr(self.socket, self.socket_method)(self.address)
-
-    def log_connected(self):
-        self.logger.info('Established %s/%s to %s (self.pid: %s)', self.socket_type, self.socket_method, self.address, self.pid)
+    def recv_frame(self, socket, _loads=loads, _unpack=frame_header.unpack, _header_size=frame_header_size):
+        size, = _unpack(self._recv_exactly(socket, _header_size))
+        return _loads(self._recv_exactly(socket, size))
 
     def close(self):
-        self.keep_running = False
-        self.socket.close()
-        self.ctx.term()
+        raise NotImplementedError('Needs to be implemented in subclasses')
 
 # ################################################################################################################################
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from traceback import format_exc
+
+# gevent
+from gevent import socket, spawn
+from gevent.event import AsyncResult
+from gevent.lock import RLock
+
+# Zato
+from zato.common.api import IPC
+from zato.common.ipc import IPCEndpoint, Request
+
+# ################################################################################################################################
+
+class IPCClient(IPCEndpoint):
+    """ Sends IPC requests to a server in another process over a single connection that is kept open.
+    Any number of requests may be in flight at a time, each waiting for the response with its request ID.
+    """
+    def __init__(self, name, pid, target_name):
+        super(IPCClient, self).__init__(name, pid)
+        self.address = self.get_address(target_name)
+        self.is_connected = False
+        self.send_lock = RLock()
+        self.pending = {} # Request ID -> AsyncResult with the response to that request
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.address)
+        self.is_connected = True
+
+        spawn(self._read_responses)
+        self.logger.info('Established IPC connection to %s (self.pid: %s)', self.address, self.pid)
+
+# ################################################################################################################################
+
+    def _read_responses(self):
+
+        try:
+            while self.keep_running:
+                request_id, response = self.recv_frame(self.socket)
+
+                # There may be no one waiting for it anymore if the request has timed out
+                result = self.pending.pop(request_id, None)
+                if result:
+                    result.set(response)
+
+        except (EOFError, OSError):
+            self.logger.debug('IPC connection to %s closed', self.address)
+        except Exception:
+            self.logger.warning('Error in IPC client, e:`%s`', format_exc())
+        finally:
+            self._on_disconnected()
+
+# ################################################################################################################################
+
+    def _on_disconnected(self):
+
+        self.is_connected = False
+
+        # No response will be received through this connection so we need to let the callers know about it
+        pending, self.pending = self.pending, {}
+        for result in pending.values():
+            result.set_exception(EOFError('IPC connection to {} closed'.format(self.address)))
+
+# ################################################################################################################################
+
+    def invoke(self, payload, service='', target_pid=None, timeout=90, is_async=False, action=IPC.ACTION.INVOKE_SERVICE):
+        """ Sends a request and, unless is_async is True, waits for its response, returning None if there is none in time.
+        """
+        request = Request(self.name, self.pid)
+
+        request.payload = payload
+        request.service = service
+        request.action = action
+        request.target_pid = target_pid
+        request.needs_response = not is_async
+
+        if not is_async:
+            result = AsyncResult()
+            self.pending[request.request_id] = result
+
+        try:
+            with self.send_lock:
+                try:
+                    self.send_frame(self.socket, request)
+
+                # If sending was interrupted, e.g. because our greenlet was killed, a part of the frame may have been written
+                # already and nothing else can be sent through this connection anymore, so it needs to be replaced with a new one.
+                except BaseException:
+                    self.close()
+                    raise
+
+            if not is_async:
+                return result.get(timeout=timeout, block=True)
+
+        # This includes timeouts and greenlets being killed, neither of which is an Exception
+        except BaseException:
+            self.pending.pop(request.request_id, None)
+            raise
+
+# ################################################################################################################################
+
+    def close(self):
+        self.keep_running = False
+        self.is_connected = False
+        self.socket.close()
+
+# ################################################################################################################################
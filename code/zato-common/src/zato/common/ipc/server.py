@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from errno import ENOENT
+from traceback import format_exc
+
+# gevent
+from gevent import socket, spawn
+from gevent.lock import RLock
+from gevent.server import StreamServer
+
+# Zato
+from zato.common.api import IPC
+from zato.common.ipc import IPCEndpoint, Request
+
+# This is needed so that unpickling of requests works
+Request = Request
+
+# ################################################################################################################################
+
+class IPCServer(IPCEndpoint):
+    """ Listens for incoming IPC requests, invokes a callback for each and sends its response back to the caller.
+    Each connection is kept open and requests received through it are handled concurrently, which is why
+    responses may be sent in a different order than requests were - callers tell them apart by request IDs.
+    """
+    def __init__(self, on_message_callback, name, pid, backlog=256):
+        super(IPCServer, self).__init__(name, pid)
+        self.on_message_callback = on_message_callback
+        self.address = self.get_address(name)
+        self.backlog = backlog
+        self.server = None
+        self.connections = set()
+
+# ################################################################################################################################
+
+    def _remove_address(self):
+        try:
+            os.remove(self.address)
+        except OSError as e:
+            if e.errno != ENOENT:
+                raise
+
+# ################################################################################################################################
+
+    def serve_forever(self):
+
+        # Remove any leftovers from a previous process of the same name
+        self._remove_address()
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.listen(self.backlog)
+
+        self.server = StreamServer(listener, self._handle_connection)
+        self.logger.info('Listening for IPC requests on %s (self.pid: %s)', self.address, self.pid)
+        self.server.serve_forever()
+
+# ################################################################################################################################
+
+    def _handle_connection(self, conn, _ignored_address):
+
+        send_lock = RLock()
+        self.connections.add(conn)
+
+        try:
+            while self.keep_running:
+                request = self.recv_frame(conn)
+                spawn(self._handle_request, conn, send_lock, request)
+        except (EOFError, OSError):
+            self.logger.debug('IPC connection closed in `%s`', self.name)
+        except Exception:
+            self.logger.warning('Error in IPC server, e:`%s`', format_exc())
+        finally:
+            self.connections.discard(conn)
+            conn.close()
+
+# ################################################################################################################################
+
+    def _handle_request(self, conn, send_lock, request, failure=IPC.STATUS.FAILURE):
+
+        try:
+            response = self.on_message_callback(request)
+        except Exception:
+            response = '{};{}'.format(failure, format_exc())
+
+        if not request.needs_response:
+            return
+
+        try:
+            with send_lock:
+                self.send_frame(conn, (request.request_id, response))
+        except Exception:
+            self.logger.warning('Could not send IPC response, r:`%s`, e:`%s`', request, format_exc())
+
+# ################################################################################################################################
+
+    def close(self):
+        self.keep_running = False
+        if self.server:
+            self.server.stop()
+
+        # Clients notice that connections are closed and reconnect if we are started again
+        for conn in list(self.connections):
+            conn.close()
+
+        self._remove_address()
+
+# ################################################################################################################################
@@ -9,6 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 # stdlib
 from dataclasses import asdict, _FIELDS, MISSING, _PARAMS # type: ignore
 from http.client import BAD_REQUEST
+from functools import partial
 from inspect import isclass
 from typing import Any
 
@@ -37,7 +38,7 @@ from zato.common.typing_ import cast_, extract_from_union, is_union
 
 if 0:
     from dataclasses import Field
-    from zato.common.typing_ import any_, anydict, boolnone, dictnone, intnone, optional
+    from zato.common.typing_ import any_, anydict, anytuple, callable_, dict_, dictnone, list_, optional
     from zato.server.service import Service
 
     Field = Field
@@ -176,118 +177,72 @@ class ElementIsNotAList(ElementMissing):
 # ################################################################################################################################
 # ################################################################################################################################
 
-class DictCtx:
-    def __init__(
-        self,
-        service:      'Service',
-        current_dict: 'anydict | Model',
-        DataClass:    'any_',
-        extra:        'dictnone',
-        list_idx:     'intnone',
-        parent:       'optional[FieldCtx]' = None
-        ) -> 'None':
-
-        # We get these on input ..
-        self.service      = service
-        self.current_dict = current_dict
-        self.extra        = extra
-        self.DataClass    = DataClass
-        self.list_idx     = list_idx
-        self.parent       = parent
-
-        # .. while these we need to build ourselves in self.init.
-        self.has_init = None # type: boolnone
-
-        # These are the Field object that we expect this dict will contain,
-        # i.e. it will be possible to map ourselves to these Field objects.
-        self.fields = None # type: dictnone
-
-        # This will be populated with parameters to the dataclass's __init__ method, assuming that the class has one.
-        self.init_attrs = {}
-
-        # This will be populated with parameters to be set via setattr, in case the class does not have __init__.
-        self.setattr_attrs = {}
-
-        # We can check it once upfront and make it point to either init_attrs or setattr_attrs
-        self.attrs_container = cast_('dict', None) # type: dictnone
+def _get_none() -> 'None':
+    return None
 
 # ################################################################################################################################
 
-    def init(self):
-
-        # Whether the dataclass defines the __init__method
-        dataclass_params = getattr(self.DataClass, _PARAMS, None)
-        self.has_init = dataclass_params.init if dataclass_params else False
-
-        self.attrs_container = self.init_attrs if self.has_init else self.setattr_attrs
-        self.fields = getattr(self.DataClass, _FIELDS) # type: dictnone
+def get_empty_value_factory(field_type:'any_') -> 'callable_':
+    """ Returns a callable that creates the value of an optional field for which no value was given on input.
+    """
+    # This is the most reliable way
+    if 'typing.List' in str(field_type):
+        return list
+    elif field_type is Any:
+        return _get_none
+    elif issubclass(field_type, str):
+        return str
+    elif issubclass(field_type, int):
+        return int
+    elif issubclass(field_type, list):
+        return list
+    elif issubclass(field_type, dict):
+        return dict
+    elif issubclass(field_type, float):
+        return float
+    else:
+        return _get_none
 
 # ################################################################################################################################
 # ################################################################################################################################
 
-class FieldCtx:
-    def __init__(self, dict_ctx, field, parent):
-        # type: (DictCtx, Field, optional[FieldCtx]) -> None
+class FieldPlan:
+    """ Everything that can be found out about a field of a model upfront, before there is any input data to unmarshall.
+    """
+    __slots__ = ('name', 'field_type', 'is_required', 'is_model', 'is_list', 'model_class', 'contains_model',
+        'model_plan', 'default', 'default_factory', 'empty_value_factory')
+
+    def __init__(self, field:'Field') -> 'None':
+
+        self.name = field.name # type: str
 
-        # We get these on input ..
-        self.dict_ctx   = dict_ctx
-        self.field      = field
-        self.parent     = parent
-        self.name       = self.field.name # type: str
+        # Assume we are required ..
+        self.is_required = True
 
-        # This will be the same as self.field.type unless self.field.type is a union (e.g. optional[str]).
-        # In this case, self.field_type will be str whereas self.field.type will be the original type.
-        self.field_type = None # type: object
+        # This will be the same as field.type unless field.type is a union (e.g. optional[str]).
+        # In this case, self.field_type will be str whereas field.type will be the original type.
+        self.field_type = field.type
 
-        # .. by default, assume we have no type information (we do not know what model class it is)
-        self.model_class = None # type: object
+        # .. unless it is a union with None = this field is really optional[type_]
+        if is_union(field.type):
+            _, self.field_type, union_with = extract_from_union(field.type)
+            self.is_required = not (union_with is _None_Type)
 
-        # .. while these we need to build ourselves in self.init ..
-        self.value    = None # type: any_
-        self.is_class = None # type: boolnone
-        self.is_list  = None # type: boolnone
-        self.is_required = None # type: boolnone
+        is_class = isclass(field.type)
 
         # This indicates if ourselves, we are a Model instance
-        self.is_model = None # type: boolnone
+        self.is_model = is_class and issubclass(field.type, Model)
+        self.is_list = is_list(field.type, is_class) # type: ignore
+
+        # By default, assume we have no type information (we do not know what model class it is)
+        self.model_class = None # type: any_
 
         # This indicates whether we are a list that contains a Model instance.
         # The value is based on whether self.model_class exists or not
-        # and whether self.is_model points to a Model rather than, for instance, the str class,
+        # and whether it points to a Model rather than, for instance, the str class,
         # as the latter is possible in strlist definitions.
         self.contains_model = False
 
-        # We set this flag to True only if there is some extra data that we have
-        # and if we are a top-level element, as indicated by the lack of parent.
-        self.has_extra = self.dict_ctx.extra and (not self.dict_ctx.parent)
-
-# ################################################################################################################################
-
-    def init(self):
-
-        # Assume that we do not have any value
-        value = ZatoNotGiven
-
-        # If we have extra data, that will take priority over our regular dict, which is why we check it first here.
-        if self.has_extra:
-            if self.dict_ctx.extra:
-                value = self.dict_ctx.extra.get(self.name, ZatoNotGiven)
-
-        # If we do not have a value here, it means that we have no extra,
-        # or that it did not contain the expected value so we look it up in the current dictionary.
-        if value == ZatoNotGiven:
-            if isinstance(self.dict_ctx.current_dict, dict):
-                value = self.dict_ctx.current_dict.get(self.name, ZatoNotGiven)
-            elif isinstance(self.dict_ctx.current_dict, Model): # type: ignore
-                value = getattr(self.dict_ctx.current_dict, self.name, ZatoNotGiven)
-
-        # At this point, we know there will be something to assign although it still may be ZatoNotGiven.
-        self.value = value
-
-        self.is_class = isclass(self.field.type)
-        self.is_model = self.is_class and issubclass(self.field.type, Model)
-        self.is_list = is_list(self.field.type, self.is_class) # type: ignore
-
         #
         # This is a list and we need to check if its definition
         # contains information about the actual type of elements inside.
@@ -296,95 +251,119 @@ class FieldCtx:
         # Otherwise, we will just pass this list on as it is.
         #
         if self.is_list:
-            self.model_class = extract_model_class(self.field.type) # type: ignore
+            self.model_class = extract_model_class(field.type) # type: ignore
             self.contains_model = bool(self.model_class and hasattr(self.model_class, _FIELDS))
 
-# ################################################################################################################################
+        # This is the plan of a nested model, or of elements of a list, if any, populated in MarshalAPI.get_model_plan
+        self.model_plan = None # type: optional[ModelPlan]
 
-    def get_name(self):
-        if self.dict_ctx.list_idx is not None:
-            return '{}[{}]'.format(self.name, self.dict_ctx.list_idx)
-        else:
-            return self.name
+        # Values to use if there is nothing on input
+        self.default = field.default
+        self.default_factory = field.default_factory if field.default_factory is not MISSING else None
+
+        # Only some types have an empty value of their own, others cannot have it and we raise an exception,
+        # but only once we actually need such a value, because input may as well always contain one.
+        try:
+            self.empty_value_factory = get_empty_value_factory(self.field_type)
+        except TypeError:
+            self.empty_value_factory = partial(get_empty_value_factory, self.field_type)
 
 # ################################################################################################################################
 # ################################################################################################################################
 
-class MarshalAPI:
+class ModelPlan:
+    """ All the fields of a model, sorted by name, along with plans of any nested models.
+    """
+    __slots__ = ('DataClass', 'has_init', 'fields')
 
-    def __init__(self):
-        self._field_cache = {}
+    def __init__(self, DataClass:'any_') -> 'None':
+        self.DataClass = DataClass
 
-# ################################################################################################################################
+        # Whether the dataclass defines the __init__method
+        dataclass_params = getattr(DataClass, _PARAMS, None)
+        self.has_init = dataclass_params.init if dataclass_params else False
 
-    def get_validation_error(
-        self,
-        field_ctx,                 # type: FieldCtx
-        error_class=ElementMissing # type: any_
-    ) -> 'ModelValidationError':
+        # Populated in MarshalAPI.get_model_plan
+        self.fields = [] # type: list_[FieldPlan]
 
-        # This will always exist
-        elem_path = [field_ctx.name]
+# ################################################################################################################################
+# ################################################################################################################################
 
-        # Keep checking parent fields as long as they exist
-        while field_ctx.parent:
-            elem_path.append(field_ctx.parent.get_name())
-            field_ctx = field_ctx.parent
+# Plans depend only on model classes, which is why all the instances of MarshalAPI can share them
+_model_plans = {} # type: dict_[any_, ModelPlan]
 
-        # We need to reverse it now to present a top-down view
-        elem_path = reversed(elem_path)
+# ################################################################################################################################
+# ################################################################################################################################
 
-        # Now, join it with a elem_path separator
-        elem_path = '/' + '/'.join(elem_path)
+class MarshalAPI:
 
-        return error_class(elem_path)
+    def __init__(self):
+        self._model_plans = _model_plans
 
 # ################################################################################################################################
 
-    def _self_require_dict(self, field_ctx):
-        # type: (FieldCtx) -> None
-        if not isinstance(field_ctx.value, dict):
-            raise self.get_validation_error(field_ctx)
+    def get_model_plan(self, DataClass:'any_', _in_progress:'dictnone'=None) -> 'ModelPlan':
+        """ Returns a plan for unmarshalling dicts into instances of a given model class, building it first if needed.
+        """
+        plan = self._model_plans.get(DataClass)
+        if plan:
+            return plan
 
-# ################################################################################################################################
+        # Plans that are still being built are kept separately so that models referring to themselves can find them ..
+        in_progress = {} if _in_progress is None else _in_progress
 
-    def _visit_list(self, field_ctx):
-        # type: (FieldCtx) -> list
+        plan = in_progress.get(DataClass)
+        if plan:
+            return plan
 
-        # Local aliases
-        service     = field_ctx.dict_ctx.service
-        model_class = field_ctx.model_class
+        plan = ModelPlan(DataClass)
+        in_progress[DataClass] = plan
 
-        # Respone to produce
-        out = []
+        fields = getattr(DataClass, _FIELDS) # type: anydict
 
-        # Visit each element in the list ..
-        for idx, elem in enumerate(field_ctx.value):
+        for _ignored_name, _field in sorted(fields.items()):
 
-            if field_ctx.is_list:
-                field_ctx.dict_ctx.list_idx = idx
+            field_plan = FieldPlan(_field)
 
-            # .. convert it to a model instance ..
-            instance = self.from_dict(service, elem, model_class, list_idx=idx, parent=field_ctx)
+            if field_plan.is_model:
+                field_plan.model_plan = self.get_model_plan(_field.type, in_progress)
 
-            # .. and append it for our caller ..
-            out.append(instance)
+            elif field_plan.contains_model:
+                field_plan.model_plan = self.get_model_plan(field_plan.model_class, in_progress)
 
-        # .. finally, return the response.
-        return out
+            plan.fields.append(field_plan)
 
-# ################################################################################################################################
+        # .. and they are cached only once the outermost one has been built, which means that all of them are complete.
+        if _in_progress is None:
+            self._model_plans.update(in_progress)
 
-    def from_field_ctx(self, field_ctx):
-        # type: (FieldCtx) -> any_
-        return self.from_dict(field_ctx.dict_ctx.service, field_ctx.value, field_ctx.field.type,
-            extra=None, list_idx=field_ctx.dict_ctx.list_idx, parent=field_ctx)
+        return plan
 
 # ################################################################################################################################
 
-    def _ensure_value_is_a_list(self, field_ctx:'FieldCtx', value:'any_') -> 'None':
-        if not isinstance(value, list):
-            raise self.get_validation_error(field_ctx, error_class=ElementIsNotAList)
+    def get_validation_error(
+        self,
+        name,                      # type: str
+        parent,                    # type: anytuple | None
+        error_class=ElementMissing # type: any_
+    ) -> 'ModelValidationError':
+
+        # This will always exist
+        elem_path = [name]
+
+        # Keep checking parent fields as long as they exist,
+        # each of them is a tuple of the field's name, its index in a list if there is one, and the field's own parent.
+        while parent:
+            parent_name, list_idx, parent = parent
+            elem_path.append(parent_name if list_idx is None else '{}[{}]'.format(parent_name, list_idx))
+
+        # We need to reverse it now to present a top-down view
+        elem_path = reversed(elem_path)
+
+        # Now, join it with a elem_path separator
+        elem_path = '/' + '/'.join(elem_path)
+
+        return error_class(elem_path)
 
 # ################################################################################################################################
 
@@ -394,70 +373,91 @@ class MarshalAPI:
         current_dict: 'dict',
         DataClass:    'any_',
         extra:        'dictnone' = None,
-        list_idx:     'intnone'  = None,
-        parent:       'optional[FieldCtx]' = None
+        parent:       'anytuple | None' = None
         ) -> 'any_':
+        return self._from_plan(service, current_dict, self._model_plans.get(DataClass) or self.get_model_plan(DataClass),
+            extra, parent)
 
-        dict_ctx = DictCtx(service, current_dict, DataClass, extra, list_idx, parent)
-        dict_ctx.init()
+# ################################################################################################################################
 
-        # All fields that we will visit
-        field_items = sorted(dict_ctx.fields.items()) # type: any_
+    def _from_plan(
+        self,
+        service:      'Service',
+        current_dict: 'anydict | Model',
+        plan:         'ModelPlan',
+        extra:        'dictnone',
+        parent:       'anytuple | None',
+        _not_given=ZatoNotGiven, # type: any_
+        _missing=MISSING,        # type: any_
+        ) -> 'any_':
+
+        # Local aliases
+        DataClass = plan.DataClass
 
-        for _ignored_name, _field in field_items:
+        # This will be populated with parameters to the dataclass's __init__ method or to be set via setattr,
+        # depending on whether the class has __init__ or not.
+        attrs = {}
+
+        # We set this flag to True only if there is some extra data that we have
+        # and if we are a top-level element, as indicated by the lack of parent.
+        has_extra = extra and (not parent)
 
-            # Assume we are required ..
-            is_required = True
+        is_dict = isinstance(current_dict, dict)
+        is_model = (not is_dict) and isinstance(current_dict, Model)
 
-            # Use this by default ..
-            field_type = _field.type
+        for field_plan in plan.fields:
 
-            # .. unless it is a union with None = this field is really optional[type_]
-            if is_union(_field.type):
-                result = extract_from_union(_field.type)
-                _, field_type, union_with = result
+            name = field_plan.name
 
-                # .. check if this was an optional field.
-                is_required = not (union_with is _None_Type)
+            # Assume that we do not have any value
+            value = _not_given
 
-            # Represents a current field in the model in the context of the input dict ..
-            field_ctx = FieldCtx(dict_ctx, _field, parent)
-            field_ctx.is_required = is_required
-            field_ctx.field_type = field_type
+            # If we have extra data, that will take priority over our regular dict, which is why we check it first here.
+            if has_extra:
+                value = extra.get(name, _not_given) # type: ignore
 
-            # .. this call will populate the initial value of the field as well (field_ctx..
-            field_ctx.init()
+            # If we do not have a value here, it means that we have no extra,
+            # or that it did not contain the expected value so we look it up in the current dictionary.
+            if value is _not_given:
+                if is_dict:
+                    value = current_dict.get(name, _not_given) # type: ignore
+                elif is_model:
+                    value = getattr(current_dict, name, _not_given)
 
             # If this field points to a model ..
-            if field_ctx.is_model:
+            if field_plan.is_model:
 
                 # .. first, we need a dict as value as it is the only container that we can extract model fields from ..
-                self._self_require_dict(field_ctx)
+                if not isinstance(value, dict):
+                    raise self.get_validation_error(name, parent)
 
                 # .. if we are here, it means that we can check the dict and extract its fields,
                 # but note that we do not pass extra data on to nested models
                 # because we can only ever overwrite top-level elements with what extra contains.
-                field_ctx.value = self.from_field_ctx(field_ctx)
+                value = self._from_plan(service, value, field_plan.model_plan, None, (name, None, parent)) # type: ignore
 
             # .. if this field points to a list ..
-            elif field_ctx.is_list:
+            elif field_plan.is_list:
 
                 # If we have a model class the elements of the list are of,
                 # we need to visit each of them now.
-                if field_ctx.model_class:
+                if field_plan.model_class:
 
                     # Enter further only if we have any value at all to check ..
-                    if field_ctx.value and field_ctx.value != ZatoNotGiven: # type: ignore
+                    if value and value is not _not_given:
 
                         # .. if the field is required, make sure that what we have on input really is a list object ..
-                        if field_ctx.is_required:
-                            self._ensure_value_is_a_list(field_ctx, field_ctx.value)
+                        if field_plan.is_required:
+                            if not isinstance(value, list):
+                                raise self.get_validation_error(name, parent, error_class=ElementIsNotAList)
 
                         # However, that model class may actually point to <type 'str'> types
                         # in case of fields like strlist, and we need to take that into account
-                        # before entering the _visit_list method below.
-                        if field_ctx.is_model or field_ctx.contains_model:
-                            field_ctx.value = self._visit_list(field_ctx)
+                        # before visiting each element.
+                        if field_plan.contains_model:
+                            model_plan = field_plan.model_plan
+                            value = [self._from_plan(service, elem, model_plan, None, (name, idx, parent)) # type: ignore
+                                for idx, elem in enumerate(value)]
 
                     # .. if we are here, it may be because the value is a dictlist instance
                     # .. for which there will be no underlying model and we can just assign it as is ..
@@ -474,71 +474,51 @@ class MarshalAPI:
                         #     my_list: anylistnone = list_field()
                         #     my_dict: anydictnone = dict_field()
                         #
-                        if field_ctx.name in current_dict:
+                        if name in current_dict:
 
                             # .. extract the value first ..
-                            value = current_dict[field_ctx.name]
+                            value = current_dict[name]
 
                             # .. if the field is required, make sure that what we have on input really is a list object ..
-                            if field_ctx.is_required:
-                                self._ensure_value_is_a_list(field_ctx, value)
-
-                            # .. assign the list now.
-                            field_ctx.value = value
+                            if field_plan.is_required:
+                                if not isinstance(value, list):
+                                    raise self.get_validation_error(name, parent, error_class=ElementIsNotAList)
 
             # If we do not have a value yet, perhaps we will find a default one
-            if field_ctx.value == ZatoNotGiven:
-
-                default = field_ctx.field.default
-                default_factory = field_ctx.field.default_factory
-
-                if default is not MISSING:
-                    field_ctx.value = default
-
-                elif default_factory and default_factory is not MISSING:
-                    field_ctx.value = default_factory()
-
-            # Let's check if we found any value
-            if field_ctx.value != ZatoNotGiven:
-                value = field_ctx.value
-            else:
-                if field_ctx.is_required:
-                    raise self.get_validation_error(field_ctx)
-                else:
-                    # This is the most reliable way
-                    if 'typing.List' in str(field_ctx.field_type):
-                        value = []
-                    elif field_ctx.field_type is Any:
-                        value = None
-                    elif issubclass(field_ctx.field_type, str):
-                        value = ''
-                    elif issubclass(field_ctx.field_type, int):
-                        value = 0
-                    elif issubclass(field_ctx.field_type, list):
-                        value = []
-                    elif issubclass(field_ctx.field_type, dict):
-                        value = {}
-                    elif issubclass(field_ctx.field_type, float):
-                        value = 0.0
+            if value is _not_given:
+
+                if field_plan.default is not _missing:
+                    value = field_plan.default
+
+                elif field_plan.default_factory:
+                    value = field_plan.default_factory()
+
+                # Let's check if we found any value
+                if value is _not_given:
+                    if field_plan.is_required:
+                        raise self.get_validation_error(name, parent)
                     else:
-                        value = None
+                        value = field_plan.empty_value_factory()
 
             # Assign the value now
-            dict_ctx.attrs_container[field_ctx.name] = value # type: ignore
+            attrs[name] = value
 
         # Create a new instance, potentially with attributes ..
-        instance = DataClass(**dict_ctx.init_attrs) # type: Model
+        if plan.has_init:
+            instance = DataClass(**attrs) # type: Model
 
-        # .. and add extra ones in case __init__ was not defined ..
-        for k, v in dict_ctx.setattr_attrs.items():
-            setattr(instance, k, v)
+        # .. or add them in case __init__ was not defined ..
+        else:
+            instance = DataClass()
+            for k, v in attrs.items():
+                setattr(instance, k, v)
 
         # .. run the post-creation hook ..
         if instance.after_created:
 
             ctx = ModelCtx()
             ctx.service = service
-            ctx.data = dict_ctx.current_dict
+            ctx.data = current_dict
             ctx.DataClass = DataClass
 
             instance.after_created(ctx)
@@ -7,11 +7,12 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+import os
 from datetime import datetime
 from logging import getLogger
 from tempfile import NamedTemporaryFile
 from random import choice, randint
-from unittest import TestCase
+from unittest import skipUnless, TestCase
 from uuid import uuid4
 
 # Bunch
@@ -62,6 +63,15 @@ if 0:
 
 test_class_name = '<my-test-class>'
 
+# Benchmarks are not run by default because they take a while
+benchmark_environ_key = 'ZATO_TEST_BENCHMARK'
+
+# Use it to decorate tests that are benchmarks ..
+benchmark = skipUnless(os.environ.get(benchmark_environ_key), 'Set {} to run benchmarks'.format(benchmark_environ_key))
+
+# .. and this is where their results are logged to.
+benchmark_logger = getLogger('zato.test.benchmark')
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -64,6 +64,7 @@ from dateutil.parser import parse as dt_parse
 from gevent import sleep as gevent_sleep, spawn, Timeout
 from gevent.greenlet import Greenlet
 from gevent.hub import Hub
+from gevent.pool import Pool
 
 # lxml
 from lxml import etree
@@ -518,7 +519,8 @@ def payload_from_request(json_parser, cid, request, data_format, transport, chan
                 channel_item['hl7_version'],
                 channel_item['json_path'],
                 channel_item['should_parse_on_input'],
-                channel_item['should_validate']
+                channel_item['should_validate'],
+                channel_item.get('hl7_impl_class'),
             )
 
         #
@@ -1710,6 +1712,34 @@ def spawn_greenlet(callable, *args, **kwargs):
 
 # ################################################################################################################################
 
+def spawn_all(callable, items, max_concurrency, deadline, *args, **kwargs):
+    """ Invokes callable for each of items in greenlets, no more than max_concurrency at a time, and waits up to deadline
+    seconds for all of them to complete. Returns their responses, in the same order as items. A response is ZATO_NOT_GIVEN
+    if the deadline was reached before callable returned, in which case that greenlet is killed, or if callable raised
+    an exception, which callers should rather catch and turn into responses themselves.
+    """
+    out = [ZATO_NOT_GIVEN] * len(items)
+
+    def _invoke(idx, item):
+        out[idx] = callable(item, *args, **kwargs)
+
+    pool = Pool(max_concurrency)
+
+    # Pool.spawn blocks when the pool is full so the deadline needs to cover spawning greenlets too
+    with Timeout(deadline, False):
+        for idx, item in enumerate(items):
+            _ = pool.spawn(_invoke, idx, item)
+        pool.join()
+
+    # Anything that is still running at this point has exceeded the deadline. Killing it raises GreenletExit in the middle
+    # of whatever it was doing, which is why callable must leave anything it shares with others in a usable state
+    # if that happens, e.g. IPCClient.invoke closes a connection if it is interrupted while sending a request through it.
+    pool.kill()
+
+    return out
+
+# ################################################################################################################################
+
 def get_logger_for_class(class_):
     return logging.getLogger('{}.{}'.format(inspect.getmodule(class_).__name__, class_.__name__))
 
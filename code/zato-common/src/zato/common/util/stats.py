@@ -82,22 +82,168 @@ def percentile(data, percent, key=lambda x:x):
 # ################################################################################################################################
 # ################################################################################################################################
 
+#
+# Log-bucketed histograms of durations. Each value is counted in a bucket whose bounds grow geometrically,
+# so that any value read out of a histogram, e.g. a percentile, is within histogram_accuracy of the real one,
+# no matter how many values have been added. Buckets that have not been used take no space and there can be
+# at most histogram_max_buckets of them, which means that histograms use constant memory. Histograms are dicts
+# that can be serialised to JSON as they are and two histograms can be merged into one, e.g. to combine the ones
+# from multiple worker processes.
+#
+
+histogram_accuracy = 0.01
+histogram_max_buckets = 2048
+
+_histogram_gamma = (1 + histogram_accuracy) / (1 - histogram_accuracy)
+_histogram_log_gamma = math.log(_histogram_gamma)
+
+# ################################################################################################################################
+
+def new_histogram():
+    # type: () -> dict
+    return {
+        'count': 0,
+        'sum': 0.0,
+        'min': None,
+        'max': None,
+        'zero': 0,     # How many values were zero or less
+        'buckets': {}, # Bucket index, as a string, to how many values were in that bucket
+    }
+
+# ################################################################################################################################
+
+def _collapse_histogram(hist, max_buckets=histogram_max_buckets):
+    # type: (dict, int) -> list
+    """ Returns indexes of all the buckets that were changed or removed, if any.
+    """
+
+    # If there are too many buckets, the lowest ones are merged first because higher values are more interesting
+    buckets = hist['buckets']
+    if len(buckets) > max_buckets:
+
+        idx_list = sorted(buckets, key=int)
+        to_collapse = idx_list[:len(buckets) - max_buckets]
+        target = idx_list[len(to_collapse)]
+
+        for idx in to_collapse:
+            buckets[target] += buckets.pop(idx)
+
+        return to_collapse + [target]
+
+    return []
+
+# ################################################################################################################################
+
+def histogram_add(hist, value, _log=math.log, _ceil=math.ceil, _log_gamma=_histogram_log_gamma):
+    # type: (dict, float) -> list
+    """ Adds a value to a histogram and returns indexes of all the buckets that were changed or removed.
+    """
+
+    hist['count'] += 1
+    hist['sum'] += value
+
+    if hist['min'] is None or value < hist['min']:
+        hist['min'] = value
+
+    if hist['max'] is None or value > hist['max']:
+        hist['max'] = value
+
+    if value > 0:
+        idx = str(_ceil(_log(value) / _log_gamma))
+        buckets = hist['buckets']
+        buckets[idx] = buckets.get(idx, 0) + 1
+        return [idx] + _collapse_histogram(hist)
+    else:
+        hist['zero'] += 1
+        return []
+
+# ################################################################################################################################
+
+def histogram_merge(hist, other):
+    # type: (dict, dict) -> dict
+    """ Adds all the values from other to hist and returns hist.
+    """
+    if not other or not other['count']:
+        return hist
+
+    hist['count'] += other['count']
+    hist['sum'] += other['sum']
+    hist['zero'] += other['zero']
+
+    hist['min'] = other['min'] if hist['min'] is None else min(hist['min'], other['min'])
+    hist['max'] = other['max'] if hist['max'] is None else max(hist['max'], other['max'])
+
+    buckets = hist['buckets']
+    for idx, count in other['buckets'].items():
+        buckets[idx] = buckets.get(idx, 0) + count
+
+    _ = _collapse_histogram(hist)
+
+    return hist
+
+# ################################################################################################################################
+
+def histogram_percentile(hist, percent):
+    # type: (dict, float) -> float
+    """ Returns a value from a histogram that percent (from 0.0 to 1.0) of the values added to it were not greater than.
+    """
+    if not hist['count']:
+        return 0
+
+    rank = percent * (hist['count'] - 1)
+
+    if rank < hist['zero']:
+        return hist['min']
+
+    seen = hist['zero']
+    buckets = hist['buckets']
+
+    for idx in sorted(buckets, key=int):
+        seen += buckets[idx]
+        if seen > rank:
+
+            # This is the value in the middle of the bucket, relative to its bounds,
+            # but it can never be outside of what was actually added.
+            value = 2 * _histogram_gamma ** int(idx) / (_histogram_gamma + 1)
+            return min(max(value, hist['min']), hist['max'])
+
+    return hist['max']
+
+# ################################################################################################################################
+
+def histogram_summary(hist, round_digits=3):
+    # type: (dict, int) -> dict
+
+    count = hist['count']
+
+    return {
+        StatsKey.PerKeyCount: count,
+        StatsKey.PerKeyMin: hist['min'],
+        StatsKey.PerKeyMax: hist['max'],
+        StatsKey.PerKeyMean: round(hist['sum'] / count, round_digits) if count else 0,
+        StatsKey.PerKeyP50: round(histogram_percentile(hist, 0.5), round_digits),
+        StatsKey.PerKeyP90: round(histogram_percentile(hist, 0.9), round_digits),
+        StatsKey.PerKeyP99: round(histogram_percentile(hist, 0.99), round_digits),
+    }
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 def collect_current_usage(data):
     # type: (list) -> dict
 
-    # numpy
-    import numpy as np
-
     # For later use
     usage = 0
 
+    # Histograms from all the elements are merged into this one
+    hist = new_histogram()
+
+    # Elements that have no histograms of their own
+    no_hist_elems = []
+
     last_duration = None
     last_timestamp = ''
 
-    usage_min  = None
-    usage_max  = None
-    usage_mean = None
-
     # Make sure we always have a list to iterate over (rather than None)
     data = data or []
 
@@ -112,32 +258,50 @@ def collect_current_usage(data):
             last_timestamp = elem[StatsKey.PerKeyLastTimestamp]
             last_duration = elem[StatsKey.PerKeyLastDuration]
 
-        if usage_min:
-            usage_min = min([usage_min, elem[StatsKey.PerKeyMin]])
-        else:
-            usage_min = elem[StatsKey.PerKeyMin]
+        elem_hist = elem.get(StatsKey.PerKeyHistogram)
 
-        if usage_max:
-            usage_max  = max([usage_max, elem[StatsKey.PerKeyMax]])
-        else:
-            usage_max = elem[StatsKey.PerKeyMax]
+        if elem_hist and elem_hist['count']:
+            _ = histogram_merge(hist, elem_hist)
 
-        if usage_mean:
-            usage_mean = np.mean([usage_mean, elem[StatsKey.PerKeyMean]])
-        else:
-            usage_mean = elem[StatsKey.PerKeyMean]
+        # Elements without histograms, e.g. ones stored before histograms were introduced,
+        # still have their own min, max and mean that we can use.
+        elif elem.get(StatsKey.PerKeyMin) is not None:
+            no_hist_elems.append(elem)
 
-        usage_mean = round(usage_mean, 3) if usage_mean else 0
-
-    return {
+    out = {
         StatsKey.PerKeyValue: usage,
         StatsKey.PerKeyLastDuration:  last_duration,
         StatsKey.PerKeyLastTimestamp: last_timestamp,
-        StatsKey.PerKeyMin: usage_min,
-        StatsKey.PerKeyMax: usage_max,
-        StatsKey.PerKeyMean: usage_mean,
     }
 
+    # Min, max, mean and percentiles are computed over all the durations from all the elements ..
+    out.update(histogram_summary(hist))
+
+    # .. though percentiles cannot be computed for elements without histograms, unlike min, max and mean,
+    # for which each such element counts as many times as it was used.
+    if no_hist_elems:
+
+        min_list = [elem[StatsKey.PerKeyMin] for elem in no_hist_elems]
+        max_list = [elem[StatsKey.PerKeyMax] for elem in no_hist_elems]
+
+        if hist['count']:
+            min_list.append(hist['min'])
+            max_list.append(hist['max'])
+
+        total_count = hist['count']
+        total_sum = hist['sum']
+
+        for elem in no_hist_elems:
+            elem_count = elem[StatsKey.PerKeyValue] or 1
+            total_count += elem_count
+            total_sum += elem[StatsKey.PerKeyMean] * elem_count
+
+        out[StatsKey.PerKeyMin] = min(min_list)
+        out[StatsKey.PerKeyMax] = max(max_list)
+        out[StatsKey.PerKeyMean] = round(total_sum / total_count, 3)
+
+    return out
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -24,7 +24,8 @@ from traceback import format_exc
 from types import GeneratorType
 
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, Timeout
+from gevent.event import AsyncResult
 
 # ws4py
 from ws4py.client.geventclient import WebSocketClient
@@ -475,8 +476,8 @@ class Client:
         # Keyed by IDs of requests sent from this client to Zato
         self.requests_sent = {}
 
-        # Same key as self.requests_sent but the dictionary contains responses to previously sent requests
-        self.responses_received = {}
+        # Same key as self.requests_sent but the dictionary contains AsyncResult objects for responses that someone is waiting for
+        self.pending_responses = {} # type: dict[str, AsyncResult]
 
         # Requests initiated by Zato, keyed by their IDs
         self.requests_received = {}
@@ -525,17 +526,15 @@ class Client:
         """ Wait until a response arrives and return it
         or return None if there is no response up to wait_time or self.config.wait_time.
         """
-        now = utcnow()
-        until = now + timedelta(seconds=wait_time or self.config.wait_time)
-
-        while now < until:
+        # Requests are sent in greenlets of their own, which means that this always runs before a response can arrive
+        result = self.pending_responses.setdefault(request_id, AsyncResult())
 
-            response = self.responses_received.get(request_id) # type: any_
-            if response:
-                return response
-            else:
-                sleep(0.01)
-                now = utcnow()
+        try:
+            return result.get(timeout=wait_time or self.config.wait_time)
+        except Timeout:
+            return None
+        finally:
+            _ = self.pending_responses.pop(request_id, None)
 
 # ################################################################################################################################
 
@@ -567,7 +566,6 @@ class Client:
         else:
             self.auth_token = response.data['token']
             self.is_authenticated = True
-            del self.responses_received[request_id]
 
             self.logger.info('Authenticated successfully as `%s` (%s %s)',
                 self.config.username, self.config.client_name, self.config.client_id)
@@ -582,9 +580,11 @@ class Client:
 
         in_reply_to = _msg['meta'].get('in_reply_to')
 
-        # Reply from Zato to one of our requests
+        # Reply from Zato to one of our requests, unless no one is waiting for it anymore
         if in_reply_to:
-            self.responses_received[in_reply_to] = ResponseFromServer.from_json(_msg)
+            result = self.pending_responses.get(in_reply_to)
+            if result:
+                result.set(ResponseFromServer.from_json(_msg))
 
         # Request from Zato
         else:
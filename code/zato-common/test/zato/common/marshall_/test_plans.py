@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from time import perf_counter
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# Zato
+from zato.common.ext.dataclasses import dataclass
+from zato.common.marshal_.api import ElementIsNotAList, ElementMissing, FieldPlan, MarshalAPI, Model
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.test.marshall_ import CreatePhoneListRequest, CreateUserRequest, WithAny
+from zato.common.typing_ import cast_, list_, list_field
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.server.service import Service
+    Service = Service
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_list_size = 10_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+@dataclass(init=False, repr=False)
+class TreeNode(Model):
+    name: str
+    child_list: list_['TreeNode'] = list_field() # type: ignore
+
+# This is needed because the class refers to itself
+TreeNode.__dataclass_fields__['child_list'].type = list_[TreeNode] # type: ignore
+
+@dataclass(init=False, repr=False)
+class WithUntypedList(Model):
+    value_list: list
+
+@dataclass(init=False, repr=False)
+class PlanChild(Model):
+    value: str
+
+@dataclass(init=False, repr=False)
+class PlanParent(Model):
+    name: str
+    child: PlanChild
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_user_request(role_count):
+    return {
+        'request_id': 123,
+        'user': {
+            'user_name': 'my.user',
+            'address': {
+                'locality': 'my.locality',
+                'post_code': '12345',
+            }
+        },
+        'role_list': [{'type': 'type.{}'.format(idx), 'name': 'name.{}'.format(idx)} for idx in range(role_count)]
+    }
+
+# ################################################################################################################################
+
+def get_phone_list_request(phone_count, attr_count):
+    return {
+        'phone_list': [
+            {'attr_list': [{'type': 'type.{}'.format(idx), 'name': 'name.{}'.format(idx)} for idx in range(attr_count)]}
+                for _ in range(phone_count)
+        ]
+    }
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class MarshalPlanTestCase(TestCase):
+
+    def setUp(self):
+        self.service = cast_('Service', None)
+        self.api = MarshalAPI()
+
+# ################################################################################################################################
+
+    def test_plan_is_cached(self):
+
+        plan = self.api.get_model_plan(CreateUserRequest)
+
+        # The same plan is used by all the instances of the API ..
+        self.assertIs(MarshalAPI().get_model_plan(CreateUserRequest), plan)
+
+        # .. its fields are sorted by name ..
+        self.assertListEqual([item.name for item in plan.fields], ['request_id', 'role_list', 'user'])
+
+        # .. and nested models have their own plans.
+        request_id, role_list, user = plan.fields
+
+        self.assertTrue(request_id.is_required)
+        self.assertFalse(request_id.is_model)
+
+        self.assertTrue(role_list.is_list)
+        self.assertIs(role_list.model_plan, self.api.get_model_plan(role_list.model_class))
+
+        self.assertTrue(user.is_model)
+        self.assertIs(user.model_plan, self.api.get_model_plan(user.field_type))
+
+# ################################################################################################################################
+
+    def test_plan_is_not_cached_if_not_built(self):
+
+        def get_field_plan(field):
+            if field.name == 'value':
+                raise ValueError('Field plan could not be built')
+            return FieldPlan(field)
+
+        # A nested plan cannot be built ..
+        with patch('zato.common.marshal_.api.FieldPlan', get_field_plan):
+            with self.assertRaises(ValueError):
+                self.api.get_model_plan(PlanParent)
+
+        # .. which means that neither its own plan nor its parent's one is cached ..
+        self.assertNotIn(PlanParent, self.api._model_plans)
+        self.assertNotIn(PlanChild, self.api._model_plans)
+
+        # .. so they will be built in full the next time.
+        plan = self.api.get_model_plan(PlanParent)
+        self.assertListEqual([item.name for item in plan.fields], ['child', 'name'])
+        self.assertListEqual([item.name for item in plan.fields[0].model_plan.fields], ['value'])
+
+        request = self.api.from_dict(self.service, {'name': 'abc', 'child': {'value': 'def'}}, PlanParent)
+        self.assertEqual(request.child.value, 'def')
+
+# ################################################################################################################################
+
+    def test_unmarshall_repeated(self):
+
+        # Each call with the same model walks the input data only so none can affect the other ones
+        for role_count in (3, 0, 5):
+            request = self.api.from_dict(self.service, get_user_request(role_count), CreateUserRequest)
+
+            self.assertEqual(request.request_id, 123)
+            self.assertEqual(request.user.address.post_code, '12345')
+            self.assertDictEqual(request.user.address.details, {})
+            self.assertEqual(len(request.role_list), role_count)
+
+            for idx, role in enumerate(request.role_list):
+                self.assertEqual(role.name, 'name.{}'.format(idx))
+
+# ################################################################################################################################
+
+    def test_unmarshall_empty_values_are_not_shared(self):
+
+        first = self.api.from_dict(self.service, {}, WithAny)
+        second = self.api.from_dict(self.service, {}, WithAny)
+
+        self.assertIsNone(first.str1)
+        self.assertListEqual(first.list1, [])
+        self.assertDictEqual(first.dict1, {})
+
+        # Each instance gets its own containers
+        self.assertIsNot(first.list1, second.list1)
+        self.assertIsNot(first.dict1, second.dict1)
+
+# ################################################################################################################################
+
+    def test_unmarshall_self_referencing_model(self):
+
+        data = {'name': 'a', 'child_list': [{'name': 'b', 'child_list': [{'name': 'c'}]}, {'name': 'd'}]}
+        node = self.api.from_dict(self.service, data, TreeNode)
+
+        self.assertEqual(node.name, 'a')
+        self.assertEqual(node.child_list[0].name, 'b')
+        self.assertEqual(node.child_list[0].child_list[0].name, 'c')
+        self.assertListEqual(node.child_list[0].child_list[0].child_list, [])
+        self.assertEqual(node.child_list[1].name, 'd')
+
+# ################################################################################################################################
+
+    def test_unmarshall_untyped_list(self):
+
+        # Lists without a type of their elements are taken from extra first ..
+        data = {'value_list': [1]}
+        request = self.api.from_dict(self.service, data, WithUntypedList, extra={'value_list': [2]})
+        self.assertListEqual(request.value_list, [2])
+
+        # .. and they are assigned as they are, even if they are not lists.
+        request = self.api.from_dict(self.service, {'value_list': 'abc'}, WithUntypedList)
+        self.assertEqual(request.value_list, 'abc')
+
+# ################################################################################################################################
+
+    def test_validation_errors_in_nested_lists(self):
+
+        data = get_phone_list_request(3, 3)
+        del data['phone_list'][2]['attr_list'][1]['name']
+
+        with self.assertRaises(ElementMissing) as cm:
+            self.api.from_dict(self.service, data, CreatePhoneListRequest)
+
+        self.assertEqual(cm.exception.reason, 'Element missing: /phone_list[2]/attr_list[1]/name')
+
+        data = get_user_request(1)
+        data['role_list'] = {'type': 'abc'}
+
+        with self.assertRaises(ElementIsNotAList) as cm:
+            self.api.from_dict(self.service, data, CreateUserRequest)
+
+        self.assertEqual(cm.exception.reason, 'Element is not a list: /role_list')
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_unmarshall_benchmark(self):
+
+        for name, DataClass, data in (
+            ('user, roles', CreateUserRequest, get_user_request(benchmark_list_size)),
+            ('phones, attrs', CreatePhoneListRequest, get_phone_list_request(benchmark_list_size // 10, 10)),
+        ):
+            start = perf_counter()
+            _ = self.api.from_dict(self.service, data, DataClass)
+            taken = perf_counter() - start
+
+            benchmark_logger.info('Unmarshalling {} of {} ({} nested models); total: {:.2f} ms, per model: {:.2f} us'.format(
+                name, DataClass.__name__, benchmark_list_size, taken * 1000, taken / benchmark_list_size * 1_000_000))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+import subprocess
+import sys
+from json import dumps
+from time import perf_counter
+from unittest import main, TestCase
+from uuid import uuid4
+
+# gevent
+from gevent import sleep, spawn
+
+# Zato
+from zato.common.api import IPC, ZATO_NOT_GIVEN
+from zato.common.ipc import IPCEndpoint
+from zato.common.ipc.api import IPCAPI
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.util.api import spawn_all
+
+# ################################################################################################################################
+
+round_trips = 2_000
+
+cluster_name = 'test.cluster'
+
+# The other worker process used by the benchmark - it responds to each request with the service name and payload it received
+benchmark_worker = """
+import sys
+from json import dumps
+from gevent import sleep
+from zato.common.ipc.api import IPCAPI
+
+ipc_api = IPCAPI()
+ipc_api.name = IPCAPI.get_endpoint_name(sys.argv[1], sys.argv[2], int(sys.argv[3]))
+ipc_api.pid = int(sys.argv[3])
+ipc_api.on_message_callback = lambda msg: 'zs;' + dumps({'service': msg.service, 'payload': msg.payload})
+ipc_api.run()
+
+while True:
+    sleep(1)
+"""
+
+# ################################################################################################################################
+
+def on_message_callback(msg):
+
+    # Lets the tests check that responses do not need to be sent in the same order that requests were
+    if msg.payload.get('sleep'):
+        sleep(msg.payload['sleep'])
+
+    if msg.payload.get('fail'):
+        return '{};{}'.format(IPC.STATUS.FAILURE, 'Invocation failed')
+
+    return '{};{}'.format(IPC.STATUS.SUCCESS, dumps({'service': msg.service, 'payload': msg.payload}))
+
+# ################################################################################################################################
+
+class IPCTestCase(TestCase):
+
+    def setUp(self):
+        self.server_name = 'test.server.{}'.format(uuid4().hex[:8])
+        self.target_pid = 1
+
+        self.target = self.get_ipc_api(self.target_pid)
+        self.target.run()
+
+        self.source = self.get_ipc_api(2)
+
+        # Wait until the target starts to listen
+        sleep(0.05)
+
+    def tearDown(self):
+        self.source.close()
+        self.target.close()
+
+# ################################################################################################################################
+
+    def get_ipc_api(self, pid):
+        ipc_api = IPCAPI()
+        ipc_api.name = IPCAPI.get_endpoint_name(cluster_name, self.server_name, pid)
+        ipc_api.pid = pid
+        ipc_api.on_message_callback = on_message_callback
+        return ipc_api
+
+# ################################################################################################################################
+
+    def invoke(self, payload, **kwargs):
+        return self.source.invoke_by_pid('my.service', payload, cluster_name, self.server_name, self.target_pid, **kwargs)
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid(self):
+
+        is_success, response = self.invoke({'abc': 123})
+
+        self.assertTrue(is_success)
+        self.assertDictEqual(response, {'service': 'my.service', 'payload': {'abc': 123}})
+
+        # The same connection is used by all the subsequent invocations
+        client = self.source.pid_clients[self.target_pid]
+        self.assertTupleEqual(self.invoke({'abc': 456}), (True, {'service': 'my.service', 'payload': {'abc': 456}}))
+        self.assertIs(self.source.pid_clients[self.target_pid], client)
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid_failure(self):
+        self.assertTupleEqual(self.invoke({'fail': True}), (False, 'Invocation failed'))
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid_timeout(self):
+        self.assertTupleEqual(self.invoke({'sleep': 0.2}, timeout=0.05), (False, None))
+        self.assertDictEqual(self.source.pid_clients[self.target_pid].pending, {})
+
+        # A response that arrives after its request timed out is ignored and the connection can be still used
+        sleep(0.2)
+        self.assertTrue(self.invoke({'abc': 123})[0])
+
+# ################################################################################################################################
+
+    def test_invoke_by_pid_async(self):
+        self.assertIsNone(self.invoke({'abc': 123}, is_async=True))
+        self.assertDictEqual(self.source.pid_clients[self.target_pid].pending, {})
+
+# ################################################################################################################################
+
+    def test_responses_out_of_order(self):
+
+        responses = []
+
+        def invoke(idx, sleep_time):
+            responses.append((idx, self.invoke({'idx': idx, 'sleep': sleep_time})))
+
+        # The first request is the slowest one but it does not hold up the others sent through the same connection
+        greenlets = [spawn(invoke, idx, sleep_time) for idx, sleep_time in enumerate([0.1, 0.05, 0])]
+        for greenlet in greenlets:
+            greenlet.join()
+
+        self.assertListEqual([idx for idx, _ in responses], [2, 1, 0])
+
+        for idx, (is_success, response) in responses:
+            self.assertTrue(is_success)
+            self.assertEqual(response['payload']['idx'], idx)
+
+# ################################################################################################################################
+
+    def test_reconnect_after_target_restarted(self):
+
+        self.assertTrue(self.invoke({'abc': 123})[0])
+        client = self.source.pid_clients[self.target_pid]
+
+        self.target.close()
+        sleep(0.05)
+
+        # There is no one to connect to ..
+        self.assertIsNone(self.invoke({'abc': 123}))
+
+        # .. until the target is started again.
+        self.target = self.get_ipc_api(self.target_pid)
+        self.target.run()
+        sleep(0.05)
+
+        self.assertTrue(self.invoke({'abc': 123})[0])
+
+        # The previous connection is replaced and its socket is closed
+        self.assertIsNot(self.source.pid_clients[self.target_pid], client)
+        self.assertEqual(client.socket.fileno(), -1)
+
+# ################################################################################################################################
+
+    def test_killed_while_waiting(self):
+
+        greenlet = spawn(self.invoke, {'sleep': 0.1})
+        sleep(0.05)
+        greenlet.kill()
+
+        # No one is waiting for the response anymore but the connection can be still used
+        client = self.source.pid_clients[self.target_pid]
+        self.assertDictEqual(client.pending, {})
+
+        sleep(0.1)
+        self.assertTrue(self.invoke({'abc': 123})[0])
+        self.assertIs(self.source.pid_clients[self.target_pid], client)
+
+# ################################################################################################################################
+
+    def test_killed_while_sending(self):
+
+        self.assertTrue(self.invoke({'abc': 123})[0])
+        client = self.source.pid_clients[self.target_pid]
+
+        # Sending a request is interrupted after only a part of its frame has been written ..
+        def send_frame(socket, data):
+            socket.sendall(b'\x00\x00')
+            sleep(1)
+
+        client.send_frame = send_frame
+
+        greenlet = spawn(self.invoke, {'abc': 456})
+        sleep(0.05)
+        greenlet.kill()
+
+        # .. which means that the connection cannot be used anymore ..
+        self.assertFalse(client.is_connected)
+        self.assertDictEqual(client.pending, {})
+        self.assertEqual(client.socket.fileno(), -1)
+
+        # .. and a new one is established instead.
+        self.assertTrue(self.invoke({'abc': 789})[0])
+        self.assertIsNot(self.source.pid_clients[self.target_pid], client)
+
+# ################################################################################################################################
+
+    def test_spawn_all_deadline(self):
+
+        self.assertTrue(self.invoke({'abc': 123})[0])
+        client = self.source.pid_clients[self.target_pid]
+
+        # One request is being sent when the deadline is reached and another one is waiting for its response ..
+        send_frame = client.send_frame
+
+        def stalled_send_frame(socket, data):
+            if data.payload.get('stall'):
+                socket.sendall(b'\x00\x00')
+                sleep(1)
+            else:
+                send_frame(socket, data)
+
+        client.send_frame = stalled_send_frame
+
+        responses = spawn_all(self.invoke, [{'sleep': 1}, {'stall': True}], 10, 0.1)
+        self.assertListEqual(responses, [ZATO_NOT_GIVEN, ZATO_NOT_GIVEN])
+
+        # .. both of them are killed, none is still pending and the connection that was written to only in part is closed ..
+        self.assertDictEqual(client.pending, {})
+        self.assertFalse(client.is_connected)
+
+        # .. so the next invocation uses a new one.
+        self.assertTrue(self.invoke({'abc': 456})[0])
+        self.assertIsNot(self.source.pid_clients[self.target_pid], client)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class IPCBenchmarkTestCase(TestCase):
+
+    @benchmark
+    def test_round_trip_latency(self):
+
+        server_name = 'test.server.{}'.format(uuid4().hex[:8])
+        target_pid = 1
+
+        worker = subprocess.Popen([sys.executable, '-c', benchmark_worker, cluster_name, server_name, str(target_pid)])
+
+        try:
+            address = IPCEndpoint.get_address(IPCAPI.get_endpoint_name(cluster_name, server_name, target_pid))
+            while not os.path.exists(address):
+                sleep(0.05)
+
+            source = IPCAPI()
+            source.name = IPCAPI.get_endpoint_name(cluster_name, server_name, 2)
+            source.pid = 2
+
+            timings = []
+
+            for idx in range(round_trips):
+                start = perf_counter()
+                is_success, _ = source.invoke_by_pid('my.service', {'idx': idx}, cluster_name, server_name, target_pid)
+                timings.append(perf_counter() - start)
+                self.assertTrue(is_success)
+
+            source.close()
+
+        finally:
+            worker.kill()
+            worker.wait()
+
+        timings.sort()
+        mean = sum(timings) / len(timings)
+        p99 = timings[int(len(timings) * 0.99)]
+
+        benchmark_logger.info('IPC round trips {}; mean: {:.2f} us, p99: {:.2f} us'.format(
+            round_trips, mean * 1_000_000, p99 * 1_000_000))
+
+        # Each invocation through per-call FIFOs took at least 50 ms because that is how often they were polled
+        self.assertLess(p99, 0.05)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
@@ -11,7 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import time
 from datetime import datetime, timedelta
-from random import choice, seed
+from random import seed
 from unittest import TestCase
 
 # Bunch
@@ -27,7 +27,7 @@ except ImportError:
     from dateutil.parser import parse as parse_datetime
 
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep
 
 # mock
 from mock import patch
@@ -36,6 +36,7 @@ from mock import patch
 from zato.common.api import SCHEDULER
 from zato.common.test import is_like_cid, rand_bool, rand_date_utc, rand_int, rand_string
 from zato.scheduler.backend import Interval, Job, Scheduler
+from zato.scheduler.dispatcher import to_timestamp
 
 seed()
 
@@ -54,6 +55,12 @@ class RLock:
 def dummy_callback(*args, **kwargs):
     pass
 
+class ODB:
+    """ Lets the scheduler add its startup jobs, of which there are none in tests.
+    """
+    def session(self):
+        return Bunch(close=dummy_callback)
+
 def get_job(name=None, interval_in_seconds=None, start_time=None, max_repeats=None, callback=None, prefix='job'):
     name = name or '{}-{}'.format(prefix, rand_string())
     interval_in_seconds = interval_in_seconds or rand_int()
@@ -76,8 +83,9 @@ def get_scheduler_config():
     config._add_startup_jobs = False
     config._add_scheduler_jobs = False
     config.startup_jobs = []
-    config.odb = None
+    config.odb = ODB()
     config.job_log_level = 'info'
+    config.main = Bunch(cluster=Bunch(id=rand_int(), stats_enabled=False))
 
     return config
 
@@ -222,143 +230,60 @@ class JobTestCase(TestCase):
 
             self.assertDictEqual(ctx, expected)
 
-    def test_main_loop_keep_running_false(self):
+    def test_get_next_run_at_interval_based(self):
 
-        job = get_job()
-        job.keep_running = False
+        start_time = parse_datetime('2019-11-23 13:15:17')
+        start = to_timestamp(start_time)
 
-        self.assertTrue(job.main_loop())
-        self.assertFalse(job.keep_running)
-        self.assertFalse(job.max_repeats_reached)
+        job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=90), start_time,
+            clone_start_time=True)
 
-        self.assertEqual(job.current_run, 0)
+        # Runs that are on time are followed by the next ones exactly one interval later, no matter when they end ..
+        run_at = start
+        for idx in range(1, 1001):
+            next_run_at = job.get_next_run_at(run_at, run_at + 3.7)
+            self.assertAlmostEqual(next_run_at, start + idx * 90, places=6)
+            run_at = next_run_at
 
-    def test_main_loop_max_repeats_reached(self):
+        self.assertEqual(job.current_run, 1000)
 
-        runs_ctx = []
+        # .. and runs that were missed are skipped.
+        next_run_at = job.get_next_run_at(run_at, run_at + 90 * 5 + 1)
+        self.assertAlmostEqual(next_run_at, run_at + 90 * 6, places=6)
 
-        def callback(ctx):
-            runs_ctx.append(ctx)
+    def test_get_next_run_at_max_repeats(self):
 
-        cb_kwargs = {
-            rand_string():rand_string(),
-            rand_string():rand_string()
-        }
+        data = {'called': 0}
 
-        interval_in_seconds = 0.01
-        max_repeats = choice(range(2, 5))
+        def on_max_repeats_reached_cb(job):
+            data['called'] += 1
 
-        job = get_job(interval_in_seconds=interval_in_seconds, max_repeats=max_repeats)
-        job.callback = callback
-        job.cb_kwargs = cb_kwargs
+        job = get_job(interval_in_seconds=10, max_repeats=3)
+        job.on_max_repeats_reached_cb = on_max_repeats_reached_cb
 
-        self.assertTrue(job.main_loop())
-        sleep(0.2)
+        run_at = to_timestamp(job.start_time)
 
-        len_runs_ctx = len(runs_ctx)
-        self.assertEqual(len_runs_ctx, max_repeats)
+        for _ in range(2):
+            run_at = job.get_next_run_at(run_at, run_at)
+            self.assertIsNotNone(run_at)
+            self.assertFalse(job.max_repeats_reached)
 
+        self.assertIsNone(job.get_next_run_at(run_at, run_at))
+        self.assertTrue(job.max_repeats_reached)
         self.assertFalse(job.keep_running)
-        self.assertIs(job.callback, callback)
-
-        for idx, ctx in enumerate(runs_ctx, 1):
-            self.check_ctx(ctx, job, interval_in_seconds, max_repeats, idx, cb_kwargs, len_runs_ctx)
-
-    def test_main_loop_sleep_spawn_called(self):
-
-        wait_time = 0.2
-        sleep_time = rand_int()
-
-        now_values = [parse_datetime('2019-12-23 22:19:03'), parse_datetime('2021-05-13 17:35:48')]
-
-        sleep_history = []
-        spawn_history = []
-        sleep_time_history = []
-
-        def sleep(value):
-            if value != wait_time:
-                sleep_history.append(value)
-
-        def spawn(*args, **kwargs):
-            spawn_history.append([args, kwargs])
-
-        def get_sleep_time(*args, **kwargs):
-            sleep_time_history.append(args[1])
-            return sleep_time
-
-        with patch('gevent.sleep', sleep):
-            with patch('zato.scheduler.backend.Job._spawn', spawn):
-                with patch('zato.scheduler.backend.Job.get_sleep_time', get_sleep_time):
-                    for now in now_values:
-                        self.now = now
-                        with patch('zato.scheduler.backend.datetime', self._datetime):
-                            for job_type in SCHEDULER.JOB_TYPE.CRON_STYLE, SCHEDULER.JOB_TYPE.INTERVAL_BASED:
-
-                                max_repeats = choice(range(2, 5))
-
-                                cb_kwargs = {
-                                    rand_string():rand_string(),
-                                    rand_string():rand_string()
-                                }
-
-                                interval = Interval(seconds=sleep_time) if job_type == SCHEDULER.JOB_TYPE.INTERVAL_BASED \
-                                    else CronTab(DEFAULT_CRON_DEFINITION)
+        self.assertEqual(data['called'], 1)
 
-                                job = Job(rand_int(), rand_string(), job_type, interval, max_repeats=max_repeats)
+        ctx = job.get_context()
+        self.assertEqual(ctx['current_run'], 3)
+        self.assertTrue(ctx['max_repeats_reached'])
 
-                                if job.type == SCHEDULER.JOB_TYPE.CRON_STYLE:
-                                    job.cron_definition = DEFAULT_CRON_DEFINITION
+    def test_get_next_run_at_one_time(self):
 
-                                job.cb_kwargs = cb_kwargs
-                                job.start_time = datetime.utcnow()
-                                job.callback = dummy_callback
+        job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.ONE_TIME, Interval(seconds=5), datetime.utcnow())
+        now = time.time()
 
-                                self.assertTrue(job.main_loop())
-                                time.sleep(0.5)
-
-                                self.assertEqual(max_repeats, len(sleep_history))
-                                self.assertEqual(max_repeats, len(spawn_history))
-
-                                for item in sleep_history:
-                                    self.assertEqual(sleep_time, item)
-
-                                for idx, (callback, ctx_dict) in enumerate(spawn_history, 1):
-                                    self.assertEqual(2, len(callback))
-                                    callback = callback[1]
-                                    self.check_ctx(
-                                        ctx_dict['ctx'], job, sleep_time, max_repeats, idx, cb_kwargs, len(spawn_history), job_type)
-                                    self.assertIs(callback, dummy_callback)
-
-                                del sleep_history[:]
-                                del spawn_history[:]
-
-                            for item in sleep_time_history:
-                                self.assertEqual(item, now)
-
-                            del sleep_time_history[:]
-
-    def test_run(self):
-
-        data = {'main_loop_called':False, 'sleep': False}
-
-        def main_loop():
-            data['main_loop_called'] = True
-
-        def sleep(value):
-            data['sleep'] = value # Should not be executed if start_time is None
-
-        start_time = datetime.utcnow() + timedelta(seconds=1.2)
-
-        with patch('gevent.sleep', sleep):
-
-            job = get_job()
-            job.main_loop = main_loop
-            job.start_time = start_time
-
-            job.run()
-
-            self.assertTrue(data['main_loop_called'])
-            self.assertEqual(data['sleep'], 1)
+        self.assertIsNone(job.get_next_run_at(now, now))
+        self.assertEqual(job.current_run, 1)
 
     def test_hash_eq(self):
         job1 = get_job(name='a')
@@ -405,39 +330,17 @@ class JobStartTimeTestCase(TestCase):
         expected = parse_datetime(expected)
 
         interval = 1 # Days
-        data = {'start_time':[], 'now':[]}
-
-        def wait_iter_cb(start_time, now, *ignored):
-            data['start_time'].append(start_time)
-            data['now'].append(now)
 
         with patch('zato.scheduler.backend.datetime', self._datetime):
 
             interval = Interval(days=interval)
             job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=start_time, interval=interval)
-            job.wait_iter_cb = wait_iter_cb
-            job.wait_sleep_time = 0.1
 
             self.assertEqual(job.start_time, expected)
             self.assertTrue(job.keep_running)
             self.assertFalse(job.max_repeats_reached)
             self.assertIs(job.max_repeats_reached_at, None)
 
-            spawn(job.run)
-            sleep(0.2)
-
-            len_start_time = len(data['start_time'])
-            len_now = len(data['now'])
-
-            self.assertNotEquals(len_start_time, 0)
-            self.assertNotEquals(len_now, 0)
-
-            for item in data['start_time']:
-                self.assertEqual(expected, item)
-
-            for item in data['now']:
-                self.assertEqual(self.now, item)
-
     def test_get_start_time_result_in_future(self):
         self.check_get_start_time('2017-03-20 19:11:37', '2017-03-21 15:11:37', '2017-03-21 19:11:37')
 
@@ -463,63 +366,67 @@ class SchedulerTestCase(TestCase):
 
     def test_create(self):
 
-        data = {'spawned_jobs': 0}
-
         def on_job_executed(*ignored):
             pass
 
-        def job_run(*ignored):
-            pass
+        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler.lock = RLock()
+        scheduler.on_job_executed = on_job_executed
+
+        job1 = get_job()
+        job2 = get_job()
+        job3 = get_job(name=job2.name)
 
-        def spawn(scheduler_instance, func):
-            self.assertIs(func, job_run)
-            data['spawned_jobs'] += 1
+        job4 = get_job()
+        job5 = get_job()
 
-        with patch('zato.scheduler.backend.Scheduler._spawn', spawn):
+        job6 = get_job(prefix='inactive')
+        job6.is_active = False
 
-            scheduler = Scheduler(get_scheduler_config(), None)
-            scheduler.lock = RLock()
-            scheduler.on_job_executed = on_job_executed
+        scheduler.create(job1)
+        scheduler.create(job2)
 
-            job1 = get_job()
-            job1.run = job_run
+        # These two won't be added because scheduler.jobs is a dict keyed by a job's name,
+        # and the last one replaces the previous ones of the same name in the dispatcher.
+        scheduler.create(job2)
+        scheduler.create(job3)
 
-            job2 = get_job()
-            job2.run = job_run
+        # The first one won't be scheduled but the second one will.
+        scheduler.create(job4, spawn=False)
+        scheduler.create(job5, spawn=True)
 
-            job3 = get_job(name=job2.name)
-            job3.run = job_run
+        # Won't be scheduled because it's inactive.
+        scheduler.create(job6)
 
-            job4 = get_job()
-            job5 = get_job()
+        self.assertEqual(scheduler.lock.called, 7)
+        self.assertEqual(len(scheduler.jobs), 5)
 
-            job6 = get_job(prefix='inactive')
-            job6.is_active = False
+        self.assertIn(job1.name, scheduler.jobs)
+        self.assertIn(job2.name, scheduler.jobs)
 
-            scheduler.create(job1)
-            scheduler.create(job2)
+        self.assertIs(job1.callback, scheduler.on_job_executed)
+        self.assertIs(job2.callback, scheduler.on_job_executed)
 
-            # These two won't be added because scheduler.jobs is a set hashed by a job's name.
-            scheduler.create(job2)
-            scheduler.create(job3)
+        self.assertEqual(len(scheduler.dispatcher), 3)
+        self.assertIs(scheduler.dispatcher.get(job2.name), job3)
+        self.assertNotIn(job4.name, scheduler.dispatcher)
+        self.assertNotIn(job6.name, scheduler.dispatcher)
 
-            # The first one won't be spawned but the second one will.
-            scheduler.create(job4, spawn=False)
-            scheduler.create(job5, spawn=True)
+    def test_unschedule_by_name(self):
 
-            # Won't be added anywhere nor spawned because it's inactive.
-            scheduler.create(job6)
+        scheduler = Scheduler(get_scheduler_config(), None)
 
-            self.assertEqual(scheduler.lock.called, 7)
-            self.assertEqual(len(scheduler.jobs), 5)
+        job1 = get_job()
+        job2 = get_job()
 
-            self.assertIn(job1, scheduler.jobs)
-            self.assertIn(job2, scheduler.jobs)
+        scheduler.create(job1)
+        scheduler.create(job2)
 
-            self.assertIs(job1.callback, scheduler.on_job_executed)
-            self.assertIs(job2.callback, scheduler.on_job_executed)
+        scheduler.unschedule_by_name(job1.name)
 
-            self.assertEqual(data['spawned_jobs'], 4)
+        self.assertNotIn(job1.name, scheduler.jobs)
+        self.assertNotIn(job1.name, scheduler.dispatcher)
+        self.assertIn(job2.name, scheduler.dispatcher)
 
     def test_run(self):
 
@@ -534,20 +441,12 @@ class SchedulerTestCase(TestCase):
         def spawn_job(job):
             data['jobs'].add(job)
 
-        def job_run(self):
-            pass
-
         job1, job2, job3 = [get_job(str(x)) for x in range(3)]
 
         # Already run out of max_repeats and should not be started
         job4 = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=parse_datetime('1997-12-23 21:24:27'),
             interval=Interval(seconds=5), max_repeats=3)
 
-        job1.run = job_run
-        job2.run = job_run
-        job3.run = job_run
-        job4.run = job_run
-
         config = Bunch()
         config.on_job_executed_cb = dummy_callback
         config._add_startup_jobs = False
@@ -585,13 +484,11 @@ class SchedulerTestCase(TestCase):
     def test_on_max_repeats_reached(self):
 
         test_wait_time = 0.5
-        job_sleep_time = 0.02
         job_max_repeats = 3
 
         data = {'job':None, 'called':0}
 
         job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job.wait_sleep_time = job_sleep_time
 
         # Just to make sure it's inactive by default.
         self.assertTrue(job.is_active)
@@ -626,14 +523,10 @@ class SchedulerTestCase(TestCase):
 
     def test_delete(self):
         test_wait_time = 0.5
-        job_sleep_time = 10
         job_max_repeats = 30
 
         job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job1.wait_sleep_time = job_sleep_time
-
         job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job2.wait_sleep_time = job_sleep_time
 
         scheduler = Scheduler(get_scheduler_config(), None)
         scheduler.lock = RLock()
@@ -646,10 +539,14 @@ class SchedulerTestCase(TestCase):
 
         scheduler.unschedule(job1)
 
-        self.assertIn(job2, scheduler.jobs)
-        self.assertNotIn(job1, scheduler.jobs)
+        self.assertIn(job2.name, scheduler.jobs)
+        self.assertNotIn(job1.name, scheduler.jobs)
         self.assertFalse(job1.keep_running)
 
+        # Deleted jobs are not run anymore
+        self.assertIn(job2.name, scheduler.dispatcher)
+        self.assertNotIn(job1.name, scheduler.dispatcher)
+
         # run - 1
         # create - 2
         # delete - 1
@@ -657,62 +554,41 @@ class SchedulerTestCase(TestCase):
         # 1+2+1 = 4
         self.assertEqual(scheduler.lock.called, 4)
 
-    def test_job_greenlets(self):
+    def test_dispatcher_jobs(self):
 
-        data = {'spawned':[], 'stopped': []}
-
-        class FakeGreenlet:
-            def __init__(_self, run):
-                _self.run = _self._run = run
-
-            def kill(_self, *args, **kwargs):
-                data['stopped'].append([_self, args, kwargs])
-
-        def spawn(scheduler_instance, job, *args, **kwargs):
-            g = FakeGreenlet(job)
-            data['spawned'].append(g)
-            return g
-
-        with patch('zato.scheduler.backend.Scheduler._spawn', spawn):
-
-            test_wait_time = 0.5
-            job_sleep_time = 10
-            job_max_repeats = 30
-
-            job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-            job1.wait_sleep_time = job_sleep_time
+        test_wait_time = 0.5
+        job_max_repeats = 30
 
-            job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-            job2.wait_sleep_time = job_sleep_time
+        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
+        job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
 
-            scheduler = Scheduler(get_scheduler_config(), None)
-            scheduler.lock = RLock()
-            scheduler.iter_cb = iter_cb
-            scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
+        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler.lock = RLock()
+        scheduler.iter_cb = iter_cb
+        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
-            scheduler.create(job1)
-            scheduler.create(job2)
-            scheduler.run()
+        scheduler.create(job1)
+        scheduler.create(job2)
+        scheduler.run()
 
-            self.assertEqual(scheduler.job_greenlets[job1.name]._run, job1.run)
-            self.assertEqual(scheduler.job_greenlets[job2.name]._run, job2.run)
+        # Both jobs have been run by the dispatcher, each at its own times
+        self.assertIs(scheduler.dispatcher.get(job1.name), job1)
+        self.assertIs(scheduler.dispatcher.get(job2.name), job2)
 
-            self.assertTrue(job1.keep_running)
-            self.assertTrue(job2.keep_running)
+        self.assertGreater(job1.current_run, 1)
+        self.assertGreater(job2.current_run, 1)
 
-            scheduler.unschedule(job1)
+        self.assertTrue(job1.keep_running)
+        self.assertTrue(job2.keep_running)
 
-            self.assertFalse(job1.keep_running)
-            self.assertTrue(job2.keep_running)
+        scheduler.unschedule(job1)
 
-            self.assertNotIn(job1.name, scheduler.job_greenlets)
-            self.assertEqual(scheduler.job_greenlets[job2.name]._run, job2.run)
+        self.assertFalse(job1.keep_running)
+        self.assertTrue(job2.keep_running)
 
-            self.assertEqual(len(data['stopped']), 1)
-            g, args, kwargs = data['stopped'][0]
-            self.assertIs(g.run.im_func, job1.run.im_func) # That's how we know it was job1 deleted not job2
-            self.assertIs(args, ())
-            self.assertDictEqual(kwargs, {'timeout':2.0, 'block':False})
+        self.assertNotIn(job1.name, scheduler.dispatcher)
+        self.assertIs(scheduler.dispatcher.get(job2.name), job2)
+        self.assertEqual(len(scheduler.dispatcher), 1)
 
     def test_edit(self):
 
@@ -725,7 +601,6 @@ class SchedulerTestCase(TestCase):
         start_time = datetime.utcnow()
         test_wait_time = 0.5
         job_interval1, job_interval2 = 2, 3
-        job_sleep_time = 10
         job_max_repeats1, job_max_repeats2 = 20, 30
 
         scheduler = Scheduler(get_scheduler_config(), None)
@@ -734,15 +609,14 @@ class SchedulerTestCase(TestCase):
         scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         def check(scheduler, job, label):
-            self.assertIn(job.name, scheduler.job_greenlets)
-            self.assertIn(job, scheduler.jobs)
+            self.assertIn(job.name, scheduler.dispatcher)
+            self.assertIn(job.name, scheduler.jobs)
 
-            self.assertEqual(1, len(scheduler.job_greenlets))
+            self.assertEqual(1, len(scheduler.dispatcher))
             self.assertEqual(1, len(scheduler.jobs))
 
-            self.assertIs(job.run.im_func, scheduler.job_greenlets.values()[0]._run.im_func)
-
-            clone = list(scheduler.jobs)[0]
+            clone = list(scheduler.jobs.values())[0]
+            self.assertIs(scheduler.dispatcher.get(job.name), clone)
 
             for name in 'name', 'interval', 'cb_kwargs', 'max_repeats', 'is_active':
                 expected = getattr(job, name)
@@ -757,23 +631,21 @@ class SchedulerTestCase(TestCase):
 
             if label == 'first':
                 self.assertEqual(job.start_time, clone.start_time)
-                self.assertIs(job_cb.im_func, clone_cb.im_func)
-                self.assertIs(job_on_max_cb.im_func, clone_on_max_cb.im_func)
+                self.assertIs(job_cb, clone_cb)
+                self.assertIs(job_on_max_cb, clone_on_max_cb)
 
             else:
                 self.assertEqual(job.start_time, clone.start_time)
-                self.assertIs(clone_cb.im_func, scheduler.on_job_executed.im_func)
-                self.assertIs(clone_on_max_cb.im_func, scheduler.on_max_repeats_reached.im_func)
+                self.assertEqual(clone_cb, scheduler.on_job_executed)
+                self.assertEqual(clone_on_max_cb, scheduler.on_max_repeats_reached)
 
         job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval1), start_time, max_repeats=job_max_repeats1)
         job1.callback = callback
         job1.on_max_repeats_reached_cb = on_max_repeats_reached_cb
-        job1.wait_sleep_time = job_sleep_time
 
         job2 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval2), start_time, max_repeats=job_max_repeats2)
         job2.callback = callback
         job2.on_max_repeats_reached_cb = on_max_repeats_reached_cb
-        job2.wait_sleep_time = job_sleep_time
 
         scheduler.run()
         scheduler.create(job1)
@@ -802,11 +674,9 @@ class SchedulerTestCase(TestCase):
             data['runs'].append(ctx)
 
         test_wait_time = 0.5
-        job_sleep_time = 0.1
         job_max_repeats = 10
 
         job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job.wait_sleep_time = job_sleep_time
         job.get_context = get_context
 
         scheduler = Scheduler(get_scheduler_config(), None)
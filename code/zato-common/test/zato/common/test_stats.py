@@ -7,10 +7,18 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from random import Random
+from time import perf_counter
 from unittest import main, TestCase
 
+# orjson
+from orjson import dumps as json_dumps, loads as json_loads
+
 # Zato
-from zato.common.util.stats import collect_current_usage
+from zato.common.api import StatsKey
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.util.stats import collect_current_usage, histogram_accuracy, histogram_add, histogram_max_buckets, \
+     histogram_merge, histogram_percentile, histogram_summary, new_histogram, percentile
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -63,6 +71,176 @@ class StatsTestCase(TestCase):
         self.assertEqual(result['last_timestamp'], last_timestamp3)
         self.assertEqual(result['last_duration'], last_duration3)
 
+# ################################################################################################################################
+
+    def test_collect_current_usage_merges_histograms(self):
+
+        hist1 = new_histogram()
+        hist2 = new_histogram()
+
+        for value in range(1, 11):
+            histogram_add(hist1, value)
+
+        for value in range(11, 21):
+            histogram_add(hist2, value)
+
+        data = [
+            {'value': 10, 'last_timestamp': '2021-11-22T11:22:33.445566', 'last_duration': 10, 'histogram': hist1},
+            {'value': 10, 'last_timestamp': '2022-12-22T12:22:32.425262', 'last_duration': 20, 'histogram': hist2},
+        ]
+
+        result = collect_current_usage(data)
+
+        self.assertEqual(result[StatsKey.PerKeyCount], 20)
+        self.assertEqual(result[StatsKey.PerKeyMin], 1)
+        self.assertEqual(result[StatsKey.PerKeyMax], 20)
+        self.assertEqual(result[StatsKey.PerKeyMean], 10.5)
+
+# ################################################################################################################################
+
+    def test_collect_current_usage_elems_without_histograms(self):
+
+        hist = new_histogram()
+
+        for value in range(1, 11):
+            histogram_add(hist, value)
+
+        data = [
+            {'value': 10, 'last_timestamp': '2021-11-22T11:22:33.445566', 'last_duration': 10, 'histogram': hist},
+            {'value': 30, 'last_timestamp': '2022-12-22T12:22:32.425262', 'last_duration': 20,
+                'min': 0.5, 'max': 40, 'mean': 20.5, 'histogram': None},
+            {'value': 5, 'last_timestamp': '2020-10-20T10:20:30.405060', 'last_duration': 5,
+                'min': 2, 'max': 8, 'mean': 5.0, 'histogram': new_histogram()},
+        ]
+
+        result = collect_current_usage(data)
+
+        # Elements without histograms still contribute their own min, max and mean ..
+        self.assertEqual(result[StatsKey.PerKeyMin], 0.5)
+        self.assertEqual(result[StatsKey.PerKeyMax], 40)
+        self.assertEqual(result[StatsKey.PerKeyMean], round((55 + 20.5 * 30 + 5.0 * 5) / 45, 3))
+
+        # .. and if there are only such elements, this is what the result is based on.
+        result = collect_current_usage(data[1:])
+
+        self.assertEqual(result[StatsKey.PerKeyMin], 0.5)
+        self.assertEqual(result[StatsKey.PerKeyMax], 40)
+        self.assertEqual(result[StatsKey.PerKeyMean], round((20.5 * 30 + 5.0 * 5) / 35, 3))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class HistogramTestCase(TestCase):
+
+    def get_values(self, count=10_000, seed=123):
+        random = Random(seed)
+        return [random.lognormvariate(3, 1.5) for _ in range(count)]
+
+# ################################################################################################################################
+
+    def test_histogram_percentiles(self):
+
+        values = self.get_values()
+        hist = new_histogram()
+
+        for value in values:
+            histogram_add(hist, value)
+
+        # Each percentile is within the histogram's accuracy of the exact one
+        for percent in (0.5, 0.9, 0.99):
+            expected = percentile(values, percent)
+            given = histogram_percentile(hist, percent)
+            self.assertLess(abs(given - expected) / expected, histogram_accuracy * 2, percent)
+
+        summary = histogram_summary(hist)
+
+        self.assertEqual(summary[StatsKey.PerKeyCount], len(values))
+        self.assertEqual(summary[StatsKey.PerKeyMin], min(values))
+        self.assertEqual(summary[StatsKey.PerKeyMax], max(values))
+        self.assertAlmostEqual(summary[StatsKey.PerKeyMean], sum(values) / len(values), places=2)
+
+# ################################################################################################################################
+
+    def test_histogram_merge(self):
+
+        values = self.get_values()
+
+        hist = new_histogram()
+        hist1 = new_histogram()
+        hist2 = new_histogram()
+
+        for idx, value in enumerate(values):
+            histogram_add(hist, value)
+            histogram_add(hist1 if idx % 2 else hist2, value)
+
+        # A histogram of all the values is the same as the merged histograms of its parts
+        merged = histogram_merge(histogram_merge(new_histogram(), hist1), hist2)
+
+        self.assertDictEqual(merged['buckets'], hist['buckets'])
+        self.assertEqual(merged['count'], hist['count'])
+        self.assertEqual(merged['min'], hist['min'])
+        self.assertEqual(merged['max'], hist['max'])
+
+# ################################################################################################################################
+
+    def test_histogram_zero_and_empty(self):
+
+        hist = new_histogram()
+        self.assertEqual(histogram_percentile(hist, 0.5), 0)
+        self.assertEqual(histogram_summary(hist)[StatsKey.PerKeyMean], 0)
+
+        for value in (0, 0, 0, 5):
+            histogram_add(hist, value)
+
+        self.assertEqual(histogram_percentile(hist, 0.5), 0)
+        self.assertEqual(histogram_percentile(hist, 1.0), 5)
+
+# ################################################################################################################################
+
+    def test_histogram_serialisable_and_bounded(self):
+
+        hist = new_histogram()
+
+        # Values from across many orders of magnitude ..
+        for exponent in range(-6, 12):
+            for mantissa in range(1, 100):
+                histogram_add(hist, mantissa * 10 ** exponent)
+
+        # .. never need more than the maximum number of buckets ..
+        self.assertLessEqual(len(hist['buckets']), histogram_max_buckets)
+
+        # .. and the histogram survives a round trip through JSON.
+        self.assertDictEqual(json_loads(json_dumps(hist)), hist)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_histogram_add_benchmark(self):
+
+        # numpy
+        import numpy as np
+
+        values = self.get_values(100_000)
+        hist = new_histogram()
+
+        # What a two-point mean cost before ..
+        start = perf_counter()
+        previous = values[0]
+        for value in values:
+            previous = np.mean([previous, value]).item()
+        two_point_mean = (perf_counter() - start) / len(values)
+
+        # .. and what it takes to add a value to a histogram.
+        start = perf_counter()
+        for value in values:
+            histogram_add(hist, value)
+        histogram = (perf_counter() - start) / len(values)
+
+        benchmark_logger.info('Duration stats per value; two-point numpy mean: {:.2f} us, histogram: {:.2f} us'.format(
+            two_point_mean * 1_000_000, histogram * 1_000_000))
+
+        self.assertLess(histogram, two_point_mean)
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -13,6 +13,7 @@ from datetime import datetime
 from decimal import Decimal
 from email.utils import formatdate as stdlib_format_date
 from hashlib import sha256
+from heapq import heapify, heappop, heappush
 from json import dumps as json_dumps, JSONEncoder
 from logging import getLogger
 from sys import getsizeof
@@ -25,9 +26,7 @@ from arrow import Arrow
 from cpython.dict cimport PyDict_Contains, PyDict_DelItem, PyDict_GetItem, PyDict_Items, PyDict_Keys, PyDict_SetItem, \
     PyDict_Values
 from cpython.int cimport PyInt_AS_LONG,  PyInt_FromLong, PyInt_GetMax
-from cpython.list cimport PyList_GET_SIZE, PyList_Insert, PyList_SetSlice
 from cpython.object cimport Py_EQ, PyObject, PyObject_RichCompareBool
-from cpython.sequence cimport PySequence_ITEM
 from libc.stdint cimport uint64_t
 #from posix.time cimport timeval, timezone, gettimeofday
 
@@ -37,6 +36,9 @@ from gevent.lock import RLock
 # regex
 from regex import compile as re_compile
 
+# sortedcontainers
+from sortedcontainers import SortedList
+
 # Python 2/3 compatibility
 from builtins import bytes
 from six import binary_type, integer_types, string_types, text_type
@@ -60,6 +62,7 @@ key_types = len_values + integer_types
 class CACHE:
     DEFAULT_SIZE = _COMMON_CACHE.DEFAULT.MAX_SIZE
     MAX_ITEM_SIZE = _COMMON_CACHE.DEFAULT.MAX_ITEM_SIZE
+    MAX_BYTES = _COMMON_CACHE.DEFAULT.MAX_BYTES
 
 # ################################################################################################################################
 
@@ -78,6 +81,35 @@ class _JSONEncoder(JSONEncoder):
 
 # ################################################################################################################################
 
+cdef Py_ssize_t get_deep_size(object value, _getsizeof=getsizeof):
+    """ Returns an approximate size of a value in bytes, including everything it refers to if it is a container.
+    Objects referred to more than once are counted once.
+    """
+    cdef Py_ssize_t out = 0
+    cdef list to_visit = [value]
+    cdef set seen = set()
+    cdef object value_id
+
+    while to_visit:
+        value = to_visit.pop()
+        value_id = id(value)
+
+        if value_id in seen:
+            continue
+
+        seen.add(value_id)
+        out += _getsizeof(value)
+
+        if isinstance(value, dict):
+            to_visit.extend(PyDict_Keys(value))
+            to_visit.extend(PyDict_Values(value))
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            to_visit.extend(value)
+
+    return out
+
+# ################################################################################################################################
+
 cdef class Entry:
     """ Represents an individual value stored in a cache.
     """
@@ -111,19 +143,25 @@ cdef class Entry:
         # This entry's position in index
         public long position
 
-        # Hashed in SHA256
-        public str hash
+        # Approximate number of bytes taken by the key and value, computed only if the cache has max_bytes set
+        public Py_ssize_t size
+
+        # Neighbours in the cache's LRU list - the previous one is closer to the head (most recently used)
+        Entry _prev
+        Entry _next
+
+        # The value of the cache's clock when this entry was last moved to the head of the LRU list
+        uint64_t _stamp
+
+        # The deadline under which this entry is kept in the cache's expiry heap or 0.0 if it is not there
+        double _scheduled_at
 
-        # Non-float timestamps
-        public object last_read_iso
-        public object prev_read_iso
-        public object last_write_iso
-        public object prev_write_iso
+        # Hashed in SHA256, computed on demand and kept until the next write
+        str _hash
 
-        public object last_read_http
-        public object prev_read_http
-        public object last_write_http
-        public object prev_write_http
+        # Non-float timestamps, computed on demand - maps names of timestamps to tuples of
+        # (timestamp, its ISO-8601 form, its RFC 2822 form) so that we know if the timestamp changed in the meantime.
+        dict _formatted
 
     cpdef dict to_dict(self):
         return {
@@ -136,6 +174,7 @@ cdef class Entry:
 
             'hits': self.hits,
             'position': self.position,
+            'size': self.size,
 
             'last_read': self.last_read,
             'prev_read': self.prev_read,
@@ -155,8 +194,17 @@ cdef class Entry:
         }
 
     cpdef set_metadata(self, bint log_details=False):
-        """ Configures metadata after set* operations.
+        """ Configures metadata after set* operations. The actual hash and formatted timestamps are computed
+        only when they are first needed, here we just make sure that the ones from a previous write are not reused.
         """
+        self._hash = None
+        self._formatted = None
+
+        if log_details:
+            logger.info('Set metadata %s', self.to_dict())
+
+    cdef str _get_hash(self):
+
         # Will contain the computed hash value
         h = sha256()
 
@@ -171,28 +219,67 @@ cdef class Entry:
         value = value if isinstance(value, bytes) else value.encode('utf8')
 
         h.update(value)
-        self.hash = str(h.hexdigest())
+        return str(h.hexdigest())
+
+    cdef tuple _get_formatted(self, str name, double timestamp):
+        """ Returns a timestamp in the ISO-8601 and RFC 2822 formats, reusing the previous result if the timestamp
+        has not changed since then.
+        """
+        cdef tuple out
 
-        # Timestamps in formats other than seconds since epoch
+        # Timestamps that have not been set yet are not formatted
+        if not timestamp:
+            return (None, None)
 
-        if self.last_read:
-            self.last_read_iso = datetime.fromtimestamp(self.last_read).isoformat()
-            self.last_read_http = stdlib_format_date(self.last_read, usegmt=True)
+        if self._formatted is None:
+            self._formatted = {}
+        else:
+            out = self._formatted.get(name)
+            if out is not None and out[0] == timestamp:
+                return out[1:]
 
-        if self.prev_read:
-            self.prev_read_iso = datetime.fromtimestamp(self.prev_read).isoformat()
-            self.prev_read_http = stdlib_format_date(self.prev_read, usegmt=True)
+        out = (timestamp, datetime.fromtimestamp(timestamp).isoformat(), stdlib_format_date(timestamp, usegmt=True))
+        self._formatted[name] = out
 
-        if self.prev_write:
-            self.prev_write_iso = datetime.fromtimestamp(self.prev_write).isoformat()
-            self.prev_write_http = stdlib_format_date(self.prev_write, usegmt=True)
+        return out[1:]
 
-        # This is always available because it is set during the initial write
-        self.last_write_iso = datetime.fromtimestamp(self.last_write).isoformat()
-        self.last_write_http = stdlib_format_date(self.last_write, usegmt=True)
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = self._get_hash()
+        return self._hash
 
-        if log_details:
-            logger.info('Set metadata %s', self.to_dict())
+    @property
+    def last_read_iso(self):
+        return self._get_formatted('last_read', self.last_read)[0]
+
+    @property
+    def prev_read_iso(self):
+        return self._get_formatted('prev_read', self.prev_read)[0]
+
+    @property
+    def last_write_iso(self):
+        return self._get_formatted('last_write', self.last_write)[0]
+
+    @property
+    def prev_write_iso(self):
+        return self._get_formatted('prev_write', self.prev_write)[0]
+
+    @property
+    def last_read_http(self):
+        return self._get_formatted('last_read', self.last_read)[1]
+
+    @property
+    def prev_read_http(self):
+        return self._get_formatted('prev_read', self.prev_read)[1]
+
+    @property
+    def last_write_http(self):
+        return self._get_formatted('last_write', self.last_write)[1]
+
+    @property
+    def prev_write_http(self):
+        return self._get_formatted('prev_write', self.prev_write)[1]
 
 # ################################################################################################################################
 
@@ -204,10 +291,22 @@ cdef class Cache:
         public long max_size
         public long max_item_size
         public bint has_max_item_size
+        public long max_bytes
+        public bint has_max_bytes
+        public uint64_t current_bytes # Sum of the sizes of all entries, computed only if has_max_bytes is True
+        public bint use_key_index
+        object _key_index # Sorted string keys, if use_key_index is True, for prefix lookups
+        object _reversed_key_index # Sorted string keys reversed, if use_key_index is True, for suffix lookups
         public bint extend_expiry_on_get
         public bint extend_expiry_on_set
         public dict _data
-        public list _index
+        Entry _head  # Most recently used entry
+        Entry _tail  # Least recently used entry, the first one to be evicted
+        uint64_t _clock # Incremented each time an entry is moved to the head of the LRU list
+        list _expiry_heap # A min-heap of (expires_at, sequence number, entry) tuples, possibly including stale ones
+        uint64_t _expiry_seq # Makes sure that entries themselves are never compared in the expiry heap
+        public uint64_t pending_expirations # How many entries are waiting in the expiry heap
+        public double last_sweep # When was self.delete_expired last called
         public uint64_t misses
         public uint64_t hits
         public uint64_t set_ops
@@ -220,7 +319,14 @@ cdef class Cache:
 
     def __cinit__(self):
         self._data = {}
-        self._index = []
+        self._head = None
+        self._tail = None
+        self._clock = 0
+        self.current_bytes = 0
+        self._expiry_heap = []
+        self._expiry_seq = 0
+        self.pending_expirations = 0
+        self.last_sweep = 0.0
         self.hits_per_position = {}
         self._expired_on_op = []
         self.hits = 0
@@ -229,23 +335,56 @@ cdef class Cache:
         self.get_ops = 0
         self._regex_cache = {}
 
-    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None):
+    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None,
+        max_bytes=None, use_key_index=False):
         self._lock = lock or RLock()
         self.default_get = object()
         with self._lock:
-            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set)
+            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, max_bytes, use_key_index)
+
+    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, max_bytes=None,
+        use_key_index=False):
+        cdef bint had_max_bytes = self.has_max_bytes
+        cdef Entry entry
 
-    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set):
         self.max_size = max_size or CACHE.DEFAULT_SIZE
         self.max_item_size = max_item_size or CACHE.MAX_ITEM_SIZE
         self.has_max_item_size = self.max_item_size > 0
+        self.max_bytes = max_bytes or CACHE.MAX_BYTES
+        self.has_max_bytes = self.max_bytes > 0
         self.extend_expiry_on_get = extend_expiry_on_get
         self.extend_expiry_on_set = extend_expiry_on_set
         self.hits_per_position.update(dict((key, 0) for key in xrange(self.max_size)))
 
+        # Sizes of entries are not computed without max_bytes so, if it has just been set, we need to do it now
+        if self.has_max_bytes:
+            if not had_max_bytes:
+                self.current_bytes = 0
+                for entry in PyDict_Values(self._data):
+                    entry.size = get_deep_size(entry.key) + get_deep_size(entry.value)
+                    self.current_bytes += entry.size
+            self._evict_to_max_bytes(None)
+
+        # Conversely, if there is no limit anymore, sizes will not be kept up to date so we need to reset them
+        elif had_max_bytes:
+            self.current_bytes = 0
+            for entry in PyDict_Values(self._data):
+                entry.size = 0
+
+        # Build the key indexes out of what we already have or drop them if they are no longer needed
+        self.use_key_index = use_key_index
+        if use_key_index:
+            if self._key_index is None:
+                self._key_index = SortedList(key for key in self._data if isinstance(key, str_types))
+                self._reversed_key_index = SortedList(key[::-1] for key in self._key_index)
+        else:
+            self._key_index = None
+            self._reversed_key_index = None
+
     def update_config(self, config):
         with self._lock:
-            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set)
+            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set,
+                config.get('max_bytes'), config.get('use_key_index'))
 
 # ################################################################################################################################
 
@@ -257,11 +396,13 @@ cdef class Cache:
             get_to_set_ops = (round(1.0 * self.get_ops / self.set_ops, 1)) if self.set_ops and self.get_ops else 'n/a'
             get_to_set_ops = ' ({})'.format(get_to_set_ops)
 
-            return '<{} at {}, size:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}>'.format(
+            return '<{} at {}, size:{}/{} bytes:{}/{} hits/misses:{}/{}{}, get/set:{}/{}{}, max_item_size:{}, ' \
+                'pending_expirations:{}>'.format(
                 self.__class__.__name__, hex(id(self)), len(self._data), self.max_size,
+                self.current_bytes, self.max_bytes,
                 self.hits, self.misses, hits_to_misses,
                 self.get_ops, self.set_ops, get_to_set_ops,
-                self.max_item_size
+                self.max_item_size, self.pending_expirations
             )
 
 # ################################################################################################################################
@@ -274,7 +415,7 @@ cdef class Cache:
 
     def __len__(self):
         with self._lock:
-            return PyList_GET_SIZE(self._index)
+            return len(self._data)
 
 # ################################################################################################################################
 
@@ -292,7 +433,21 @@ cdef class Cache:
 
     cpdef list keys_by_position(self):
         with self._lock:
-            return list(self._index)
+            return self._keys_by_position()
+
+# ################################################################################################################################
+
+    cdef list _keys_by_position(self):
+        """ Returns all keys, from the most to the least recently used one. Must be called with self._lock held.
+        """
+        cdef list out = []
+        cdef Entry entry = self._head
+
+        while entry is not None:
+            out.append(entry.key)
+            entry = entry._next
+
+        return out
 
 # ################################################################################################################################
 
@@ -322,10 +477,10 @@ cdef class Cache:
 
     def get_slice(self, start, stop, step):
         with self._lock:
-            for key in self._index[start:stop:step]:
+            for position, key in list(enumerate(self._keys_by_position()))[start:stop:step]:
                 entry = self._data[key]
                 as_dict = entry.to_dict()
-                as_dict['position'] = self._get_index(key)
+                as_dict['position'] = position
                 yield as_dict
 
 # ################################################################################################################################
@@ -336,7 +491,16 @@ cdef class Cache:
         # The attributes cleared below must be kept in sync with the ones from __cinit__.
         with self._lock:
             self._data.clear()
-            self._index[:] = []
+            self._head = None
+            self._tail = None
+            self._clock = 0
+            self.current_bytes = 0
+            self._expiry_heap[:] = []
+            if self._key_index is not None:
+                self._key_index.clear()
+                self._reversed_key_index.clear()
+            self._expiry_seq = 0
+            self.pending_expirations = 0
             self.hits_per_position.clear()
             self._expired_on_op[:] = []
             self.hits = 0
@@ -354,10 +518,13 @@ cdef class Cache:
             return
         else:
             # We run under self.lock so at this point we know that the key was valid
-            # and _remove_from_index_by_idx is safe to call.
+            # and _unlink is safe to call.
             out = entry.value
             del self._data[key]
-            self._remove_from_index_by_idx(self._get_index(key))
+            self._unlink(entry)
+            self._unschedule_expiry(entry)
+            self._remove_from_key_index(key)
+            self.current_bytes -= entry.size
 
             return out
 
@@ -369,6 +536,178 @@ cdef class Cache:
 
     __del__ = delete
 
+# ################################################################################################################################
+
+    cdef inline void _add_to_key_index(self, object key):
+        """ Adds a new key to key indexes, if they are used. Must be called with self._lock held.
+        """
+        if self._key_index is not None and isinstance(key, str_types):
+            self._key_index.add(key)
+            self._reversed_key_index.add(key[::-1])
+
+# ################################################################################################################################
+
+    cdef inline void _remove_from_key_index(self, object key):
+        """ Removes a key from key indexes, if they are used. Must be called with self._lock held.
+        """
+        if self._key_index is not None and isinstance(key, str_types):
+            self._key_index.remove(key)
+            self._reversed_key_index.remove(key[::-1])
+
+# ################################################################################################################################
+
+    cdef list _match_prefix(self, object data, int limit):
+        """ Returns up to limit keys starting with the input prefix, or all of them if limit is 0. Non-string-like keys
+        are ignored. With key indexes, this is O(log n + k), otherwise all keys are visited until enough of them match.
+        Must be called with self._lock held.
+        """
+        cdef list out = []
+
+        if self._key_index is not None:
+            for key in self._key_index.irange(minimum=data):
+                if not key.startswith(data):
+                    break
+                out.append(key)
+                if len(out) == limit:
+                    break
+        else:
+            for key in self._data.iterkeys():
+                if isinstance(key, str_types) and key.startswith(data):
+                    out.append(key)
+                    if len(out) == limit:
+                        break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _match_suffix(self, object data, int limit):
+        """ Returns keys ending with the input suffix, which with key indexes means looking up reversed keys by their
+        reversed prefix. Otherwise, the same as self._match_prefix. Must be called with self._lock held.
+        """
+        cdef list out = []
+        cdef object reversed_data
+
+        if self._key_index is not None:
+            reversed_data = data[::-1]
+            for key in self._reversed_key_index.irange(minimum=reversed_data):
+                if not key.startswith(reversed_data):
+                    break
+                out.append(key[::-1])
+                if len(out) == limit:
+                    break
+        else:
+            for key in self._data.iterkeys():
+                if isinstance(key, str_types) and key.endswith(data):
+                    out.append(key)
+                    if len(out) == limit:
+                        break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _match_regex(self, object data, int limit):
+        """ Returns up to limit keys matching the input regex pattern, or all of them if limit is 0.
+        Non-string-like keys are ignored. Must be called with self._lock held.
+        """
+        cdef list out = []
+        cdef object regex = self._regex_cache.setdefault(data, re_compile(data))
+
+        for key in self._data.iterkeys():
+            if isinstance(key, str_types) and regex.match(key):
+                out.append(key)
+                if len(out) == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _match_contains(self, object data, int limit):
+        """ Returns up to limit keys containing the input pattern, or all of them if limit is 0.
+        Non-string-like keys are ignored. Must be called with self._lock held.
+        """
+        cdef list out = []
+
+        for key in self._data.iterkeys():
+            if isinstance(key, str_types) and data in key:
+                out.append(key)
+                if len(out) == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _match_not_contains(self, object data, int limit):
+        """ Returns up to limit keys that don't contain the input pattern, or all of them if limit is 0.
+        Non-string-like keys are ignored. Must be called with self._lock held.
+        """
+        cdef list out = []
+
+        for key in self._data.iterkeys():
+            if isinstance(key, str_types) and data not in key:
+                out.append(key)
+                if len(out) == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _match_contains_all(self, object data, int limit):
+        """ Returns up to limit keys containing all of the input patterns, or all of them if limit is 0.
+        Non-string-like keys are ignored. Must be called with self._lock held.
+        """
+        cdef list out = []
+        cdef bint use_key
+
+        for key in self._data.iterkeys():
+
+            if not isinstance(key, str_types):
+                continue
+
+            use_key = True
+            for elem in data:
+                if elem not in key:
+                    use_key = False
+                    break
+
+            if use_key:
+                out.append(key)
+                if len(out) == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _match_contains_any(self, object data, int limit):
+        """ Returns up to limit keys containing at least one of the input patterns, or all of them if limit is 0.
+        Non-string-like keys are ignored. Must be called with self._lock held.
+        """
+        cdef list out = []
+        cdef bint use_key
+
+        for key in self._data.iterkeys():
+
+            if not isinstance(key, str_types):
+                continue
+
+            use_key = False
+            for elem in data:
+                if elem in key:
+                    use_key = True
+                    break
+
+            if use_key:
+                out.append(key)
+                if len(out) == limit:
+                    break
+
+        return out
+
 # ################################################################################################################################
 
     cpdef dict delete_by_prefix(self, object data, bint return_found, int limit):
@@ -379,23 +718,12 @@ cdef class Cache:
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_prefix(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -409,23 +737,12 @@ cdef class Cache:
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_suffix(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -436,27 +753,15 @@ cdef class Cache:
         that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef object regex = self._regex_cache.setdefault(data, re_compile(data))
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if regex.match(key):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_regex(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -470,23 +775,12 @@ cdef class Cache:
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data in key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_contains(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -500,23 +794,12 @@ cdef class Cache:
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data not in key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_not_contains(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -530,32 +813,12 @@ cdef class Cache:
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
-        cdef bint add_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_contains_all(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -570,32 +833,12 @@ cdef class Cache:
         cdef object key
         cdef dict out = {}
         cdef object value = None
-        cdef list to_delete = []
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-                if idx == limit:
-                    break
-
-        # We could not do in the loop above because that would have changed self._data
-        # and result in 'RuntimeError: dictionary changed size during iteration'.
-        for key in to_delete:
-            self._delete(key)
+            for key in self._match_contains_any(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                self._delete(key)
 
         return out
 
@@ -603,16 +846,17 @@ cdef class Cache:
 
     cdef inline long _get_index(self, object key):
         """ C-only version of self.get_position that will always return a long - must be called only
-        if key is known to be in self._index or self._data and only with self._lock held.
+        if key is known to be in self._data and only with self._lock held. Walks the LRU list so it should not
+        be used in hot paths, these use self._get_position_estimate instead.
         """
-        cdef Py_ssize_t index_idx = 0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef bint index_key_eq
+        cdef long index_idx = 0
+        cdef Entry entry = self._head
 
-        while index_idx < cache_size:
-            if PyObject_RichCompareBool(PySequence_ITEM(self._index, index_idx), <object>key, Py_EQ):
+        while entry is not None:
+            if PyObject_RichCompareBool(entry.key, <object>key, Py_EQ):
                 return index_idx
             index_idx += 1
+            entry = entry._next
 
 # ################################################################################################################################
 
@@ -625,14 +869,177 @@ cdef class Cache:
 
 # ################################################################################################################################
 
-    cdef inline object _remove_from_index_by_idx(self, long idx):
-        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
-        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
+    cdef inline long _get_position_estimate(self, Entry entry):
+        """ Returns in O(1) an upper bound of the entry's position in the LRU list. Each time an entry is moved
+        to the head of the list, the clock is incremented, so the difference between the clock and the entry's
+        stamp is the number of moves that could have put other entries in front of it. This is exact unless
+        the same entries were read repeatedly in the meantime, in which case the position is overestimated
+        but never greater than the size of the cache. Must be called with self._lock held.
         """
-        cdef object index_key = PySequence_ITEM(self._index, idx)
-        PyList_SetSlice(self._index, idx, idx+1, <object>NULL)
+        cdef uint64_t moves = self._clock - entry._stamp
+        cdef Py_ssize_t cache_size = len(self._data)
 
-        return index_key
+        if moves >= <uint64_t>cache_size:
+            return cache_size - 1 if cache_size else 0
+        return <long>moves
+
+# ################################################################################################################################
+
+    cdef inline void _link_head(self, Entry entry):
+        """ Adds an entry at the head of the LRU list. Must be called with self._lock held.
+        """
+        entry._prev = None
+        entry._next = self._head
+
+        if self._head is not None:
+            self._head._prev = entry
+        else:
+            self._tail = entry
+
+        self._head = entry
+
+        self._clock += 1
+        entry._stamp = self._clock
+
+# ################################################################################################################################
+
+    cdef inline void _unlink(self, Entry entry):
+        """ Removes an entry from the LRU list. Must be called with self._lock held.
+        """
+        if entry._prev is not None:
+            entry._prev._next = entry._next
+        else:
+            self._head = entry._next
+
+        if entry._next is not None:
+            entry._next._prev = entry._prev
+        else:
+            self._tail = entry._prev
+
+        entry._prev = None
+        entry._next = None
+
+# ################################################################################################################################
+
+    cdef inline void _move_to_head(self, Entry entry):
+        """ Marks an entry as the most recently used one. Must be called with self._lock held.
+        """
+        self._unlink(entry)
+        self._link_head(entry)
+
+# ################################################################################################################################
+
+    cdef inline void _evict(self, Entry entry):
+        """ Removes an entry to make room for other ones. Must be called with self._lock held.
+        """
+        self._unlink(entry)
+        self._unschedule_expiry(entry)
+        self._remove_from_key_index(entry.key)
+        self.current_bytes -= entry.size
+        PyDict_DelItem(self._data, entry.key)
+
+# ################################################################################################################################
+
+    cdef void _evict_to_max_bytes(self, Entry keep):
+        """ Evicts the least recently used entries, other than the one to keep, until the cache fits in max_bytes.
+        Must be called with self._lock held.
+        """
+        cdef Entry victim
+
+        while self.current_bytes > <uint64_t>self.max_bytes:
+            victim = self._tail
+
+            # The entry just written to may not have been moved to the head of the list so we need to skip it
+            if victim is keep:
+                victim = victim._prev
+
+            if victim is None:
+                break
+
+            self._evict(victim)
+
+# ################################################################################################################################
+
+    cdef inline void _schedule_expiry(self, Entry entry):
+        """ Makes sure that the entry will be found by self.delete_expired no later than when it expires.
+        Deadlines pushed forward do not update the heap - self.delete_expired reschedules such entries when it
+        finds them. Must be called with self._lock held.
+        """
+        if not entry.expires_at:
+            self._unschedule_expiry(entry)
+            return
+
+        # We have nothing to do if the entry is already in the heap under the same or an earlier deadline
+        if entry._scheduled_at and entry._scheduled_at <= entry.expires_at:
+            return
+
+        if not entry._scheduled_at:
+            self.pending_expirations += 1
+
+        self._expiry_seq += 1
+        entry._scheduled_at = entry.expires_at
+        heappush(self._expiry_heap, (entry.expires_at, self._expiry_seq, entry))
+
+        # Do not let stale items left behind by deleted or rescheduled entries grow the heap indefinitely
+        if <uint64_t>len(self._expiry_heap) > 2 * self.pending_expirations + 1024:
+            self._compact_expiry_heap()
+
+# ################################################################################################################################
+
+    cdef inline void _unschedule_expiry(self, Entry entry):
+        """ Marks the entry as one that is no longer waiting for expiry. Its item in the heap, if any,
+        will be ignored by self.delete_expired. Must be called with self._lock held.
+        """
+        if entry._scheduled_at:
+            entry._scheduled_at = 0.0
+            self.pending_expirations -= 1
+
+# ################################################################################################################################
+
+    cdef void _compact_expiry_heap(self):
+        """ Removes stale items from the expiry heap. Must be called with self._lock held.
+        """
+        cdef tuple item
+        cdef list heap = []
+
+        for item in self._expiry_heap:
+            if (<Entry>item[2])._scheduled_at == item[0]:
+                heap.append(item)
+
+        heapify(heap)
+        self._expiry_heap = heap
+
+# ################################################################################################################################
+
+    cpdef double get_next_expiry(self):
+        """ Returns the earliest time at which any of the entries may expire or 0.0 if none of them uses expiry.
+        The entry may turn out to have had its expiry time extended in the meantime.
+        """
+        with self._lock:
+            while self._expiry_heap:
+                if (<Entry>self._expiry_heap[0][2])._scheduled_at == self._expiry_heap[0][0]:
+                    return self._expiry_heap[0][0]
+                heappop(self._expiry_heap)
+            return 0.0
+
+# ################################################################################################################################
+
+    cpdef dict get_stats(self):
+        """ Returns statistics regarding the cache's usage.
+        """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'set_ops': self.set_ops,
+                'get_ops': self.get_ops,
+                'pending_expirations': self.pending_expirations,
+                'last_sweep': self.last_sweep,
+                'max_bytes': self.max_bytes,
+                'current_bytes': self.current_bytes,
+            }
 
 # ################################################################################################################################
 
@@ -653,10 +1060,8 @@ cdef class Cache:
         cdef Entry entry
         cdef double _now
         cdef double _orig_now = 0.0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef Py_ssize_t index_idx
-        cdef bint old_key_eq
-        cdef long hits_per_position
+        cdef Py_ssize_t cache_size = len(self._data)
+        cdef Py_ssize_t size = 0
         cdef long len_value
 
         # If multiple processes synchronize contents of their caches, the one that originally added the keys
@@ -676,6 +1081,11 @@ cdef class Cache:
                 if len_value > self.max_item_size:
                     raise ValueError('Value too long {} > {}'.format(len_value, self.max_item_size))
 
+        if self.has_max_bytes:
+            size = get_deep_size(key) + get_deep_size(value)
+            if size > self.max_bytes:
+                raise ValueError('Value too big {} > {} bytes'.format(size, self.max_bytes))
+
         # Update total # of .set operations
         self.set_ops += 1
 
@@ -688,6 +1098,7 @@ cdef class Cache:
                 if expiry:
                     entry.expiry = expiry
                     entry.expires_at = _now + expiry
+                    self._schedule_expiry(entry)
             else:
                 # Mark as deleted an entry that has already expired
                 if _now >= entry.expires_at:
@@ -699,6 +1110,7 @@ cdef class Cache:
                     if expiry == 0.0:
                         entry.expires_at = 0.0
                         entry.expiry = 0.0
+                        self._unschedule_expiry(entry)
                     else:
                         # The entry exists and has not expired so now, if we are configured to, prolong its expiration time
                         if self.extend_expiry_on_set and entry.expiry:
@@ -712,12 +1124,16 @@ cdef class Cache:
             entry.value = value
             entry.set_metadata()
 
+            self.current_bytes -= entry.size
+            self.current_bytes += size
+            entry.size = size
+
         # No such key in cache - let's add it.
         else:
 
             # Make sure there is room for the new key
             if cache_size == self.max_size:
-                PyDict_DelItem(self._data, self._index.pop())
+                self._evict(self._tail)
 
             # Actually insert entry
             entry = Entry()
@@ -730,14 +1146,26 @@ cdef class Cache:
             entry.hits = 0
             entry.expiry = expiry
             entry.expires_at = 0.0 if not expiry else _now + expiry
+            entry.size = size
             entry.set_metadata()
 
             PyDict_SetItem(self._data, key, entry)
-            PyList_Insert(self._index, 0, key)
+            self._link_head(entry)
+            self._add_to_key_index(key)
+
+            if entry.expires_at:
+                self._schedule_expiry(entry)
+
+            self.current_bytes += size
+
+        # Make sure there is room for what we have just written
+        if self.has_max_bytes:
+            self._evict_to_max_bytes(entry)
 
         # If any output dict for metadata was passed in by reference, set its requires items.
         if meta_ref is not None:
             meta_ref['expires_at'] = entry.expires_at
+            meta_ref['entry_expiry'] = entry.expiry
             meta_ref['orig_now'] = _orig_now
 
         return entry if details else out
@@ -750,82 +1178,68 @@ cdef class Cache:
 
 # ################################################################################################################################
 
-    cpdef dict set_by_prefix(self, object data, value, double expiry, bint details, dict meta_ref, bint return_found,
-        int limit, object orig_now=None):
-        """ Sets a given value for all keys matching the input prefix. Non-string-like keys are ignored. Optionally,
-        returns a dict of keys that matched the input criteria along with their previous values.
-        Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
+    cdef dict _set_matched(self, list keys, value, double expiry, bint details, dict meta_ref, bint return_found,
+        double _now):
+        """ Sets a given value for all keys found by one of the set_* methods. Optionally, returns a dict of these keys
+        along with their previous values. Keys evicted by earlier updates, which is possible if max_bytes is set,
+        are skipped. Must be called with self._lock held.
         """
         cdef dict out = {}
         cdef Entry entry
         cdef bint _needs_any_found_report = True if meta_ref else False
-        cdef double _now = orig_now if orig_now else self._get_timestamp()
 
-        with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
+        for key in keys:
 
-                    self._set(key, value, expiry, False, None, _now)
+            if not PyDict_Contains(self._data, key):
+                continue
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+            # Set it before the update which would overwrite it, this is why we can return
+            # value alone, without any metadata.
+            if return_found:
+                entry = <Entry>PyDict_GetItem(self._data, key)
+                out[key] = entry if details else entry.value
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+            self._set(key, value, expiry, False, None, _now)
 
-        if meta_ref:
-            meta_ref['_now'] = _now
+            # Indicate to our caller that there was at least one matching key
+            if _needs_any_found_report:
+                meta_ref['_any_found'] = True
+                _needs_any_found_report = False
 
         return out
 
 # ################################################################################################################################
 
-    cpdef dict set_by_suffix(self, object data, value, double expiry, bint details, dict meta_ref, bint return_found,
+    cpdef dict set_by_prefix(self, object data, value, double expiry, bint details, dict meta_ref, bint return_found,
         int limit, object orig_now=None):
-        """ Sets a given value for all keys matching the input suffix. Non-string-like keys are ignored. Optionally,
+        """ Sets a given value for all keys matching the input prefix. Non-string-like keys are ignored. Optionally,
         returns a dict of keys that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef dict out = {}
-        cdef Entry entry
-        cdef bint _needs_any_found_report = True if meta_ref else False
+        cdef dict out
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
+            out = self._set_matched(self._match_prefix(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
-                if key.endswith(data):
+        if meta_ref:
+            meta_ref['_now'] = _now
 
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
+        return out
 
-                    self._set(key, value, expiry, False, None, _now)
+# ################################################################################################################################
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+    cpdef dict set_by_suffix(self, object data, value, double expiry, bint details, dict meta_ref, bint return_found,
+        int limit, object orig_now=None):
+        """ Sets a given value for all keys matching the input suffix. Non-string-like keys are ignored. Optionally,
+        returns a dict of keys that matched the input criteria along with their previous values.
+        Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
+        """
+        cdef dict out
+        cdef double _now = orig_now if orig_now else self._get_timestamp()
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+        with self._lock:
+            out = self._set_matched(self._match_suffix(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -840,36 +1254,11 @@ cdef class Cache:
         Optionally, returns a dict of keys that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef dict out = {}
-        cdef Entry entry
-        cdef object regex = self._regex_cache.setdefault(data, re_compile(data))
-        cdef bint _needs_any_found_report = True if meta_ref else False
+        cdef dict out
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                if regex.match(key):
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
-
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
-
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+            out = self._set_matched(self._match_regex(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -884,36 +1273,11 @@ cdef class Cache:
         Optionally, returns a dict of keys that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef dict out = {}
-        cdef Entry entry
-        cdef bint _needs_any_found_report = True if meta_ref else False
+        cdef dict out
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                if data in key:
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
-
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
-
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+            out = self._set_matched(self._match_contains(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -928,35 +1292,11 @@ cdef class Cache:
         Optionally, returns a dict of keys that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef dict out = {}
-        cdef Entry entry
-        cdef bint _needs_any_found_report = True if meta_ref else False
+        cdef dict out
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                if data not in key:
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
-
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
-
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+            out = self._set_matched(self._match_not_contains(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
         return out
 
@@ -968,42 +1308,11 @@ cdef class Cache:
         Optionally, returns a dict of keys that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef dict out = {}
-        cdef Entry entry
-        cdef bint use_key
-        cdef bint _needs_any_found_report = True if meta_ref else False
+        cdef dict out
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
-
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
-
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+            out = self._set_matched(self._match_contains_all(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -1018,42 +1327,11 @@ cdef class Cache:
         Optionally, returns a dict of keys that matched the input criteria along with their previous values.
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
-        cdef dict out = {}
-        cdef Entry entry
-        cdef bint use_key
-        cdef bint _needs_any_found_report = True if meta_ref else False
+        cdef dict out
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
-
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
-
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+            out = self._set_matched(self._match_contains_any(data, limit), value, expiry, details, meta_ref, return_found, _now)
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -1068,9 +1346,9 @@ cdef class Cache:
         """
         cdef object _item
         cdef Entry entry
-        cdef Py_ssize_t index_idx
-        cdef Py_ssize_t cache_size
-        cdef object index_key
+        cdef long index_idx
+        cdef long hits_per_position
+        cdef PyObject *hits_per_position_item
         cdef double _now = self._get_timestamp()
 
         try:
@@ -1099,19 +1377,17 @@ cdef class Cache:
             self.hits += 1
 
             # Current position of that key in index
-            index_idx = self._get_index(key)
+            index_idx = self._get_position_estimate(entry)
 
             # We have the key's position so we can now update per-position counter
             # to be able to offer statistics on how often a key is found at a given position.
-            hits_per_position = PyInt_AS_LONG(<object>PyDict_GetItem(self.hits_per_position, index_idx))
+            hits_per_position_item = PyDict_GetItem(self.hits_per_position, index_idx)
+            hits_per_position = PyInt_AS_LONG(<object>hits_per_position_item) if hits_per_position_item is not NULL else 0
             hits_per_position += 1
             PyDict_SetItem(self.hits_per_position, index_idx, PyInt_FromLong(hits_per_position))
 
-            # Remove key from index
-            index_key = self._remove_from_index_by_idx(index_idx)
-
-            # Now insert the key back at the head position.
-            PyList_Insert(self._index, 0, index_key)
+            # Now move the key to the head position.
+            self._move_to_head(entry)
 
             # Update last/prev access information + hits
             entry.prev_read = entry.last_read
@@ -1150,13 +1426,8 @@ cdef class Cache:
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._match_prefix(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1170,13 +1441,8 @@ cdef class Cache:
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._match_suffix(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1188,20 +1454,13 @@ cdef class Cache:
         it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef dict out = {}
-        cdef object regex = self._regex_cache.setdefault(data, re_compile(data))
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if regex.match(key):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._match_regex(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
-
 # ################################################################################################################################
 
     cpdef object get_contains(self, object data, bint details, int limit):
@@ -1212,13 +1471,8 @@ cdef class Cache:
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data in key:
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._match_contains(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1232,13 +1486,8 @@ cdef class Cache:
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data not in key:
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._match_not_contains(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1250,25 +1499,10 @@ cdef class Cache:
         it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef dict out = {}
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-                    out[key] = self._get(key, self.default_get, details)
-
-                if idx == limit:
-                    break
+            for key in self._match_contains_all(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1280,25 +1514,10 @@ cdef class Cache:
         it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef dict out = {}
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-                    out[key] = self._get(key, self.default_get, details)
-
-                if idx == limit:
-                    break
+            for key in self._match_contains_any(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1332,14 +1551,9 @@ cdef class Cache:
         cdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._match_prefix(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1352,14 +1566,9 @@ cdef class Cache:
         cdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._match_suffix(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1370,17 +1579,11 @@ cdef class Cache:
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef bint found_any = False
-        cdef object regex = self._regex_cache.setdefault(data, re_compile(data))
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if regex.match(key):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._match_regex(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1393,14 +1596,9 @@ cdef class Cache:
         cdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data in key:
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._match_contains(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1413,14 +1611,9 @@ cdef class Cache:
         cdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data not in key:
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._match_not_contains(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1431,25 +1624,11 @@ cdef class Cache:
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef bint found_any = False
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-                    self._expire(key, expiry, None)
-                    found_any = True
-
-                if idx == limit:
-                    break
+            for key in self._match_contains_all(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1460,35 +1639,22 @@ cdef class Cache:
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef bint found_any = False
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-                    self._expire(key, expiry, None)
-                    found_any = True
-
-                if idx == limit:
-                    break
+            for key in self._match_contains_any(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
 # ################################################################################################################################
 
-    cpdef set_expiration_data(self, object key, double expiry, double expires_at):
+    cpdef set_expiration_data(self, object key, double expiry, double expires_at, bint only_if_later=True):
         """ Sets expiry and expires_at attributes of a cache entry. Unlike self.expire,
         this method is not exposed to user API and is instead used in cache synchronization,
         i.e. current worker's Cache API calls this method after another worker issued a call that changes
-        a given entry's expiry/expires_at attributes.
+        a given entry's expiry/expires_at attributes. If only_if_later is False, the attributes are set
+        even if that means that the entry will expire sooner, or not at all.
         """
         cdef Entry entry
 
@@ -1504,36 +1670,56 @@ cdef class Cache:
                 # Process this request only if its expiration data is farther in the future than what we have in cache,
                 # i.e. it's possible that our current worker already updated expiration metadata before this request was received
                 # and without this condition, we would set expiration data back in the past.
-                if expires_at > entry.expires_at:
+                if expires_at > entry.expires_at or not only_if_later:
                     entry.expiry = expiry
                     entry.expires_at = expires_at
+                    self._schedule_expiry(entry)
 
 # ################################################################################################################################
 
     cpdef list delete_expired(self):
         """ Deletes all entries expired as of now. Also, deletes all entries possibly found to have expired by .get or .set calls.
+        Only entries whose expiry time is in the past are visited, rather than all of the entries in the cache.
         """
         cdef list deleted
         cdef double _now = self._get_timestamp()
-        cdef double expires_at
-
-        # Collects all keys to be deleted and in another pass, delete them all.
-        # It's performed it two steps so as to be able to hold self._lock only once.
+        cdef tuple item
+        cdef Entry entry
 
         with self._lock:
 
             deleted = self._expired_on_op[:]
 
-            # Collect keys still in cache
-            for key, value in PyDict_Items(self._data):
-                expires_at = value.expires_at
-                if expires_at and _now > expires_at:
-                    self._delete(key)
-                    deleted.append(key)
+            while self._expiry_heap:
+
+                # The heap is ordered by expiry time, so we can stop at the first entry that has not expired yet
+                item = self._expiry_heap[0]
+                if item[0] > _now:
+                    break
+
+                heappop(self._expiry_heap)
+                entry = <Entry>item[2]
+
+                # This entry has been deleted or rescheduled since the item was added to the heap
+                if entry._scheduled_at != item[0]:
+                    continue
+
+                entry._scheduled_at = 0.0
+                self.pending_expirations -= 1
+
+                # The entry's expiry time was extended by a .get or .set call in the meantime
+                if entry.expires_at > _now:
+                    self._schedule_expiry(entry)
+                    continue
+
+                self._delete(entry.key)
+                deleted.append(entry.key)
 
             # Collect keys deleted by .get operations
             self._expired_on_op[:] = []
 
+            self.last_sweep = _now
+
         return deleted
 
 # ################################################################################################################################
@@ -15,7 +15,7 @@ from logging import getLogger
 import cython as cy
 
 # Zato
-from zato.common.api import DATA_FORMAT
+from zato.common.api import DATA_FORMAT, SIMPLE_IO
 
 # Zato - Cython
 from zato.simpleio import CySimpleIO
@@ -33,6 +33,7 @@ logger = getLogger('zato')
 # ################################################################################################################################
 
 DATA_FORMAT_DICT:str = DATA_FORMAT.DICT
+SIMPLE_IO_STREAM_FORMAT:set = SIMPLE_IO.STREAM_FORMAT
 _not_given:object = object()
 
 # ################################################################################################################################
@@ -56,6 +57,9 @@ class SimpleIOPayload:
     # This is used by Zato internal services only
     zato_meta = cy.declare(cy.object, visibility='public') # type: object
 
+    # An iterable of output elements that will be streamed to callers instead of being kept in user_attrs_list
+    stream_data = cy.declare(cy.object, visibility='public') # type: object
+
 # ################################################################################################################################
 
     def __cinit__(self, sio:CySimpleIO, all_output_elem_names:list, cid, data_format):
@@ -67,6 +71,7 @@ class SimpleIOPayload:
         self.user_attrs_dict = {}
         self.user_attrs_list = []
         self.zato_meta = None
+        self.stream_data = None
 
 # ################################################################################################################################
 
@@ -86,6 +91,8 @@ class SimpleIOPayload:
         # Special-case Zato's own internal attributes
         if key == 'zato_meta':
             self.zato_meta = value
+        elif key == 'stream_data':
+            self.set_stream(value)
         else:
             self.user_attrs_dict[key] = value
 
@@ -106,7 +113,7 @@ class SimpleIOPayload:
 
     @cy.returns(bool)
     def has_data(self):
-        return bool(self.user_attrs_dict or self.user_attrs_list)
+        return bool(self.user_attrs_dict or self.user_attrs_list or self.stream_data is not None)
 
 # ################################################################################################################################
 
@@ -196,6 +203,35 @@ class SimpleIOPayload:
             else:
                 self.user_attrs_dict.update(self._extract_payload_attrs(value))
 
+# ################################################################################################################################
+
+    def set_stream(self, value:object):
+        """ Assigns an iterable of output elements, e.g. a generator of SQL rows, that will be serialised and sent
+        to the caller in chunks rather than kept in memory. Note that the iterable may be consumed only once.
+        """
+        self.stream_data = value
+        self.output_repeated = True
+
+# ################################################################################################################################
+
+    @cy.returns(bool)
+    def is_streaming(self):
+        """ Returns True if there is stream data that can be sent in chunks in the current data format.
+        """
+        return self.stream_data is not None and self.data_format in SIMPLE_IO_STREAM_FORMAT
+
+# ################################################################################################################################
+
+    def iter_output(self, chunk_size:cy.int):
+        """ Returns a generator of encoded chunks of output built out of stream data.
+        """
+        stream_data = self.stream_data
+        self.stream_data = None
+
+        items = (self._extract_payload_attrs(item) for item in stream_data)
+
+        return self.sio.iter_output(items, self.data_format, chunk_size)
+
 # ################################################################################################################################
 
     @cy.ccall
@@ -206,6 +242,12 @@ class SimpleIOPayload:
             if force_dict_serialisation:
                 serialize = True
 
+        # Stream data cannot be sent in chunks in this context so all of it needs to be read in
+        if self.stream_data is not None:
+            for item in self.stream_data:
+                self.user_attrs_list.append(self._extract_payload_attrs(item))
+            self.stream_data = None
+
         # If data format is DICT, we force serialisation to that format
         # unless overridden on input.
         value = self.user_attrs_list if self.output_repeated else self.user_attrs_dict
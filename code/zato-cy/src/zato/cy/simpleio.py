@@ -33,7 +33,7 @@ from dateutil.parser import parse as dt_parse
 from lxml.etree import _Element as EtreeElementClass, SubElement, XPath
 
 # Zato
-from zato.common.api import APISPEC, DATA_FORMAT, ZATO_NONE
+from zato.common.api import APISPEC, DATA_FORMAT, SIMPLE_IO, ZATO_NONE
 from zato.common.marshal_.api import ElementMissing
 from zato.common.odb.api import SQLRow
 from zato.common.pubsub import PubSubMessage
@@ -1291,6 +1291,35 @@ class SIODefinition:
 # ################################################################################################################################
 # ################################################################################################################################
 
+@cy.cclass
+class InputPlanItem:
+    """ An input element along with everything needed to parse it that is known upfront, when a service is deployed,
+    rather than established anew for each request.
+    """
+    elem          = cy.declare(Elem, visibility='public')    # type: Elem
+    name          = cy.declare(object, visibility='public')  # type: str
+    parse_func    = cy.declare(object, visibility='public')  # type: callable
+    default_func  = cy.declare(object, visibility='public')  # type: callable
+    is_required   = cy.declare(cy.bint, visibility='public') # type: bool
+    is_secret     = cy.declare(cy.bint, visibility='public') # type: bool
+    always_skip   = cy.declare(cy.bint, visibility='public') # type: bool
+    skip_if_empty = cy.declare(cy.bint, visibility='public') # type: bool
+
+# ################################################################################################################################
+
+@cy.cclass
+class OutputPlanItem:
+    """ An output element along with everything needed to serialise it that is known upfront.
+    """
+    name        = cy.declare(object, visibility='public')  # type: str
+    parse_func  = cy.declare(object, visibility='public')  # type: callable
+    encoding    = cy.declare(object, visibility='public')  # type: str
+    is_required = cy.declare(cy.bint, visibility='public') # type: bool
+    is_text     = cy.declare(cy.bint, visibility='public') # type: bool
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 @cy.cclass
 class CySimpleIO:
     """ If a service uses SimpleIO then, during deployment, its class will receive an attribute called _sio
@@ -1318,6 +1347,15 @@ class CySimpleIO:
     # A service class this SimpleIO object is attached to
     service_class = cy.declare(object, visibility='public') # type: object
 
+    # Whether to use input and output plans built for each data format, if there are any for the one requested
+    use_plans = cy.declare(cy.bint, visibility='public') # type: bool
+
+    # Data format -> a list of InputPlanItem objects, one for each input element
+    input_plans = cy.declare(dict, visibility='public') # type: dict
+
+    # Data format -> a list of OutputPlanItem objects, one for each output element
+    output_plans = cy.declare(dict, visibility='public') # type: dict
+
 # ################################################################################################################################
 
     def __cinit__(self, server:object, server_config:SIOServerConfig, user_declaration:object):
@@ -1402,6 +1440,9 @@ class CySimpleIO:
         self.server = server
         self.server_config = server_config
         self.user_declaration = user_declaration
+        self.use_plans = True
+        self.input_plans = {}
+        self.output_plans = {}
 
 # ################################################################################################################################
 
@@ -1567,6 +1608,59 @@ class CySimpleIO:
         # Set up XML configuration
         self._set_up_xml_config()
 
+        # Now that everything else is known, we can prepare input and output plans
+        self._build_plans()
+
+# ################################################################################################################################
+
+    @cy.cfunc
+    def _build_plans(self):
+        """ Resolves upfront, for each data format, what _parse_input_elem and _yield_data_dicts would otherwise look up
+        for each element of each request - parsers and serialisers, defaults as well as whether to skip empty values.
+        Input plans are used with dict-like input only, i.e. XML and CSV are always parsed element by element.
+        """
+        skip_empty:SIOSkipEmpty = self.definition.skip_empty
+        elem:Elem
+
+        for data_format in (DATA_FORMAT_JSON, DATA_FORMAT_DICT, DATA_FORMAT_FORM):
+            input_plan:list = []
+
+            for elem in self.definition.all_input_elems:
+                input_item:InputPlanItem = InputPlanItem()
+                input_item.elem = elem
+                input_item.name = elem.name
+                input_item.parse_func = elem.parse_from[data_format]
+                input_item.default_func = elem.get_default_value
+                input_item.is_required = elem.is_required
+                input_item.is_secret = getattr(elem, 'is_secret', False)
+
+                # The same conditions that _should_skip_on_input checks
+                is_forced:cy.bint = elem.name in skip_empty.force_empty_input_set
+                input_item.always_skip = skip_empty.has_skip_input_set and elem.name in skip_empty.skip_input_set \
+                    and not is_forced
+                input_item.skip_if_empty = skip_empty.skip_all_empty_input and not is_forced
+
+                input_plan.append(input_item)
+
+            self.input_plans[data_format] = input_plan
+
+        for data_format in (DATA_FORMAT_JSON, DATA_FORMAT_DICT, DATA_FORMAT_FORM, DATA_FORMAT_CSV):
+            output_plan:list = []
+
+            for is_required, elems in ((True, self.definition._output_required.elems_by_name),
+                                       (False, self.definition._output_optional.elems_by_name)):
+                for elem in elems.values():
+                    output_item:OutputPlanItem = OutputPlanItem()
+                    output_item.name = elem.name
+                    output_item.parse_func = elem.parse_to[data_format]
+                    output_item.is_required = is_required
+                    output_item.is_text = cy.cast(cy.int, elem._type) == cy.cast(cy.int, sio_text_type)
+                    output_item.encoding = getattr(elem, 'encoding', None)
+
+                    output_plan.append(output_item)
+
+            self.output_plans[data_format] = output_plan
+
 # ################################################################################################################################
 
     @cy.returns(Elem)
@@ -1838,6 +1932,14 @@ class CySimpleIO:
                 elem, type(elem).__name__, self.service_class)
             return
 
+        # Dict-like input is parsed with a plan prepared upfront for its data format, if there is one ..
+        if is_dict and self.use_plans:
+            input_plan = self.input_plans.get(data_format)
+            if input_plan is not None:
+                return self._parse_input_dict(elem, data_format, input_plan, extra)
+
+        # .. otherwise, each element is parsed by checking its configuration as we go.
+
         # This dictionary holds keys that were common to both 'elem' and 'extra'. If extra exists,
         # and some of the extra keys already exist in elem, this dictionary is populated with such
         # keys/value extracted from elem. Before we return, they are re-added. This is needed,
@@ -1962,6 +2064,64 @@ class CySimpleIO:
 
         return out
 
+# ################################################################################################################################
+
+    @cy.returns(dict)
+    def _parse_input_dict(self, elem:object, data_format:object, input_plan:list, extra:dict) -> dict:
+        """ Does the same as _parse_input_elem but with everything about each element resolved upfront in input_plan.
+        """
+        out:dict = {}
+        item:InputPlanItem
+        has_extra:cy.bint = bool(extra)
+
+        for item in input_plan:
+
+            # Keys from extra take precedence over the ones from elem
+            input_value = InternalNotGiven
+
+            if has_extra:
+                input_value = extra.get(item.name, InternalNotGiven)
+
+            if input_value is InternalNotGiven:
+                input_value = cy.cast(dict, elem).get(item.name, InternalNotGiven)
+
+            # We do not have such a elem on input so an exception needs to be raised if this is a require one
+            if input_value is InternalNotGiven:
+
+                if item.is_required:
+
+                    # This goes to logs ..
+                    logger.warning('%s; No such input elem `%s` among `%s` in `%s`' % (
+                        self.service_class, item.name, elem.keys(), elem))
+
+                    # .. while this is potentially returned to users.
+                    raise ElementMissing(item.name)
+
+                elif item.always_skip or item.skip_if_empty:
+                    continue
+
+                elif item.default_func:
+                    value = item.default_func()
+
+                else:
+                    value = item.elem.default_value
+
+            else:
+                if item.always_skip or (item.skip_if_empty and not input_value):
+                    continue
+
+                try:
+                    value = item.parse_func(input_value)
+                except NotImplementedError:
+                    raise NotImplementedError('No parser for input `{}` ({})'.format(input_value, data_format))
+
+                if item.is_secret:
+                    value = self.eval_(item.name, input_value, self.server.encrypt if self.server else None)
+
+            out[item.name] = value
+
+        return out
+
 # ################################################################################################################################
 
     @cy.returns(object)
@@ -1992,7 +2152,7 @@ class CySimpleIO:
 
 # ################################################################################################################################
 
-    def _yield_data_dicts(self, data:object, data_format:str):
+    def _yield_data_dicts(self, data:object, data_format:str, is_iterable:cy.bint=False): # noqa: E252
 
         required_elems:dict = self.definition._output_required.elems_by_name
         optional_elems:dict = self.definition._output_optional.elems_by_name
@@ -2001,7 +2161,8 @@ class CySimpleIO:
         yield list(required_elems.keys())
         yield list(optional_elems.keys())
 
-        input_data:list = data if isinstance(data, (list, tuple)) else [data]
+        # Streamed output may be produced out of any iterable, e.g. a generator of SQL rows, not only out of lists
+        input_data:object = data if (is_iterable or isinstance(data, (list, tuple))) else [data]
 
         # 1st item = is_required
         # 2nd item = elems dict
@@ -2016,6 +2177,9 @@ class CySimpleIO:
         current_elem:Elem = None
         input_data_dict = None
 
+        output_plan:list = self.output_plans.get(data_format) if self.use_plans else None
+        output_item:OutputPlanItem = None
+
         for _input_data_dict in input_data:
 
             # This is the dictionary that we return.
@@ -2035,6 +2199,31 @@ class CySimpleIO:
             elif isinstance(_input_data_dict, SQLRow):
                 input_data_dict = _input_data_dict.get_value()
 
+            # Use a plan prepared upfront, if there is one for this data format ..
+            if output_plan is not None:
+                for output_item in output_plan:
+                    value = input_data_dict.get(output_item.name, InternalNotGiven)
+                    if value is InternalNotGiven:
+                        if output_item.is_required:
+                            raise SerialisationError('Required element `{}` missing in `{}` ({})'.format(
+                                output_item.name, input_data_dict, self.service_class))
+                    else:
+                        try:
+                            value = output_item.parse_func(value)
+                        except Exception as e:
+                            raise SerialisationError('Exception `{!r}` while serialising `{}` ({}) ({}) (func:{})'.format(
+                                e, value, self.service_class, input_data_dict, output_item.parse_func))
+
+                        if output_item.is_text:
+                            if isinstance(value, bytes):
+                                value = value.decode(output_item.encoding)
+
+                        out_data_dict[output_item.name] = value
+
+                yield out_data_dict
+                continue
+
+            # .. otherwise, check each element's configuration as we go.
             for is_required, current_elems in all_elems: # type: bool, dict
                 for current_elem_name, current_elem in current_elems.items():
                     value = input_data_dict.get(current_elem_name, InternalNotGiven)
@@ -2141,6 +2330,101 @@ class CySimpleIO:
         out:object = self._convert_to_dicts(data, DATA_FORMAT_JSON)
         return self.serialise(out, DATA_FORMAT_JSON) if serialise else out
 
+# ################################################################################################################################
+
+    def _iter_output_json(self, data:object, chunk_size:cy.int):
+
+        gen = self._yield_data_dicts(data, DATA_FORMAT_DICT, True)
+
+        # Ignore field names, not needed in JSON
+        next(gen)
+        next(gen)
+
+        encode = self.server_config.json_encoder.encode
+
+        buff:list = []
+        buff_size:cy.int = 0
+        is_first:cy.bint = True
+        chunk:bytes
+
+        # Wrap the response in a top-level element if needed
+        if self.definition._has_response_elem:
+            buff.append(b'{' + encode(self.definition._response_elem).encode('utf8') + b': [')
+            suffix = b']}'
+        else:
+            buff.append(b'[')
+            suffix = b']'
+
+        for data_dict in gen:
+
+            chunk = encode(data_dict).encode('utf8')
+
+            if is_first:
+                is_first = False
+            else:
+                chunk = b', ' + chunk
+
+            buff.append(chunk)
+            buff_size += len(chunk)
+
+            if buff_size >= chunk_size:
+                yield b''.join(buff)
+                buff.clear()
+                buff_size = 0
+
+        buff.append(suffix)
+        yield b''.join(buff)
+
+# ################################################################################################################################
+
+    def _iter_output_csv(self, data:object, chunk_size:cy.int):
+
+        gen = self._yield_data_dicts(data, DATA_FORMAT_CSV, True)
+
+        # First, get the field names
+        required_field_names:list = next(gen)
+        optional_field_names:list = next(gen)
+
+        buff:StringIO = StringIO()
+        writer:DictWriter = DictWriter(
+            buff, required_field_names + optional_field_names, **self.definition._csv_config.writer_config)
+
+        if self.definition._csv_config.should_write_header:
+            writer.writeheader()
+
+        for data_dict in gen:
+            writer.writerow(data_dict)
+
+            if buff.tell() >= chunk_size:
+                yield buff.getvalue().encode('utf8')
+                buff.seek(0)
+                buff.truncate()
+
+        if buff.tell():
+            yield buff.getvalue().encode('utf8')
+
+        buff.close()
+
+# ################################################################################################################################
+
+    def iter_output(self, data:object, data_format:object, chunk_size:cy.int=SIMPLE_IO.DEFAULT.STREAM_CHUNK_SIZE): # noqa: E252
+        """ Returns a generator of UTF-8 encoded chunks of output, each of at least chunk_size bytes, except for the last one.
+        Input data may be any iterable, elements of which are converted only as each of the chunks is produced,
+        which means that the full output never needs to be kept in memory. Only lists of JSON or CSV elements can be streamed.
+        """
+        # No reason to continue if no SimpleIO output is declared
+        if not (self.definition.has_output_required or self.definition.has_output_optional):
+            return iter(())
+
+        if data_format == DATA_FORMAT_JSON:
+            return self._iter_output_json(data, chunk_size)
+
+        elif data_format == DATA_FORMAT_CSV:
+            return self._iter_output_csv(data, chunk_size)
+
+        else:
+            raise ValueError('Output data format `{}` cannot be streamed'.format(data_format))
+
 # ################################################################################################################################
 
     @cy.cfunc
@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import re as stdlib_re
+from collections import OrderedDict
 from datetime import datetime
 from logging import getLogger
 from operator import itemgetter
@@ -39,6 +40,22 @@ unused_marker = 'unused'
 
 _internal_url_path_indicator = '{}/zato/'.format(target_separator)
 
+# ################################################################################################################################
+
+# Characters that give a segment of a pattern a meaning other than its literal one
+_regex_chars = frozenset('.^$*+?()[]{}|\\')
+
+# A pattern's segment that is a single parameter only, e.g. {user_id}
+_param_segment = re_compile(r'^\{[\w \$.\-:|=~^\/]+\}$', stdlib_re.UNICODE)
+
+# A pattern's HTTP method that is a list of alternatives, e.g. (GET|POST) when a channel has no method of its own
+_method_alternatives = re_compile(r'^\((\w+(?:\|\w+)*)\)$', stdlib_re.UNICODE)
+
+_http_any_internal_accept = '{}HTTP_SEP{}'.format(http_any_internal, http_any_internal)
+
+# How many matched URL paths to keep in CyURLData.url_path_cache by default
+url_path_cache_default_max_size = 10000
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -52,7 +69,7 @@ cdef class Matcher:
         public unicode pattern
         public object matcher
         object match_func
-        public bint is_static, is_internal
+        public bint is_static, is_internal, match_slash
         object _brace_pattern
         object _elem_re_template
         set ignore_http_methods
@@ -68,6 +85,7 @@ cdef class Matcher:
 
         self.group_names = []
         self.pattern = pattern
+        self.match_slash = bool(match_slash)
         self.matcher = None
         self.is_static = True
         self._brace_pattern = re_compile('\{[\w \$.\-:|=~^\/]+\}', stdlib_re.UNICODE)
@@ -132,35 +150,312 @@ cdef class Matcher:
 # ################################################################################################################################
 # ################################################################################################################################
 
+cdef class _RouteNode:
+    """ A node of the routing tree. Each level of the tree is a part of a match target - the HTTP method,
+    the HTTP Accept header and then each of the URL path's segments.
+    """
+    cdef:
+        dict static_children     # Literal value -> node
+        _RouteNode any_child     # Matches anything at this level, e.g. a method or Accept header not given
+        _RouteNode param_child   # Matches a single URL path segment, e.g. {user_id}
+        _RouteNode slash_child   # Matches one or more URL path segments, e.g. {user_id} with match_slash set
+        list positions           # Positions in channel_data of channels whose patterns end at this node
+
+    def __init__(self):
+        self.static_children = {}
+        self.any_child = None
+        self.param_child = None
+        self.slash_child = None
+        self.positions = []
+
+# ################################################################################################################################
+
+    cdef _RouteNode get_static_child(self, unicode value):
+        cdef _RouteNode child = self.static_children.get(value)
+        if child is None:
+            child = self.static_children[value] = _RouteNode()
+        return child
+
+    cdef _RouteNode get_any_child(self):
+        if self.any_child is None:
+            self.any_child = _RouteNode()
+        return self.any_child
+
+    cdef _RouteNode get_param_child(self):
+        if self.param_child is None:
+            self.param_child = _RouteNode()
+        return self.param_child
+
+    cdef _RouteNode get_slash_child(self):
+        if self.slash_child is None:
+            self.slash_child = _RouteNode()
+        return self.slash_child
+
+# ################################################################################################################################
+
+    cdef void collect(self, list segments, int idx, set out):
+        """ Adds to out the positions of all channels whose patterns may match URL path segments from idx onwards.
+        """
+        cdef _RouteNode child
+        cdef int segments_len = len(segments)
+        cdef int next_idx
+
+        if idx == segments_len:
+            out.update(self.positions)
+            return
+
+        child = self.static_children.get(segments[idx])
+        if child is not None:
+            child.collect(segments, idx + 1, out)
+
+        if self.param_child is not None:
+            self.param_child.collect(segments, idx + 1, out)
+
+        if self.slash_child is not None:
+            for next_idx in range(idx + 1, segments_len + 1):
+                self.slash_child.collect(segments, next_idx, out)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+cdef inline bint _is_literal(unicode value):
+    for char in value:
+        if char in _regex_chars:
+            return False
+    return True
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 cdef class CyURLData:
 
     cdef:
         public list channel_data
-        public dict url_path_cache
+        public object url_path_cache           # Cache keys -> channels matched, from the least to the most recently used
+        public long url_path_cache_max_size
+        public long url_path_cache_hits
+        public long url_path_cache_misses
+        public dict url_target_cache
         bint has_trace1
+        dict _url_path_cache_by_channel        # Match targets of channels -> keys under which they are in url_path_cache
+        bint _has_accept_routes                # Whether any channel requires a specific HTTP Accept header
+        _RouteNode _routes        # Channels indexed by method, Accept header and URL path segments
+        list _route_fallback      # Positions of channels whose patterns cannot be indexed and are always matched
+        list _route_items         # Channel data as it was when the routes were built
 
-    def __init__(self, channel_data=None):
+    def __init__(self, channel_data=None, url_path_cache_max_size=None):
         self.channel_data = channel_data
-        self.url_path_cache = {}
+        self.url_path_cache = OrderedDict()
+        self.url_path_cache_max_size = url_path_cache_max_size or url_path_cache_default_max_size
+        self.url_path_cache_hits = 0
+        self.url_path_cache_misses = 0
         self.url_target_cache = {}
         self.has_trace1 = logger.isEnabledFor(TRACE1)
+        self._url_path_cache_by_channel = {}
+        self._has_accept_routes = False
+        self.rebuild_routes()
+
+# ################################################################################################################################
+
+    cpdef rebuild_routes(self):
+        """ Builds the routing tree out of current channel_data. Must be called each time channel_data changes.
+        The tree only narrows down which channels may match a given request, their own matchers
+        still make the final decision, in the same order that channel_data is in.
+        """
+        cdef _RouteNode routes = _RouteNode()
+        cdef list fallback = []
+        cdef bint has_accept_routes = False
+        cdef list items = list(self.channel_data or [])
+        cdef list nodes
+        cdef list parts
+        cdef unicode method, accept, segment
+        cdef Matcher matcher
+        cdef _RouteNode node
+        cdef int position
+
+        for position, item in enumerate(items):
+
+            matcher = item['match_target_compiled']
+            parts = matcher.pattern.split(target_separator, 3)
+
+            # Only channels without a SOAP action can be matched because requests never have it
+            if len(parts) != 4 or parts[0] or target_separator in parts[3]:
+                fallback.append(position)
+                continue
+
+            _, method, accept, url_path = parts
+            has_accept_routes = has_accept_routes or accept != _http_any_internal_accept
+
+            # The HTTP method may be a literal one, a list of alternatives or anything else ..
+            if _is_literal(method):
+                nodes = [routes.get_static_child(method)]
+            else:
+                alternatives = _method_alternatives.match(method)
+                if alternatives:
+                    nodes = [routes.get_static_child(elem) for elem in alternatives.group(1).split('|')]
+                else:
+                    nodes = [routes.get_any_child()]
+
+            # .. likewise the HTTP Accept header ..
+            if accept != _http_any_internal_accept and _is_literal(accept):
+                nodes = [node.get_static_child(accept) for node in nodes]
+            else:
+                nodes = [node.get_any_child() for node in nodes]
+
+            # .. and each segment of the URL path is either a literal one or a parameter.
+            for segment in url_path.split('/'):
+                if _is_literal(segment):
+                    nodes = [node.get_static_child(segment) for node in nodes]
+                elif _param_segment.match(segment):
+                    if matcher.match_slash:
+                        nodes = [node.get_slash_child() for node in nodes]
+                    else:
+                        nodes = [node.get_param_child() for node in nodes]
+
+                # Anything else, e.g. a parameter that is only part of a segment, can be matched by a regex only
+                else:
+                    fallback.append(position)
+                    break
+            else:
+                for node in nodes:
+                    node.positions.append(position)
+
+        self._routes = routes
+        self._route_fallback = fallback
+        self._route_items = items
+
+        # Keys of url_path_cache include HTTP Accept headers only if any channel depends on them
+        if has_accept_routes != self._has_accept_routes:
+            self._has_accept_routes = has_accept_routes
+            self.clear_url_path_cache()
+
+# ################################################################################################################################
+
+    cdef list _get_route_candidates(self, unicode url_path, unicode http_method, unicode http_accept):
+        """ Returns channels that may match the request, in the same order that they are in channel_data.
+        """
+        cdef set positions = set(self._route_fallback)
+        cdef list segments = url_path.split('/')
+        cdef list items = self._route_items
+        cdef _RouteNode method_node, accept_node
+
+        for method_node in (self._routes.static_children.get(http_method), self._routes.any_child):
+            if method_node is None:
+                continue
+            for accept_node in (method_node.static_children.get(http_accept), method_node.any_child):
+                if accept_node is not None:
+                    accept_node.collect(segments, 0, positions)
+
+        return [items[position] for position in sorted(positions)]
+
+# ################################################################################################################################
+    cdef unicode _get_cache_key(self, unicode http_method, unicode http_accept, unicode url_path):
+        """ Returns a key under which a target is kept in url_path_cache. Unless any channel depends on HTTP Accept headers,
+        they are not part of the key because each client may send a different one.
+        """
+        cdef unicode key = ''
+        key += target_separator
+        key += http_method
+        key += target_separator
+        if self._has_accept_routes:
+            key += http_accept
+        key += target_separator
+        key += url_path
+        return key
+
+# ################################################################################################################################
+
+    cdef _add_to_cache(self, unicode key, object channel_item):
+        """ Caches a channel matched for a key, evicting the least recently used key if the cache is full.
+        """
+        cdef object match_target = channel_item['match_target']
+
+        self.url_path_cache[key] = channel_item
+        self._url_path_cache_by_channel.setdefault(match_target, set()).add(key)
+
+        if len(self.url_path_cache) > self.url_path_cache_max_size:
+            key, channel_item = self.url_path_cache.popitem(last=False)
+            self._discard_cache_key(channel_item['match_target'], key)
+
+# ################################################################################################################################
+
+    cdef _discard_cache_key(self, object match_target, unicode key):
+        cdef set keys = self._url_path_cache_by_channel.get(match_target)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._url_path_cache_by_channel[match_target]
+
+# ################################################################################################################################
+
+    cdef _pop_from_cache(self, unicode key):
+        channel_item = self.url_path_cache.pop(key, None)
+        if channel_item is not None:
+            self._discard_cache_key(channel_item['match_target'], key)
+
+# ################################################################################################################################
+
+    cpdef clear_url_path_cache(self):
+        self.url_path_cache.clear()
+        self._url_path_cache_by_channel.clear()
+
+# ################################################################################################################################
+
+    cpdef dict get_cache_stats(self):
+        """ Returns statistics of url_path_cache.
+        """
+        return {
+            'size': len(self.url_path_cache),
+            'max_size': self.url_path_cache_max_size,
+            'hits': self.url_path_cache_hits,
+            'misses': self.url_path_cache_misses,
+        }
 
 # ################################################################################################################################
 
     cpdef _remove_from_cache(self, unicode match_target):
+        """ Removes from url_path_cache all the keys that a channel of a given match target was cached under
+        as well as the ones that this channel, if it is a new one, may match from now on.
+        """
+        cdef Matcher matcher = None
+        cdef list parts
+        cdef unicode method, accept, url_path
 
-        targets_to_remove = []
-        cached_targets = self.url_path_cache.keys()
+        # Keys that this channel was cached under ..
+        for key in self._url_path_cache_by_channel.pop(match_target, ()):
+            del self.url_path_cache[key]
 
-        for target in cached_targets:
-            for item in self.channel_data:
+        # .. if this is a new channel, it may take precedence over channels already cached ..
+        for item in self.channel_data:
+            if item['match_target_compiled'].pattern == match_target:
                 matcher = item['match_target_compiled']
-                if matcher.pattern == match_target:
-                    if matcher.match(target) is not None:
-                        targets_to_remove.append(target)
+                break
+
+        if matcher is None:
+            return
+
+        # .. if its pattern is a literal one, we know exactly which keys it may match ..
+        parts = match_target.split(target_separator, 3)
+        if len(parts) == 4 and not parts[0]:
+            _, method, accept, url_path = parts
+            if _is_literal(url_path) and (
+                (accept != _http_any_internal_accept and _is_literal(accept)) or not self._has_accept_routes):
+                alternatives = _method_alternatives.match(method)
+                if alternatives:
+                    methods = alternatives.group(1).split('|')
+                elif _is_literal(method):
+                    methods = [method]
+                else:
+                    methods = None
 
-        for target in targets_to_remove:
-            del self.url_path_cache[target]
+                if methods is not None:
+                    for method in methods:
+                        self._pop_from_cache(self._get_cache_key(method, accept, url_path))
+                    return
+
+        # .. otherwise, each key needs to be checked against its matcher.
+        for key in [key for key in self.url_path_cache if matcher.match(key) is not None]:
+            self._pop_from_cache(key)
 
 # ################################################################################################################################
 
@@ -174,6 +469,8 @@ cdef class CyURLData:
         cdef Matcher matcher
         cdef dict item
         cdef object item_bunch
+        cdef list items
+        cdef unicode cache_key
 
         cdef unicode target = ''
         target += '' # This used to be a SOAP action, now it is always an empty string
@@ -189,14 +486,29 @@ cdef class CyURLData:
         except KeyError:
             has_target_in_cache = False
 
+        cache_key = self._get_cache_key(http_method, http_accept, url_path)
+
         # Return from cache if already seen
         try:
-            ctx, channel_item = {}, self.url_path_cache[target]
+            ctx, channel_item = {}, self.url_path_cache[cache_key]
+            self.url_path_cache.move_to_end(cache_key)
+            self.url_path_cache_hits += 1
             return ctx, channel_item
         except KeyError:
+            self.url_path_cache_misses += 1
             needs_user = not url_path.startswith('/zato')
 
-            for item in self.channel_data:
+            # Channels may have been added or removed without the routes having been rebuilt
+            if len(self._route_items) != len(self.channel_data):
+                self.rebuild_routes()
+
+            # A URL path with a separator in it cannot be split into parts reliably so we need to check all the channels
+            if sep in url_path:
+                items = self.channel_data
+            else:
+                items = self._get_route_candidates(url_path, http_method, http_accept)
+
+            for item in items:
 
                 matcher = item['match_target_compiled']
                 if needs_user and matcher.is_internal:
@@ -212,7 +524,7 @@ cdef class CyURLData:
 
                     # Cache that target but only if it's a static URL without dynamic variables
                     if (not has_target_in_cache) and matcher.is_static:
-                        self.url_path_cache[target] = item_bunch
+                        self._add_to_cache(cache_key, item_bunch)
 
                     return match, item_bunch
 
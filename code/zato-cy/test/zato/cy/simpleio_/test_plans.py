@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from time import perf_counter
+from unittest import main
+
+# Zato
+from zato.common.api import DATA_FORMAT
+from zato.common.test import BaseSIOTestCase, benchmark, benchmark_logger
+from zato.server.service import Service
+
+# Zato - Cython
+from zato.simpleio import AsIs, Bool, CSV, CySimpleIO, Date, DateTime, Decimal, Dict, DictList, ElementMissing, Float, \
+     Int, List, Opaque, Secret, SerialisationError, Text, UUID
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+parse_ops = 20_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_data(idx=0):
+    """ The same input that test_parsing_input_json uses in test_parse_all_elem_types_non_list.
+    """
+    return {
+        'aaa': 'aaa-{}'.format(idx),
+        'bbb': object(),
+        'ccc': True,
+        'ddd': '1,2,3,4',
+        'eee': '1999-12-31',
+        'fff': '1988-01-29T11:22:33.0000Z',
+        'ggg': '123.456',
+        'hhh': {'a':1, 'b':2, 'c':3},
+        'iii': [{'d':4, 'e':5, 'f':6}, {'d':44, 'e':55, 'f':66}],
+        'jjj': '111.222',
+        'mmm': '9090',
+        'nnn': [1, 2, 3, 4],
+        'ooo': object(),
+        'ppp': 'mytext',
+        'qqq': 'd011d054-db4b-4320-9e24-7f4c217af673',
+    }
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class SIOPlansTestCase(BaseSIOTestCase):
+
+    def get_service(self):
+
+        class MyService(Service):
+            class SimpleIO:
+                input = 'aaa', AsIs('bbb'), Bool('ccc'), CSV('ddd'), Date('eee'), DateTime('fff'), Decimal('ggg'), \
+                    Dict('hhh', 'a', 'b', 'c'), DictList('iii', 'd', 'e', 'f'), Float('jjj'), Int('mmm'), List('nnn'), \
+                    Opaque('ooo'), Text('ppp'), UUID('qqq'), '-rrr', Int('-sss', default=123)
+                output = 'aaa', Int('bbb'), Opaque('ccc'), Bool('-ddd'), Text('-eee')
+
+        CySimpleIO.attach_sio(None, self.get_server_config(), MyService)
+
+        return MyService
+
+# ################################################################################################################################
+
+    def parse_input(self, sio, data, data_format, use_plans, **kwargs):
+        sio.use_plans = use_plans
+        try:
+            return sio.parse_input(data, data_format, **kwargs)
+        finally:
+            sio.use_plans = True
+
+# ################################################################################################################################
+
+    def get_output(self, sio, data, data_format, use_plans):
+        sio.use_plans = use_plans
+        try:
+            return sio.get_output(data, data_format)
+        finally:
+            sio.use_plans = True
+
+# ################################################################################################################################
+
+    def test_plans_are_built(self):
+
+        sio = self.get_service()._sio
+
+        self.assertListEqual(sorted(sio.input_plans), sorted([DATA_FORMAT.JSON, DATA_FORMAT.DICT, DATA_FORMAT.FORM_DATA]))
+        self.assertListEqual(sorted(sio.output_plans), sorted([DATA_FORMAT.JSON, DATA_FORMAT.DICT, DATA_FORMAT.FORM_DATA,
+            DATA_FORMAT.CSV]))
+
+        input_plan = sio.input_plans[DATA_FORMAT.JSON]
+        self.assertListEqual([item.name for item in input_plan], sio.definition.all_input_elem_names)
+
+        output_plan = sio.output_plans[DATA_FORMAT.JSON]
+        self.assertListEqual([(item.name, item.is_required) for item in output_plan],
+            [('aaa', True), ('bbb', True), ('ccc', True), ('ddd', False), ('eee', False)])
+
+# ################################################################################################################################
+
+    def test_parse_input_same_as_without_plans(self):
+
+        sio = self.get_service()._sio
+        data = get_data()
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.DICT):
+            with_plans = self.parse_input(sio, data, data_format, True, extra={'aaa': 'from-extra'})
+            without_plans = self.parse_input(sio, data, data_format, False, extra={'aaa': 'from-extra'})
+
+            self.assertDictEqual(with_plans, without_plans)
+            self.assertEqual(with_plans.aaa, 'from-extra')
+            self.assertEqual(with_plans.rrr, '')
+            self.assertEqual(with_plans.sss, 123)
+
+        # Extra keys must not be left over in the input
+        self.assertEqual(data['aaa'], 'aaa-0')
+
+# ################################################################################################################################
+
+    def test_parse_input_missing_required(self):
+
+        sio = self.get_service()._sio
+        data = get_data()
+        del data['mmm']
+
+        for use_plans in (True, False):
+            with self.assertRaises(ElementMissing):
+                self.parse_input(sio, data, DATA_FORMAT.JSON, use_plans)
+
+# ################################################################################################################################
+
+    def test_parse_input_skip_empty(self):
+
+        class MyService(Service):
+            class SimpleIO:
+                input = '-aaa', '-bbb', '-ccc', Secret('-ddd')
+                skip_empty_keys = True
+                force_empty_keys = ['bbb']
+
+        CySimpleIO.attach_sio(None, self.get_server_config(), MyService)
+
+        class MyServiceSkipSet(Service):
+            class SimpleIO:
+                input = '-aaa', '-bbb', '-ccc'
+
+                class SkipEmpty:
+                    input = 'aaa', 'bbb'
+                    force_empty_input = 'bbb'
+
+        CySimpleIO.attach_sio(None, self.get_server_config(), MyServiceSkipSet)
+
+        for service in (MyService, MyServiceSkipSet):
+            for data in ({}, {'aaa': '', 'bbb': '', 'ccc': ''}, {'aaa': 'a', 'bbb': 'b', 'ccc': 'c'}):
+                with_plans = self.parse_input(service._sio, data, DATA_FORMAT.JSON, True)
+                without_plans = self.parse_input(service._sio, data, DATA_FORMAT.JSON, False)
+                self.assertDictEqual(with_plans, without_plans)
+
+# ################################################################################################################################
+
+    def test_parse_input_csv_has_no_plan(self):
+
+        sio = self.get_service()._sio
+        self.assertNotIn(DATA_FORMAT.CSV, sio.input_plans)
+
+# ################################################################################################################################
+
+    def test_get_output_same_as_without_plans(self):
+
+        sio = self.get_service()._sio
+
+        data = [
+            {'aaa': 'aaa-1', 'bbb': '1', 'ccc': 'ccc-1', 'ddd': True, 'eee': b'eee-1'},
+            {'aaa': 'aaa-2', 'bbb': '2', 'ccc': 'ccc-2'},
+        ]
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.DICT, DATA_FORMAT.CSV):
+            with_plans = self.get_output(sio, data, data_format, True)
+            without_plans = self.get_output(sio, data, data_format, False)
+            self.assertEqual(with_plans, without_plans)
+
+        with_plans = self.get_output(sio, data, DATA_FORMAT.DICT, True)
+        self.assertEqual(with_plans[0]['eee'], 'eee-1')
+
+        # A required element is missing
+        for use_plans in (True, False):
+            with self.assertRaises(SerialisationError):
+                self.get_output(sio, {'aaa': 'aaa-1', 'bbb': '1'}, DATA_FORMAT.JSON, use_plans)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_parse_input_benchmark(self):
+
+        sio = self.get_service()._sio
+        data_list = [get_data(idx) for idx in range(100)]
+
+        results = []
+
+        for use_plans in (False, True):
+            sio.use_plans = use_plans
+
+            start = perf_counter()
+            for idx in range(parse_ops):
+                sio.parse_input(data_list[idx % 100], DATA_FORMAT.JSON)
+            results.append((perf_counter() - start) / parse_ops)
+
+        sio.use_plans = True
+        without_plans, with_plans = results
+
+        benchmark_logger.info('SimpleIO parse_input; without plans: {:.2f} us, with plans: {:.2f} us'.format(
+            without_plans * 1_000_000, with_plans * 1_000_000))
+
+        self.assertLess(with_plans, without_plans)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_get_output_benchmark(self):
+
+        sio = self.get_service()._sio
+        data = [{'aaa': 'aaa-{}'.format(idx), 'bbb': str(idx), 'ccc': idx, 'ddd': True, 'eee': 'eee'} for idx in range(100)]
+
+        results = []
+
+        for use_plans in (False, True):
+            sio.use_plans = use_plans
+
+            start = perf_counter()
+            for _ in range(parse_ops // 100):
+                sio.get_output(data, DATA_FORMAT.JSON, False)
+            results.append((perf_counter() - start) / parse_ops)
+
+        sio.use_plans = True
+        without_plans, with_plans = results
+
+        benchmark_logger.info('SimpleIO get_output per element; without plans: {:.2f} us, with plans: {:.2f} us'.format(
+            without_plans * 1_000_000, with_plans * 1_000_000))
+
+        self.assertLess(with_plans, without_plans)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
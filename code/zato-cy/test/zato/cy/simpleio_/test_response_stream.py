@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import tracemalloc
+from gzip import decompress
+from unittest import main
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common.api import DATA_FORMAT
+from zato.common.test import BaseSIOTestCase, benchmark, benchmark_logger
+from zato.server.base.parallel.http import HTTPHandler
+from zato.server.connection.http_soap.channel import gzip_chunks
+from zato.server.service import Service
+
+# Zato - Cython
+from zato.cy.reqresp.payload import SimpleIOPayload
+from zato.simpleio import CySimpleIO, Int, Opaque, SerialisationError
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_rows = 100_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_rows(count, consumed=None):
+    """ Returns a generator of rows, optionally recording how many of them have been consumed so far.
+    """
+    for idx in range(count):
+        if consumed is not None:
+            consumed.append(idx)
+        yield {'aaa': 'aaa-{}'.format(idx), 'bbb': str(idx), 'ccc': 'ccc-{}'.format(idx)}
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class StreamResponse(BaseSIOTestCase):
+
+    def get_sio(self, needs_response_elem=False):
+
+        class MyService(Service):
+            class SimpleIO:
+                output = 'aaa', Int('bbb'), Opaque('ccc'), '-ddd'
+                response_elem = 'my_response'
+
+        CySimpleIO.attach_sio(None, self.get_server_config(needs_response_elem), MyService)
+        return MyService._sio
+
+# ################################################################################################################################
+
+    def test_stream_json_same_as_get_output(self):
+
+        for needs_response_elem in (False, True):
+            sio = self.get_sio(needs_response_elem)
+
+            for count in (0, 1, 100):
+                rows = list(get_rows(count))
+
+                expected = sio.get_output(rows, DATA_FORMAT.JSON)
+                result = b''.join(sio.iter_output(rows, DATA_FORMAT.JSON, 256))
+
+                self.assertEqual(result.decode('utf8'), expected)
+
+# ################################################################################################################################
+
+    def test_stream_csv_same_as_get_output(self):
+
+        sio = self.get_sio()
+
+        for count in (0, 1, 100):
+            rows = list(get_rows(count))
+
+            expected = sio.get_output(rows, DATA_FORMAT.CSV)
+            result = b''.join(sio.iter_output(rows, DATA_FORMAT.CSV, 256))
+
+            self.assertEqual(result.decode('utf8'), expected)
+
+# ################################################################################################################################
+
+    def test_stream_chunk_size(self):
+
+        sio = self.get_sio()
+        chunk_size = 1024
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.CSV):
+
+            consumed = []
+            chunks = sio.iter_output(get_rows(1000, consumed), data_format, chunk_size)
+
+            # Rows are read in only as they are needed for the next chunk ..
+            first = next(chunks)
+            self.assertGreaterEqual(len(first), chunk_size)
+            self.assertLess(len(consumed), 100)
+
+            # .. and each chunk, other than the last one, is only as large as it takes to exceed chunk_size.
+            chunks = [first] + list(chunks)
+            self.assertEqual(len(consumed), 1000)
+
+            for chunk in chunks[:-1]:
+                self.assertGreaterEqual(len(chunk), chunk_size)
+                self.assertLess(len(chunk), chunk_size + 100)
+
+# ################################################################################################################################
+
+    def test_stream_errors(self):
+
+        sio = self.get_sio()
+
+        # A required element is missing
+        with self.assertRaises(SerialisationError):
+            list(sio.iter_output([{'aaa': 'aaa-1'}], DATA_FORMAT.JSON))
+
+        # Only JSON and CSV can be streamed
+        with self.assertRaises(ValueError):
+            sio.iter_output([], DATA_FORMAT.DICT)
+
+# ################################################################################################################################
+
+    def test_payload_set_stream(self):
+
+        sio = self.get_sio()
+
+        # In a format that can be streamed, the output is produced in chunks ..
+        payload = SimpleIOPayload(sio, sio.definition.all_output_elem_names, 'cid', DATA_FORMAT.JSON)
+        payload.set_stream(get_rows(10))
+
+        self.assertTrue(payload.is_streaming())
+        result = b''.join(payload.iter_output(64))
+        self.assertEqual(result.decode('utf8'), sio.get_output(list(get_rows(10)), DATA_FORMAT.JSON))
+
+        # .. whereas other formats have the whole output read in first.
+        payload = SimpleIOPayload(sio, sio.definition.all_output_elem_names, 'cid', DATA_FORMAT.DICT)
+        payload.stream_data = get_rows(10)
+
+        self.assertFalse(payload.is_streaming())
+        self.assertEqual(payload.getvalue(), sio.get_output(list(get_rows(10)), DATA_FORMAT.DICT))
+
+# ################################################################################################################################
+
+    def test_gzip_chunks(self):
+
+        sio = self.get_sio()
+        rows = list(get_rows(1000))
+
+        chunks = list(gzip_chunks(sio.iter_output(rows, DATA_FORMAT.JSON, 1024)))
+
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(decompress(b''.join(chunks)).decode('utf8'), sio.get_output(rows, DATA_FORMAT.JSON))
+
+# ################################################################################################################################
+
+    def test_wsgi_request_stream(self):
+
+        sio = self.get_sio()
+        rows = list(get_rows(100))
+
+        access_log = []
+
+        def dispatch(cid, request_ts_utc, wsgi_environ, worker_store):
+            wsgi_environ['zato.http.response.status'] = '200 OK'
+            return sio.iter_output(rows, DATA_FORMAT.JSON, 256)
+
+        def access_logger_log(level, msg, args, exc_info, extra):
+            access_log.append(extra)
+
+        server = Bunch()
+        server.client_address_headers = ['HTTP_X_FORWARDED_FOR', 'REMOTE_ADDR']
+        server.request_dispatcher_dispatch = dispatch
+        server.worker_store = None
+        server.needs_access_log = True
+        server.needs_all_access_log = True
+        server.access_logger_log = access_logger_log
+
+        wsgi_environ = {
+            'REMOTE_ADDR': '127.0.0.1',
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/my/channel',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+        }
+
+        response = HTTPHandler.on_wsgi_request(server, wsgi_environ, lambda status, headers: None) # type: ignore
+
+        # The WSGI server receives the chunks one by one, rather than a list with the whole stream in it ..
+        chunks = list(response)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(b''.join(chunks).decode('utf8'), sio.get_output(rows, DATA_FORMAT.JSON))
+
+        # .. and the size of the response is not known when it is logged.
+        self.assertEqual(len(access_log), 1)
+        self.assertEqual(access_log[0]['response_size'], '-')
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_stream_memory_benchmark(self):
+
+        sio = self.get_sio()
+
+        tracemalloc.start()
+
+        try:
+            # The whole list is built and serialised upfront ..
+            tracemalloc.reset_peak()
+            size = len(sio.get_output(list(get_rows(benchmark_rows)), DATA_FORMAT.JSON))
+            _, full_peak = tracemalloc.get_traced_memory()
+
+            # .. which is not needed when chunks are produced out of a generator.
+            tracemalloc.reset_peak()
+            for _ in sio.iter_output(get_rows(benchmark_rows), DATA_FORMAT.JSON):
+                pass
+            _, stream_peak = tracemalloc.get_traced_memory()
+
+        finally:
+            tracemalloc.stop()
+
+        benchmark_logger.info('SimpleIO output of {} rows ({} bytes); peak memory, full: {:.2f} MB, streamed: {:.2f} MB'.format(
+            benchmark_rows, size, full_peak / 1_000_000, stream_peak / 1_000_000))
+
+        self.assertLess(stream_peak * 10, full_peak)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -7,11 +7,20 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from datetime import datetime
 from decimal import Decimal
+from email.utils import formatdate as format_date
+from hashlib import sha256
+from json import dumps as json_dumps
+from sys import getsizeof
 from time import sleep
 from unittest import main as unittest_main, TestCase
+from unittest.mock import patch
 from uuid import uuid4
 
+# Bunch
+from bunch import Bunch
+
 # Zato
 from zato.cache import Cache, KeyExpiredError
 from zato.common.py23_ import maxint
@@ -143,6 +152,42 @@ class CacheTestCace(TestCase):
         self.assertEqual(c.index(key2), 1)
         self.assertIsNone(c.index(key1))
 
+# ################################################################################################################################
+
+    def test_set_eviction_after_get(self):
+
+        max_size = 3
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+        key3, expected3 = 'key3', 'value3'
+        key4, expected4 = 'key4', 'value4'
+
+        c = Cache(max_size)
+        c.set(key1, expected1, 0.0, None)
+        c.set(key2, expected2, 0.0, None)
+        c.set(key3, expected3, 0.0, None)
+
+        # Reading key1 makes it the most recently used one so it is key2 that will be evicted
+        c.get(key1, None, False)
+        self.assertListEqual(c.keys_by_position(), [key1, key3, key2])
+
+        c.set(key4, expected4, 0.0, None)
+        self.assertListEqual(c.keys_by_position(), [key4, key1, key3])
+        self.assertNotIn(key2, c)
+
+        # Deleting keys from the middle and both ends of the index keeps the remaining ones in order
+        c.delete(key1)
+        self.assertListEqual(c.keys_by_position(), [key4, key3])
+
+        c.delete(key4)
+        c.delete(key3)
+        self.assertListEqual(c.keys_by_position(), [])
+        self.assertEqual(len(c), 0)
+
+        c.set(key1, expected1, 0.0, None)
+        self.assertListEqual(c.keys_by_position(), [key1])
+        self.assertEqual(c.index(key1), 0)
+
 # ################################################################################################################################
 
     def test_set_already_exists_no_expiry(self):
@@ -358,6 +403,84 @@ class CacheTestCace(TestCase):
         self.assertIn(key2, c)
         self.assertNotIn(key3, c)
 
+# ################################################################################################################################
+
+    def test_delete_expired_at_expires_at(self):
+
+        key1, expected1 = 'key1', 'value1'
+
+        c = Cache()
+        entry = c.set(key1, expected1, 10.0, True)
+
+        # An entry that expires exactly now is expired, the same as it would be for .get and .set
+        with patch('zato.cache.time', return_value=entry.expires_at):
+            deleted = c.delete_expired()
+
+        self.assertListEqual(deleted, [key1])
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.get_stats()['pending_expirations'], 0)
+
+# ################################################################################################################################
+
+    def test_delete_expired_extended_expiry(self):
+
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+        key3, expected3 = 'key3', 'value3'
+
+        c = Cache(extend_expiry_on_get=True)
+        c.set(key1, expected1, 0.1, None)
+        c.set(key2, expected2, 0.1, None)
+        c.set(key3, expected3, 0.0, None)
+
+        stats = c.get_stats()
+        self.assertEqual(stats['pending_expirations'], 2)
+        self.assertEqual(stats['last_sweep'], 0.0)
+
+        # Reading key1 pushes its expiry time forward so it must outlive key2
+        sleep(0.06)
+        c.get(key1, None, False)
+        sleep(0.06)
+
+        deleted = c.delete_expired()
+        self.assertListEqual(deleted, [key2])
+        self.assertIn(key1, c)
+        self.assertIn(key3, c)
+
+        stats = c.get_stats()
+        self.assertEqual(stats['pending_expirations'], 1)
+        self.assertLessEqual(stats['last_sweep'], c.get_timestamp())
+        self.assertGreater(stats['last_sweep'], 0.0)
+        self.assertGreater(c.get_next_expiry(), c.get_timestamp())
+
+        sleep(0.11)
+
+        deleted = c.delete_expired()
+        self.assertListEqual(deleted, [key1])
+        self.assertEqual(c.get_stats()['pending_expirations'], 0)
+        self.assertEqual(c.get_next_expiry(), 0.0)
+
+# ################################################################################################################################
+
+    def test_delete_expired_after_delete_and_reset(self):
+
+        key1, expected1 = 'key1', 'value1'
+        key2, expected2 = 'key2', 'value2'
+
+        c = Cache()
+        c.set(key1, expected1, 0.05, None)
+        c.set(key2, expected2, 0.05, None)
+
+        # Neither key should be reported as expired - one is deleted and the other one no longer uses expiry
+        c.delete(key1)
+        c.set(key2, expected2, 0.0, None)
+        self.assertEqual(c.get_stats()['pending_expirations'], 0)
+
+        sleep(0.06)
+
+        self.assertListEqual(c.delete_expired(), [])
+        self.assertIn(key2, c)
+
 # ################################################################################################################################
 
     def test_get_deletes_expired_key(self):
@@ -474,6 +597,253 @@ class CacheTestCace(TestCase):
         returned1 = c.get(key1, None, False)
         self.assertIs(returned1, expected1)
 
+# ################################################################################################################################
+
+    def test_metadata_computed_on_demand(self):
+
+        key1, expected1 = 'key1', {'a': 1, 'b': 2}
+        expected1_new = {'b': 2, 'a': 1, 'c': 3}
+
+        c = Cache()
+        c.set(key1, expected1, 0.0, None)
+
+        entry = c.get(key1, None, True)
+        hash1 = entry.hash
+        last_write_iso1 = entry.last_write_iso
+
+        self.assertEqual(hash1, sha256(json_dumps(expected1, sort_keys=True).encode('utf8')).hexdigest())
+        self.assertEqual(last_write_iso1, datetime.fromtimestamp(entry.last_write).isoformat())
+        self.assertEqual(entry.last_read_iso, datetime.fromtimestamp(entry.last_read).isoformat())
+        self.assertIsNone(entry.prev_write_iso)
+        self.assertIsNone(entry.prev_write_http)
+
+        # Reading the metadata again returns the same objects
+        self.assertIs(entry.hash, hash1)
+        self.assertIs(entry.last_write_iso, last_write_iso1)
+
+        sleep(0.01)
+        c.set(key1, expected1_new, 0.0, None)
+
+        # After a write, all of the metadata reflects the new value
+        as_dict = entry.to_dict()
+        self.assertNotEqual(as_dict['hash'], hash1)
+        self.assertEqual(as_dict['hash'], sha256(json_dumps(expected1_new, sort_keys=True).encode('utf8')).hexdigest())
+        self.assertEqual(as_dict['prev_write_iso'], last_write_iso1)
+        self.assertNotEqual(as_dict['last_write_iso'], last_write_iso1)
+        self.assertEqual(as_dict['last_write_http'], format_date(entry.last_write, usegmt=True))
+
+# ################################################################################################################################
+
+    def test_max_bytes_evicts_least_recently_used(self):
+
+        value = 'a' * 1000
+        entry_size = getsizeof('key1') + getsizeof(value)
+
+        # There is room for three entries but not for four
+        c = Cache(max_item_size=-1, max_bytes=entry_size * 3 + entry_size // 2)
+
+        c.set('key1', value, 0.0, None)
+        c.set('key2', value, 0.0, None)
+        c.set('key3', value, 0.0, None)
+
+        self.assertEqual(c.current_bytes, entry_size * 3)
+        self.assertEqual(c.get_stats()['current_bytes'], entry_size * 3)
+
+        # Reading key1 makes key2 the least recently used one
+        c.get('key1', None, False)
+        c.set('key4', value, 0.0, None)
+
+        self.assertListEqual(c.keys_by_position(), ['key4', 'key1', 'key3'])
+        self.assertEqual(c.current_bytes, entry_size * 3)
+
+        # A bigger value evicts as many entries as needed, even if the key being updated is the least recently used one
+        c.set('key3', value * 2, 0.0, None)
+        self.assertListEqual(c.keys_by_position(), ['key4', 'key3'])
+        self.assertLessEqual(c.current_bytes, c.max_bytes)
+
+        c.delete('key4')
+        c.delete('key3')
+        self.assertEqual(c.current_bytes, 0)
+
+# ################################################################################################################################
+
+    def test_max_bytes_set_by_regex(self):
+
+        value = 'a' * 1000
+        entry_size = getsizeof('key1') + getsizeof(value)
+
+        c = Cache(max_item_size=-1, max_bytes=entry_size * 3 + entry_size // 2)
+
+        c.set('key1', value, 0.0, None)
+        c.set('key2', value, 0.0, None)
+        c.set('key3', value, 0.0, None)
+
+        # Updating key1 evicts key2, which matched as well but is no longer in the cache when its turn comes
+        found = c.set_by_regex('key[12]', value * 2, 0.0, False, None, True, 0)
+
+        self.assertDictEqual(found, {'key1': value})
+        self.assertListEqual(c.keys_by_position(), ['key3', 'key1'])
+        self.assertEqual(c.get('key1', None, False), value * 2)
+        self.assertEqual(c.get('key3', None, False), value)
+        self.assertLessEqual(c.current_bytes, c.max_bytes)
+
+# ################################################################################################################################
+
+    def test_max_bytes_nested_values(self):
+
+        value = {'a': ['b' * 100, {'c': 'd' * 100}], 'e': ('f' * 100,)}
+
+        c = Cache(max_bytes=100_000)
+        entry = c.set('key1', value, 0.0, True)
+
+        self.assertGreater(entry.size, getsizeof(value) + 300)
+        self.assertEqual(c.current_bytes, entry.size)
+
+# ################################################################################################################################
+
+    def test_max_bytes_value_too_big(self):
+
+        c = Cache(max_item_size=-1, max_bytes=1000)
+
+        try:
+            c.set('key1', 'a' * 1000, 0.0, None)
+        except ValueError as e:
+            self.assertTrue(e.args[0].startswith('Value too big'))
+        else:
+            self.fail('Expected a ValueError to be raised')
+
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.current_bytes, 0)
+
+# ################################################################################################################################
+
+    def _check_prefix_suffix(self, c):
+
+        c.set('a.1.x', 1, 0.0, None)
+        c.set('a.2.y', 2, 0.0, None)
+        c.set('b.1.x', 3, 0.0, None)
+        c.set(123, 4, 0.0, None)
+
+        self.assertDictEqual(c.get_by_prefix('a.', False, 0), {'a.1.x': 1, 'a.2.y': 2})
+        self.assertDictEqual(c.get_by_suffix('.x', False, 0), {'a.1.x': 1, 'b.1.x': 3})
+        self.assertDictEqual(c.get_by_prefix('c.', False, 0), {})
+
+        self.assertDictEqual(c.delete_by_prefix('a.', True, 0), {'a.1.x': 1, 'a.2.y': 2})
+        self.assertDictEqual(c.get_by_prefix('a.', False, 0), {})
+        self.assertDictEqual(c.get_by_suffix('.x', False, 0), {'b.1.x': 3})
+
+        self.assertDictEqual(c.delete_by_suffix('.x', True, 0), {'b.1.x': 3})
+        self.assertEqual(len(c), 1)
+
+        c.set('a.3.z', 5, 0.0, None)
+        c.set('a.4.z', 6, 0.0, None)
+        c.set('a.5.z', 7, 0.0, None)
+        c.set('a.6.z', 8, 0.0, None) # With max_size=4, this evicts key 123
+        c.set('a.7.z', 9, 0.0, None) # This evicts a.3.z
+
+        self.assertEqual(len(c), 4)
+        self.assertDictEqual(c.get_by_prefix('a.', False, 0), {'a.4.z': 6, 'a.5.z': 7, 'a.6.z': 8, 'a.7.z': 9})
+        self.assertDictEqual(c.get_by_suffix('.z', False, 0), {'a.4.z': 6, 'a.5.z': 7, 'a.6.z': 8, 'a.7.z': 9})
+
+        c.clear()
+        self.assertDictEqual(c.get_by_prefix('a.', False, 0), {})
+        self.assertDictEqual(c.get_by_suffix('.z', False, 0), {})
+
+# ################################################################################################################################
+
+    def _check_prefix_suffix_limit(self, c):
+
+        # Keys that do not match are added first so that they are visited first if there are no key indexes
+        for idx in range(10):
+            c.set('b.{}.y'.format(idx), idx, 0.0, None)
+
+        c.set('a.1.x', 1, 0.0, None)
+        c.set('a.2.x', 2, 0.0, None)
+        c.set('a.3.x', 3, 0.0, None)
+
+        # With or without key indexes, limit is the maximum number of keys matched
+        for func, data in ((c.get_by_prefix, 'a.'), (c.get_by_suffix, '.x')):
+            self.assertEqual(len(func(data, False, 2)), 2)
+            self.assertEqual(len(func(data, False, 5)), 3)
+            self.assertEqual(len(func(data, False, 0)), 3)
+
+        deleted = c.delete_by_prefix('a.', True, 2)
+        self.assertEqual(len(deleted), 2)
+        self.assertDictEqual(c.get_by_prefix('a.', False, 0), c.get_by_suffix('.x', False, 0))
+        self.assertEqual(len(c.get_by_prefix('a.', False, 0)), 1)
+
+        deleted = c.delete_by_suffix('.y', True, 4)
+        self.assertEqual(len(deleted), 4)
+        self.assertEqual(len(c), 7)
+
+# ################################################################################################################################
+
+    def test_prefix_suffix_no_key_index(self):
+        c = Cache(4)
+        self._check_prefix_suffix(c)
+
+        c = Cache(100)
+        self._check_prefix_suffix_limit(c)
+
+# ################################################################################################################################
+
+    def test_prefix_suffix_key_index(self):
+        c = Cache(4, use_key_index=True)
+        self._check_prefix_suffix(c)
+
+        c = Cache(100, use_key_index=True)
+        self._check_prefix_suffix_limit(c)
+
+# ################################################################################################################################
+
+    def test_regex_contains_limit(self):
+
+        c = Cache(100)
+
+        # Keys that do not match are added first so that they are visited first
+        for idx in range(10):
+            c.set('b.{}.y'.format(idx), idx, 0.0, None)
+
+        c.set('a.1.x', 1, 0.0, None)
+        c.set('a.2.x', 2, 0.0, None)
+        c.set('a.3.x', 3, 0.0, None)
+
+        # Limit is the maximum number of keys matched, the same as in prefix and suffix lookups
+        for func, data in (
+            (c.get_by_regex, r'a\.\d\.x'),
+            (c.get_contains, '.x'),
+            (c.get_not_contains, '.y'),
+            (c.get_contains_all, ['a.', '.x']),
+            (c.get_contains_any, ['.x', '.z']),
+        ):
+            self.assertEqual(len(func(data, False, 2)), 2, func)
+            self.assertEqual(len(func(data, False, 5)), 3, func)
+            self.assertEqual(len(func(data, False, 0)), 3, func)
+
+        found = c.set_by_regex(r'a\.\d\.x', 0, 0.0, False, None, True, 2)
+        self.assertDictEqual(found, {'a.1.x': 1, 'a.2.x': 2})
+
+        deleted = c.delete_contains_any(['.x'], True, 2)
+        self.assertDictEqual(deleted, {'a.1.x': 0, 'a.2.x': 0})
+        self.assertEqual(len(c), 11)
+
+# ################################################################################################################################
+
+    def test_key_index_enabled_with_existing_keys(self):
+        c = Cache()
+
+        c.set('a.1', 1, 0.0, None)
+        c.set('a.2', 2, 0.0, None)
+        c.set('b.1', 3, 0.0, None)
+
+        c.update_config(Bunch(max_size=100, max_item_size=10000, extend_expiry_on_get=True, extend_expiry_on_set=True,
+            use_key_index=True))
+
+        self.assertTrue(c.use_key_index)
+        self.assertDictEqual(c.get_by_prefix('a.', False, 0), {'a.1': 1, 'a.2': 2})
+        self.assertDictEqual(c.get_by_prefix('a.', False, 1), {'a.1': 1})
+        self.assertDictEqual(c.get_by_suffix('.1', False, 0), {'a.1': 1, 'b.1': 3})
+
 # ################################################################################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from random import Random
+from time import perf_counter
+from unittest import main as unittest_main, TestCase
+
+# Zato
+from zato.cache import Cache
+from zato.common.test import benchmark, benchmark_logger
+
+# ################################################################################################################################
+
+cache_sizes = [1_000, 100_000, 1_000_000]
+get_ops = 2_000
+
+# ################################################################################################################################
+
+class _ListIndexCache:
+    """ A reference implementation of how the cache's index used to be kept - as a list of keys,
+    from the most to the least recently used one, with each hit moving a key to the list's head.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = {}
+        self._index = []
+
+    def set(self, key, value):
+        if key not in self._data:
+            if len(self._index) == self.max_size:
+                del self._data[self._index.pop()]
+            self._index.insert(0, key)
+        self._data[key] = value
+
+    def get(self, key):
+        value = self._data[key]
+        idx = self._index.index(key)
+        del self._index[idx]
+        self._index.insert(0, key)
+        return value
+
+# ################################################################################################################################
+
+class CacheBenchmarkTestCase(TestCase):
+
+    def _get_keys(self, cache_size):
+        return ['key.{}'.format(idx) for idx in range(cache_size)]
+
+# ################################################################################################################################
+
+    def _run_gets(self, func, keys):
+        start = perf_counter()
+        for key in keys:
+            func(key)
+        return (perf_counter() - start) / len(keys)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_get_latency_by_cache_size(self):
+
+        random = Random(1)
+
+        for cache_size in cache_sizes:
+
+            keys = self._get_keys(cache_size)
+            sample = random.choices(keys, k=get_ops)
+
+            list_cache = _ListIndexCache(cache_size)
+            for key in keys:
+                list_cache.set(key, key)
+
+            cache = Cache(cache_size)
+            for key in keys:
+                cache.set(key, key, 0.0, False)
+
+            list_taken = self._run_gets(list_cache.get, sample)
+            cache_taken = self._run_gets(lambda key: cache.get(key, None, False), sample)
+
+            benchmark_logger.info('Cache size {:>9}; get list index: {:.2f} us, linked list index: {:.2f} us'.format(
+                cache_size, list_taken * 1_000_000, cache_taken * 1_000_000))
+
+            # With large caches, a linear scan of the index dominates everything else that .get does
+            if cache_size >= 100_000:
+                self.assertLess(cache_taken, list_taken)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_get_latency_is_flat(self):
+
+        random = Random(2)
+        results = []
+
+        for cache_size in cache_sizes:
+
+            keys = self._get_keys(cache_size)
+            sample = random.choices(keys, k=get_ops)
+
+            cache = Cache(cache_size)
+            for key in keys:
+                cache.set(key, key, 0.0, False)
+
+            results.append(self._run_gets(lambda key: cache.get(key, None, False), sample))
+
+        # A thousand times more keys must not make reads more than a few times slower,
+        # the remaining difference is down to CPU caches rather than to the index itself.
+        self.assertLess(results[-1], results[0] * 10)
+
+# ################################################################################################################################
+
+    def _run_sets(self, cache, value, set_ops, needs_metadata):
+        start = perf_counter()
+        for idx in range(set_ops):
+            entry = cache.set('key.{}'.format(idx % 100), value, 0.0, True)
+
+            # This is what each .set used to compute before metadata became lazy
+            if needs_metadata:
+                entry.hash
+                entry.last_write_iso
+                entry.last_write_http
+
+        return set_ops / (perf_counter() - start)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_set_throughput_by_value_type(self):
+
+        max_item_size = 2 * 1024 * 1024
+
+        values = [
+            ('str', 'abc' * 10, 100_000),
+            ('dict', {'key.{}'.format(idx): [idx, str(idx), {'idx': idx}] for idx in range(100)}, 10_000),
+            ('1 MB', 'a' * 1024 * 1024, 1_000),
+        ]
+
+        for name, value, set_ops in values:
+
+            eager = self._run_sets(Cache(max_item_size=max_item_size), value, set_ops, True)
+            lazy = self._run_sets(Cache(max_item_size=max_item_size), value, set_ops, False)
+
+            benchmark_logger.info('Value {:>4}; sets per second with eager metadata: {:.0f}, lazy metadata: {:.0f}'.format(
+                name, eager, lazy))
+            self.assertGreater(lazy, eager)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_delete_by_prefix_key_index(self):
+
+        cache_size = 1_000_000
+        invalidations = 20
+
+        # Each prefix stands for a group of 10 keys, e.g. all the keys cached for a single customer
+        keys = ['customer.{}.{}'.format(idx // 10, idx % 10) for idx in range(cache_size)]
+        prefixes = ['customer.{}.'.format(idx) for idx in Random(3).sample(range(cache_size // 10), invalidations)]
+
+        results = []
+
+        for use_key_index in (False, True):
+
+            cache = Cache(cache_size, use_key_index=use_key_index)
+            for key in keys:
+                cache.set(key, key, 0.0, False)
+
+            start = perf_counter()
+            for prefix in prefixes:
+                deleted = cache.delete_by_prefix(prefix, True, 0)
+                self.assertEqual(len(deleted), 10)
+            results.append((perf_counter() - start) / invalidations)
+
+        linear_taken, index_taken = results
+
+        benchmark_logger.info('Cache size {:>9}; delete_by_prefix linear scan: {:.2f} ms, key index: {:.2f} ms'.format(
+            cache_size, linear_taken * 1000, index_taken * 1000))
+
+        self.assertLess(index_taken * 100, linear_taken)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from random import Random
+from time import perf_counter
+from unittest import main as unittest_main, TestCase
+
+# Zato
+from zato.common.api import HTTP_SOAP
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.util.url_dispatcher import get_match_target
+from zato.url_dispatcher import CyURLData, Matcher
+
+# ################################################################################################################################
+
+http_methods_allowed_re = '(GET|POST|PUT|DELETE|PATCH)'
+accept_any = '{}HTTP_SEP{}'.format(HTTP_SOAP.ACCEPT.ANY_INTERNAL, HTTP_SOAP.ACCEPT.ANY_INTERNAL)
+
+channel_counts = [10, 1_000, 10_000]
+match_ops = 1_000
+
+# ################################################################################################################################
+
+def get_channel(name, url_path, http_method='', http_accept='', match_slash=False):
+    match_target = get_match_target({
+        'soap_action': '',
+        'http_method': http_method,
+        'http_accept': http_accept,
+        'url_path': url_path,
+    }, http_methods_allowed_re=http_methods_allowed_re)
+
+    return {
+        'name': name,
+        'is_internal': url_path.startswith('/zato'),
+        'match_target': match_target,
+        'match_target_compiled': Matcher(match_target, match_slash),
+    }
+
+# ################################################################################################################################
+
+def match_linear(channel_data, url_path, http_method, http_accept=accept_any):
+    """ Matches a request the way it was done before there was a routing tree - by trying each channel in turn.
+    """
+    target = ':::{}:::{}:::{}'.format(http_method, http_accept, url_path)
+    for item in channel_data:
+        match = item['match_target_compiled'].match(target)
+        if match is not None:
+            return match, item['name']
+    return None, None
+
+# ################################################################################################################################
+
+class URLDispatcherTestCase(TestCase):
+
+    def match(self, url_data, url_path, http_method, http_accept=accept_any):
+        match, item = url_data.match(url_path, http_method, http_accept)
+        return match, (item['name'] if item else None)
+
+# ################################################################################################################################
+
+    def test_match_static_and_params(self):
+
+        url_data = CyURLData([
+            get_channel('a', '/api/user'),
+            get_channel('b', '/api/user/{user_id}'),
+            get_channel('c', '/api/user/{user_id}/group/{group_id}', 'GET'),
+        ])
+
+        self.assertEqual(self.match(url_data, '/api/user', 'GET'), ({}, 'a'))
+        self.assertEqual(self.match(url_data, '/api/user/123', 'POST'), ({'user_id': '123'}, 'b'))
+        self.assertEqual(self.match(url_data, '/api/user/123/group/456', 'GET'), ({'user_id': '123', 'group_id': '456'}, 'c'))
+
+        self.assertEqual(self.match(url_data, '/api/user/123/group/456', 'POST'), (None, None))
+        self.assertEqual(self.match(url_data, '/api/user/123/group', 'GET'), (None, None))
+        self.assertEqual(self.match(url_data, '/api/customer', 'GET'), (None, None))
+
+# ################################################################################################################################
+
+    def test_match_precedence(self):
+
+        # Both channels match the same path so the one that comes first in channel_data wins ..
+        channel_data = [
+            get_channel('a', '/api/{name}'),
+            get_channel('b', '/api/user'),
+        ]
+
+        url_data = CyURLData(channel_data)
+        self.assertEqual(self.match(url_data, '/api/user', 'GET'), ({'name': 'user'}, 'a'))
+
+        # .. which is still the case after the order has been changed.
+        channel_data.reverse()
+        url_data.rebuild_routes()
+        self.assertEqual(self.match(url_data, '/api/user', 'GET'), ({}, 'b'))
+
+# ################################################################################################################################
+
+    def test_match_slash(self):
+
+        url_data = CyURLData([
+            get_channel('a', '/api/file/{path}', match_slash=True),
+            get_channel('b', '/api/dir/{path}/info', match_slash=True),
+        ])
+
+        self.assertEqual(self.match(url_data, '/api/file/a/b/c', 'GET'), ({'path': 'a/b/c'}, 'a'))
+        self.assertEqual(self.match(url_data, '/api/dir/a/b/info', 'GET'), ({'path': 'a/b'}, 'b'))
+        self.assertEqual(self.match(url_data, '/api/dir/info', 'GET'), (None, None))
+
+# ################################################################################################################################
+
+    def test_match_fallback_patterns(self):
+
+        # Neither of these can be put in the routing tree so they are always matched with their regexes
+        url_data = CyURLData([
+            get_channel('a', '/api/user/{user_id}.json'),
+            get_channel('b', '/api/v1.0/user'),
+        ])
+
+        self.assertEqual(self.match(url_data, '/api/user/123.json', 'GET'), ({'user_id': '123'}, 'a'))
+        self.assertEqual(self.match(url_data, '/api/v1.0/user', 'GET'), ({}, 'b'))
+        self.assertEqual(self.match(url_data, '/api/v1x0/user', 'GET'), ({}, 'b'))
+
+# ################################################################################################################################
+
+    def test_match_http_accept(self):
+
+        url_data = CyURLData([
+            get_channel('a', '/api/user', http_accept='application/json'),
+            get_channel('b', '/api/user'),
+        ])
+
+        self.assertEqual(self.match(url_data, '/api/user', 'GET', 'applicationHTTP_SEPjson'), ({}, 'a'))
+        self.assertEqual(self.match(url_data, '/api/user', 'GET', 'textHTTP_SEPxml'), ({}, 'b'))
+
+# ################################################################################################################################
+
+    def test_channel_data_changed(self):
+
+        channel_data = [get_channel('a', '/api/a')]
+        url_data = CyURLData(channel_data)
+
+        self.assertEqual(self.match(url_data, '/api/b', 'GET'), (None, None))
+
+        # Routes are rebuilt if channel_data changes without rebuild_routes having been called
+        channel_data.append(get_channel('b', '/api/b'))
+        self.assertEqual(self.match(url_data, '/api/b', 'GET'), ({}, 'b'))
+
+# ################################################################################################################################
+
+    def test_match_same_as_linear(self):
+
+        random = Random(1)
+
+        segments = ['api', 'user', 'group', 'customer', 'order', 'v1.0', '{id}', '{name}', '{x}.json', '']
+        methods = ['', 'GET', 'POST', 'DELETE']
+
+        channel_data = []
+        for idx in range(500):
+            url_path = '/' + '/'.join(random.choice(segments) for _ in range(random.randint(1, 4)))
+            channel_data.append(get_channel('channel.{}'.format(idx), url_path, random.choice(methods),
+                match_slash=random.random() < 0.3))
+
+        url_data = CyURLData(channel_data)
+
+        for _ in range(2000):
+            url_path = '/' + '/'.join(random.choice(['api', 'user', 'group', '123', 'abc', 'v1.0', 'v1x0', 'a.json', ''])
+                for _ in range(random.randint(1, 6)))
+            http_method = random.choice(methods[1:])
+            self.assertEqual(self.match(url_data, url_path, http_method), match_linear(channel_data, url_path, http_method))
+
+    def test_url_path_cache_lru(self):
+
+        url_data = CyURLData([get_channel('channel.{}'.format(idx), '/api/{}'.format(idx)) for idx in range(5)],
+            url_path_cache_max_size=3)
+
+        for idx in range(4):
+            self.match(url_data, '/api/{}'.format(idx), 'GET')
+
+        # The least recently used path was evicted ..
+        self.assertListEqual(list(url_data.url_path_cache), [':::GET::::::/api/1', ':::GET::::::/api/2', ':::GET::::::/api/3'])
+
+        # .. a hit makes a path the most recently used one ..
+        self.match(url_data, '/api/1', 'GET')
+        self.match(url_data, '/api/4', 'GET')
+        self.assertListEqual(list(url_data.url_path_cache), [':::GET::::::/api/3', ':::GET::::::/api/1', ':::GET::::::/api/4'])
+
+        # .. and HTTP Accept headers are not part of keys because no channel needs a specific one.
+        self.match(url_data, '/api/4', 'GET', 'textHTTP_SEPxml')
+
+        self.assertDictEqual(url_data.get_cache_stats(), {'size': 3, 'max_size': 3, 'hits': 2, 'misses': 5})
+
+# ################################################################################################################################
+
+    def test_url_path_cache_invalidation(self):
+
+        channel_data = [
+            get_channel('a', '/api/a'),
+            get_channel('b', '/api/b'),
+            get_channel('c', '/api/{name}', 'GET'),
+        ]
+
+        url_data = CyURLData(channel_data)
+
+        self.match(url_data, '/api/a', 'GET')
+        self.match(url_data, '/api/b', 'GET')
+        self.match(url_data, '/api/b', 'POST')
+
+        # Deleting a channel removes only the keys that this channel was cached under ..
+        url_data._remove_from_cache(channel_data[1]['match_target'])
+        self.assertListEqual(list(url_data.url_path_cache), [':::GET::::::/api/a'])
+
+        # .. while adding a channel removes the keys that it takes precedence over, whether it is a literal one ..
+        self.match(url_data, '/api/b', 'GET')
+        channel_data.insert(0, get_channel('b2', '/api/b', 'GET'))
+        url_data._remove_from_cache(channel_data[0]['match_target'])
+        self.assertListEqual(list(url_data.url_path_cache), [':::GET::::::/api/a'])
+        self.assertEqual(self.match(url_data, '/api/b', 'GET'), ({}, 'b2'))
+
+        # .. or one with parameters.
+        channel_data.insert(0, get_channel('d', '/api/{other_name}', 'GET'))
+        url_data._remove_from_cache(channel_data[0]['match_target'])
+        self.assertListEqual(list(url_data.url_path_cache), [])
+
+# ################################################################################################################################
+
+# ################################################################################################################################
+
+class URLDispatcherBenchmarkTestCase(TestCase):
+
+    def _get_channel_data(self, channel_count):
+
+        channel_data = []
+
+        for idx in range(channel_count):
+
+            # A mix of the kind of channels that REST APIs usually have - static ones and ones with parameters
+            if idx % 2:
+                url_path = '/api/customer{}/{{customer_id}}/order/{{order_id}}'.format(idx)
+            else:
+                url_path = '/api/customer{}/list'.format(idx)
+
+            channel_data.append(get_channel('channel.{}'.format(idx), url_path, 'GET'))
+
+        return channel_data
+
+# ################################################################################################################################
+
+    def _run_matches(self, func, url_paths):
+        start = perf_counter()
+        for url_path in url_paths:
+            func(url_path)
+        return (perf_counter() - start) / len(url_paths)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_match_latency_by_channel_count(self):
+
+        random = Random(1)
+
+        for channel_count in channel_counts:
+
+            channel_data = self._get_channel_data(channel_count)
+            url_data = CyURLData(channel_data)
+
+            # Requests to channels with parameters only because static ones are served from url_path_cache anyway
+            url_paths = ['/api/customer{}/123/order/456'.format(random.randrange(1, channel_count, 2)) for _ in range(match_ops)]
+
+            linear_taken = self._run_matches(lambda url_path: match_linear(channel_data, url_path, 'GET'), url_paths)
+            tree_taken = self._run_matches(lambda url_path: url_data.match(url_path, 'GET', accept_any), url_paths)
+
+            benchmark_logger.info('Channels {:>6}; match linear scan: {:.2f} us, routing tree: {:.2f} us'.format(
+                channel_count, linear_taken * 1_000_000, tree_taken * 1_000_000))
+
+            if channel_count >= 1_000:
+                self.assertLess(tree_taken * 10, linear_taken)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
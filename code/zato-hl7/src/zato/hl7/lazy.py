@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import re
+
+# hl7apy
+from hl7apy import load_library
+from hl7apy.exceptions import UnsupportedVersion
+from hl7apy.parser import parse_message as hl7apy_parse_message
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from hl7apy.core import Message
+    from zato.common.typing_ import any_, anydict, anylist, strlist
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+# Segments are always separated by carriage returns
+segment_separator = '\r'
+
+# Used if a message does not say which version it is in or if its version is not known to hl7apy
+default_version = '2.5'
+
+# Elements can be always accessed by their positions, e.g. pid_3 or cx_1, including ones hl7apy knows nothing of
+_position_name_regex = re.compile(r'^[a-z0-9_]+_(\d+)$')
+
+# Maps IDs of hl7apy structures to names and positions of their children, e.g. message_type -> 9
+_spec_cache = {} # type: anydict
+
+# Maps message versions to hl7apy libraries, these are loaded only once
+_library_cache = {} # type: anydict
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_spec(children:'any_') -> 'anydict':
+    """ Returns a dict mapping both positional and long names of children of an hl7apy structure to their positions
+    and to their own children. For instance, MSH_9 and MESSAGE_TYPE both point to the ninth field of MSH.
+    """
+    if children is None:
+        return {}
+
+    key = id(children)
+
+    if (entry := _spec_cache.get(key)) is None:
+
+        spec = {}
+
+        for child in children:
+
+            # E.g. ('MSH_9', ('sequence', ((...),), 'MSG', 'MESSAGE_TYPE', None, -1), (0, 1), 'FIE')
+            position_name, details = child[0], child[1]
+            position = int(position_name.rsplit('_', 1)[1])
+
+            # Leaf elements have no children
+            child_children = details[1] if details[0] == 'sequence' else None
+
+            _ = spec.setdefault(position_name.lower(), (position, child_children))
+            _ = spec.setdefault(details[3].lower(), (position, child_children))
+
+        # We keep the structure itself to make sure that its ID is not reused by another one
+        entry = _spec_cache[key] = (children, spec)
+
+    return entry[1]
+
+# ################################################################################################################################
+
+def get_library(version:'str') -> 'any_':
+
+    if (library := _library_cache.get(version)) is None:
+        try:
+            library = load_library(version)
+        except UnsupportedVersion:
+            library = get_library(default_version)
+
+        _library_cache[version] = library
+
+    return library
+
+# ################################################################################################################################
+
+def get_child(name:'str', spec:'anydict') -> 'any_':
+    """ Returns the position and children of an element by its name, or raises AttributeError if there is no such element.
+    """
+    if child := spec.get(name):
+        return child
+
+    elif match := _position_name_regex.match(name):
+        return int(match.group(1)), None
+
+    else:
+        raise AttributeError(name)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyComponent:
+    """ A component or subcomponent of a field whose own children are split only when accessed.
+    """
+    __slots__ = 'value', 'children', 'separator'
+
+    def __init__(self, value:'str', children:'any_', separator:'str | None') -> 'None':
+        self.value = value
+        self.children = children
+        self.separator = separator
+
+    def __getattr__(self, name:'str') -> 'LazyComponent':
+
+        # Subcomponents have no children
+        if self.separator is None:
+            raise AttributeError(name)
+
+        position, children = get_child(name, get_spec(self.children))
+        values = self.value.split(self.separator)
+        value = values[position - 1] if position <= len(values) else ''
+
+        return LazyComponent(value, children, None)
+
+    def __str__(self) -> 'str':
+        return self.value
+
+    def __repr__(self) -> 'str':
+        return '<{} value:`{}`>'.format(self.__class__.__name__, self.value)
+
+    def to_er7(self) -> 'str':
+        return self.value
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyField:
+    """ A field of a segment, including all of its repetitions. Its value and components are those of the first repetition,
+    the same as in hl7apy, and other repetitions are available by their indexes.
+    """
+    __slots__ = 'raw', 'children', 'message'
+
+    def __init__(self, raw:'str', children:'any_', message:'LazyMessage | None') -> 'None':
+        self.raw = raw
+        self.children = children
+
+        # Fields that are not to be split, e.g. MSH-2, have no message to get separators from
+        self.message = message
+
+    @property
+    def value(self) -> 'str':
+        if self.message is None:
+            return self.raw
+        else:
+            return self.raw.split(self.message.repetition_separator, 1)[0]
+
+    def __len__(self) -> 'int':
+        if not self.raw:
+            return 0
+        elif self.message is None:
+            return 1
+        else:
+            return self.raw.count(self.message.repetition_separator) + 1
+
+    def __getitem__(self, idx:'int') -> 'LazyField':
+        if self.message is None:
+            repetitions = [self.raw]
+        else:
+            repetitions = self.raw.split(self.message.repetition_separator)
+        return LazyField(repetitions[idx], self.children, self.message)
+
+    def __getattr__(self, name:'str') -> 'LazyComponent':
+
+        if self.message is None:
+            raise AttributeError(name)
+
+        position, children = get_child(name, get_spec(self.children))
+        values = self.value.split(self.message.component_separator)
+        value = values[position - 1] if position <= len(values) else ''
+
+        return LazyComponent(value, children, self.message.subcomponent_separator)
+
+    def __str__(self) -> 'str':
+        return self.value
+
+    def __repr__(self) -> 'str':
+        return '<{} value:`{}`>'.format(self.__class__.__name__, self.value)
+
+    def to_er7(self) -> 'str':
+        return self.raw
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazySegment:
+    """ A segment whose fields are split only when the first of them is accessed.
+    """
+    __slots__ = 'name', 'raw', 'message', '_fields', '_spec'
+
+    def __init__(self, name:'str', raw:'str', message:'LazyMessage') -> 'None':
+        self.name = name
+        self.raw = raw
+        self.message = message
+        self._fields = None # type: strlist | None
+        self._spec = None   # type: anydict | None
+
+    def get_field(self, position:'int', children:'any_'=None) -> 'LazyField':
+
+        if self._fields is None:
+            self._fields = self.raw.split(self.message.field_separator)
+
+        # In MSH, the field separator is the first field itself and the encoding characters
+        # are the second one, which is why they cannot be split like other fields can.
+        if self.name == 'MSH':
+            if position == 1:
+                return LazyField(self.message.field_separator, children, None)
+            elif position == 2:
+                return LazyField(self._fields[1], children, None)
+            else:
+                position -= 1
+
+        raw = self._fields[position] if position < len(self._fields) else ''
+
+        return LazyField(raw, children, self.message)
+
+    def __getattr__(self, name:'str') -> 'LazyField':
+
+        if self._spec is None:
+            self._spec = get_spec(self.message.get_segment_fields(self.name))
+
+        position, children = get_child(name, self._spec)
+        return self.get_field(position, children)
+
+    @property
+    def value(self) -> 'str':
+        return self.raw
+
+    def __str__(self) -> 'str':
+        return self.raw
+
+    def __repr__(self) -> 'str':
+        return '<{} name:`{}`>'.format(self.__class__.__name__, self.name)
+
+    def to_er7(self) -> 'str':
+        return self.raw
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyMessage:
+    """ An HL7 v2 message that is split into segments, fields and components only as they are accessed, without building
+    the hl7apy tree. Segments are looked up by their names, e.g. msg.PID or msg.pid, and fields and components
+    by the same positional and long names that hl7apy uses, e.g. msg.MSH.msh_9.msg_1 or msg.MSH.message_type.message_code.
+
+    Values are returned as they are in the message, e.g. escape sequences are not unescaped, and messages are not validated.
+    Anything else is read from the full hl7apy message, which is built the first time that it is needed,
+    or when get_message is called, and which is validated then if validation is requested.
+    """
+    __slots__ = 'raw', 'should_validate', 'field_separator', 'component_separator', 'repetition_separator', \
+        'subcomponent_separator', 'version', '_segments', '_segment_index', '_message', '_library'
+
+    def __init__(self, data:'str', should_validate:'bool'=False) -> 'None':
+
+        data = data.strip()
+
+        if not data.startswith('MSH'):
+            raise ValueError('Message does not begin with an MSH segment `{!r}`'.format(data[:10]))
+
+        self.raw = data
+        self.should_validate = should_validate
+
+        # All the separators are given in MSH, e.g. MSH|^~\&|
+        self.field_separator = data[3]
+        encoding_chars = data[4:data.index(self.field_separator, 4)]
+
+        self.component_separator = encoding_chars[0]
+        self.repetition_separator = encoding_chars[1]
+        self.subcomponent_separator = encoding_chars[3] if len(encoding_chars) > 3 else '&'
+
+        self._segments = [elem for elem in data.split(segment_separator) if elem]
+
+        # Maps names of segments to their positions in the message, it is built when the first segment is accessed
+        self._segment_index = None # type: anydict | None
+
+        self._message = None # type: Message | None
+        self._library = None # type: any_
+
+        # E.g. MSH-12 2.5 or 2.5^DEU
+        self.version = LazySegment('MSH', self._segments[0], self).get_field(12).value.split(
+            self.component_separator, 1)[0] or default_version
+
+    def _build_segment_index(self) -> 'anydict':
+
+        index = {} # type: anydict
+        for idx, segment in enumerate(self._segments):
+            index.setdefault(segment[:3], []).append(idx)
+
+        self._segment_index = index
+        return index
+
+    def get_segment_fields(self, name:'str') -> 'any_':
+        """ Returns the hl7apy structure of fields of a segment, or None if the segment is not a standard one.
+        """
+        if self._library is None:
+            self._library = get_library(self.version)
+
+        if segment := self._library.SEGMENTS.get(name):
+            return segment[1]
+
+    def segments(self, name:'str') -> 'anylist':
+        """ Returns all the segments of a given name, in the order they are in in the message.
+        """
+        index = self._segment_index or self._build_segment_index()
+        name = name.upper()
+
+        return [LazySegment(name, self._segments[idx], self) for idx in index.get(name, [])]
+
+    def get_message(self) -> 'Message':
+        """ Returns the full hl7apy message, parsing it the first time that it is needed.
+        """
+        if self._message is None:
+            self._message = hl7apy_parse_message(self.raw, force_validation=self.should_validate)
+        return self._message
+
+    def __getattr__(self, name:'str') -> 'any_':
+
+        # Special methods are never looked up in the full message, e.g. copy.copy checks if there is __copy__ ..
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        # .. segments are accessed by their names ..
+        if len(name) == 3:
+            index = self._segment_index or self._build_segment_index()
+            segment_name = name.upper()
+
+            if positions := index.get(segment_name):
+                return LazySegment(segment_name, self._segments[positions[0]], self)
+
+        # .. and everything else is read from the full message.
+        return getattr(self.get_message(), name)
+
+    def __repr__(self) -> 'str':
+        return '<{} version:`{}` segments:{}>'.format(self.__class__.__name__, self.version, len(self._segments))
+
+    def to_er7(self) -> 'str':
+        return segment_separator.join(self._segments)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def parse_message_lazily(data:'str', force_validation:'bool'=False) -> 'LazyMessage':
+    """ Has the same signature as hl7apy's parse_message but returns a LazyMessage.
+    """
+    return LazyMessage(data, force_validation)
+
+# ################################################################################################################################
+# ################################################################################################################################
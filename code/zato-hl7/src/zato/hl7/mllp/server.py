@@ -7,11 +7,15 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from functools import partial
 from logging import DEBUG, getLevelName, getLogger
 from socket import timeout as SocketTimeoutException
 from time import sleep
 from traceback import format_exc
 
+# gevent
+from gevent.pool import Pool
+
 # hl7apy
 from hl7apy.core import Message
 
@@ -21,6 +25,7 @@ from zato.common.audit_log import DataReceived, DataSent
 from zato.common.typing_ import cast_
 from zato.common.util.api import new_cid
 from zato.common.util.tcp import get_fqdn_by_ip, ZatoStreamServer
+from zato.hl7.lazy import LazyMessage
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -30,7 +35,7 @@ if 0:
     from socket import socket as Socket
     from bunch import Bunch
     from zato.common.audit_log import AuditLog
-    from zato.common.typing_ import any_, anydict, anylist, anytuple, boolnone, byteslist, bytesnone, callable_, type_
+    from zato.common.typing_ import any_, anydict, anylist, anytuple, bytesnone, callable_, type_
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -56,17 +61,203 @@ def new_msg_id(
 ) -> 'str':
     return pattern.format(_new_cid(id_len))
 
-class HandleCompleteMessageArgs:
+# ################################################################################################################################
+# ################################################################################################################################
+
+class MLLPFramingError(Exception):
+    """ Raised when data received from a remote end cannot be split into MLLP frames.
+    """
+    def __init__(self, reason:'str') -> 'None':
+        super().__init__(reason)
+        self.reason = reason
+
+        # Frames that were complete before the invalid data
+        self.frames = [] # type: anylist
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class MLLPFramer:
+    """ Splits a stream of bytes into MLLP frames. Data is read from sockets directly into a growable buffer,
+    frames are looked up in that buffer without joining or copying what has been received so far, and each call
+    to get_frames returns all the complete frames in the buffer, no matter how many of them a single read returned.
+    """
+    buffer: 'bytearray'
+    view:   'memoryview'
+
+    start_seq:     'bytes'
+    start_seq_len: 'int'
+
+    end_seq:     'bytes'
+    end_seq_len: 'int'
+
+    max_msg_size: 'int'
+
+    # Where the data not returned in any frame yet begins and ends in the buffer
+    start: 'int'
+    end:   'int'
+
+    # Where to look for the end sequence from, so that bytes already checked are not checked again
+    search_from: 'int'
+
+    def __init__(
+        self,
+        start_seq,    # type: bytes
+        end_seq,      # type: bytes
+        max_msg_size, # type: int
+        buffer_size   # type: int
+    ) -> 'None':
+
+        self.start_seq = start_seq
+        self.start_seq_len = len(start_seq)
+
+        self.end_seq = end_seq
+        self.end_seq_len = len(end_seq)
+
+        self.max_msg_size = max_msg_size
+
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+
+        self.start = 0
+        self.end = 0
+        self.search_from = 0
+
+# ################################################################################################################################
+
+    def _ensure_capacity(self, size:'int') -> 'None':
+
+        # We have enough room after the data received so far ..
+        if len(self.buffer) - self.end >= size:
+            return
+
+        # .. otherwise, move the data not returned yet to the beginning of the buffer ..
+        if self.start:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.search_from = max(self.search_from - self.start, 0)
+            self.start = 0
+            self.end = pending
+
+        # .. and if that is still not enough, grow the buffer, which is possible only if no views to it exist.
+        if len(self.buffer) - self.end < size:
+            self.view.release()
+            self.buffer.extend(bytes(max(size, len(self.buffer))))
+            self.view = memoryview(self.buffer)
+
+# ################################################################################################################################
+
+    def read_from(self, recv_into:'callable_', size:'int') -> 'int':
+        """ Reads at most size bytes into the buffer using a socket's recv_into method and returns how many were read.
+        """
+        self._ensure_capacity(size)
+
+        with self.view[self.end:self.end + size] as read_view:
+            count = recv_into(read_view)
+
+        self.end += count
+        return count
+
+# ################################################################################################################################
+
+    def feed(self, data:'bytes') -> 'anylist':
+        """ Adds data to the buffer and returns all the frames that are complete now.
+        """
+        size = len(data)
+        self._ensure_capacity(size)
+
+        self.buffer[self.end:self.end + size] = data
+        self.end += size
+
+        return self.get_frames()
+
+# ################################################################################################################################
+
+    def get_last_read(self, size:'int') -> 'bytes':
+        return bytes(self.view[self.end - size:self.end])
+
+# ################################################################################################################################
+
+    def get_frames(self) -> 'anylist':
+        """ Returns the business data of each complete frame in the buffer, without its start and end sequences.
+        """
+        out = []
+
+        try:
+            self._get_frames(out)
+        except MLLPFramingError as e:
+            e.frames = out
+            raise
+        else:
+            return out
+
+# ################################################################################################################################
+
+    def _get_frames(self, out:'anylist') -> 'None':
+
+        buffer = self.buffer
+        start = self.start
+        end = self.end
+
+        start_seq = self.start_seq
+        start_seq_len = self.start_seq_len
+
+        end_seq = self.end_seq
+        end_seq_len = self.end_seq_len
 
-    _buffer:           'anylist'
-    _buffer_join_func: 'callable_'
+        while start < end:
 
-    conn_ctx:    'ConnCtx'
-    request_ctx: 'RequestCtx'
+            available = end - start
 
-    _socket_send:       'callable_'
-    _run_callback:      'callable_'
-    _request_ctx_reset: 'callable_'
+            # Each frame must begin with the start sequence, which we may not have received in full yet ..
+            if available < start_seq_len:
+                if not start_seq.startswith(buffer[start:end]):
+                    self._raise_header_mismatch(start, end)
+                break
+
+            if not buffer.startswith(start_seq, start):
+                self._raise_header_mismatch(start, end)
+
+            # .. if it does, look up the end sequence, skipping what has been already checked ..
+            data_start = start + start_seq_len
+            end_idx = buffer.find(end_seq, max(self.search_from, data_start), end)
+
+            # .. no end sequence means that the frame is not complete yet ..
+            if end_idx == -1:
+
+                if available > self.max_msg_size:
+                    raise MLLPFramingError('message would exceed max. size allowed `{}` > `{}`'.format(
+                        available, self.max_msg_size))
+
+                # .. though the end sequence may be split between this and the next read ..
+                self.search_from = max(data_start, end - end_seq_len + 1)
+                break
+
+            # .. otherwise, we have a complete frame ..
+            frame_end = end_idx + end_seq_len
+
+            if frame_end - start > self.max_msg_size:
+                raise MLLPFramingError('message exceeds max. size allowed `{}` > `{}`'.format(
+                    frame_end - start, self.max_msg_size))
+
+            out.append(bytes(self.view[data_start:end_idx]))
+
+            # .. and the next one can begin right after it.
+            start = frame_end
+
+        # If everything has been returned, we can use the buffer from its beginning again
+        if start == end:
+            start = end = 0
+            self.search_from = 0
+
+        self.start = start
+        self.end = end
+
+# ################################################################################################################################
+
+    def _raise_header_mismatch(self, start:'int', end:'int') -> 'None':
+        data = bytes(self.view[start:min(end, start + self.start_seq_len)])
+        raise MLLPFramingError('header mismatch `{!r}` != `{!r}`'.format(data, self.start_seq))
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -198,6 +389,12 @@ class HL7MLLPServer:
     # This is configurable by users
     read_buffer_size: 'int'
 
+    # How many messages from the same connection can be processed concurrently
+    pipeline_size: 'int'
+
+    # Which implementation parses messages, e.g. hl7apy or Zato for lazily parsed ones
+    impl_class: 'str'
+
     object_id: 'str'
     name: 'str'
     address: 'str'
@@ -208,7 +405,6 @@ class HL7MLLPServer:
 
     start_seq: 'str'
     start_seq_len: 'int'
-    start_seq_len_eq_one: 'bool'
 
     end_seq: 'str'
     end_seq_len: 'int'
@@ -243,10 +439,11 @@ class HL7MLLPServer:
         self.service_name = config.service_name
         self.should_log_messages = config.should_log_messages
         self.read_buffer_size = int(cast_('str', config.read_buffer_size))
+        self.pipeline_size = int(config.get('pipeline_size') or HL7.Default.pipeline_size)
+        self.impl_class = config.get('hl7_impl_class') or HL7.Const.ImplClass.hl7apy
 
         self.start_seq     = cast_('str', config.start_seq)
         self.start_seq_len = len(self.start_seq)
-        self.start_seq_len_eq_one = self.start_seq_len == 1
 
         self.end_seq     = cast_('str', config.end_seq)
         self.end_seq_len = len(self.end_seq)
@@ -318,16 +515,6 @@ class HL7MLLPServer:
 
         self._logger_info('Waiting for HL7 MLLP data from %s', conn_ctx.get_conn_pretty_info())
 
-        # Current message whose contents we are accumulating
-        _buffer = []
-
-        # Details of the current message
-        request_ctx = RequestCtx()
-        request_ctx.conn_id = conn_ctx.conn_id
-
-        # To indicate if message header is already checked or not
-        _needs_header_check = True
-
         # To make fewer namespace lookups
         _max_msg_size = int(cast_('str', self.config.max_msg_size))
         _recv_timeout = self.config.recv_timeout # type: float
@@ -338,184 +525,64 @@ class HL7MLLPServer:
         _has_debug_log = self._has_debug_log
         _log_debug = self._logger_debug
 
-        _run_callback = self._run_callback
-        _check_header = self._check_header
         _close_connection = self._close_connection
-        _request_ctx_reset = request_ctx.reset
-        _buffer_append = _buffer.append
-        _buffer_len    = _buffer.__len__
-        _buffer_join_func = b''.join
-
-        _socket_recv = conn_ctx.socket.recv
-        _socket_send = conn_ctx.socket.send
-        _socket_settimeout = conn_ctx.socket.settimeout
-
-        _handle_complete_message_args = HandleCompleteMessageArgs()
-        _handle_complete_message_args._buffer = _buffer
-        _handle_complete_message_args._buffer_join_func = _buffer_join_func
-        _handle_complete_message_args.conn_ctx = conn_ctx
-        _handle_complete_message_args.request_ctx = request_ctx
-        _handle_complete_message_args._socket_send = _socket_send
-        _handle_complete_message_args._run_callback = _run_callback
-        _handle_complete_message_args._request_ctx_reset = _request_ctx_reset
+        _handle_messages = self._handle_messages
+
+        # Splits the data received into messages
+        framer = MLLPFramer(self.start_seq, self.end_seq, _max_msg_size, _read_buffer_size)
+
+        _framer_read_from = framer.read_from
+        _framer_get_frames = framer.get_frames
+
+        # Messages from the same connection are processed concurrently only if we are configured to do it
+        pool = Pool(self.pipeline_size) if self.pipeline_size > 1 else None
+
+        _socket_recv_into = conn_ctx.socket.recv_into
+        conn_ctx.socket.settimeout(_recv_timeout)
 
         # Run the main loop
         while self.keep_running:
 
             try:
-                # In each iteration, assume that no data was received
-                data = None
-
-                # Check whether reading the data would not exceed our message size limit
-                new_size = request_ctx.msg_size + _read_buffer_size
-                if new_size > _max_msg_size:
-                    reason = 'message would exceed max. size allowed `{}` > `{}`'.format(new_size, _max_msg_size)
-                    _close_connection(conn_ctx, reason)
-                    return
-
-                # Receive data from the other end
-                _socket_settimeout(_recv_timeout)
 
                 # Try to receive some data from the socket ..
                 try:
 
                     # .. read data in ..
-                    data = _socket_recv(_read_buffer_size)
-
-                    # .. update counters ..
-                    conn_ctx.total_message_packets_received += 1
-
-                    if _has_debug_log:
-                        _log_debug('HL7 MLLP data received by `%s` (%d) -> `%s`', conn_ctx.conn_id, len(data), data)
+                    size = _framer_read_from(_socket_recv_into, _read_buffer_size)
 
                 # .. catch timeouts here but no other exception type ..
                 except SocketTimeoutException:
                     # That is fine, we simply did not get any data in this iteration
-                    pass
-
-                # .. no timeout = we may have received some data from the socket ..
-                else:
-
-                    # .. something was received so we can append it to our buffer ..
-                    if data:
-
-                        # If we are here, it means that the recv call succeeded so we can increase the message size
-                        # by how many bytes were actually read from the socket.
-                        request_ctx.msg_size += len(data)
-
-                        # At this point we either do not have all the bytes required to check the header
-                        # or the header is already checked, so we can just append data to our current buffer ..
-                        _buffer_append(data)
-
-                        # The first byte may be a header and we need to check whether we require it or not at this stage of parsing.
-                        # This method will close the connection if anything to do with header parsing is invalid.
-                        if _needs_header_check:
-
-                            # If we have a single-byte header, we can check it immediately. This is because
-                            # we received some data, which means one byte at the very least, so we can go ahead
-                            # with checking the header ..
-                            if self.start_seq_len_eq_one:
-                                if not _check_header(conn_ctx, request_ctx, data):
-                                    return
-                                else:
-                                    _needs_header_check = False
-
-                            # .. but if we have a multi-byte header, we need to ensure we have already
-                            # read as many bytes as there are in the expected header. We do it by iterating
-                            # over the buffer of bytes received so far and concatenating them until we have
-                            # at least as many bytes as there are in the header to check.
-                            else:
-                                to_check_buffer = [] # type: byteslist
-                                to_check_len = 0
-
-                                # Go through each, potentially multi-byte, element in the buffer so far ..
-                                for elem in _buffer:
-                                    elem = cast_('bytes', elem)
-
-                                    # .. break if we have already all the bytes that we need ..
-                                    if to_check_len >= self.start_seq_len:
-                                        break
-
-                                    # .. otherwise, append bytes from the current element
-                                    # and increase the bytes read so far counter.
-                                    else:
-                                        to_check_buffer.append(elem)
-                                        to_check_len += len(elem)
-
-                                # We still need to check if we have the full header worth of bytes already ..
-                                if to_check_len >= self.start_seq_len:
-
-                                    # .. and if we do, we can look up the header now.
-                                    to_check = b''.join(to_check_buffer)
-
-                                    if not _check_header(conn_ctx, request_ctx, to_check):
-                                        return
-                                    else:
-                                        _needs_header_check = False
-
-                                else:
-                                    # .. otherwise, if we do not have enough bytes,
-                                    # we do nothing and this block is added to make it explicit that it is the case.
-                                    pass
-
-                        # .. the line that have just received may have been part of a trailer
-                        # or the trailer itself so we need to check it ..
-
-                        # .. but we need to take into account the fact that the trailer has been split into two or more
-                        # segments. For instance, the previous segment of bytes returned by _socket_recv
-                        # ended with the first byte of end_seq and now we have received the second byte.
-                        # E.g. our _read_buffer_size is 2048 and if the overall message happens to be 2049 bytes
-                        # then the first byte of end_seq will be in the buffer already and the data currently
-                        # received contains the second byte. Note that if someone uses end_seq longer than two bytes
-                        # this will still work because our _read_buffer_size is always at least 2048 bytes
-                        # so end_seq may be split across two segments at most (unless someone uses a multi-kilobyte end_seq,
-                        # which is not something to be expected).
-
-                        # First, try to check if data currently received ends in end_seq ..
-                        if self._points_to_full_message(data):
-
-                            # .. even if it does, make sure we have a header already and reject the message otherwise ..
-                            if _needs_header_check:
-                                reason = 'end bytes `{}` received without a preceeding header `{}` (#1)'.format(
-                                    self.end_seq, self.start_seq)
-                                self._close_connection(conn_ctx, reason)
-                                return
-
-                            # .. it is a match so it means that data was the last part of a message that we can already process ..
-                            self._handle_complete_message(_handle_complete_message_args)
-
-                        # .. otherwise, try to check if in combination with the previous segment,
-                        # the data received now points to a full message. However, for this to work
-                        # we require that there be at least one previous segment - otherwise we are the first one
-                        # and if we were the ending one we would have been caught in the if above ..
-                        else:
-
-                            if _buffer_len() > 1:
-
-                                # Index -1 is our own segment (data) previously appended,
-                                # which is why we use -2 to get the segment preceeding it.
-                                last_data = _buffer[-2] # type: bytes
-                                concatenated = last_data + data
-
-                                # .. now that we have it concatenated, check if that indicates that a full message
-                                # is already received.
-                                if self._points_to_full_message(concatenated):
-
-                                    # Again, even if it does but have not received the header yet,
-                                    # we need to reject the whole message.
-                                    if _needs_header_check:
-                                        reason = 'end bytes `{}` received without a preceeding header `{}` (#2)'.format(
-                                            self.end_seq, self.start_seq)
-                                        self._close_connection(conn_ctx, reason)
-                                        return
-
-                                    self._handle_complete_message(_handle_complete_message_args)
-
-                    # No data received = remote end is no longer connected.
-                    else:
-                        reason = 'remote end disconnected; `{}`'.format(data)
-                        _close_connection(conn_ctx, reason)
-                        return
+                    continue
+
+                # No data received = remote end is no longer connected.
+                if not size:
+                    _close_connection(conn_ctx, 'remote end disconnected')
+                    return
+
+                # .. update counters ..
+                conn_ctx.total_message_packets_received += 1
+
+                if _has_debug_log:
+                    _log_debug('HL7 MLLP data received by `%s` (%d) -> `%s`', conn_ctx.conn_id, size,
+                        framer.get_last_read(size))
+
+                # .. a single read may have returned any number of complete messages, including none ..
+                try:
+                    messages = _framer_get_frames()
+                except MLLPFramingError as e:
+
+                    # Messages received before the invalid data are still responded to
+                    if e.frames:
+                        _handle_messages(conn_ctx, e.frames, pool)
+
+                    _close_connection(conn_ctx, e.reason)
+                    return
+
+                # .. and we can process each of them now.
+                if messages:
+                    _handle_messages(conn_ctx, messages, pool)
 
             # This covers the whole body of the 'while' block,
             # catching everything that was raised in a given loop's iteration.
@@ -530,52 +597,58 @@ class HL7MLLPServer:
 
 # ################################################################################################################################
 
-    def _points_to_full_message(self, data:'bytes') -> 'bool':
-        """ Returns True if input bytes indicate that we have a full message from the socket.
-        """
-        # Get as many bytes from data as we expected for our end_seq to be the length of ..
-        data_last_bytes = data[-self.end_seq_len:]
-
-        # .. return True if the last bytes point to our having a complete message to process.
-        return data_last_bytes == self.end_seq
+    def _handle_messages(self, conn_ctx:'ConnCtx', messages:'anylist', pool:'Pool | None') -> 'None':
 
-# ################################################################################################################################
+        # Without a pool, each message is processed and responded to before the next one ..
+        if pool is None:
+            for data in messages:
+                request_ctx, response = self._process_message(conn_ctx, data)
+                self._send_response(conn_ctx, request_ctx, response)
 
-    def _handle_complete_message(self, args:'HandleCompleteMessageArgs') -> 'None':
+        # .. whereas with a pool, messages are processed concurrently but imap returns their responses
+        # in the same order that the messages were received in, which is the order the remote end expects them in.
+        else:
+            for request_ctx, response in pool.imap(partial(self._process_message, conn_ctx), messages):
+                self._send_response(conn_ctx, request_ctx, response)
 
-        # Produce the message to invoke the callback with ..
-        _buffer_data = args._buffer_join_func(args._buffer)
+# ################################################################################################################################
 
-        # .. remove the header and trailer ..
-        _buffer_data = _buffer_data[self.start_seq_len:-self.end_seq_len]
+    def _process_message(self, conn_ctx:'ConnCtx', data:'bytes') -> 'anytuple':
 
-        # .. asign the actual business data to message ..
-        args.request_ctx.data = _buffer_data
+        # Details of the current message ..
+        request_ctx = RequestCtx()
+        request_ctx.conn_id = conn_ctx.conn_id
+        request_ctx.msg_size = len(data)
+        request_ctx.data = data
 
         # .. update our runtime metadata first (data received) ..
         if self.is_audit_log_received_active:
-            self._store_data_received(args.request_ctx)
+            self._store_data_received(request_ctx)
 
         # .. update counters ..
-        args.conn_ctx.total_messages_received += 1
+        conn_ctx.total_messages_received += 1
 
         # .. invoke the callback ..
-        response = args._run_callback(args.conn_ctx, args.request_ctx) or b''
+        response = self._run_callback(conn_ctx, request_ctx) or b''
+
+        # .. and return the response to our caller.
+        return request_ctx, response
 
-        # .. optionally, log what we are about to send ..
+# ################################################################################################################################
+
+    def _send_response(self, conn_ctx:'ConnCtx', request_ctx:'RequestCtx', response:'bytes') -> 'None':
+
+        # Optionally, log what we are about to send ..
         if self.should_log_messages:
             self._logger_info('Sending HL7 MLLP response to `%s` -> `%s` (c:%s; s=%d)',
-                args.request_ctx.msg_id, response, args.conn_ctx.conn_id, len(response))
+                request_ctx.msg_id, response, conn_ctx.conn_id, len(response))
 
         # .. write the response back ..
-        args._socket_send(response)
+        conn_ctx.socket.sendall(response)
 
-        # .. update our runtime metadata first (data sent) ..
+        # .. and update our runtime metadata (data sent).
         if self.is_audit_log_sent_active:
-            self._store_data_sent(args.request_ctx, response)
-
-        # .. and reset the message to make it possible to handle a new one.
-        args._request_ctx_reset()
+            self._store_data_sent(request_ctx, response)
 
 # ################################################################################################################################
 
@@ -635,6 +708,7 @@ class HL7MLLPServer:
                     'zato.channel_item': {
                     'data_encoding': 'utf8',
                     'hl7_version': _hl7_v2,
+                    'hl7_impl_class': self.impl_class,
                     'json_path': None,
                     'should_parse_on_input': True,
                     'should_validate': True,
@@ -649,7 +723,7 @@ class HL7MLLPServer:
         else:
 
             # Convert high-level objects to bytes ..
-            if isinstance(response, Message):
+            if isinstance(response, (Message, LazyMessage)):
                 response = response.to_er7()
 
             # .. and make sure we actually do use bytes objects ..
@@ -665,50 +739,6 @@ class HL7MLLPServer:
         self._logger_info('Closing connection; %s; %s', reason, conn_ctx.get_conn_pretty_info())
         conn_ctx.socket.close()
 
-# ################################################################################################################################
-
-    def _check_meta(
-        self,
-        conn_ctx,       # type: ConnCtx
-        request_ctx,    # type: RequestCtx
-        data,           # type: bytes
-        bytes_to_check, # type: bytes
-        meta_attr,      # type: str
-        has_meta_attr,  # type: str
-        meta_seq        # type: str
-    ) -> 'boolnone':
-
-        # If we already have the meta element then we do not expect another one
-        # while we are still processing the same message and if one is found, we close the connection.
-        if request_ctx.meta[has_meta_attr]:
-            if bytes_to_check == meta_seq:
-                reason = 'unexpected {} found `{!r}` == `{!r}` in data `{!r}`'.format(meta_attr, bytes_to_check, meta_seq, data)
-                self._close_connection(conn_ctx, reason)
-                return
-
-        # If we do not have the element, it must be a new message that we are receiving.
-        # In such a case, we expect for it to begin with a header. Otherwise, we reject the entire connection.
-        else:
-            if bytes_to_check != meta_seq:
-                reason = '{} mismatch `{!r}` != `{!r}` in data `{!r}`'.format(meta_attr, bytes_to_check, meta_seq, data)
-                self._close_connection(conn_ctx, reason)
-                return
-
-        # If we are here, it means that the meta attribute is correct
-        request_ctx.meta[has_meta_attr] = True
-        return True
-
-# ################################################################################################################################
-
-    def _check_header(self, conn_ctx:'ConnCtx', request_ctx:'RequestCtx', data:'bytes') -> 'boolnone':
-
-        bytes_to_check = data[:self.start_seq_len]
-        meta_attr = 'header'
-        has_meta_attr  = 'has_start_seq'
-        meta_seq = self.start_seq
-
-        return self._check_meta(conn_ctx, request_ctx, data, bytes_to_check, meta_attr, has_meta_attr, meta_seq)
-
 # ################################################################################################################################
 # ################################################################################################################################
 
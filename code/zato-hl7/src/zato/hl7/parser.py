@@ -16,13 +16,15 @@ from hl7apy.parser import parse_message as hl7apy_parse_message
 # Zato
 from zato.common.api import HL7
 from zato.common.hl7 import HL7Exception
+from zato.hl7.lazy import parse_message_lazily
 
 # ################################################################################################################################
 # ################################################################################################################################
 
 if 0:
     from hl7apy.core import Message
-    from zato.common.typing_ import any_, boolnone
+    from zato.common.typing_ import any_, boolnone, strnone
+    from zato.hl7.lazy import LazyMessage
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -36,7 +38,8 @@ logger_hl7 = getLogger('zato_hl7')
 # Maps HL7 versions and implementation classes to parse functions.
 _parse_func_map = {
     HL7.Const.Version.v2.id: {
-        HL7.Const.ImplClass.hl7apy: hl7apy_parse_message
+        HL7.Const.ImplClass.hl7apy: hl7apy_parse_message,
+        HL7.Const.ImplClass.zato: parse_message_lazily,
     }
 }
 
@@ -51,9 +54,11 @@ def get_payload_from_request(
     hl7_version,    # type: str
     _ignored_json_path,             # type: boolnone
     _ignored_should_parse_on_input, # type: boolnone
-    should_validate                 # type: bool
-) -> 'Message':
-    """ Parses a channel message into an HL7 one.
+    should_validate,                # type: bool
+    impl_class=None                 # type: strnone
+) -> 'Message | LazyMessage':
+    """ Parses a channel message into an HL7 one. By default, this is a full hl7apy message
+    but the Zato implementation class returns a LazyMessage that is parsed only as it is accessed.
     """
     try:
 
@@ -62,7 +67,7 @@ def get_payload_from_request(
             data = data.decode(data_encoding)
 
         # .. now, parse and return the result.
-        return parse(data, _impl_class, hl7_version, should_validate)
+        return parse(data, impl_class or _impl_class, hl7_version, should_validate)
 
     except Exception as e:
         msg = 'Caught an HL7 exception while handling data:`%s` (%s); e:`%s`'
@@ -76,7 +81,7 @@ def parse(
     impl_class,      # type: any_
     hl7_version,     # type: str
     should_validate  # type: bool
-) -> 'Message':
+) -> 'Message | LazyMessage':
     """ Parses input data in the specified HL7 version using implementation pointed to be impl_class.
     """
     impl_dict = _parse_func_map[hl7_version] # type: dict
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from copy import copy
+from time import perf_counter
+from unittest import main, TestCase
+
+# hl7apy
+from hl7apy.core import Message
+from hl7apy.parser import parse_message
+
+# Zato
+from zato.common.api import HL7
+from zato.common.hl7 import HL7Exception
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.test.hl7_ import test_data
+from zato.hl7.lazy import LazyMessage
+from zato.hl7.parser import get_payload_from_request
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_messages = 500
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+test_data_oru = """
+MSH|^~\\&|GHH LAB|ELAB-3|GHH OE|BLDG4|200202150930||ORU^R01^ORU_R01|CNTRL-3456|P|2.5
+PID|||555-44-4444||EVERYWOMAN^EVE^E^^^^L|JONES|19620320|F|||153 FERNWOOD DR.^^STATESVILLE^OH^35292||(206)3345232|(206)752-121||||AC555444444||67-A4335^OH^20030520
+OBR|1|845439^GHH OE|1045813^GHH LAB|15545^GLUCOSE|||200202150730|||||||||555-55-5555^PRIMARY^PATRICIA P^^^^MD^^^^^^^^^^^^^^^^^^LEVEL SEVEN HEALTHCARE, INC.|||||||||F||||||444-44-4444^HIPPOCRATES^HOWARD H^^^^MD
+OBX|1|SN|1554-5^GLUCOSE^POST 12H CFST:MCNC:PT:SER/PLAS:QN||^182|mg/dl|70_105|H|||F
+OBX|2|SN|1555-6^GLUCOSE^POST 12H CFST:MCNC:PT:SER/PLAS:QN||^95|mg/dl|70_105|N|||F
+ZPD|1|custom^value&sub
+""".strip().replace('\n', '\r') # noqa: E501, W605
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LazyMessageTestCase(TestCase):
+
+    def test_same_values_as_hl7apy(self):
+
+        lazy = LazyMessage(test_data)
+        full = parse_message(test_data)
+
+        for get_value in (
+            lambda msg: msg.MSH.msh_1.value,
+            lambda msg: msg.MSH.msh_2.value,
+            lambda msg: msg.MSH.msh_9.value,
+            lambda msg: msg.msh.message_type.message_code.value,
+            lambda msg: msg.MSH.msh_9.msg_2.value,
+            lambda msg: msg.MSH.msh_10.value,
+            lambda msg: msg.PID.pid_3.value,
+            lambda msg: msg.PID.patient_identifier_list.id_number.value,
+            lambda msg: msg.PID.pid_3.cx_1.value,
+            lambda msg: msg.PID.pid_5.xpn_1.value,
+            lambda msg: msg.PID.pid_11.value,
+            lambda msg: msg.PID.pid_11[1].value,
+            lambda msg: msg.PID.patient_address.city.value,
+            lambda msg: msg.PID.pid_2.value,
+            lambda msg: len(msg.PID.pid_2),
+            lambda msg: len(msg.PID.pid_11),
+            lambda msg: msg.EVN.recorded_date_time.value,
+            lambda msg: msg.PV1.assigned_patient_location.facility.value,
+        ):
+            self.assertEqual(get_value(lazy), get_value(full))
+
+        self.assertEqual(lazy.to_er7(), full.to_er7())
+        self.assertEqual(lazy.version, '2.5')
+
+# ################################################################################################################################
+
+    def test_segments(self):
+
+        msg = LazyMessage(test_data_oru)
+
+        # Repeating segments are returned in the order they are in ..
+        obx_list = msg.segments('OBX')
+        self.assertListEqual([obx.obx_1.value for obx in obx_list], ['1', '2'])
+        self.assertEqual(obx_list[1].observation_identifier.identifier.value, '1555-6')
+
+        # .. segments that hl7apy does not know of can be accessed by positions ..
+        self.assertEqual(msg.ZPD.zpd_2.value, 'custom^value&sub')
+        self.assertEqual(msg.ZPD.zpd_2.zpd_2_2.value, 'value&sub')
+        self.assertEqual(msg.ZPD.zpd_2.zpd_2_2.zpd_2_2_2.value, 'sub')
+
+        # .. fields and components beyond what a message has are empty ..
+        self.assertEqual(msg.PID.pid_30.value, '')
+        self.assertEqual(msg.PID.pid_3.cx_9.value, '')
+
+        # .. and names that do not exist are reported as such.
+        with self.assertRaises(AttributeError):
+            _ = msg.PID.no_such_field
+
+        self.assertListEqual(msg.segments('NTE'), [])
+
+# ################################################################################################################################
+
+    def test_full_message(self):
+
+        msg = LazyMessage(test_data)
+
+        # The full message is not built until it is needed ..
+        self.assertIsNone(msg._message)
+        _ = msg.PID.pid_3.value
+        _ = copy(msg)
+        self.assertIsNone(msg._message)
+
+        # .. after which it is built only once ..
+        full = msg.get_message()
+        self.assertIsInstance(full, Message)
+        self.assertIs(msg.get_message(), full)
+
+        # .. and whatever the lazy message does not have is read from it.
+        self.assertEqual(msg.name, full.name)
+        self.assertEqual(msg.PID.pid_3.value, full.PID.pid_3.value)
+
+# ################################################################################################################################
+
+    def test_get_payload_from_request(self):
+
+        version = HL7.Const.Version.v2.id
+
+        msg = get_payload_from_request(test_data.encode('utf8'), 'utf8', version, None, True, True, HL7.Const.ImplClass.zato)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertTrue(msg.should_validate)
+
+        # The default implementation class is still hl7apy
+        msg = get_payload_from_request(test_data, 'utf8', version, None, True, False)
+        self.assertIsInstance(msg, Message)
+
+        with self.assertRaises(HL7Exception):
+            _ = get_payload_from_request('PID|||123', 'utf8', version, None, True, False, HL7.Const.ImplClass.zato)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_parse_benchmark(self):
+
+        corpus = []
+        for idx in range(benchmark_messages):
+            data = test_data if idx % 2 else test_data_oru
+            corpus.append(data.replace('01052901', '0105{}'.format(idx)))
+
+        # Routing services read the message type and patient identifiers only
+        def route(msg:'LazyMessage | Message') -> 'None':
+            _ = msg.MSH.msh_9.value
+            _ = msg.PID.pid_3.value
+
+        for name, parse_func in (
+            ('hl7apy', parse_message),
+            ('lazy', LazyMessage),
+        ):
+            start = perf_counter()
+            for data in corpus:
+                route(parse_func(data))
+            taken = perf_counter() - start
+
+            benchmark_logger.info('HL7 v2 parsing ({}) of {} ADT/ORU messages; total: {:.2f} ms, per message: {:.2f} us'.format(
+                name, benchmark_messages, taken * 1000, taken / benchmark_messages * 1_000_000))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
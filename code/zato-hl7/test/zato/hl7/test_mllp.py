@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import socket
+from random import random
+from time import perf_counter
+from unittest import main, TestCase
+
+# Bunch
+from bunch import bunchify
+
+# gevent
+from gevent import sleep, spawn
+
+# Zato
+from zato.common.test import benchmark, benchmark_logger
+from zato.hl7.mllp.server import HL7MLLPServer, MLLPFramer, MLLPFramingError
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_, anylist
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_messages = 100_000
+benchmark_lockstep_messages = 10_000
+
+# Concurrent processing is of use only if services wait for something, e.g. a database, so they wait here too
+benchmark_blocking_messages = 2_000
+benchmark_blocking_time = 0.001
+benchmark_pipeline_size = 50
+
+start_seq = b'\x0b'
+end_seq = b'\x1c\x0d'
+
+max_msg_size = 1_000_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_adt_message(idx:'int') -> 'bytes':
+    return (
+        'MSH|^~\\&|ADT1|GOOD HEALTH HOSPITAL|GHH LAB|GHH|20230101120000||ADT^A01^ADT_A01|MSG{}|P|2.5\r'
+        'EVN||20230101120000\r'
+        'PID|1||PATID{}^^^GHH^MR||DOE^JOHN||19800101|M\r'
+    ).format(idx, idx).encode('utf8')
+
+# ################################################################################################################################
+
+def get_control_id(message:'bytes') -> 'bytes':
+    return message.split(b'\r', 1)[0].split(b'|')[9]
+
+# ################################################################################################################################
+
+def wrap(message:'bytes') -> 'bytes':
+    return start_seq + message + end_seq
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class MLLPFramerTestCase(TestCase):
+
+    def get_framer(self, buffer_size:'int'=16) -> 'MLLPFramer':
+        return MLLPFramer(start_seq, end_seq, max_msg_size, buffer_size)
+
+# ################################################################################################################################
+
+    def test_many_frames_in_one_read(self):
+
+        framer = self.get_framer()
+        messages = [get_adt_message(idx) for idx in range(5)]
+
+        frames = framer.feed(b''.join(wrap(message) for message in messages))
+
+        self.assertListEqual(frames, messages)
+        self.assertEqual(framer.start, 0)
+        self.assertEqual(framer.end, 0)
+
+# ################################################################################################################################
+
+    def test_frames_split_across_reads(self):
+
+        framer = self.get_framer()
+        messages = [get_adt_message(idx) for idx in range(3)]
+        data = b''.join(wrap(message) for message in messages)
+
+        # Each byte arrives on its own, which splits both the start and end sequences too
+        frames = []
+        for idx in range(len(data)):
+            frames.extend(framer.feed(data[idx:idx+1]))
+
+        self.assertListEqual(frames, messages)
+
+        # Chunks that end in the middle of a frame give the frames that are complete so far
+        framer = self.get_framer()
+        self.assertListEqual(framer.feed(data[:50]), [])
+        self.assertListEqual(framer.feed(data[50:len(wrap(messages[0])) + 10]), messages[:1])
+        self.assertListEqual(framer.feed(data[len(wrap(messages[0])) + 10:]), messages[1:])
+
+# ################################################################################################################################
+
+    def test_buffer_reuse(self):
+
+        framer = self.get_framer(buffer_size=64)
+        message = get_adt_message(1)
+
+        # A frame is received partly, after which more frames need room in the buffer ..
+        for _ in range(100):
+            data = wrap(message) + wrap(message)[:20]
+            self.assertListEqual(framer.feed(data), [message])
+            self.assertListEqual(framer.feed(wrap(message)[20:]), [message])
+
+        # .. which does not make the buffer grow beyond what a single read requires.
+        self.assertLessEqual(len(framer.buffer), 4 * len(wrap(message)))
+
+# ################################################################################################################################
+
+    def test_read_from(self):
+
+        framer = self.get_framer()
+        data = wrap(get_adt_message(1))
+
+        def recv_into(view:'memoryview') -> 'int':
+            view[:len(data)] = data
+            return len(data)
+
+        # Data is read into the buffer directly
+        self.assertEqual(framer.read_from(recv_into, len(data)), len(data))
+        self.assertEqual(framer.get_last_read(len(data)), data)
+        self.assertListEqual(framer.get_frames(), [get_adt_message(1)])
+
+# ################################################################################################################################
+
+    def test_invalid_data(self):
+
+        # No start sequence ..
+        with self.assertRaises(MLLPFramingError) as cm:
+            _ = self.get_framer().feed(b'MSH|abc' + end_seq)
+        self.assertIn('header mismatch', cm.exception.reason)
+
+        # .. data between frames ..
+        with self.assertRaises(MLLPFramingError):
+            _ = self.get_framer().feed(wrap(b'MSH|abc') + b'\n' + wrap(b'MSH|abc'))
+
+        # .. a message that is too big, even if not complete yet ..
+        framer = MLLPFramer(start_seq, end_seq, 100, 16)
+        with self.assertRaises(MLLPFramingError) as cm:
+            _ = framer.feed(start_seq + b'a' * 200)
+        self.assertIn('max. size', cm.exception.reason)
+
+        # .. or complete.
+        framer = MLLPFramer(start_seq, end_seq, 100, 16)
+        with self.assertRaises(MLLPFramingError):
+            _ = framer.feed(wrap(b'a' * 200))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class HL7MLLPServerTestCase(TestCase):
+
+    def setUp(self) -> 'None':
+        self.servers = [] # type: anylist
+
+    def tearDown(self) -> 'None':
+        for server in self.servers:
+            server.stop()
+
+# ################################################################################################################################
+
+    def start_server(self, callback_func:'any_', pipeline_size:'int'=1) -> 'int':
+
+        config = bunchify({
+            'id': '123',
+            'name': 'test.hl7.mllp',
+            'address': '127.0.0.1:0',
+            'service_name': 'test.service',
+            'max_msg_size': max_msg_size,
+            'read_buffer_size': 65536,
+            'pipeline_size': pipeline_size,
+            'recv_timeout': 0.25,
+            'logging_level': 'WARN',
+            'should_log_messages': False,
+            'start_seq': start_seq,
+            'end_seq': end_seq,
+        })
+
+        server = HL7MLLPServer(config, callback_func, None)
+        _ = spawn(server.start)
+
+        while not getattr(server, 'impl', None) or not server.impl.started:
+            sleep(0.01)
+
+        self.servers.append(server)
+
+        return server.impl.server_port
+
+# ################################################################################################################################
+
+    def get_ack(self, message:'bytes') -> 'bytes':
+        return wrap(b'MSH|^~\\&|||||||ACK|1|P|2.5\rMSA|AA|' + get_control_id(message))
+
+# ################################################################################################################################
+
+    def on_message(self, service_name:'str', data:'bytes', **kwargs:'any_') -> 'bytes':
+        return self.get_ack(data)
+
+# ################################################################################################################################
+
+    def send_pipelined(self, port:'int', messages:'anylist', chunk_size:'int'=1000) -> 'anylist':
+        """ Sends all the messages without waiting for responses and returns the responses received.
+        """
+        framer = MLLPFramer(start_seq, end_seq, max_msg_size, 65536)
+        responses = []
+
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+
+            def _send() -> 'None':
+                for idx in range(0, len(messages), chunk_size):
+                    sock.sendall(b''.join(wrap(message) for message in messages[idx:idx+chunk_size]))
+
+            _ = spawn(_send)
+
+            while len(responses) < len(messages):
+                if not framer.read_from(sock.recv_into, 65536):
+                    break
+                responses.extend(framer.get_frames())
+
+        return responses
+
+# ################################################################################################################################
+
+    def send_lockstep(self, port:'int', messages:'anylist') -> 'anylist':
+        """ Sends each message only after a response to the previous one has been received.
+        """
+        framer = MLLPFramer(start_seq, end_seq, max_msg_size, 65536)
+        responses = []
+
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            for message in messages:
+                sock.sendall(wrap(message))
+                frames = []
+                while not frames:
+                    if not framer.read_from(sock.recv_into, 65536):
+                        return responses
+                    frames = framer.get_frames()
+                responses.extend(frames)
+
+        return responses
+
+# ################################################################################################################################
+
+    def test_pipelined_messages(self):
+
+        port = self.start_server(self.on_message)
+        messages = [get_adt_message(idx) for idx in range(500)]
+
+        # Many messages arrive in each read and each of them is responded to
+        responses = self.send_pipelined(port, messages, chunk_size=50)
+
+        self.assertListEqual(responses, [self.get_ack(message)[1:-2] for message in messages])
+
+# ################################################################################################################################
+
+    def test_pipelined_messages_concurrently(self):
+
+        def on_message(service_name:'str', data:'bytes', **kwargs:'any_') -> 'bytes':
+
+            # Later messages may be completed before earlier ones ..
+            sleep(random() / 100)
+            return self.get_ack(data)
+
+        port = self.start_server(on_message, pipeline_size=20)
+        messages = [get_adt_message(idx) for idx in range(200)]
+
+        # .. yet responses are sent in the order the messages were received in.
+        responses = self.send_pipelined(port, messages, chunk_size=50)
+
+        self.assertListEqual(responses, [self.get_ack(message)[1:-2] for message in messages])
+
+# ################################################################################################################################
+
+    def test_invalid_data_closes_connection(self):
+
+        port = self.start_server(self.on_message)
+
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            sock.sendall(wrap(get_adt_message(1)) + b'abc' + end_seq)
+
+            # The valid message is responded to, after which the connection is closed
+            data = b''
+            while True:
+                received = sock.recv(65536)
+                if not received:
+                    break
+                data += received
+
+        self.assertEqual(data, self.get_ack(get_adt_message(1)))
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_throughput_benchmark(self):
+
+        messages = [get_adt_message(idx) for idx in range(benchmark_messages)]
+
+        # Each message is sent only after the previous one was responded to ..
+        port = self.start_server(self.on_message)
+
+        start = perf_counter()
+        responses = self.send_lockstep(port, messages[:benchmark_lockstep_messages])
+        taken = perf_counter() - start
+
+        self.assertEqual(len(responses), benchmark_lockstep_messages)
+
+        benchmark_logger.info('HL7 MLLP one message at a time; {} messages: {:.2f} ms, {:.0f} msg/s'.format(
+            benchmark_lockstep_messages, taken * 1000, benchmark_lockstep_messages / taken))
+
+        # .. compared to messages pipelined by the client ..
+        port = self.start_server(self.on_message)
+
+        start = perf_counter()
+        responses = self.send_pipelined(port, messages)
+        taken = perf_counter() - start
+
+        self.assertEqual(len(responses), benchmark_messages)
+
+        benchmark_logger.info('HL7 MLLP pipelined; {} messages: {:.2f} ms, {:.0f} msg/s'.format(
+            benchmark_messages, taken * 1000, benchmark_messages / taken))
+
+        # .. and to pipelined messages that take a while to process, one or many at a time.
+        def on_message(service_name:'str', data:'bytes', **kwargs:'any_') -> 'bytes':
+            sleep(benchmark_blocking_time)
+            return self.get_ack(data)
+
+        for pipeline_size in (1, benchmark_pipeline_size):
+
+            port = self.start_server(on_message, pipeline_size)
+
+            start = perf_counter()
+            responses = self.send_pipelined(port, messages[:benchmark_blocking_messages])
+            taken = perf_counter() - start
+
+            self.assertEqual(len(responses), benchmark_blocking_messages)
+
+            benchmark_logger.info('HL7 MLLP pipelined, {} ms per message, pipeline size {}; {} messages: {:.2f} ms, '
+                '{:.0f} msg/s'.format(
+                benchmark_blocking_time * 1000, pipeline_size, benchmark_blocking_messages, taken * 1000,
+                benchmark_blocking_messages / taken))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
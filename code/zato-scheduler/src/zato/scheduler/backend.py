@@ -22,12 +22,13 @@ from gevent import lock, sleep
 from paodate import Delta
 
 # Python 2/3 compatibility
-from zato.common.ext.future.utils import iterkeys, itervalues
+from zato.common.ext.future.utils import itervalues
 
 # Zato
 from zato.common.api import FILE_TRANSFER, SCHEDULER
 from zato.common.util.api import add_scheduler_jobs, add_startup_jobs, asbool, make_repr, new_cid, spawn_greenlet
 from zato.scheduler.cleanup.cli import start_cleanup
+from zato.scheduler.dispatcher import Dispatcher, from_timestamp, to_timestamp
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -102,10 +103,6 @@ class Job:
         else:
             self.start_time = self.get_start_time(start_time if start_time is not None else datetime.datetime.utcnow())
 
-        self.wait_sleep_time = 1
-        self.wait_iter_cb = None
-        self.wait_iter_cb_args = ()
-
         # TODO: Add skip_days, skip_hours and skip_dates
 
     def __str__(self):
@@ -227,88 +224,44 @@ class Job:
         else:
             raise ValueError('Unsupported job type `{}` ({})'.format(self.type, self.name))
 
-    def _spawn(self, *args, **kwargs):
-        """ A thin wrapper so that it is easier to mock this method out in unit-tests.
-        """
-        return spawn_greenlet(*args, **kwargs)
-
-    def main_loop(self):
-
-        logger.info('Job entering main loop `%s`', self)
-
-        _sleep = gevent.sleep
-
-        try:
-            while self.keep_running:
-                try:
-                    self.current_run += 1
-
-                    # Perhaps we've already been executed enough times
-                    if self.max_repeats and self.current_run == self.max_repeats:
-                        self.keep_running = False
-                        self.max_repeats_reached = True
-                        self.max_repeats_reached_at = datetime.datetime.utcnow()
-
-                        if self.on_max_repeats_reached_cb:
-                            self.on_max_repeats_reached_cb(self)
-
-                    # Invoke callback in a new greenlet so it doesn't block the current one.
-                    self._spawn(self.callback, **{'ctx':self.get_context()})
-
-                except Exception:
-                    logger.warning(format_exc())
-
-                finally:
-                    # pylint: disable=lost-exception
+    def get_next_run_at(self, run_at:'float', now:'float') -> 'float | None':
+        """ Invoked by the dispatcher each time the job runs. Returns a timestamp of when the job should run next,
+        or None if it should not run anymore.
 
-                    # Pause the greenlet for however long is needed if it is not a one-off job
-                    if self.type == SCHEDULER.JOB_TYPE.ONE_TIME:
-                        return True
-                    else:
-                        _sleep(self.get_sleep_time(datetime.datetime.utcnow()))
-
-            logger.info('Job leaving main loop `%s` after %d iterations', self, self.current_run)
-
-        except Exception:
-            logger.warning(format_exc())
-
-        return True
-
-    def run(self):
-
-        # OK, we're ready
-        try:
-
-            # If we are a job that triggers file transfer channels we do not start
-            # unless our extra data is filled in. Otherwise, we would not trigger any transfer anyway.
-            if self.service == FILE_TRANSFER.SCHEDULER_SERVICE and (not self.extra):
-                logger.warning('Skipped file transfer job `%s` without extra set `%s` (%s)', self.name, self.extra, self.service)
-                return
+        The next run of an interval-based job is always computed from start_time rather than from when the previous one
+        took place, which means that jobs do not drift over time. If the dispatcher was late, e.g. because the scheduler
+        was busy, the runs that were missed are skipped and the job runs next at the first of its times after now.
+        """
+        self.current_run += 1
 
-            if not self.start_time:
-                logger.warning('Job `%s` cannot start without start_time set', self.name)
-                return
+        # Perhaps we've already been executed enough times
+        if self.max_repeats and self.current_run == self.max_repeats:
+            self.keep_running = False
+            self.max_repeats_reached = True
+            self.max_repeats_reached_at = datetime.datetime.utcnow()
 
-            logger.info('Job starting `%s`', self)
+            if self.on_max_repeats_reached_cb:
+                self.on_max_repeats_reached_cb(self)
 
-            _utcnow = datetime.datetime.utcnow
-            _sleep = gevent.sleep
+        if self.type == SCHEDULER.JOB_TYPE.ONE_TIME or not self.keep_running:
+            return None
 
-            # If the job has a start time in the future, sleep until it's ready to go.
-            now = _utcnow()
+        now = max(run_at, now)
 
-            while self.start_time > now:
-                _sleep(self.wait_sleep_time)
+        if self.type == SCHEDULER.JOB_TYPE.INTERVAL_BASED:
+            start = to_timestamp(self.start_time)
+            interval = self.interval.in_seconds
 
-                if self.wait_iter_cb:
-                    self.wait_iter_cb(self.start_time, now, *self.wait_iter_cb_args)
+            next_run_at = start + ((now - start) // interval + 1) * interval
 
-                now = _utcnow()
+            # Floating point division may round down to the current run
+            if next_run_at <= run_at:
+                next_run_at += interval
 
-            self.main_loop()
+            return next_run_at
 
-        except Exception:
-            logger.warning(format_exc())
+        else:
+            return now + self.get_sleep_time(from_timestamp(now))
 
 # ################################################################################################################################
 
@@ -320,7 +273,6 @@ class Scheduler:
         self.startup_jobs = config.startup_jobs
         self.odb = config.odb
         self.jobs = {}
-        self.job_greenlets = {}
         self.keep_running = True
         self.lock = lock.RLock()
         self.sleep_time = 0.1
@@ -331,6 +283,10 @@ class Scheduler:
         self._add_scheduler_jobs = config._add_scheduler_jobs
         self.job_log = getattr(logger, config.job_log_level)
         self.initial_sleep_time = self.config.main.get('misc', {}).get('initial_sleep_time') or SCHEDULER.InitialSleepTime
+        self.job_pool_size = self.config.main.get('misc', {}).get('job_pool_size') or SCHEDULER.JobPoolSize
+
+        # All the jobs are run by this one dispatcher rather than each in its own greenlet
+        self.dispatcher = Dispatcher(self.job_pool_size)
 
     def on_max_repeats_reached(self, job):
         with self.lock:
@@ -370,13 +326,10 @@ class Scheduler:
         found = False
         job.keep_running = False
 
-        if name in iterkeys(self.jobs):
-            del self.jobs[name]
+        if self.jobs.pop(name, None):
             found = True
 
-        if name in iterkeys(self.job_greenlets):
-            self.job_greenlets[name].kill(block=False, timeout=2.0)
-            del self.job_greenlets[name]
+        if self.dispatcher.remove(name):
             found = True
 
         return found
@@ -399,17 +352,11 @@ class Scheduler:
     def unschedule_by_name(self, name):
         """ Deletes a job by its name.
         """
-        _job = None
-
         with self.lock:
-            for job in itervalues(self.jobs):
-                if job.name == name:
-                    _job = job
-                    break
+            job = self.jobs.get(name)
 
-        # We can't do it with self.lock because deleting changes the set = RuntimeError
-        if _job:
-            self.unschedule(job)
+            if job:
+                self._unschedule_stop(job, '(src:unschedule)')
 
     def stop_job(self, job):
         """ Stops a job by deleting it.
@@ -421,10 +368,12 @@ class Scheduler:
         """ Stops all jobs and the scheduler itself.
         """
         with self.lock:
-            jobs = sorted(self.jobs)
+            jobs = sorted(itervalues(self.jobs))
             for job in jobs:
                 self._unschedule_stop(job.clone(), 'stopped')
 
+        self.dispatcher.stop()
+
     def sleep(self, value):
         """ A method introduced so the class is easier to mock out in tests.
         """
@@ -434,12 +383,12 @@ class Scheduler:
         """ Executes a job no matter if it's active or not. One-time job are not unscheduled afterwards.
         """
         with self.lock:
-            for job in itervalues(self.jobs):
-                if job.name == name:
-                    self.on_job_executed(job.get_context(), False)
-                    break
+            job = self.jobs.get(name)
+
+            if job:
+                self.on_job_executed(job.get_context(), False)
             else:
-                logger.warning('No such job `%s` in `%s`', name, [elem.get_context() for elem in itervalues(self.jobs)])
+                logger.warning('No such job `%s` in `%s`', name, sorted(self.jobs))
 
     def on_job_executed(self, ctx:'stranydict', unschedule_one_time:'bool'=True) -> 'None':
 
@@ -462,11 +411,22 @@ class Scheduler:
         return spawn_greenlet(*args, **kwargs)
 
     def spawn_job(self, job):
-        """ Spawns a job's greenlet. Must be called with self.lock held.
+        """ Adds a job to the dispatcher, replacing any previous one of the same name. Must be called with self.lock held.
         """
         job.callback = self.on_job_executed
         job.on_max_repeats_reached_cb = self.on_max_repeats_reached
-        self.job_greenlets[job.name] = self._spawn(job.run)
+
+        # If we are a job that triggers file transfer channels we do not start
+        # unless our extra data is filled in. Otherwise, we would not trigger any transfer anyway.
+        if job.service == FILE_TRANSFER.SCHEDULER_SERVICE and (not job.extra):
+            logger.warning('Skipped file transfer job `%s` without extra set `%s` (%s)', job.name, job.extra, job.service)
+            return
+
+        if not job.start_time:
+            logger.warning('Job `%s` cannot start without start_time set', job.name)
+            return
+
+        self.dispatcher.add(job, to_timestamp(job.start_time))
 
     def init_jobs(self):
 
@@ -506,6 +466,7 @@ class Scheduler:
 
             # Ok, we're good now.
             self.ready = True
+            self._spawn(self.dispatcher.run)
 
             logger.info('Scheduler started')
 
@@ -515,5 +476,7 @@ class Scheduler:
                 if self.iter_cb:
                     self.iter_cb(*self.iter_cb_args)
 
+            self.dispatcher.stop()
+
         except Exception:
             logger.warning(format_exc())
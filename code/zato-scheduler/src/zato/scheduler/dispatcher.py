@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from datetime import datetime
+from heapq import heapify, heappop, heappush
+from itertools import count
+from logging import getLogger
+from time import time
+from traceback import format_exc
+
+# gevent
+from gevent.event import Event
+from gevent.pool import Pool
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_, anylist, callable_, stranydict
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+# How many callbacks of jobs may run at the same time
+default_pool_size = 100
+
+# The dispatcher never sleeps longer than this many seconds, even if there are no jobs to run
+default_max_sleep = 1.0
+
+# Stale heap entries are removed only if there are at least that many of them
+min_stale_to_compact = 1000
+
+_epoch = datetime(1970, 1, 1)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def to_timestamp(value:'datetime') -> 'float':
+    """ Converts a naive UTC datetime to seconds since the epoch.
+    """
+    return (value - _epoch).total_seconds()
+
+# ################################################################################################################################
+
+def from_timestamp(value:'float') -> 'datetime':
+    """ Converts seconds since the epoch to a naive UTC datetime.
+    """
+    return datetime.utcfromtimestamp(value)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Dispatcher:
+    """ Runs all the jobs from a single greenlet. Times when jobs are to run next are kept in a min-heap,
+    as timestamps, and a dict maps names of jobs to the jobs and their current heap entries.
+
+    Jobs are rescheduled before their callbacks are invoked, in a bounded pool, which means that how long
+    the callbacks take has no effect on when the jobs run next. Each job is expected to have a name, a callback,
+    a get_context method returning what the callback is invoked with and a get_next_run_at method
+    returning a timestamp of the job's next run, or None if it should not run anymore.
+
+    Entries of jobs that are edited or deleted are not removed from the heap, they are ignored instead
+    when they are popped and the heap is compacted if there are too many of them.
+    """
+    def __init__(self, pool_size:'int'=default_pool_size, clock:'callable_'=time, max_sleep:'float'=default_max_sleep) -> 'None':
+        self.clock = clock
+        self.max_sleep = max_sleep
+        self.pool = Pool(pool_size)
+
+        # Each entry is (run_at, seq, name), seq keeps jobs that run at the same time in the order they were added in
+        self.heap = [] # type: anylist
+
+        # Maps names of jobs to tuples of (seq, job), an entry in the heap is current only if it has the same seq
+        self.index = {} # type: stranydict
+
+        self.seq = count()
+        self.stale = 0
+        self.keep_running = True
+        self.wake_up = Event()
+
+    def __len__(self) -> 'int':
+        return len(self.index)
+
+    def __contains__(self, name:'str') -> 'bool':
+        return name in self.index
+
+# ################################################################################################################################
+
+    def get(self, name:'str') -> 'any_':
+        entry = self.index.get(name)
+        return entry[1] if entry else None
+
+# ################################################################################################################################
+
+    def get_next_run_at(self) -> 'float | None':
+        """ Returns a timestamp of when the earliest of all the jobs is to run, or None if there are no jobs.
+        """
+        heap = self.heap
+        index = self.index
+
+        while heap:
+            run_at, seq, name = heap[0]
+            entry = index.get(name)
+
+            if entry and entry[0] == seq:
+                return run_at
+
+            _ = heappop(heap)
+            self.stale -= 1
+
+# ################################################################################################################################
+
+    def _push(self, job:'any_', run_at:'float') -> 'None':
+        seq = next(self.seq)
+        self.index[job.name] = (seq, job)
+        heappush(self.heap, (run_at, seq, job.name))
+
+# ################################################################################################################################
+
+    def add(self, job:'any_', run_at:'float') -> 'None':
+        """ Schedules a job to run at a given timestamp. If there already is a job of the same name, it is replaced.
+        """
+        if job.name in self.index:
+            self.stale += 1
+
+        next_run_at = self.get_next_run_at()
+        self._push(job, run_at)
+
+        # The dispatcher may be sleeping until a later time than that of this job
+        if next_run_at is None or run_at < next_run_at:
+            self.wake_up.set()
+
+        self.compact()
+
+# ################################################################################################################################
+
+    def remove(self, name:'str') -> 'bool':
+        """ Unschedules a job by its name, returning True if it was found.
+        """
+        if self.index.pop(name, None):
+            self.stale += 1
+            self.compact()
+            return True
+        else:
+            return False
+
+# ################################################################################################################################
+
+    def compact(self) -> 'None':
+        """ Removes stale entries from the heap if they are more than half of it.
+        """
+        if self.stale >= min_stale_to_compact and self.stale * 2 > len(self.heap):
+            index = self.index
+            self.heap[:] = [elem for elem in self.heap if index.get(elem[2], (None,))[0] == elem[1]]
+            heapify(self.heap)
+            self.stale = 0
+
+# ################################################################################################################################
+
+    def clear(self) -> 'None':
+        self.heap.clear()
+        self.index.clear()
+        self.stale = 0
+
+# ################################################################################################################################
+
+    def _invoke(self, callback:'callable_', ctx:'any_') -> 'None':
+        try:
+            callback(ctx)
+        except Exception:
+            logger.warning(format_exc())
+
+# ################################################################################################################################
+
+    def run_pending(self, now:'float | None'=None) -> 'int':
+        """ Invokes callbacks of all the jobs that were to run at or before now and schedules their next runs.
+        Returns how many callbacks were invoked.
+        """
+        now = self.clock() if now is None else now
+
+        heap = self.heap
+        index = self.index
+        spawn = self.pool.spawn
+        invoke = self._invoke
+
+        total = 0
+
+        while heap and heap[0][0] <= now:
+
+            run_at, seq, name = heappop(heap)
+            entry = index.get(name)
+
+            # This job was edited or deleted after this entry had been added
+            if not (entry and entry[0] == seq):
+                self.stale -= 1
+                continue
+
+            job = entry[1]
+
+            # The next run is computed from when this one was to take place, not from when it actually did,
+            # which is why jobs do not drift even if we are late ..
+            try:
+                next_run_at = job.get_next_run_at(run_at, now)
+                ctx = job.get_context()
+            except Exception:
+                logger.warning('Job `%s` will not run anymore, e:`%s`', name, format_exc())
+                del index[name]
+                continue
+
+            if next_run_at is None:
+                del index[name]
+            else:
+                self._push(job, next_run_at)
+
+            # .. and callbacks do not delay other jobs, unless there are already as many of them running as the pool allows.
+            _ = spawn(invoke, job.callback, ctx)
+            total += 1
+
+        return total
+
+# ################################################################################################################################
+
+    def wait(self) -> 'None':
+        """ Sleeps until the earliest job is to run, but not longer than max_sleep and only until a job is added
+        that is to run before that.
+        """
+        self.wake_up.clear()
+
+        timeout = self.max_sleep
+        next_run_at = self.get_next_run_at()
+
+        if next_run_at is not None:
+            timeout = min(max(next_run_at - self.clock(), 0), timeout)
+
+        _ = self.wake_up.wait(timeout)
+
+# ################################################################################################################################
+
+    def run(self) -> 'None':
+        while self.keep_running:
+            try:
+                _ = self.run_pending()
+            except Exception:
+                logger.warning(format_exc())
+
+            self.wait()
+
+# ################################################################################################################################
+
+    def stop(self) -> 'None':
+        self.keep_running = False
+        self.wake_up.set()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to be done as soon as possible
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+from random import Random
+from time import perf_counter, time
+from unittest import main, TestCase
+
+# gevent
+from gevent import sleep, spawn
+from gevent.event import Event
+
+# Zato
+from zato.scheduler.dispatcher import Dispatcher, min_stale_to_compact
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_, anylist, callable_
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Clock:
+    """ A clock that moves only when told to.
+    """
+    def __init__(self, now:'float'=1_700_000_000.0) -> 'None':
+        self.now = now
+
+    def __call__(self) -> 'float':
+        return self.now
+
+# ################################################################################################################################
+
+class FakeJob:
+    """ An interval-based job whose runs are computed the same way as those of zato.scheduler.backend.Job.
+    """
+    def __init__(self, name:'str', start:'float', interval:'float', callback:'callable_', max_repeats:'int'=0) -> 'None':
+        self.name = name
+        self.start = start
+        self.interval = interval
+        self.callback = callback
+        self.max_repeats = max_repeats
+        self.current_run = 0
+        self.run_at = None # type: float | None
+
+    def get_next_run_at(self, run_at:'float', now:'float') -> 'float | None':
+        self.current_run += 1
+        self.run_at = run_at
+
+        if self.max_repeats and self.current_run == self.max_repeats:
+            return None
+
+        now = max(run_at, now)
+        next_run_at = self.start + ((now - self.start) // self.interval + 1) * self.interval
+
+        if next_run_at <= run_at:
+            next_run_at += self.interval
+
+        return next_run_at
+
+    def get_context(self) -> 'any_':
+        return self.name, self.run_at, self.current_run
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class DispatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.runs = [] # type: anylist
+
+    def get_dispatcher(self, **kwargs:'any_') -> 'Dispatcher':
+        return Dispatcher(clock=self.clock, **kwargs)
+
+    def on_job_executed(self, ctx:'any_') -> 'None':
+        self.runs.append(ctx)
+
+    def add_job(self, dispatcher:'Dispatcher', name:'str', start:'float', interval:'float', **kwargs:'any_') -> 'FakeJob':
+        job = FakeJob(name, start, interval, self.on_job_executed, **kwargs)
+        dispatcher.add(job, start)
+        return job
+
+    def run_until(self, dispatcher:'Dispatcher', end:'float', step:'float') -> 'None':
+        """ Moves the clock from now to end and runs the jobs that are due each step of the way.
+        """
+        while self.clock.now < end:
+            self.clock.now = min(self.clock.now + step, end)
+            _ = dispatcher.run_pending()
+            dispatcher.pool.join()
+
+# ################################################################################################################################
+
+    def test_no_drift(self):
+
+        dispatcher = self.get_dispatcher()
+        start = self.clock.now + 10
+        interval = 7.3
+        total_runs = 1000
+
+        random = Random(0)
+
+        def on_job_executed(ctx):
+            self.runs.append(ctx)
+
+            # Each run takes some time ..
+            self.clock.now += random.uniform(0, 5)
+
+        job = FakeJob('job', start, interval, on_job_executed)
+        dispatcher.add(job, start)
+
+        # .. and the dispatcher wakes up somewhat later than it should ..
+        while len(self.runs) < total_runs:
+            self.clock.now = max(self.clock.now, dispatcher.get_next_run_at()) + random.uniform(0, 0.1)
+            _ = dispatcher.run_pending()
+            dispatcher.pool.join()
+
+        # .. yet each run is exactly when it was to take place, no matter how many there were.
+        for idx, (_, run_at, current_run) in enumerate(self.runs):
+            self.assertEqual(current_run, idx + 1)
+            self.assertAlmostEqual(run_at, start + idx * interval, places=6)
+
+        self.assertAlmostEqual(dispatcher.get_next_run_at(), start + total_runs * interval, places=6)
+
+# ################################################################################################################################
+
+    def test_late_runs_skipped(self):
+
+        dispatcher = self.get_dispatcher()
+        start = self.clock.now
+        _ = self.add_job(dispatcher, 'job', start, 10)
+
+        # We were not able to run the job for five and a half intervals ..
+        self.clock.now = start + 55
+        self.assertEqual(dispatcher.run_pending(), 1)
+
+        # .. so it runs once only and then at the next of its times, as though it had run all along.
+        self.assertEqual(dispatcher.get_next_run_at(), start + 60)
+
+        self.clock.now = start + 59.9
+        self.assertEqual(dispatcher.run_pending(), 0)
+
+        self.clock.now = start + 60
+        self.assertEqual(dispatcher.run_pending(), 1)
+
+# ################################################################################################################################
+
+    def test_order(self):
+
+        dispatcher = self.get_dispatcher()
+        start = self.clock.now
+
+        # Jobs are added in an order that is different from the one they are to run in ..
+        for name, offset in (('c', 3), ('a', 1), ('d', 3), ('b', 2), ('e', 3)):
+            _ = self.add_job(dispatcher, name, start + offset, 100, max_repeats=1)
+
+        self.assertEqual(len(dispatcher), 5)
+
+        # .. they run in the order of their times, and the ones that have the same time run in the order they were added in ..
+        self.run_until(dispatcher, start + 10, 10)
+        self.assertListEqual([elem[0] for elem in self.runs], ['a', 'b', 'c', 'd', 'e'])
+
+        # .. and they are not kept after their last runs.
+        self.assertEqual(len(dispatcher), 0)
+        self.assertIsNone(dispatcher.get_next_run_at())
+
+# ################################################################################################################################
+
+    def test_edit_delete(self):
+
+        dispatcher = self.get_dispatcher()
+        start = self.clock.now
+
+        _ = self.add_job(dispatcher, 'edited', start + 1, 10)
+        _ = self.add_job(dispatcher, 'deleted', start + 1, 10)
+
+        # A job of the same name replaces the previous one ..
+        job = self.add_job(dispatcher, 'edited', start + 5, 10)
+        self.assertIs(dispatcher.get('edited'), job)
+
+        # .. and deleted jobs are not run.
+        self.assertTrue(dispatcher.remove('deleted'))
+        self.assertFalse(dispatcher.remove('deleted'))
+        self.assertNotIn('deleted', dispatcher)
+
+        self.run_until(dispatcher, start + 20, 1)
+        self.assertListEqual([elem[:2] for elem in self.runs], [('edited', start + 5), ('edited', start + 15)])
+
+# ################################################################################################################################
+
+    def test_compact(self):
+
+        dispatcher = self.get_dispatcher()
+        start = self.clock.now
+
+        # Entries of jobs that are edited many times are not kept for longer than needed
+        for idx in range(min_stale_to_compact * 10):
+            _ = self.add_job(dispatcher, 'job', start + idx, 10)
+
+        self.assertLessEqual(len(dispatcher.heap), min_stale_to_compact * 2)
+        self.assertEqual(dispatcher.get_next_run_at(), start + min_stale_to_compact * 10 - 1)
+
+# ################################################################################################################################
+
+    def test_pool_is_bounded(self):
+
+        dispatcher = self.get_dispatcher(pool_size=3)
+        release = Event()
+        running = []
+
+        def on_job_executed(ctx):
+            running.append(ctx)
+            _ = release.wait()
+
+        for idx in range(10):
+            dispatcher.add(FakeJob(str(idx), self.clock.now, 10, on_job_executed), self.clock.now)
+
+        # No more callbacks run at the same time than the pool allows ..
+        greenlet = spawn(dispatcher.run_pending)
+        sleep(0.05)
+        self.assertEqual(len(running), 3)
+
+        # .. and the rest run when the previous ones complete.
+        release.set()
+        self.assertEqual(greenlet.get(timeout=1), 10)
+        dispatcher.pool.join()
+        self.assertEqual(len(running), 10)
+
+# ################################################################################################################################
+
+    def test_wake_up_on_add(self):
+
+        # This one uses the actual clock
+        dispatcher = Dispatcher(max_sleep=10)
+        _ = spawn(dispatcher.run)
+        sleep(0.01)
+
+        # The dispatcher would sleep for much longer if it were not woken up by a new job
+        _ = self.add_job(dispatcher, 'job', time() + 0.05, 10)
+        sleep(0.5)
+
+        dispatcher.stop()
+        self.assertEqual(len(self.runs), 1)
+
+# ################################################################################################################################
+
+    def test_many_jobs(self):
+
+        total_jobs = 100_000
+        duration = 300
+
+        dispatcher = self.get_dispatcher()
+        random = Random(0)
+        begin = self.clock.now
+
+        jobs = []
+
+        for idx in range(total_jobs):
+            start = begin + random.uniform(0, 60)
+            interval = random.choice((15, 30, 60, 120, 90.5))
+            jobs.append(self.add_job(dispatcher, 'job-{}'.format(idx), start, interval))
+
+        # A quarter of the jobs are deleted and another quarter is edited ..
+        for job in jobs[::4]:
+            self.assertTrue(dispatcher.remove(job.name))
+
+        for job in jobs[1::4]:
+            _ = self.add_job(dispatcher, job.name, job.start, job.interval * 2)
+
+        expected = {}
+        for idx, job in enumerate(jobs):
+            if idx % 4 == 0:
+                continue
+            interval = job.interval * 2 if idx % 4 == 1 else job.interval
+            expected[job.name] = int((begin + duration - job.start) // interval) + 1
+
+        started = perf_counter()
+        self.run_until(dispatcher, begin + duration, 1)
+        elapsed = perf_counter() - started
+
+        # .. and all the other ones run each time they are to run and at no other time.
+        runs = {}
+        for name, run_at, current_run in self.runs:
+            runs[name] = current_run
+            self.assertLessEqual(run_at, begin + duration)
+
+        self.assertDictEqual(runs, expected)
+        self.assertEqual(len(dispatcher), total_jobs * 3 // 4)
+
+        # The dispatcher itself, rather than the callbacks, takes only microseconds per run
+        self.assertLess(elapsed / len(self.runs), 0.001, (elapsed, len(self.runs)))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
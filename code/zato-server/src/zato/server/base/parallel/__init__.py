@@ -15,6 +15,7 @@ from pathlib import Path
 from platform import system as platform_system
 from random import seed as random_seed
 from tempfile import mkstemp
+from time import monotonic
 from traceback import format_exc
 from uuid import uuid4
 
@@ -33,8 +34,8 @@ from paste.util.converters import asbool
 from zato.broker import BrokerMessageReceiver
 from zato.broker.client import BrokerClient
 from zato.bunch import Bunch
-from zato.common.api import DATA_FORMAT, default_internal_modules, HotDeploy, KVDB as CommonKVDB, RATE_LIMIT, SERVER_STARTUP, \
-    SEC_DEF_TYPE, SERVER_UP_STATUS, ZatoKVDB as CommonZatoKVDB, ZATO_ODB_POOL_NAME
+from zato.common.api import DATA_FORMAT, default_internal_modules, HotDeploy, INVOKE_ALL, KVDB as CommonKVDB, RATE_LIMIT, \
+    SERVER_STARTUP, SEC_DEF_TYPE, SERVER_UP_STATUS, SIMPLE_IO, ZatoKVDB as CommonZatoKVDB, ZATO_NOT_GIVEN, ZATO_ODB_POOL_NAME
 from zato.common.audit import audit_pii
 from zato.common.audit_log import AuditLog
 from zato.common.broker_message import HOT_DEPLOY, MESSAGE_TYPE
@@ -52,8 +53,8 @@ from zato.common.pubsub import SkipDelivery
 from zato.common.rate_limiting import RateLimiting
 from zato.common.typing_ import cast_, intnone, optional
 from zato.common.util.api import absolutize, get_config_from_file, get_kvdb_config_for_log, get_user_config_name, \
-    fs_safe_name, hot_deploy, invoke_startup_services as _invoke_startup_services, new_cid, spawn_greenlet, StaticConfig, \
-    register_diag_handlers
+    fs_safe_name, hot_deploy, invoke_startup_services as _invoke_startup_services, new_cid, spawn_all, spawn_greenlet, \
+    StaticConfig, register_diag_handlers
 from zato.common.util.file_transfer import path_string_list_to_list
 from zato.common.util.json_ import BasicParser
 from zato.common.util.platform_ import is_posix
@@ -86,7 +87,7 @@ if 0:
     from zato.common.crypto.api import ServerCryptoManager
     from zato.common.odb.api import ODBManager
     from zato.common.odb.model import Cluster as ClusterModel
-    from zato.common.typing_ import any_, anydict, anylist, anyset, callable_, strbytes, strlist, strnone
+    from zato.common.typing_ import any_, anydict, anylist, anyset, callable_, intlist, strbytes, strlist, strnone
     from zato.server.commands import CommandResult
     from zato.server.connection.cache import Cache, CacheAPI
     from zato.server.connection.connector.subprocess_.ipc import SubprocessIPC
@@ -114,11 +115,6 @@ kvdb_logger = logging.getLogger('zato_kvdb')
 # ################################################################################################################################
 # ################################################################################################################################
 
-megabyte = 10 ** 6
-
-# ################################################################################################################################
-# ################################################################################################################################
-
 class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
     """ Main server process.
     """
@@ -199,7 +195,10 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         self.pid = -1
         self.sync_internal = False
         self.ipc_api = IPCAPI()
-        self.fifo_response_buffer_size = -1
+        self.invoke_all_max_concurrency = INVOKE_ALL.DEFAULT.MAX_CONCURRENCY
+        self.invoke_all_deadline = INVOKE_ALL.DEFAULT.DEADLINE
+        self.http_stream_chunk_size = SIMPLE_IO.DEFAULT.STREAM_CHUNK_SIZE
+        self._worker_pids = cast_('intlist', None)
         self.is_first_worker = False
         self.shmem_size = -1.0
         self.server_startup_ipc = ServerStartupIPC()
@@ -660,9 +659,6 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         # Read all the user config files that are already available on startup
         self.read_user_config()
 
-        # Convert size of FIFO response buffers to megabytes
-        self.fifo_response_buffer_size = int(float(self.fs_server_config.misc.fifo_response_buffer_size) * megabyte)
-
         locally_deployed = self.maybe_on_first_worker(server)
 
         return locally_deployed
@@ -732,7 +728,7 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         config_ctx = _ServerRPC_ConfigCtx(config_source, self)
 
         # A publicly available RPC client
-        return ServerRPC(config_ctx)
+        return ServerRPC(config_ctx, self.invoke_all_max_concurrency, self.invoke_all_deadline)
 
 # ################################################################################################################################
 
@@ -875,6 +871,15 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         # Looked up upfront here and assigned to services in their store
         self.enforce_service_invokes = asbool(self.fs_server_config.misc.enforce_service_invokes)
 
+        # How many servers or processes are invoked at a time by self.rpc.invoke_all and self.invoke_all_pids,
+        # and how long each of these two may take in total, in seconds.
+        misc = self.fs_server_config.misc
+        self.invoke_all_max_concurrency = int(misc.get('invoke_all_max_concurrency') or INVOKE_ALL.DEFAULT.MAX_CONCURRENCY)
+        self.invoke_all_deadline = float(misc.get('invoke_all_deadline') or INVOKE_ALL.DEFAULT.DEADLINE)
+
+        # How many bytes at a time are sent in streamed responses to HTTP channels
+        self.http_stream_chunk_size = int(misc.get('http_stream_chunk_size') or SIMPLE_IO.DEFAULT.STREAM_CHUNK_SIZE)
+
         # For server-to-server RPC
         self.rpc = self.build_server_rpc()
 
@@ -1332,42 +1337,121 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         """
         return self.worker_store.cache_api.get_cache(cache_type, cache_name).set(key, value)
 
+# ################################################################################################################################
+
+    def get_worker_pids(self) -> 'intlist':
+        """ Returns PIDs of all the processes of current server. They are looked up once and then cached
+        until it turns out that a process cannot be invoked, e.g. because workers have been recycled.
+        """
+        if self._worker_pids is None:
+            data = self.invoke('zato.info.get-worker-pids', serialize=False).getvalue(False)
+            self._worker_pids = data['response']['pids']
+
+        return self._worker_pids
+
+# ################################################################################################################################
+
+    def _invoke_pid(
+        self,
+        pid:'int',
+        unreachable:'anyset',
+        service:'str',
+        request:'any_',
+        timeout:'int',
+        *args:'any_',
+        **kwargs:'any_'
+    ) -> 'anydict':
+
+        response = {
+            'is_ok': False,
+            'pid_data': None,
+            'error_info': None,
+            'response_time': 0.0,
+        }
+
+        start = monotonic()
+
+        try:
+            result = self.invoke_by_pid(service, request, pid, timeout=timeout, *args, **kwargs)
+
+            # This means that there was no process to connect to
+            if result is None:
+                unreachable.add(pid)
+                response['error_info'] = 'PID {} could not be invoked'.format(pid)
+            else:
+                is_ok, pid_data = result
+                response['is_ok'] = is_ok
+                response['pid_data' if is_ok else 'error_info'] = pid_data
+
+        except Exception:
+            e = format_exc()
+            response['error_info'] = e
+        finally:
+            response['response_time'] = monotonic() - start
+
+        return response
+
+# ################################################################################################################################
+
+    def _invoke_pids(self, pids:'intlist', unreachable:'anyset', *args:'any_', **kwargs:'any_') -> 'anydict':
+
+        # PID -> response from that process
+        out = {}
+
+        responses = spawn_all(self._invoke_pid, pids, self.invoke_all_max_concurrency, self.invoke_all_deadline,
+            unreachable, *args, **kwargs)
+
+        for pid, response in zip(pids, responses):
+
+            # This process did not respond in time
+            if response is ZATO_NOT_GIVEN:
+                response = {
+                    'is_ok': False,
+                    'pid_data': None,
+                    'error_info': 'Deadline of {}s exceeded'.format(self.invoke_all_deadline),
+                    'response_time': self.invoke_all_deadline,
+                }
+
+            out[pid] = response
+
+        return out
+
 # ################################################################################################################################
 
     def invoke_all_pids(self, service:'str', request:'any_', timeout:'int'=5, *args:'any_', **kwargs:'any_') -> 'anydict':
-        """ Invokes a given service in each of processes current server has.
+        """ Invokes a given service in each of processes current server has, all of them concurrently.
         """
         # PID -> response from that process
         out = {}
 
-        # Per-PID response
-        response:'anydict'
+        # PIDs of processes that could not be invoked at all
+        unreachable = set()
 
         try:
             # Get all current PIDs
-            data = self.invoke('zato.info.get-worker-pids', serialize=False).getvalue(False)
-            pids = data['response']['pids']
+            pids = self.get_worker_pids()
 
             # Underlying IPC needs strings on input instead of None
             request = request or ''
 
-            for pid in pids:
-                response = {
-                    'is_ok': False,
-                    'pid_data': None,
-                    'error_info': None
-                }
+            out.update(self._invoke_pids(pids, unreachable, service, request, timeout, *args, **kwargs))
+
+            # If some processes could not be invoked, workers may have been recycled ..
+            if unreachable:
+
+                # .. in which case the list of PIDs needs to be looked up again ..
+                self._worker_pids = None
+                current_pids = self.get_worker_pids()
 
-                try:
-                    is_ok, pid_data = self.invoke_by_pid(service, request, pid, timeout=timeout, *args, **kwargs)
-                    response['is_ok'] = is_ok
-                    response['pid_data' if is_ok else 'error_info'] = pid_data
+                # .. processes that are gone are not reported ..
+                for pid in pids:
+                    if pid not in current_pids:
+                        _ = out.pop(pid, None)
+
+                # .. and the ones that have replaced them are invoked now.
+                new_pids = [pid for pid in current_pids if pid not in out]
+                out.update(self._invoke_pids(new_pids, unreachable, service, request, timeout, *args, **kwargs))
 
-                except Exception:
-                    e = format_exc()
-                    response['error_info'] = e
-                finally:
-                    out[pid] = response
         except Exception:
             logger.warning('PID invocation error `%s`', format_exc())
         finally:
@@ -1378,8 +1462,7 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
     def invoke_by_pid(self, service:'str', request:'any_', target_pid:'int', *args:'any_', **kwargs:'any_') -> 'any_':
         """ Invokes a service in a worker process by the latter's PID.
         """
-        return self.ipc_api.invoke_by_pid(service, request, self.cluster_name, self.name, target_pid,
-            self.fifo_response_buffer_size, *args, **kwargs)
+        return self.ipc_api.invoke_by_pid(service, request, self.cluster_name, self.name, target_pid, *args, **kwargs)
 
 # ################################################################################################################################
 
@@ -1551,6 +1634,19 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
             os.path.join(self.kvdb_dir, CommonZatoKVDB.PubSubMetadataPath),
         )
 
+        #
+        # .. if configured to, changes to each repository are appended to a log rather than having the whole repository
+        # written out each time it is synchronised ..
+        #
+
+        misc = self.fs_server_config.misc
+
+        if asbool(misc.get('kvdb_use_wal')):
+            compact_threshold = int(misc.get('kvdb_wal_compact_threshold') or CommonZatoKVDB.DefaultCompactThreshold)
+
+            for repo in (self.slow_responses, self.usage_samples, self.current_usage, self.pub_sub_metadata):
+                repo.enable_wal(compact_threshold)
+
         #
         # .. and now we can load all the data.
         #
@@ -7,6 +7,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from collections.abc import Iterator
 from datetime import datetime
 from logging import getLogger, INFO
 from traceback import format_exc
@@ -99,6 +100,10 @@ class HTTPHandler:
 
         start_response(wsgi_environ['zato.http.response.status'], wsgi_environ['zato.http.response.headers'].items())
 
+        # Streamed responses are sent chunk by chunk so their size is not known upfront. Note that these are not
+        # necessarily Python generators, e.g. generators compiled by Cython are not, hence the check for any iterator.
+        is_stream = isinstance(payload, Iterator)
+
         if isinstance(payload, str):
             payload = payload.encode('utf-8')
 
@@ -123,11 +128,11 @@ class HTTPHandler:
                         'path': wsgi_environ['PATH_INFO'],
                         'http_version': wsgi_environ['SERVER_PROTOCOL'],
                         'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                        'response_size': len(payload),
+                        'response_size': '-' if is_stream else len(payload),
                         'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
                 })
 
-        return [payload]
+        return payload if is_stream else [payload]
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -394,7 +394,8 @@ class WorkerStore(_WorkerStoreBase):
             simple_io_config = self.worker_config.simple_io,
             return_tracebacks = self.server.return_tracebacks,
             default_error_message = self.server.default_error_message,
-            http_methods_allowed = self.server.http_methods_allowed
+            http_methods_allowed = self.server.http_methods_allowed,
+            stream_chunk_size = self.server.http_stream_chunk_size
         )
 
         # Create all the expected connections and objects
@@ -2444,15 +2445,11 @@ class WorkerStore(_WorkerStoreBase):
         msg, # type: any_
         success=IPC.STATUS.SUCCESS, # type: str
         failure=IPC.STATUS.FAILURE  # type: str
-    ) -> 'None':
+    ) -> 'str':
 
         # If there is target_pid we cannot continue if we are not the recipient.
         if msg.target_pid and msg.target_pid != self.server.pid:
-            return
-
-        # By default, assume we will not succeed.
-        status = failure
-        response = 'default-ipc-response'
+            return '{};Not the recipient, target_pid:`{}`, pid:`{}`'.format(failure, msg.target_pid, self.server.pid)
 
         # We get here if there is no target_pid or if there is one and it matched that of ours.
         try:
@@ -2469,13 +2466,8 @@ class WorkerStore(_WorkerStoreBase):
         except Exception:
             response = format_exc()
             status = failure
-        finally:
-            data = '{};{}'.format(status, response)
 
-        try:
-            with open(msg.reply_to_fifo, 'wb') as fifo:
-                fifo.write(data if isinstance(data, bytes) else data.encode('utf'))
-        except Exception:
-            logger.warning('Could not write to FIFO, m:`%s`, r:`%s`, s:`%s`, e:`%s`', msg, response, status, format_exc())
+        # The IPC server will send it back to the caller
+        return '{};{}'.format(status, response)
 
 # ################################################################################################################################
@@ -9,6 +9,9 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 # stdlib
 from base64 import b64decode
 
+# Bunch
+from bunch import bunchify
+
 # Zato
 from zato.common.api import CACHE
 from zato.server.base.worker.common import WorkerImpl
@@ -294,4 +297,19 @@ class CacheBuiltin(WorkerImpl):
         if msg.source_worker_id != self.server.worker_id:
             self.cache_api.sync_after_clear(CACHE.TYPE.BUILTIN, msg)
 
+# ################################################################################################################################
+
+    def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_BATCH(
+        self:'WorkerStore', # type: ignore
+        msg, # type: Bunch
+    ) -> 'None':
+        if msg.source_worker_id != self.server.worker_id:
+            data_list = []
+            for data in msg.data_list:
+                data = bunchify(data)
+                if data.get('is_value_pickled') or data.get('is_key_pickled'):
+                    self._unpickle_msg(data)
+                data_list.append(data)
+            self.cache_api.sync_batch(CACHE.TYPE.BUILTIN, data_list)
+
 # ################################################################################################################################
@@ -14,7 +14,7 @@ from logging import getLogger
 from traceback import format_exc
 
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, spawn_later
 from gevent.lock import RLock
 
 # python-memcached
@@ -60,12 +60,17 @@ builtin_ops = [
 ]
 
 builtin_op_to_broker_msg = {}
+broker_msg_to_sync_func = {}
 
 for builtin_op in builtin_ops:
     common_key = getattr(CACHE.STATE_CHANGED, builtin_op)
     broker_msg_value = getattr(CACHE_BROKER_MSG, 'BUILTIN_STATE_CHANGED_{}'.format(builtin_op)).value
 
     builtin_op_to_broker_msg[common_key] = broker_msg_value
+    broker_msg_to_sync_func[broker_msg_value] = 'sync_after_{}'.format(builtin_op.lower())
+
+# Each of these operations fully determines the state of a single key, no matter what was done to that key earlier
+_key_state_ops = {CACHE.STATE_CHANGED.SET, CACHE.STATE_CHANGED.DELETE}
 
 # ################################################################################################################################
 
@@ -85,7 +90,8 @@ class Cache:
         self.after_state_changed_callback = self.config.after_state_changed_callback
         self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
         self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
-            self.config.extend_expiry_on_set)
+            self.config.extend_expiry_on_set, max_bytes=self.config.get('max_bytes'),
+            use_key_index=self.config.get('use_key_index'))
         spawn(self._delete_expired)
 
 # ################################################################################################################################
@@ -636,6 +642,26 @@ class Cache:
         self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
         self.impl.update_config(config)
 
+# ################################################################################################################################
+
+    def get_stats(self):
+        """ Returns statistics regarding the cache's usage, such as the number of hits, misses or pending expirations.
+        """
+        return self.impl.get_stats()
+
+# ################################################################################################################################
+
+    def _get_delete_expired_sleep_time(self, interval, min_interval=0.1):
+        """ Returns how long to wait until the next run of self.impl.delete_expired - no longer than interval seconds
+        but possibly shorter if the next entry is to expire before that.
+        """
+        next_expiry = self.impl.get_next_expiry()
+
+        if next_expiry:
+            return min(interval, max(next_expiry - self.impl.get_timestamp(), min_interval))
+        else:
+            return interval
+
 # ################################################################################################################################
 
     def _delete_expired(self, interval=5, _sleep=sleep):
@@ -644,14 +670,14 @@ class Cache:
         try:
             while True:
                 try:
-                    _sleep(interval)
+                    _sleep(self._get_delete_expired_sleep_time(interval))
                     deleted = self.impl.delete_expired()
                 except Exception:
                     logger.warning('Exception while deleting expired keys %s', format_exc())
                     _sleep(2)
                 else:
                     if deleted:
-                        logger.info('Cache `%s` deleted keys expired in the last %ss - %s', self.config.name, interval, deleted)
+                        logger.info('Cache `%s` deleted expired keys - %s', self.config.name, deleted)
         except Exception:
             logger.warning('Exception in _delete_expired loop %s', format_exc())
 
@@ -662,6 +688,14 @@ class Cache:
         """
         self.impl.set(data.key, data.value, data.expiry, False, None, data.orig_now)
 
+        # The key's expiration data in the other worker may depend on earlier operations that were not sent to us,
+        # e.g. an .expire that was superseded by this .set, which is why we use what it actually is there.
+        # Messages from workers that do not send it yet are applied as they are.
+        entry_expiry = data.get('entry_expiry')
+
+        if entry_expiry is not None:
+            self.impl.set_expiration_data(data.key, entry_expiry, data.expires_at, False)
+
     def sync_after_set_by_prefix(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_by_prefix operation in another worker process.
         """
@@ -800,11 +834,25 @@ class Cache:
 
 # ################################################################################################################################
 
-    def sync_after_clear(self):
+    def sync_after_clear(self, data=None):
         """ Invoked by Cache API to synchronizes this worker's cache after a .clear operation in another worker process.
         """
         self.impl.clear()
 
+# ################################################################################################################################
+
+    def sync_batch(self, data_list, _sync_func=broker_msg_to_sync_func):
+        """ Invoked by Cache API to apply, in the order they were made, state changes that another worker process
+        sent in a single batch. The lock is held throughout so that no other greenlet sees the batch half-applied.
+        """
+        with self.impl._lock:
+            for data in data_list:
+                try:
+                    getattr(self, _sync_func[data.action])(data)
+                except Exception:
+                    logger.warning('Could not apply a state change to cache `%s`, data:`%s`, e:`%s`',
+                        self.config.name, data, format_exc())
+
 # ################################################################################################################################
 
 class _NotConfiguredAPI:
@@ -829,6 +877,13 @@ class CacheAPI:
         self.builtin = self.caches[CACHE.TYPE.BUILTIN]
         self.memcached = self.caches[CACHE.TYPE.MEMCACHED]
 
+        # State changes of built-in caches waiting to be sent to other workers, in the order they were made
+        self.sync_batch_interval = CACHE.DEFAULT.SYNC_BATCH_INTERVAL
+        self.sync_batch_max_size = CACHE.DEFAULT.SYNC_BATCH_MAX_SIZE
+        self._sync_batch = {}
+        self._sync_batch_seq = 0
+        self._sync_batch_flush_scheduled = False
+
     def _maybe_set_default(self, config, cache):
         if config.is_default:
             self.default = cache
@@ -863,11 +918,76 @@ class CacheAPI:
             else:
                 data['is_value_pickled'] = False
 
-            self.server.broker_client.publish(data)
+            self._add_to_sync_batch(op, cache_name, data)
         except Exception:
             logger.warning('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
                 op, cache_name, data, format_exc())
 
+# ################################################################################################################################
+
+    def _add_to_sync_batch(self, op, cache_name, data, _key_state_ops=_key_state_ops, _EXPIRE=CACHE.STATE_CHANGED.EXPIRE,
+        _CLEAR=CACHE.STATE_CHANGED.CLEAR):
+        """ Buffers a state change until the next batch is sent, collapsing it with earlier changes it makes redundant.
+        """
+        batch = self._sync_batch
+
+        # A .set or .delete of a key supersedes anything done to that key earlier, including expiring it,
+        # because a .set carries the expiration data that the key has after both operations ..
+        if op in _key_state_ops:
+            batch_key = (cache_name, data['key'])
+            batch.pop(batch_key, None)
+            batch.pop((cache_name, data['key'], _EXPIRE), None)
+
+        # .. a key's new expiration time supersedes any earlier one ..
+        elif op == _EXPIRE:
+            batch_key = (cache_name, data['key'], _EXPIRE)
+            batch.pop(batch_key, None)
+
+        # .. other operations are sent as they are, though a .clear means that nothing sent earlier to this cache matters ..
+        else:
+            if op == _CLEAR:
+                for item_key in [item_key for item_key, item in batch.items() if item['cache_name'] == cache_name]:
+                    del batch[item_key]
+
+            self._sync_batch_seq += 1
+            batch_key = self._sync_batch_seq
+
+        # .. re-adding a key always puts it at the end, which preserves the order of changes that are still in the batch.
+        batch[batch_key] = data
+
+        if len(batch) >= self.sync_batch_max_size:
+            self._flush_sync_batch()
+
+        elif not self._sync_batch_flush_scheduled:
+            self._sync_batch_flush_scheduled = True
+            spawn_later(self.sync_batch_interval, self._on_sync_batch_interval)
+
+# ################################################################################################################################
+
+    def _on_sync_batch_interval(self):
+        self._sync_batch_flush_scheduled = False
+        self._flush_sync_batch()
+
+# ################################################################################################################################
+
+    def _flush_sync_batch(self, _action=CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value):
+        """ Sends all the buffered state changes to other workers in a single message.
+        """
+        if not self._sync_batch:
+            return
+
+        data_list = list(self._sync_batch.values())
+        self._sync_batch = {}
+
+        try:
+            self.server.broker_client.publish({
+                'action': _action,
+                'source_worker_id': self.server.worker_id,
+                'data_list': data_list,
+            })
+        except Exception:
+            logger.warning('Could not send a batch of %d cache state changes, e:`%s`', len(data_list), format_exc())
+
 # ################################################################################################################################
 
     def _create_builtin(self, config):
@@ -997,6 +1117,20 @@ class CacheAPI:
         """
         return len(self.caches[cache_type][name])
 
+# ################################################################################################################################
+
+    def get_bytes(self, name):
+        """ Returns approximately how many bytes are used by the entries of a given built-in cache.
+        """
+        return self.caches[CACHE.TYPE.BUILTIN][name].impl.current_bytes
+
+# ################################################################################################################################
+
+    def get_stats(self, name):
+        """ Returns statistics of a given built-in cache.
+        """
+        return self.caches[CACHE.TYPE.BUILTIN][name].get_stats()
+
 # ################################################################################################################################
 
     def sync_after_set(self, cache_type, data):
@@ -1130,4 +1264,28 @@ class CacheAPI:
         """
         self.caches[cache_type][data.cache_name].sync_after_clear()
 
+# ################################################################################################################################
+
+    def sync_batch(self, cache_type, data_list):
+        """ Synchronizes the state of this worker's caches after a batch of operations in another worker process.
+        """
+        by_cache = {}
+
+        for data in data_list:
+            by_cache.setdefault(data.cache_name, []).append(data)
+
+        caches = self.caches[cache_type]
+
+        for cache_name, cache_data_list in by_cache.items():
+
+            # The cache may have been deleted in this worker in the meantime, which must not stop other caches from syncing
+            cache = caches.get(cache_name)
+
+            if cache is None:
+                logger.warning('Skipping sync batch of %d state change(s) to unknown cache `%s` (%s)',
+                    len(cache_data_list), cache_name, cache_type)
+                continue
+
+            cache.sync_batch(cache_data_list)
+
 # ################################################################################################################################
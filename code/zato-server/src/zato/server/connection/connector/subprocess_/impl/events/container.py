@@ -11,8 +11,11 @@ from datetime import datetime
 from logging import getLogger
 from traceback import format_exc
 
+# gevent
+from gevent import spawn
+
 # Zato
-from zato.common.events.common import Action
+from zato.common.events.common import Action, batch_header, decode_batch
 from zato.common.util.json_ import JSONParser
 from zato.common.util.tcp import ZatoStreamServer
 from zato.server.connection.connector.subprocess_.base import BaseConnectionContainer
@@ -23,8 +26,10 @@ from zato.server.connection.connector.subprocess_.impl.events.database import Ev
 
 if 0:
     from bunch import Bunch
+    from io import BufferedReader
     from socket import socket
 
+    BufferedReader = BufferedReader
     Bunch = Bunch
     socket = socket
 
@@ -66,6 +71,7 @@ class EventsConnectionContainer(BaseConnectionContainer):
         self._action_map = {
             Action.Ping: self._on_event_ping,
             Action.Push: self._on_event_push,
+            Action.PushBatch: self._on_event_push_batch,
             Action.GetTable: self._on_event_get_table,
         }
 
@@ -89,6 +95,9 @@ class EventsConnectionContainer(BaseConnectionContainer):
 
             self.events_db = EventsDatabase(logger, fs_data_path, sync_threshold, sync_interval)
 
+            # Compact partitions in background
+            _ = spawn(self.events_db.run)
+
         except Exception:
             logger.warning('Exception in post_init -> `%s`', format_exc())
 
@@ -106,11 +115,25 @@ class EventsConnectionContainer(BaseConnectionContainer):
 
         # We received JSON bytes so we now need to load a Python object out of it ..
         data = self._json_parser.parse(data)
-        data = data.as_dict() # type: dict
+
+        # .. which will be already a dict unless the parser is SIMDJSON ..
+        if not isinstance(data, dict):
+            data = data.as_dict() # type: dict
 
         # .. now, we can push it to the database.
         self.events_db.access_state(_opcode, data)
 
+# ################################################################################################################################
+
+    def _on_event_push_batch(self, data, ignored_address_str, _opcode=OpCode.PushBatch):
+        # type: (bytes, str, str) -> None
+
+        # Decode all the events at once ..
+        events = decode_batch(data)
+
+        # .. and push them to the database together.
+        self.events_db.access_state(_opcode, events, len(events))
+
 # ################################################################################################################################
 
     def _on_event_get_table(self, ignored_address_str, _opcode=OpCode.Tabulate):
@@ -118,6 +141,23 @@ class EventsConnectionContainer(BaseConnectionContainer):
         data = self.events_db.get_table()
         return Action.GetTableReply + data.to_json().encode('utf8')
 
+# ################################################################################################################################
+
+    def _read_batch(self, socket_file):
+        """ Reads a batch of events, returning an empty string if the client disconnected before the whole batch was read.
+        """
+        # type: (BufferedReader) -> bytes
+
+        header = socket_file.read(batch_header.size)
+
+        if len(header) < batch_header.size:
+            return b''
+
+        data_len, _ = batch_header.unpack(header)
+        data = socket_file.read(data_len)
+
+        return data if len(data) == data_len else b''
+
 # ################################################################################################################################
 
     def _on_new_connection(self, socket, address):
@@ -137,17 +177,14 @@ class EventsConnectionContainer(BaseConnectionContainer):
             # Keep running until explicitly requested not to
             while self.keep_running:
 
-                # We work on a line-by-line basis
-                line = socket_file.readline()
+                # Each message begins with its action ..
+                action = socket_file.read(Action.LenAction)
 
                 # No input = client is no longer connected
-                if not line:
+                if not action:
                     logger.info('Stream client disconnected (%s)', address_str)
                     break
 
-                # Extract the action sent ..
-                action = line[:2]
-
                 # .. find the handler function ..
                 func = self._action_map.get(action)
 
@@ -156,8 +193,21 @@ class EventsConnectionContainer(BaseConnectionContainer):
                     logger.warning('No handler for `%r` found. Disconnecting stream client (%s)', action, address_str)
                     break
 
+                # .. batches of events are binary so they begin with their length ..
+                if action == Action.PushBatch:
+                    data = self._read_batch(socket_file)
+
+                # .. while other actions are on a line-by-line basis ..
+                else:
+                    data = socket_file.readline()
+
+                # .. either way, there is no data if the client disconnected ..
+                if not data:
+                    logger.info('Stream client disconnected (%s)', address_str)
+                    break
+
                 # .. otherwise, handle the action ..
-                data = line[2:]
+                response = None
 
                 try:
                     response = func(data, address_str) # type: str
@@ -9,15 +9,23 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 # stdlib
 import os
 from datetime import datetime, timedelta
+from shutil import rmtree
+from traceback import format_exc
 from typing import Optional as optional
+from uuid import uuid4
+
+# gevent
+from gevent import sleep
 
 # Humanize
 from humanize import intcomma as int_to_comma
 
 # Zato
 from zato.common.api import Stats
+from zato.common.events.common import Default as EventsDefault
 from zato.common.ext.dataclasses import dataclass
 from zato.common.in_ram import InRAMStore
+from zato.server.connection.connector.subprocess_.impl.events.rollup import Rollups
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -34,12 +42,47 @@ if 0:
 
 utcnow = datetime.utcnow
 
+# Events are stored in partitions, one per hour, each in a directory named after the hour it begins at, e.g. 2056-01-02T03
+partition_freq = 'H'
+partition_length = timedelta(hours=1)
+partition_name_format = '%Y-%m-%dT%H'
+
+# Each partition consists of files, each one written by a single sync or compaction, e.g. 20560102T030405123456-1a2b3c4d.parquet
+file_name_time_format = '%Y%m%dT%H%M%S%f'
+parquet_suffix = '.parquet'
+tmp_suffix = '.tmp'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_codes_dtype(num_values):
+    # type: (int) -> str
+
+    # Pandas keeps codes of categoricals in the smallest integer type that can hold them, so if our arrays
+    # use the same type, pandas can use them as they are.
+    if num_values < 127:
+        return 'int8'
+    elif num_values < 32767:
+        return 'int16'
+    else:
+        return 'int32'
+
+# ################################################################################################################################
+
+def drop_unused_categories(data):
+    # type: (DataFrame) -> DataFrame
+
+    # Categoricals keep all of their values even if no rows use them anymore, e.g. after the rows were filtered,
+    # and grouping by such values would return empty groups.
+    return data.assign(**{name: data[name].cat.remove_unused_categories() for name in data.select_dtypes('category')})
+
 # ################################################################################################################################
 # ################################################################################################################################
 
 class OpCode:
-    Push     = 'EventsDBPush'
-    Tabulate = 'EventsDBTabulate'
+    Push      = 'EventsDBPush'
+    PushBatch = 'EventsDBPushBatch'
+    Tabulate  = 'EventsDBTabulate'
 
     class Internal:
         SaveData    = 'InternalSaveData'
@@ -48,6 +91,7 @@ class OpCode:
         ReadParqet  = 'InternalReadParqet'
         CreateNewDF = 'InternalCreateNewDF'
         CombineData = 'InternalCombineData'
+        Compact     = 'InternalCompact'
 
 _op_int_save_data     = OpCode.Internal.SaveData
 _op_int_sync_state    = OpCode.Internal.SyncState
@@ -55,6 +99,7 @@ _op_int_get_from_ram  = OpCode.Internal.GetFromRAM
 _op_int_read_parqet   = OpCode.Internal.ReadParqet
 _op_int_create_new_df = OpCode.Internal.CreateNewDF
 _op_int_combine_data  = OpCode.Internal.CombineData
+_op_int_compact       = OpCode.Internal.Compact
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -173,9 +218,231 @@ class Event:
 # ################################################################################################################################
 # ################################################################################################################################
 
+class ColumnarEventBuffer:
+    """ Keeps events in preallocated numpy arrays, one per field, rather than as a list of individual objects.
+    Values that repeat across events, such as service names, are kept once each and arrays store only their codes.
+
+    Events pushed are first staged in a short list and then written to the arrays a chunk at a time, one column
+    at a time, which is much faster than writing each value of each event on its own. Arrays grow by doubling
+    when full, so each push takes constant time, and once events are turned into a DataFrame,
+    the DataFrame uses the arrays as they are, without copying them.
+    """
+
+    # Fields unique to each event
+    object_fields = ('id', 'cid')
+
+    # Fields whose values are numbers
+    int_fields = ('event_type', 'object_type', 'total_time_ms')
+
+    # Fields whose values repeat across events
+    encoded_fields = ('source_type', 'source_id', 'object_id', 'recipient_type', 'recipient_id')
+
+    # The same order that PushCtx has
+    column_order = ('id', 'cid', 'timestamp', 'event_type', 'source_type', 'source_id', 'object_type', 'object_id',
+        'recipient_type', 'recipient_id', 'total_time_ms')
+
+    # We never allocate more than that many rows up front, no matter how big the sync threshold is
+    max_initial_capacity = 100_000
+
+    # How many events to stage before they are written to the arrays
+    chunk_size = 1024
+
+    def __init__(self, capacity):
+        # type: (int) -> None
+
+        # How many events there is room for in the initial arrays
+        self.initial_capacity = max(1, min(capacity, self.max_initial_capacity))
+
+        # Maps each encoded field to a dict of its values to their codes
+        self.encodings = {name: {} for name in self.encoded_fields} # type: dict[str, dict]
+
+        # Events not written to the arrays yet
+        self.staged = [] # type: list[dict]
+
+        self._allocate(self.initial_capacity)
+
+# ################################################################################################################################
+
+    def _allocate(self, capacity):
+        # type: (int) -> None
+
+        # Numpy
+        import numpy as np
+
+        self.capacity = capacity
+        self.size = 0
+
+        self.columns = {'timestamp': np.empty(capacity, dtype='datetime64[ns]')} # type: dict
+
+        for name in self.object_fields:
+            self.columns[name] = np.empty(capacity, dtype=object)
+
+        for name in self.int_fields:
+            self.columns[name] = np.empty(capacity, dtype=np.int64)
+
+        for name in self.encoded_fields:
+            self.columns[name] = np.empty(capacity, dtype=get_codes_dtype(0))
+
+# ################################################################################################################################
+
+    def _grow(self):
+
+        # Numpy
+        import numpy as np
+
+        self.capacity *= 2
+
+        for name, column in self.columns.items():
+            new_column = np.empty(self.capacity, dtype=column.dtype)
+            new_column[:self.size] = column[:self.size]
+            self.columns[name] = new_column
+
+# ################################################################################################################################
+
+    def push(self, data):
+        # type: (dict) -> None
+
+        staged = self.staged
+        staged.append(data)
+
+        if len(staged) == self.chunk_size:
+            self.flush()
+
+# ################################################################################################################################
+
+    def push_batch(self, data):
+        # type: (list) -> None
+
+        staged = self.staged
+        staged.extend(data)
+
+        if len(staged) >= self.chunk_size:
+            self.flush()
+
+# ################################################################################################################################
+
+    def flush(self):
+        """ Writes all the staged events to the arrays.
+        """
+        staged = self.staged
+
+        if not staged:
+            return
+
+        while self.size + len(staged) > self.capacity:
+            self._grow()
+
+        start = self.size
+        end = start + len(staged)
+        columns = self.columns
+
+        # Timestamps may be given as ISO strings or datetime objects ..
+        timestamps = [item.get('timestamp') for item in staged]
+
+        try:
+            columns['timestamp'][start:end] = timestamps
+        except ValueError:
+
+            # .. and if any of them is invalid, we will store it as NaT.
+            for idx, value in enumerate(timestamps, start):
+                try:
+                    columns['timestamp'][idx] = value
+                except ValueError:
+                    columns['timestamp'][idx] = None
+
+        # These are stored as they are ..
+        for name in self.object_fields:
+            columns[name][start:end] = [item.get(name) for item in staged]
+
+        # .. numbers that are not given are stored as zeros ..
+        for name in self.int_fields:
+            columns[name][start:end] = [item.get(name) or 0 for item in staged]
+
+        # .. and values that are not given in encoded fields have no code.
+        for name in self.encoded_fields:
+
+            encoding = self.encodings[name]
+            codes = []
+
+            for item in staged:
+                value = item.get(name)
+                if value is None:
+                    codes.append(-1)
+                else:
+                    code = encoding.get(value)
+                    if code is None:
+                        code = encoding[value] = len(encoding)
+                    codes.append(code)
+
+            # New values may require a bigger type for codes
+            codes_dtype = get_codes_dtype(len(encoding))
+            if columns[name].dtype != codes_dtype:
+                columns[name] = columns[name].astype(codes_dtype)
+
+            columns[name][start:end] = codes
+
+        self.size = end
+        staged.clear()
+
+# ################################################################################################################################
+
+    def to_dataframe(self):
+        # type: () -> DataFrame
+
+        # Pandas
+        import pandas as pd
+
+        self.flush()
+
+        size = self.size
+        data = {}
+
+        for name in self.column_order:
+
+            # Each column is a view of an array rather than a copy of it ..
+            column = self.columns[name][:size]
+
+            # .. and encoded ones become categoricals, with their codes as they are.
+            if name in self.encodings:
+                column = pd.Categorical.from_codes(column, categories=list(self.encodings[name]))
+
+            data[name] = column
+
+        return pd.DataFrame(data, copy=False)
+
+# ################################################################################################################################
+
+    def clear(self):
+
+        # Previously returned DataFrames may still use the current arrays, so we allocate new ones instead of reusing them
+        self._allocate(self.initial_capacity)
+        self.staged.clear()
+
+        for encoding in self.encodings.values():
+            encoding.clear()
+
+# ################################################################################################################################
+
+    def __len__(self):
+        return self.size + len(self.staged)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class EventsDatabase(InRAMStore):
 
-    def __init__(self, logger, fs_data_path, sync_threshold, sync_interval, max_retention=Stats.MaxRetention):
+    def __init__(
+        self,
+        logger,
+        fs_data_path,
+        sync_threshold,
+        sync_interval,
+        max_retention=Stats.MaxRetention,
+        compact_min_files=EventsDefault.compact_min_files,
+        compact_interval=EventsDefault.compact_interval,
+        rollup_minute_retention=EventsDefault.rollup_minute_retention,
+        rollup_hour_retention=EventsDefault.rollup_hour_retention,
+    ):
         super().__init__(sync_threshold, sync_interval)
 
         # Numpy
@@ -187,7 +454,7 @@ class EventsDatabase(InRAMStore):
         # Our self.logger object
         self.logger = logger
 
-        # Top-level directory to keep persistent data in
+        # Top-level directory to keep persistent data in, with a subdirectory for each partition
         self.fs_data_path = fs_data_path
 
         # Aggregated usage data is kept here
@@ -197,13 +464,26 @@ class EventsDatabase(InRAMStore):
         self.fs_response_time_path = os.path.join(self.fs_data_path, 'response-time')
 
         # In-RAM database of events, saved to disk periodically in background
-        self.in_ram_store = [] # type: list[Event]
+        self.in_ram_store = ColumnarEventBuffer(sync_threshold)
 
         # Fow how long to keep statistics in persistent storage
         self.max_retention = max_retention # type: int
 
+        # Partitions with at least that many files will be compacted into one file ..
+        self.compact_min_files = compact_min_files # type: int
+
+        # .. which is checked once in that many seconds.
+        self.compact_interval = compact_interval # type: int
+
+        # Background compaction runs until this is False
+        self.keep_running = True
+
+        # Statistics of each service, updated as events are synced, which is what tables are built from
+        self.rollups = Rollups(max_retention, rollup_minute_retention, rollup_hour_retention)
+
         # Configure our opcodes
         self.opcode_to_func[OpCode.Push] = self.push
+        self.opcode_to_func[OpCode.PushBatch] = self.push_batch
         self.opcode_to_func[OpCode.Tabulate] = self.get_table
 
         # Reusable Panda groupers
@@ -225,10 +505,17 @@ class EventsDatabase(InRAMStore):
         self.telemetry[_op_int_read_parqet]   = 0
         self.telemetry[_op_int_create_new_df] = 0
         self.telemetry[_op_int_combine_data]  = 0
+        self.telemetry[_op_int_compact]       = 0
 
         # Configure Panda objects
         self.set_up_group_by()
 
+        # Previous versions kept everything in one file
+        self.migrate_single_file()
+
+        # Statistics are kept in RAM only so they need to be built from what we already have in storage
+        self.rebuild_rollups()
+
 # ################################################################################################################################
 
     def set_up_group_by(self):
@@ -268,29 +555,90 @@ class EventsDatabase(InRAMStore):
 
     def push(self, data):
         # type: (dict) -> None
-        self.in_ram_store.append(data)
+        self.in_ram_store.push(data)
 
 # ################################################################################################################################
 
-    def load_data_from_storage(self):
-        """ Reads existing data from persistent storage and returns it as a DataFrame.
+    def push_batch(self, data):
+        # type: (list) -> None
+        self.in_ram_store.push_batch(data)
+
+# ################################################################################################################################
+
+    def get_partitions(self, start=None, end=None):
+        """ Returns the start time and path of each partition that may contain events from start to end, oldest first.
+        """
+        # type: (optional[datetime], optional[datetime]) -> list
+
+        out = []
+
+        if not os.path.isdir(self.fs_data_path):
+            return out
+
+        for name in sorted(os.listdir(self.fs_data_path)):
+
+            # Each partition's name is the time it begins at ..
+            try:
+                partition_start = datetime.strptime(name, partition_name_format)
+            except ValueError:
+                continue
+
+            # .. which lets us skip the ones that are outside of the time range requested.
+            if start and partition_start + partition_length <= start:
+                continue
+
+            if end and partition_start >= end:
+                continue
+
+            out.append((partition_start, os.path.join(self.fs_data_path, name)))
+
+        return out
+
+# ################################################################################################################################
+
+    def get_partition_files(self, path):
+        # type: (str) -> list
+
+        # Files that are still being written have a different suffix
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(parquet_suffix))
+
+# ################################################################################################################################
+
+    def load_data_from_storage(self, start=None, end=None):
+        """ Reads existing data from persistent storage and returns it as a DataFrame. Only the partitions
+        that may contain events from start to end are read.
         """
+        # type: (optional[datetime], optional[datetime]) -> DataFrame
 
         # Pandas
         import pandas as pd
 
         # Let's check if we already have anything in storage ..
-        if os.path.exists(self.fs_data_path):
+        partitions = self.get_partitions(start, end)
+        file_paths = [file_path for _, path in partitions for file_path in self.get_partition_files(path)]
+
+        if file_paths:
 
             #  Let the users know what we are doing ..
-            self.logger.info('Loading DF data from %s', self.fs_data_path)
+            self.logger.info('Loading DF data from %s (%s partitions, %s files)', self.fs_data_path, len(partitions),
+                len(file_paths))
 
             # .. load existing data from storage ..
-            start = utcnow()
-            existing = pd.read_parquet(self.fs_data_path) # type: pd.DataFrame
+            start_time = utcnow()
+            existing = self.combine_data([pd.read_parquet(file_path) for file_path in file_paths])
 
             # .. log the time it took to load the data ..
-            self.logger.info('DF data read in %s; len_existing=%s', utcnow() - start, int_to_comma(len(existing)))
+            self.logger.info('DF data read in %s; len_existing=%s', utcnow() - start_time, int_to_comma(len(existing)))
+
+            # .. partitions may contain events that are outside of the time range requested ..
+            if start:
+                existing = existing[existing['timestamp'] >= start]
+
+            if end:
+                existing = existing[existing['timestamp'] < end]
+
+            # .. or ones that are no longer retained ..
+            existing = self.trim(existing)
 
             # .. update counters ..
             self.telemetry[_op_int_read_parqet] += 1
@@ -313,15 +661,12 @@ class EventsDatabase(InRAMStore):
         """
         # type: () -> None
 
-        # Pandas
-        import pandas as pd
-
         #  Let the users know what we are doing ..
         self.logger.info('Building DF out of len_current=%s', int_to_comma(len(self.in_ram_store)))
 
         # .. convert the data collected so far into a DataFrame ..
         start = utcnow()
-        current = pd.DataFrame(self.in_ram_store)
+        current = self.in_ram_store.to_dataframe()
 
         # .. log the time it took build the DataFrame ..
         self.logger.info('DF built in %s', utcnow() - start)
@@ -357,20 +702,24 @@ class EventsDatabase(InRAMStore):
 
 # ################################################################################################################################
 
-    def combine_data(self, existing, current):
-        """ Combines on disk and in-RAM data.
+    def combine_data(self, data_list):
+        """ Combines data read from multiple files.
         """
-        # type: (DataFrame, DataFrame) -> DataFrame
+        # type: (list) -> DataFrame
 
         # Pandas
         import pandas as pd
 
+        # There is nothing to combine if there is only one DataFrame
+        if len(data_list) == 1:
+            return data_list[0]
+
         # Let the user know what we are doing ..
-        self.logger.info('Combining existing and current data')
+        self.logger.info('Combining data from %s files', len(data_list))
 
-        # .. combine the existing and current data ..
+        # .. combine the data ..
         start = utcnow()
-        combined = pd.concat([existing, current])
+        combined = pd.concat(data_list)
 
         # .. log the time it took to combine the DataFrames..
         self.logger.info('DF combined in %s', utcnow() - start)
@@ -388,25 +737,74 @@ class EventsDatabase(InRAMStore):
 
             # Check how many of the past events to leave, i.e. events older than this will be discarded
             max_retained = utcnow() - timedelta(milliseconds=self.max_retention)
-            max_retained = max_retained.isoformat()
 
             # .. construct a new dataframe, containing only the events that are younger than max_retained ..
             data = data[data['timestamp'] > max_retained]
 
+            # .. and make sure that values of the events discarded are not kept in encoded columns.
+            data = drop_unused_categories(data)
+
         # .. and return it to our caller.
         return data
 
 # ################################################################################################################################
 
-    def save_data(self, data):
-        # type: (DataFrame) -> None
+    def drop_expired_partitions(self, utcnow=utcnow, timedelta=timedelta):
+        """ Deletes partitions all of whose events are older than the retention time.
+        """
+        max_retained = utcnow() - timedelta(milliseconds=self.max_retention)
+
+        for partition_start, path in self.get_partitions(end=max_retained - partition_length):
+            self.logger.info('Deleting expired partition %s', path)
+            rmtree(path, ignore_errors=True)
+
+# ################################################################################################################################
+
+    def write_file(self, path, data):
+        """ Writes data to a new file in a partition's directory. The file is renamed to its final name only once
+        it has been written in full, which is why readers never see partial files.
+        """
+        # type: (str, DataFrame) -> str
+
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+
+        file_name = '{}-{}{}'.format(utcnow().strftime(file_name_time_format), uuid4().hex[:8], parquet_suffix)
+        file_path = os.path.join(path, file_name)
+        tmp_file_path = file_path + tmp_suffix
+
+        data.to_parquet(tmp_file_path)
+        os.replace(tmp_file_path, file_path)
+
+        return file_path
+
+# ################################################################################################################################
+
+    def save_data(self, data, fs_data_path=None):
+        """ Writes new events to the partitions they belong to, each partition getting a new file. Files already
+        in storage are never read or rewritten here, which is why the time this takes depends only on how many
+        new events there are.
+        """
+        # type: (DataFrame, optional[str]) -> None
+
+        fs_data_path = fs_data_path or self.fs_data_path
+
+        # Events without timestamps cannot belong to any partition
+        data = data[data['timestamp'].notna()]
+
+        if not len(data):
+            return
 
         # Let the user know what we are doing ..
-        self.logger.info('Saving DF to %s', self.fs_data_path)
+        self.logger.info('Saving DF to %s', fs_data_path)
 
-        # .. save the DF to persistent storage ..
+        # .. save each partition's part of the DF to persistent storage ..
         start = utcnow()
-        data.to_parquet(self.fs_data_path)
+        partition_starts = data['timestamp'].dt.floor(partition_freq)
+
+        for partition_start, partition_data in data.groupby(partition_starts, sort=False):
+            path = os.path.join(fs_data_path, partition_start.strftime(partition_name_format))
+            self.write_file(path, drop_unused_categories(partition_data))
 
         # .. log the time it took to save to storage ..
         self.logger.info('DF saved in %s', utcnow() - start)
@@ -414,6 +812,81 @@ class EventsDatabase(InRAMStore):
         # .. update counters ..
         self.telemetry[_op_int_save_data] += 1
 
+# ################################################################################################################################
+
+    def migrate_single_file(self):
+        """ Previous versions kept all the events in a single file and this converts it into partitions.
+        """
+        # Pandas
+        import pandas as pd
+
+        migration_path = self.fs_data_path + '.migration'
+
+        # We may have been stopped after the file was deleted but before the partitions were moved to their final place
+        if os.path.isdir(migration_path) and not os.path.exists(self.fs_data_path):
+            os.rename(migration_path, self.fs_data_path)
+            return
+
+        if not os.path.isfile(self.fs_data_path):
+            return
+
+        self.logger.info('Converting %s to partitions', self.fs_data_path)
+
+        # Timestamps were saved as strings by previous versions
+        data = pd.read_parquet(self.fs_data_path)
+        data['timestamp'] = pd.to_datetime(data['timestamp'])
+
+        # Write all the partitions first ..
+        rmtree(migration_path, ignore_errors=True)
+        self.save_data(data, migration_path)
+
+        # .. and only then replace the file with them.
+        os.remove(self.fs_data_path)
+
+        if os.path.isdir(migration_path):
+            os.rename(migration_path, self.fs_data_path)
+
+# ################################################################################################################################
+
+    def compact(self):
+        """ Merges all the files of each partition that has at least compact_min_files of them into one,
+        dropping events that are no longer retained.
+        """
+        # type: () -> int
+
+        # Pandas
+        import pandas as pd
+
+        compacted = 0
+
+        for _, path in self.get_partitions():
+
+            # Readers must not see both the merged file and the files it was merged from
+            with self.update_lock:
+
+                file_paths = self.get_partition_files(path)
+
+                if len(file_paths) < self.compact_min_files:
+                    continue
+
+                start = utcnow()
+
+                data = self.combine_data([pd.read_parquet(file_path) for file_path in file_paths])
+                data = self.trim(data)
+
+                if len(data):
+                    _ = self.write_file(path, data)
+
+                for file_path in file_paths:
+                    os.remove(file_path)
+
+                self.logger.info('Compacted %s files of %s in %s', len(file_paths), path, utcnow() - start)
+
+                compacted += 1
+                self.telemetry[_op_int_compact] += 1
+
+        return compacted
+
 # ################################################################################################################################
 
     def _sync_state(self, _utcnow=utcnow):
@@ -426,23 +899,23 @@ class EventsDatabase(InRAMStore):
         self.logger.info('*********************** DataFrame (DF) Sync storage ***************************** ')
         self.logger.info('********************************************************************************* ')
 
-        # Get the existing data from storage
-        existing = self.load_data_from_storage()
-
         # Get data that is currently in RAM
         current = self.get_data_from_ram()
 
-        # Combine data from storage and RAM
-        combined = self.combine_data(existing, current)
-
         # Trim the data to the retention threshold
-        trimmed = self.trim(combined)
+        trimmed = self.trim(current)
 
-        # Save the combined result to storage
+        # Save the new data to storage
         self.save_data(trimmed)
 
+        # Add the new data to statistics
+        self.rollups.add(trimmed)
+
+        # Delete partitions that are no longer retained
+        self.drop_expired_partitions()
+
         # Clear our current dataset
-        self.in_ram_store[:] = []
+        self.in_ram_store.clear()
 
         # Log the total processing time
         self.logger.info('DF total processing time %s', utcnow() - now_total)
@@ -458,34 +931,61 @@ class EventsDatabase(InRAMStore):
 
 # ################################################################################################################################
 
-    def get_table(self):
+    def rebuild_rollups(self):
+        """ Adds all the events from persistent storage to statistics, one partition at a time.
+        """
+        # Pandas
+        import pandas as pd
+
+        start = utcnow()
+
+        for _, path in self.get_partitions():
+
+            file_paths = self.get_partition_files(path)
+
+            if file_paths:
+                data = self.combine_data([pd.read_parquet(file_path) for file_path in file_paths])
+                self.rollups.add(self.trim(data))
 
-        # Prepare configuration ..
-        group_by = self.group_by[Stats.TabulateAggr]
+        self.logger.info('Statistics built in %s', utcnow() - start)
 
+# ################################################################################################################################
+
+    def get_table(self, start=None, end=None):
+        """ Returns statistics of each service from start to end. These are read from pre-aggregated statistics
+        rather than computed out of individual events, which is why start and end are aligned to minutes,
+        hours or days, depending on how long ago they were.
+        """
         with self.update_lock:
 
-            # .. make sure we have access to the latest data ..
+            # Make sure we have access to the latest data ..
             self._sync_state()
 
-            # .. read our input data from persistent storage ..
-            data = self.load_data_from_storage()
+            # .. and return its statistics.
+            return self.rollups.get_table(start, end)
 
-        # .. tabulate all the statistics found ..
-        tabulated = data.\
-            groupby(group_by).\
-            agg(**self.agg_by)
-
-        # .. convert rows to columns which is what our callers expect ..
-        tabulated = tabulated.transpose()
+# ################################################################################################################################
 
-        # .. finally, return the result.
-        return tabulated
+    def get_quantiles(self, quantiles, start=None, end=None):
+        """ Returns estimates of quantiles of response times of each service from start to end, e.g. 0.5 and 0.99.
+        """
+        with self.update_lock:
+            self._sync_state()
+            return self.rollups.get_quantiles(quantiles, start, end)
 
 # ################################################################################################################################
 
     def run(self):
-        pass
+        """ Compacts partitions in background until told to stop.
+        """
+        while self.keep_running:
+
+            sleep(self.compact_interval)
+
+            try:
+                _ = self.compact()
+            except Exception:
+                self.logger.warning('Exception while compacting partitions -> `%s`', format_exc())
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -0,0 +1,621 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from datetime import datetime
+from math import log
+from typing import Optional as optional
+
+# Zato
+from zato.common.api import Stats
+from zato.common.events.common import Default as EventsDefault
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from pandas import DataFrame
+
+    DataFrame = DataFrame
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+utcnow = datetime.utcnow
+
+# Tiers are keyed by buckets, each bucket being the number of minutes since the epoch that it begins at
+minutes_in_hour = 60
+minutes_in_day = 60 * 24
+
+# Used instead of start or end when there is none
+min_bucket = -(2 ** 60)
+max_bucket = 2 ** 60
+
+# Quantiles are estimated from counts of values in logarithmic bins, each bin being 1 + 2 * relative_accuracy wider
+# than the previous one. Any quantile estimated is then within relative_accuracy of the actual one and sketches
+# can be merged by adding their counts. Bin 0 is for zero and the last one is for all values of about 44 hours or more.
+sketch_relative_accuracy = 0.1
+sketch_gamma = (1 + sketch_relative_accuracy) / (1 - sketch_relative_accuracy)
+sketch_log_gamma = log(sketch_gamma)
+sketch_bins = 96
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def floor_to(value, size):
+    # type: (int, int) -> int
+    return value // size * size
+
+# ################################################################################################################################
+
+def ceil_to(value, size):
+    # type: (int, int) -> int
+    return -(-value // size) * size
+
+# ################################################################################################################################
+
+def to_minutes(value):
+    # type: (datetime) -> int
+
+    # Numpy
+    import numpy as np
+
+    return int(np.datetime64(value, 'm').astype(np.int64))
+
+# ################################################################################################################################
+
+def get_sketch_bins(values):
+    """ Returns the index of the sketch bin each value belongs to.
+    """
+    # Numpy
+    import numpy as np
+
+    out = np.zeros(len(values), dtype=np.int64)
+    is_positive = values > 0
+
+    # Each bin is for values greater than gamma ** (idx - 2) up to and including gamma ** (idx - 1)
+    positive = np.ceil(np.log(values[is_positive]) / sketch_log_gamma).astype(np.int64) + 1
+    out[is_positive] = np.clip(positive, 1, sketch_bins - 1)
+
+    return out
+
+# ################################################################################################################################
+
+def get_sketch_value(bin_idx):
+    """ Returns the value that all the values in a sketch bin are estimated as.
+    """
+    # type: (int) -> float
+    if bin_idx == 0:
+        return 0.0
+    else:
+        return 2 * sketch_gamma ** (bin_idx - 1) / (sketch_gamma + 1)
+
+# ################################################################################################################################
+
+def group_by_key(buckets, object_codes):
+    """ Sorts rows by their buckets and objects, returning the order of rows along with where each group begins.
+    """
+    # Numpy
+    import numpy as np
+
+    order = np.lexsort((object_codes, buckets))
+
+    sorted_buckets = buckets[order]
+    sorted_object_codes = object_codes[order]
+
+    is_start = np.empty(len(order), dtype=bool)
+    is_start[:1] = True
+    is_start[1:] = (sorted_buckets[1:] != sorted_buckets[:-1]) | (sorted_object_codes[1:] != sorted_object_codes[:-1])
+
+    starts = np.flatnonzero(is_start)
+
+    return order, starts, sorted_buckets[starts], sorted_object_codes[starts]
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Aggregates:
+    """ Statistics of groups of events, one group per bucket and object. Each attribute is an array with one element
+    per group, apart from sketch which has one row of bins per group, or is None if sketches were not needed.
+    """
+    __slots__ = 'bucket', 'object_code', 'count', 'usage', 'total', 'min', 'max', 'sketch'
+
+    def __init__(self, bucket, object_code, count, usage, total, min, max, sketch):
+        self.bucket = bucket
+        self.object_code = object_code
+        self.count = count # How many events there were
+        self.usage = usage # How many of them took more than 0 ms
+        self.total = total # How many ms all of them took
+        self.min = min
+        self.max = max
+        self.sketch = sketch
+
+    def __len__(self):
+        return len(self.bucket)
+
+# ################################################################################################################################
+
+    @staticmethod
+    def from_events(buckets, object_codes, values):
+        """ Aggregates individual events.
+        """
+        # Numpy
+        import numpy as np
+
+        order, starts, bucket, object_code = group_by_key(buckets, object_codes)
+        values = values[order]
+
+        count = np.diff(np.append(starts, len(values)))
+        usage = np.add.reduceat((values != 0).astype(np.int64), starts)
+        total = np.add.reduceat(values, starts)
+        min_ = np.minimum.reduceat(values, starts)
+        max_ = np.maximum.reduceat(values, starts)
+
+        # Each event adds one to the bin of its value in its group's sketch
+        group_idx = np.repeat(np.arange(len(starts)), count)
+        sketch = np.bincount(group_idx * sketch_bins + get_sketch_bins(values), minlength=len(starts) * sketch_bins)
+        sketch = sketch.reshape(len(starts), sketch_bins).astype(np.uint32)
+
+        return Aggregates(bucket, object_code, count, usage, total, min_, max_, sketch)
+
+# ################################################################################################################################
+
+    def merge(self, buckets):
+        """ Merges groups that are in the same buckets, e.g. minutes of the same hour.
+        """
+        # Numpy
+        import numpy as np
+
+        order, starts, bucket, object_code = group_by_key(buckets, self.object_code)
+
+        return Aggregates(
+            bucket,
+            object_code,
+            np.add.reduceat(self.count[order], starts),
+            np.add.reduceat(self.usage[order], starts),
+            np.add.reduceat(self.total[order], starts),
+            np.minimum.reduceat(self.min[order], starts),
+            np.maximum.reduceat(self.max[order], starts),
+            None if self.sketch is None else np.add.reduceat(self.sketch[order], starts, axis=0),
+        )
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RollupTier:
+    """ Aggregates of events in buckets of the same size, e.g. one bucket per minute, kept in arrays that grow
+    as new buckets are added, with an index of buckets and objects to rows of these arrays.
+    """
+    # Arrays of each tier, apart from sketches
+    columns = ('bucket', 'object_code', 'count', 'usage', 'total', 'min', 'max')
+
+    # How many rows there is room for initially
+    initial_capacity = 1024
+
+    def __init__(self, name, bucket_size, retention, cutoff_size, sketch_dtype='uint32'):
+        # type: (str, int, int, int, str) -> None
+
+        # E.g. minute
+        self.name = name
+
+        # In minutes
+        self.bucket_size = bucket_size
+
+        # In milliseconds, buckets older than that are deleted ..
+        self.retention = retention
+
+        # .. though only buckets of a coarser tier at a time, e.g. minutes of a whole hour.
+        self.cutoff_size = cutoff_size
+
+        # Coarser tiers may need more than 32 bits for counts of events in a bucket
+        self.sketch_dtype = sketch_dtype
+
+        # Maps buckets and codes of objects to rows in the arrays
+        self.index = {} # type: dict[tuple, int]
+
+        self._allocate(self.initial_capacity)
+
+# ################################################################################################################################
+
+    def _allocate(self, capacity):
+        # type: (int) -> None
+
+        # Numpy
+        import numpy as np
+
+        self.capacity = capacity
+        self.size = 0
+
+        for name in self.columns:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+
+        self.sketch = np.zeros((capacity, sketch_bins), dtype=self.sketch_dtype)
+
+# ################################################################################################################################
+
+    def _grow(self):
+
+        # Numpy
+        import numpy as np
+
+        self.capacity *= 2
+
+        for name in self.columns + ('sketch',):
+            column = getattr(self, name)
+            new_column = np.zeros((self.capacity,) + column.shape[1:], dtype=column.dtype)
+            new_column[:self.size] = column[:self.size]
+            setattr(self, name, new_column)
+
+# ################################################################################################################################
+
+    def __len__(self):
+        return self.size
+
+# ################################################################################################################################
+
+    def get_cutoff(self, now):
+        """ Returns the oldest bucket that is still retained.
+        """
+        # type: (int) -> int
+        return floor_to(now - self.retention // 60_000, self.cutoff_size)
+
+# ################################################################################################################################
+
+    def add(self, aggregates):
+        """ Merges new aggregates, already in buckets of this tier, into the ones that the tier already has.
+        """
+        # type: (Aggregates) -> None
+
+        # Numpy
+        import numpy as np
+
+        keys = list(zip(aggregates.bucket.tolist(), aggregates.object_code.tolist()))
+
+        # New events may belong to buckets that we already have ..
+        index_get = self.index.get
+        rows = np.fromiter((index_get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+
+        is_new = rows < 0
+        len_new = int(is_new.sum())
+
+        # .. or it may be the first time we have events from a given bucket and object.
+        if len_new:
+
+            while self.size + len_new > self.capacity:
+                self._grow()
+
+            new_rows = np.arange(self.size, self.size + len_new)
+            rows[is_new] = new_rows
+
+            self.index.update(zip([key for key, elem in zip(keys, is_new.tolist()) if elem], new_rows.tolist()))
+            self.size += len_new
+
+            # Rows may have been used by buckets that were deleted since then
+            self.bucket[new_rows] = aggregates.bucket[is_new]
+            self.object_code[new_rows] = aggregates.object_code[is_new]
+            self.count[new_rows] = self.usage[new_rows] = self.total[new_rows] = 0
+            self.min[new_rows] = np.iinfo(np.int64).max
+            self.max[new_rows] = np.iinfo(np.int64).min
+            self.sketch[new_rows] = 0
+
+        # Each row is given only once so it can be updated in one go
+        self.count[rows] += aggregates.count
+        self.usage[rows] += aggregates.usage
+        self.total[rows] += aggregates.total
+        self.min[rows] = np.minimum(self.min[rows], aggregates.min)
+        self.max[rows] = np.maximum(self.max[rows], aggregates.max)
+        self.sketch[rows] += aggregates.sketch.astype(self.sketch_dtype)
+
+# ################################################################################################################################
+
+    def expire(self, now):
+        """ Deletes buckets that are no longer retained.
+        """
+        # type: (int) -> None
+
+        if not self.size:
+            return
+
+        is_retained = self.bucket[:self.size] >= self.get_cutoff(now)
+
+        if is_retained.all():
+            return
+
+        size = int(is_retained.sum())
+
+        for name in self.columns + ('sketch',):
+            column = getattr(self, name)
+            column[:size] = column[:self.size][is_retained]
+
+        self.size = size
+        self.index = dict(zip(zip(self.bucket[:size].tolist(), self.object_code[:size].tolist()), range(size)))
+
+# ################################################################################################################################
+
+    def select(self, start, end, needs_sketch=True):
+        """ Returns aggregates of the buckets from start to end, without sketches unless they are needed.
+        """
+        # type: (int, int, bool) -> Aggregates
+
+        # Numpy
+        import numpy as np
+
+        bucket = self.bucket[:self.size]
+        rows = np.flatnonzero((bucket >= start) & (bucket < end))
+
+        sketch = self.sketch[rows] if needs_sketch else None
+
+        return Aggregates(*[getattr(self, name)[rows] for name in self.columns], sketch)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Rollups:
+    """ Maintains per-minute, per-hour and per-day statistics of each object, e.g. a service, as events arrive,
+    so that statistics can be returned without reading the events themselves.
+
+    Each minute is kept for minute_retention and each hour for hour_retention, after which only their days are left.
+    This is why time ranges are read with the precision of minutes only if they begin and end not earlier
+    than minute_retention ago, with the precision of hours if not earlier than hour_retention ago, and of days otherwise.
+    """
+    def __init__(
+        self,
+        max_retention=Stats.MaxRetention,
+        minute_retention=EventsDefault.rollup_minute_retention,
+        hour_retention=EventsDefault.rollup_hour_retention,
+    ):
+        # type: (int, int, int) -> None
+
+        # IDs of objects, e.g. names of services, are kept once each and tiers keep their codes only
+        self.object_ids = [] # type: list[str]
+        self.object_codes = {} # type: dict[str, int]
+
+        # From the finest to the coarsest tier
+        self.minute = RollupTier('minute', 1, minute_retention, minutes_in_hour)
+        self.hour = RollupTier('hour', minutes_in_hour, hour_retention, minutes_in_day)
+        self.day = RollupTier('day', minutes_in_day, max_retention, minutes_in_day, 'uint64')
+
+        self.tiers = (self.minute, self.hour, self.day)
+
+# ################################################################################################################################
+
+    def get_object_codes(self, object_ids):
+        """ Returns codes of objects, assigning new codes to objects that are new.
+        """
+        # Numpy
+        import numpy as np
+
+        # Pandas
+        import pandas as pd
+
+        codes, uniques = pd.factorize(object_ids)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int64)
+
+        for idx, object_id in enumerate(uniques):
+            code = self.object_codes.get(object_id)
+            if code is None:
+                code = self.object_codes[object_id] = len(self.object_ids)
+                self.object_ids.append(object_id)
+            mapping[idx] = code
+
+        # Events without an object are given -1
+        mapping[-1] = -1
+
+        return mapping[codes]
+
+# ################################################################################################################################
+
+    def add(self, data, now=None):
+        """ Adds events from a DataFrame to all the tiers.
+        """
+        # type: (DataFrame, optional[datetime]) -> None
+
+        # Numpy
+        import numpy as np
+
+        if not len(data):
+            return
+
+        minutes = data['timestamp'].values.astype('datetime64[m]').astype(np.int64)
+        object_codes = self.get_object_codes(data['object_id'])
+        values = data['total_time_ms'].values.astype(np.int64)
+
+        # Only events that have both a timestamp and an object can be aggregated
+        has_key = (object_codes >= 0) & data['timestamp'].notna().values
+
+        if not has_key.all():
+            minutes, object_codes, values = minutes[has_key], object_codes[has_key], values[has_key]
+
+            if not len(minutes):
+                return
+
+        # Events are aggregated once, by minute, and each coarser tier merges buckets of the previous one into its own
+        aggregates = Aggregates.from_events(minutes, object_codes, values)
+
+        for tier in self.tiers:
+            if tier.bucket_size > 1:
+                aggregates = aggregates.merge(floor_to(aggregates.bucket, tier.bucket_size))
+            tier.add(aggregates)
+
+        self.expire(now)
+
+# ################################################################################################################################
+
+    def expire(self, now=None):
+        # type: (optional[datetime]) -> None
+
+        now = to_minutes(now or utcnow())
+
+        for tier in self.tiers:
+            tier.expire(now)
+
+# ################################################################################################################################
+
+    def get_tier_at(self, bucket, now):
+        """ Returns the finest tier that has all the buckets from the one given onwards.
+        """
+        # type: (int, int) -> RollupTier
+
+        for tier, coarser in ((self.minute, self.hour), (self.hour, self.day)):
+            if floor_to(bucket, coarser.bucket_size) >= tier.get_cutoff(now):
+                return tier
+
+        return self.day
+
+# ################################################################################################################################
+
+    def get_ranges(self, start=None, end=None, now=None):
+        """ Returns a list of tiers and buckets from each of them that, together, cover the time from start to end.
+        Buckets of coarser tiers are used wherever possible, and start and end are aligned to the finest tier
+        that still has buckets for them.
+        """
+        # type: (optional[datetime], optional[datetime], optional[datetime]) -> list
+
+        now = to_minutes(now or utcnow())
+
+        if start is None:
+            start = min_bucket
+        else:
+            start = to_minutes(start)
+            start = floor_to(start, self.get_tier_at(start, now).bucket_size)
+
+        if end is None:
+            end = max_bucket
+        else:
+            end_minutes = to_minutes(end)
+
+            # End is exclusive and it may be in the middle of a minute
+            if end > datetime.utcfromtimestamp(end_minutes * 60):
+                end_minutes += 1
+
+            end = ceil_to(end_minutes, self.get_tier_at(end_minutes, now).bucket_size)
+
+        out = []
+        self._add_ranges(out, start, end, self.tiers[::-1])
+
+        return out
+
+# ################################################################################################################################
+
+    def _add_ranges(self, out, start, end, tiers):
+        # type: (list, int, int, tuple) -> None
+
+        if start >= end:
+            return
+
+        tier, finer_tiers = tiers[0], tiers[1:]
+
+        # Whole buckets of this tier that are between start and end ..
+        tier_start = ceil_to(start, tier.bucket_size)
+        tier_end = floor_to(end, tier.bucket_size)
+
+        if tier_start < tier_end:
+            out.append((tier, tier_start, tier_end))
+        else:
+            tier_start = tier_end = end
+
+        # .. and what is left before and after them is covered by finer tiers.
+        if finer_tiers:
+            self._add_ranges(out, start, tier_start, finer_tiers)
+            self._add_ranges(out, tier_end, end, finer_tiers)
+
+# ################################################################################################################################
+
+    def get_aggregates(self, start=None, end=None, now=None, needs_sketch=True):
+        """ Returns aggregates of each object from start to end.
+        """
+        # type: (optional[datetime], optional[datetime], optional[datetime], bool) -> Aggregates
+
+        # Numpy
+        import numpy as np
+
+        selected = [tier.select(tier_start, tier_end, needs_sketch) for tier, tier_start, tier_end in
+            self.get_ranges(start, end, now)]
+        selected = [elem for elem in selected if len(elem)]
+
+        if not selected:
+            return None
+
+        combined = Aggregates(*[np.concatenate([getattr(elem, name) for elem in selected]) if needs_sketch or name != 'sketch'
+            else None for name in Aggregates.__slots__])
+
+        # All the buckets are merged into one, which leaves one group per object
+        return combined.merge(np.zeros(len(combined), dtype=np.int64))
+
+# ################################################################################################################################
+
+    def get_table(self, start=None, end=None, now=None):
+        """ Returns the same statistics that EventsDatabase.get_table computes out of individual events,
+        with one column per object.
+        """
+        # type: (optional[datetime], optional[datetime], optional[datetime]) -> DataFrame
+
+        # Pandas
+        import pandas as pd
+
+        aggregates = self.get_aggregates(start, end, now, needs_sketch=False)
+
+        if aggregates is None:
+            return pd.DataFrame(index=['item_max', 'item_min', 'item_mean', 'item_total_time', 'item_total_usage'])
+
+        table = pd.DataFrame({
+            'item_max': aggregates.max,
+            'item_min': aggregates.min,
+            'item_mean': aggregates.total / aggregates.count,
+            'item_total_time': aggregates.total,
+            'item_total_usage': aggregates.usage,
+        }, index=pd.Index([self.object_ids[code] for code in aggregates.object_code], name=Stats.TabulateAggr))
+
+        # Rows are statistics and columns are objects, sorted by their IDs, which is what our callers expect
+        return table.sort_index().transpose()
+
+# ################################################################################################################################
+
+    def get_quantiles(self, quantiles, start=None, end=None, now=None):
+        """ Returns estimates of quantiles of how long events took, e.g. 0.5 and 0.99, with one column per object.
+        Each estimate is within sketch_relative_accuracy of the actual value.
+        """
+        # type: (list, optional[datetime], optional[datetime], optional[datetime]) -> DataFrame
+
+        # Numpy
+        import numpy as np
+
+        # Pandas
+        import pandas as pd
+
+        index = pd.Index(quantiles, name='quantile')
+        aggregates = self.get_aggregates(start, end, now)
+
+        if aggregates is None:
+            return pd.DataFrame(index=index)
+
+        out = {}
+
+        for idx, code in enumerate(aggregates.object_code):
+
+            cumulative = np.cumsum(aggregates.sketch[idx])
+            values = []
+
+            for quantile in quantiles:
+
+                # The same value that numpy.quantile returns with method='lower' ..
+                rank = int(quantile * (aggregates.count[idx] - 1))
+                bin_idx = int(np.searchsorted(cumulative, rank, side='right'))
+
+                # .. which cannot be lower than the minimum or greater than the maximum.
+                value = get_sketch_value(bin_idx)
+                value = min(max(value, aggregates.min[idx]), aggregates.max[idx])
+
+                values.append(value)
+
+            out[self.object_ids[code]] = values
+
+        return pd.DataFrame(out, index=index).sort_index(axis=1)
+
+# ################################################################################################################################
+# ################################################################################################################################
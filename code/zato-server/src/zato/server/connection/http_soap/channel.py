@@ -14,6 +14,7 @@ from hashlib import sha256
 from http.client import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
 from io import StringIO
 from traceback import format_exc
+from zlib import compressobj, MAX_WBITS, Z_SYNC_FLUSH
 
 # regex
 from regex import compile as regex_compile
@@ -116,6 +117,23 @@ response_404_log = 'URL not found `%s` (Method:%s; Accept:%s; CID:%s)'
 
 # ################################################################################################################################
 
+def gzip_chunks(chunks:'any_', _wbits:'int'=16 + MAX_WBITS) -> 'any_':
+    """ Compresses each of the input chunks into the same gzip stream, as they are produced.
+    """
+    compressor = compressobj(wbits=_wbits)
+
+    for chunk in chunks:
+
+        # Flushing each chunk means that callers receive data as soon as it is available ..
+        data = compressor.compress(chunk) + compressor.flush(Z_SYNC_FLUSH)
+        if data:
+            yield data
+
+    # .. and this finishes the gzip stream.
+    yield compressor.flush()
+
+# ################################################################################################################################
+
 def client_json_error(cid:'str', details:'any_') -> 'str':
 
     # This may be a tuple of arguments to an exception object
@@ -197,7 +215,8 @@ class RequestDispatcher:
         simple_io_config:'stranydict',
         return_tracebacks:'bool',
         default_error_message:'str',
-        http_methods_allowed:'strlist'
+        http_methods_allowed:'strlist',
+        stream_chunk_size:'int'=SIMPLE_IO.DEFAULT.STREAM_CHUNK_SIZE
     ) -> 'None':
 
         self.server = server
@@ -210,9 +229,53 @@ class RequestDispatcher:
         self.default_error_message = default_error_message
         self.http_methods_allowed = http_methods_allowed
 
+        # How many bytes of a streamed response are sent at a time
+        self.stream_chunk_size = stream_chunk_size
+
         # To reduce the number of attribute lookups
         self._sso_api_user = getattr(self.server, 'sso_api', None)
 
+# ################################################################################################################################
+
+    def _audit_stream(self, cid:'str', channel_item:'any_', chunks:'any_') -> 'any_':
+        """ Stores the beginning of a streamed response in the audit log, the remaining chunks are only passed through.
+        """
+        for idx, chunk in enumerate(chunks):
+
+            if idx == 0:
+
+                # Describe our event ..
+                data_event = DataSent()
+                data_event.type_ = ModuleCtx.Channel
+                data_event.object_id = channel_item['id']
+                data_event.data = chunk
+                data_event.timestamp = _utcnow()
+                data_event.msg_id = 'zrp{}'.format(cid) # This is a response to this CID
+                data_event.in_reply_to = cid
+
+                # .. and store it in the audit log.
+                self.server.audit_log.store_data_sent(data_event)
+
+            yield chunk
+
+# ################################################################################################################################
+
+    def _get_stream(self, cid:'str', response:'any_', channel_item:'any_', wsgi_environ:'stranydict') -> 'any_':
+        """ Returns a generator of chunks of a streamed response. Since there is no Content-Length header,
+        the response is sent using chunked transfer encoding. Note that an error while the chunks are being produced
+        can be only logged because the response's status and headers will have been already sent by then.
+        """
+        chunks = response.payload.iter_output(self.stream_chunk_size)
+
+        if channel_item.get('is_audit_log_sent_active'):
+            chunks = self._audit_stream(cid, channel_item, chunks)
+
+        if channel_item['content_encoding'] == 'gzip':
+            chunks = gzip_chunks(chunks)
+            wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
+
+        return chunks
+
 # ################################################################################################################################
 
     def dispatch(
@@ -347,6 +410,10 @@ class RequestDispatcher:
                 wsgi_environ['zato.http.response.headers'].update(response.headers)
                 wsgi_environ['zato.http.response.status'] = status_response[response.status_code]
 
+                # Lists of output elements may be streamed in chunks rather than serialised in full upfront
+                if isinstance(response.payload, CySimpleIOPayload) and response.payload.is_streaming():
+                    return self._get_stream(cid, response, channel_item, wsgi_environ)
+
                 if channel_item['content_encoding'] == 'gzip':
 
                     s = StringIO()
@@ -710,9 +777,11 @@ class RequestHandler:
             merge_channel_params=channel_item.merge_url_params_req,
             params_priority=channel_item.params_pri)
 
-        # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
+        # Cache the response if needed (cache_key was already created on return from get_response_from_cache),
+        # unless it is streamed, in which case it is never available in full.
         if channel_item['cache_type']:
-            self.set_response_in_cache(channel_item, cache_key, response)
+            if not (isinstance(response.payload, CySimpleIOPayload) and response.payload.is_streaming()):
+                self.set_response_in_cache(channel_item, cache_key, response)
 
         # Having used the cache or not, we can return the response now
         response
@@ -752,6 +821,11 @@ class RequestHandler:
 
                 response.payload = dumps(payload)
         else:
+
+            # Streamed responses are serialised only as they are being sent
+            if isinstance(response.payload, CySimpleIOPayload) and response.payload.is_streaming():
+                return
+
             if not isinstance(response.payload, str):
                 if isinstance(response.payload, dict) and data_format in ModuleCtx.Dict_Like:
                     response.payload = dumps(response.payload)
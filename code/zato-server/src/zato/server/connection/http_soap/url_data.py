@@ -83,7 +83,7 @@ class URLData(CyURLData, OAuthDataStore):
                  oauth_config=None, apikey_config=None, aws_config=None, \
                  tls_channel_sec_config=None, tls_key_cert_config=None, \
                  vault_conn_sec_config=None, kvdb=None, broker_client=None, odb=None, jwt_secret=None, vault_conn_api=None):
-        super(URLData, self).__init__(channel_data)
+        super(URLData, self).__init__(channel_data, worker.server.fs_server_config.misc.get('url_path_cache_max_size'))
 
         self.worker = worker # type: WorkerStore
         self.url_sec = url_sec
@@ -608,6 +608,7 @@ class URLData(CyURLData, OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             self.channel_data.pop(match_idx)
+            self.rebuild_routes()
 
 # ################################################################################################################################
 
@@ -1025,7 +1026,7 @@ class URLData(CyURLData, OAuthDataStore):
 
     def sort_channel_data(self):
         """ Sorts channel items by name and then re-arranges the result so that user-facing services are closer to the begining
-        of the list which makes it faster to look them up - searches in the list are O(n).
+        of the list. Channels are matched in that order whenever more than one could match a request.
         """
         channel_data = []
         user_services = []
@@ -1045,6 +1046,9 @@ class URLData(CyURLData, OAuthDataStore):
 
         self.channel_data[:] = channel_data
 
+        # Positions of channels have changed so routes to them need to be built anew
+        self.rebuild_routes()
+
 # ################################################################################################################################
 
     def _channel_item_from_msg(self, msg, match_target, old_data=None):
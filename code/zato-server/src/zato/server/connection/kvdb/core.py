@@ -26,7 +26,7 @@ from zato.common.util.json_ import json_loads
 # ################################################################################################################################
 
 if 0:
-    from zato.common.typing_ import any_, anylist, stranydict, strnone
+    from zato.common.typing_ import any_, anylist, anytuple, stranydict, strnone
     from zato.server.connection.kvdb.list_ import ListRepo
     from zato.server.connection.kvdb.number import NumberRepo
     from zato.server.connection.kvdb.object_ import ObjectRepo
@@ -43,6 +43,20 @@ logger = getLogger('zato')
 # ################################################################################################################################
 # ################################################################################################################################
 
+class WALOpCode:
+    """ Operations recorded in write-ahead logs. Each record describes a state that an operation resulted in
+    rather than the operation itself, e.g. a new value of a counter rather than the fact it was incremented,
+    which means that replaying a log on top of a snapshot of the state the log ends at results in the same state again.
+    """
+    Set    = 'set'
+    Update = 'update'
+    Delete = 'delete'
+    Clear  = 'clear'
+    Append = 'append'
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 @dataclass(init=False)
 class ObjectCtx:
 
@@ -85,6 +99,22 @@ class BaseRepo(InRAMStore):
         # Where we persist data on disk
         self.data_path = data_path
 
+        # If True, changes are appended to a write-ahead log, compacted into a snapshot in data_path from time to time,
+        # instead of the whole in-RAM store's being written out each time our state is synchronised.
+        self.use_wal = False
+
+        # Compact the log into a snapshot once it contains that many records
+        self.compact_threshold = ZatoKVDB.DefaultCompactThreshold
+
+        # Serialised records that have not been written to the log yet
+        self.wal_pending = [] # type: list[bytes]
+
+        # How many records the log contains since the last snapshot
+        self.wal_size = 0
+
+        # Maps opcodes from the log to methods that apply them to the in-RAM store when the log is replayed
+        self.wal_opcode_to_func = {}
+
 # ################################################################################################################################
 
     def _append(self, *args:'any_', **kwargs:'any_') -> 'ObjectCtx':
@@ -216,6 +246,10 @@ class BaseRepo(InRAMStore):
             else:
                 logger.info('Skipping repo data path `%s` (%s)', self.data_path, self.name)
 
+            # Changes made after the latest snapshot had been taken are in the log
+            if self.use_wal:
+                self._replay_wal()
+
 # ################################################################################################################################
 
     def _dumps(self):
@@ -229,23 +263,118 @@ class BaseRepo(InRAMStore):
         with self.update_lock:
             return self._dumps()
 
+# ################################################################################################################################
+
+    def _save_snapshot(self) -> 'None':
+
+        # Write to a temporary file first so that a partially written snapshot never replaces a complete one ..
+        tmp_path = self.data_path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            data = self._dumps()
+            f.write(data)
+
+        # .. and only now can the snapshot be swapped atomically.
+        os.replace(tmp_path, self.data_path)
+
 # ################################################################################################################################
 
     def save_data(self) -> 'None':
         with self.update_lock:
-            with open(self.data_path, 'wb') as f:
-                data = self._dumps()
-                f.write(data)
+            if self.use_wal:
+                self._compact_wal()
+            else:
+                self._save_snapshot()
 
 # ################################################################################################################################
 
     def set_data_path(self, data_path:'str') -> 'None':
         self.data_path = data_path
 
+# ################################################################################################################################
+
+    def enable_wal(self, compact_threshold:'int'=ZatoKVDB.DefaultCompactThreshold) -> 'None':
+        """ Makes changes persist through a write-ahead log rather than through rewriting the whole store each time.
+        """
+        self.use_wal = True
+        self.compact_threshold = compact_threshold
+
+# ################################################################################################################################
+
+    def get_wal_path(self) -> 'str':
+        return self.data_path + ZatoKVDB.WALSuffix
+
+# ################################################################################################################################
+
+    def _wal_log(self, *record:'any_') -> 'None':
+        """ Records a change to be written to the log during the next synchronisation of our state.
+        Records are serialised immediately because the objects they refer to may still change in RAM.
+        """
+        self.wal_pending.append(json_dumps(record) + b'\n')
+
+# ################################################################################################################################
+
+    def _flush_wal(self) -> 'None':
+
+        if self.wal_pending:
+
+            pending, self.wal_pending = self.wal_pending, []
+
+            with open(self.get_wal_path(), 'ab') as f:
+                f.write(b''.join(pending))
+
+            self.wal_size += len(pending)
+
+# ################################################################################################################################
+
+    def _compact_wal(self) -> 'None':
+
+        # Whatever is still pending needs to be in the log too, so that the log always ends at the snapshot's state ..
+        self._flush_wal()
+        self._save_snapshot()
+
+        # .. which means that the log is no longer needed. Note that if we are stopped before it is truncated,
+        # it will be replayed on top of the new snapshot, which is safe because it leads to the same state.
+        with open(self.get_wal_path(), 'wb'):
+            pass
+
+        self.wal_size = 0
+
+# ################################################################################################################################
+
+    def _replay_wal(self) -> 'None':
+
+        wal_path = self.get_wal_path()
+
+        if not os.path.exists(wal_path):
+            return
+
+        with open(wal_path, 'rb') as f:
+            for line in f:
+
+                # The last line may be incomplete if we were stopped in the middle of writing it
+                try:
+                    record = json_loads(line) # type: anytuple
+                except Exception as e:
+                    logger.info('KVDB log record skipped (%s -> %s) -> %s', self.name, wal_path, e)
+                    continue
+
+                opcode, *args = record
+                func = self.wal_opcode_to_func[opcode]
+                func(*args)
+
+                self.wal_size += 1
+
 # ################################################################################################################################
 
     def sync_state(self) -> 'None':
-        self.save_data()
+        with self.update_lock:
+            if self.use_wal:
+                self._flush_wal()
+                if self.wal_size >= self.compact_threshold:
+                    self._compact_wal()
+            else:
+                self._save_snapshot()
 
 # ################################################################################################################################
 
@@ -7,20 +7,26 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+from collections import OrderedDict
+from itertools import islice
 from logging import getLogger
 
 # gevent
 from gevent.lock import RLock
 
+# orjson
+from orjson import dumps as json_dumps
+
 # Zato
+from zato.common.util.json_ import json_loads
 from zato.common.util.search import SearchResults
-from zato.server.connection.kvdb.core import BaseRepo, ObjectCtx
+from zato.server.connection.kvdb.core import BaseRepo, ObjectCtx, WALOpCode
 
 # ################################################################################################################################
 # ################################################################################################################################
 
 if 0:
-    from zato.common.typing_ import any_
+    from zato.common.typing_ import any_, anydict, strnone
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -30,8 +36,24 @@ logger = getLogger('zato')
 # ################################################################################################################################
 # ################################################################################################################################
 
+def get_object_id(item:'any_') -> 'strnone':
+    """ Objects are dicts rather than ObjectCtx instances if they were loaded from disk.
+    """
+    if isinstance(item, dict):
+        return item.get('id')
+    else:
+        return getattr(item, 'id', None)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 class ListRepo(BaseRepo):
     """ Stores arbitrary objects, as a list, in RAM only, without backing persistent storage.
+
+    Objects are kept in the order they were appended in, each under a sequence number of its own, and once there are
+    more than max_size of them, the oldest ones are evicted first. An index of object IDs to sequence numbers
+    lets objects be found and deleted without scanning the whole list. Appending an object with the same ID
+    as an existing one replaces the latter.
     """
     def __init__(
         self,
@@ -49,24 +71,101 @@ class ListRepo(BaseRepo):
         # How many objects to return at most in list responses
         self.page_size = page_size
 
-        # In-RAM database of objects
-        self.in_ram_store = [] # type: list[ObjectCtx]
+        # In-RAM database of objects, maps sequence numbers to objects, from the oldest to the newest one
+        self.in_ram_store = OrderedDict() # type: OrderedDict[int, ObjectCtx]
+
+        # Maps object IDs to their sequence numbers in self.in_ram_store
+        self.id_to_seq = {} # type: dict[str, int]
+
+        # Sequence number of the next object to be appended
+        self.next_seq = 0
 
         # Used to synchronise updates
         self.lock = RLock()
 
+        self.wal_opcode_to_func[WALOpCode.Append] = self._replay_append
+        self.wal_opcode_to_func[WALOpCode.Delete] = self._pop_object
+        self.wal_opcode_to_func[WALOpCode.Clear]  = self._clear_objects
+
 # ################################################################################################################################
 
-    def _append(self, ctx:'ObjectCtx') -> 'ObjectCtx':
+    def _push_object(self, ctx:'any_') -> 'None':
+
+        seq = self.next_seq
+        self.next_seq += 1
 
-        # Push new data ..
-        self.in_ram_store.append(ctx)
+        object_id = get_object_id(ctx)
+        if object_id is not None:
+
+            # An object with the same ID cannot be kept because it could be no longer found or deleted ..
+            existing_seq = self.id_to_seq.get(object_id)
+            if existing_seq is not None:
+                del self.in_ram_store[existing_seq]
+
+            self.id_to_seq[object_id] = seq
+
+        # .. push new data ..
+        self.in_ram_store[seq] = ctx
 
         # .. and ensure our max_size is not exceeded ..
         if len(self.in_ram_store) > self.max_size:
 
-            # .. we maintain a FIFO list, deleting the oldest entriest first.
-            del self.in_ram_store[self.max_size:]
+            # .. we maintain a FIFO list, deleting the oldest entries first.
+            _, oldest = self.in_ram_store.popitem(last=False)
+            _ = self.id_to_seq.pop(get_object_id(oldest), None)
+
+# ################################################################################################################################
+
+    def _pop_object(self, object_id:'str') -> 'any_':
+        seq = self.id_to_seq.pop(object_id, None)
+        if seq is not None:
+            return self.in_ram_store.pop(seq)
+
+# ################################################################################################################################
+
+    def _clear_objects(self) -> 'None':
+        self.in_ram_store.clear()
+        self.id_to_seq.clear()
+
+# ################################################################################################################################
+
+    def _replay_append(self, ctx:'anydict') -> 'None':
+
+        # The object will be already in the snapshot if we were stopped before the log could be truncated,
+        # although a different object with the same ID may be there too, in which case this one replaces it.
+        seq = self.id_to_seq.get(get_object_id(ctx))
+        if seq is None or self.in_ram_store[seq] != ctx:
+            self._push_object(ctx)
+
+# ################################################################################################################################
+
+    def _loads(self, data:'bytes') -> 'None':
+
+        try:
+            data_ = json_loads(data) # type: list
+        except Exception as e:
+            logger.info('KVDB load error (%s -> %s) -> %s', self.name, self.data_path, e)
+        else:
+            self._clear_objects()
+            for item in data_ or []:
+                self._push_object(item)
+
+# ################################################################################################################################
+
+    def _dumps(self) -> 'bytes':
+        return json_dumps(list(self.in_ram_store.values()))
+
+# ################################################################################################################################
+
+    def _append(self, ctx:'ObjectCtx') -> 'ObjectCtx':
+
+        self._push_object(ctx)
+
+        # Lists are persisted on each change only if they can be appended to a log,
+        # otherwise they are saved when the server is stopping.
+        if self.use_wal:
+            self._wal_log(WALOpCode.Append, ctx)
+            self.post_modify_state()
 
         return ctx
 
@@ -74,31 +173,47 @@ class ListRepo(BaseRepo):
 
     def _get(self, object_id:'str') -> 'any_':
 
-        for item in self.in_ram_store: # type: ObjectCtx
-            if item.id == object_id:
-                return item
-        else:
+        seq = self.id_to_seq.get(object_id)
+        if seq is None:
             raise KeyError('Object not found `{}`'.format(object_id))
+        else:
+            return self.in_ram_store[seq]
 
 # ################################################################################################################################
 
     def _get_list(self, cur_page:'int'=1, page_size:'int'=50) -> 'dict':
-        search_results = SearchResults.from_list(self.in_ram_store, cur_page, page_size)
+
+        cur_page = cur_page - 1 if cur_page else 0 # We index lists from 0
+        start = cur_page * page_size
+
+        # The newest objects are returned first and only the ones from the current page are copied
+        result = list(islice(reversed(self.in_ram_store.values()), start, start + page_size))
+
+        search_results = SearchResults(None, result, None, len(self.in_ram_store))
+        search_results.set_data(cur_page, page_size)
+
         return search_results.to_dict()
 
 # ################################################################################################################################
 
     def _delete(self, object_id:'str') -> 'any_':
 
-        for item in self.in_ram_store: # type: ObjectCtx
-            if item.id == object_id:
-                self.in_ram_store.remove(item)
-                return item
+        item = self._pop_object(object_id)
+
+        if item is not None and self.use_wal:
+            self._wal_log(WALOpCode.Delete, object_id)
+            self.post_modify_state()
+
+        return item
 
 # ################################################################################################################################
 
     def _remove_all(self) -> 'None':
-        self.in_ram_store[:] = []
+        self._clear_objects()
+
+        if self.use_wal:
+            self._wal_log(WALOpCode.Clear)
+            self.post_modify_state()
 
 # ################################################################################################################################
 
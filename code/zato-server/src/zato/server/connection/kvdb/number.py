@@ -15,13 +15,14 @@ from operator import add as op_add, gt as op_gt, lt as op_lt, sub as op_sub
 # Zato
 from zato.common.api import StatsKey
 from zato.common.typing_ import dataclass
-from zato.server.connection.kvdb.core import BaseRepo
+from zato.common.util.stats import histogram_add, histogram_summary, new_histogram
+from zato.server.connection.kvdb.core import BaseRepo, WALOpCode
 
 # ################################################################################################################################
 # ################################################################################################################################
 
 if 0:
-    from zato.common.typing_ import any_, anydict, callable_, callnone
+    from zato.common.typing_ import any_, anydict, anylist, callable_, callnone
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -39,6 +40,8 @@ _stats_key_per_key_min   = StatsKey.PerKeyMin
 _stats_key_per_key_max   = StatsKey.PerKeyMax
 _stats_key_per_key_mean  = StatsKey.PerKeyMean
 
+_stats_key_per_key_histogram = StatsKey.PerKeyHistogram
+
 _stats_key_per_key_value          = StatsKey.PerKeyValue
 _stats_key_per_key_last_timestamp = StatsKey.PerKeyLastTimestamp
 _stats_key_per_key_last_duration  = StatsKey.PerKeyLastDuration
@@ -85,6 +88,56 @@ class NumberRepo(BaseRepo):
 
         self.current_value = self.in_ram_store[_stats_key_current_value] # type: anydict
 
+        self.wal_opcode_to_func[WALOpCode.Set]    = self.current_value.__setitem__
+        self.wal_opcode_to_func[WALOpCode.Update] = self._replay_update
+        self.wal_opcode_to_func[WALOpCode.Clear]  = self.current_value.clear
+
+# ################################################################################################################################
+
+    def _wal_log_update(self, key:'str', per_key_dict:'anydict', changed_buckets:'anylist | None'=None) -> 'None':
+        """ Logs all the counters of a key, but, because histograms can have many buckets,
+        only the ones from changed_buckets are logged, the rest of them being already in the snapshot or in earlier records.
+        """
+        data = {name: value for name, value in per_key_dict.items() if name != _stats_key_per_key_histogram}
+
+        hist = per_key_dict.get(_stats_key_per_key_histogram)
+
+        if hist:
+            buckets = hist['buckets']
+            hist_data = {name: value for name, value in hist.items() if name != 'buckets'}
+            changed = {idx: buckets.get(idx) for idx in changed_buckets or []}
+        else:
+            hist_data = None
+            changed = None
+
+        self._wal_log(WALOpCode.Update, key, data, hist_data, changed)
+
+# ################################################################################################################################
+
+    def _replay_update(self, key:'str', data:'anydict', hist_data:'anydict | None', changed:'anydict | None') -> 'None':
+
+        per_key_dict = self.current_value.setdefault(key, {})
+
+        # The histogram is not in the record so it needs to be kept as it was ..
+        hist = per_key_dict.get(_stats_key_per_key_histogram)
+        per_key_dict.update(data)
+        per_key_dict[_stats_key_per_key_histogram] = hist
+
+        # .. unless it was changed, in which case the record contains its new state, except for the buckets not changed.
+        if hist_data:
+
+            if not hist:
+                hist = per_key_dict[_stats_key_per_key_histogram] = new_histogram()
+
+            hist.update(hist_data)
+            buckets = hist['buckets']
+
+            for idx, count in changed.items(): # type: ignore
+                if count is None:
+                    _ = buckets.pop(idx, None)
+                else:
+                    buckets[idx] = count
+
 # ################################################################################################################################
 
     def _change_value(
@@ -114,6 +167,8 @@ class NumberRepo(BaseRepo):
                 _stats_key_per_key_min:  None,
                 _stats_key_per_key_max:  None,
                 _stats_key_per_key_mean: None,
+
+                _stats_key_per_key_histogram: None,
             }
 
             # .. and assign them to our key ..
@@ -144,6 +199,10 @@ class NumberRepo(BaseRepo):
         # .. store the new value in RAM ..
         self.current_value[key] = current_data
 
+        # .. log the new counters, so that replaying the record never increments anything twice ..
+        if self.use_wal:
+            self._wal_log_update(key, current_data)
+
         # .. update metadata  ..
         self.post_modify_state()
 
@@ -185,6 +244,10 @@ class NumberRepo(BaseRepo):
     def _remove_all(self) -> 'None':
         self.current_value.clear()
 
+        if self.use_wal:
+            self._wal_log(WALOpCode.Clear)
+            self.post_modify_state()
+
 # ################################################################################################################################
 
     def _clear(self):
@@ -196,35 +259,35 @@ class NumberRepo(BaseRepo):
 
     def set_last_duration(self, key:'str', current_duration:'float') -> 'None':
 
-        # Numpy
-        import numpy as np
-
         with self.update_lock:
 
             per_key_dict = self.current_value[key]
-            previous_duration = per_key_dict[_stats_key_per_key_last_duration]
-
-            if previous_duration:
-                to_compare = [previous_duration, current_duration]
-                new_min  = min(to_compare)
-                new_max  = max(to_compare)
-                new_mean = np.mean(to_compare)
-            else:
-                new_min  = current_duration
-                new_max  = current_duration
-                new_mean = current_duration
-
-            # We need to check the exact class here instead of using isinstance(new_mean, float)
-            # because numpy.float64 is a subclass of float. It is good when the mean
-            # is used in computations but when it comes to JSON serialisation it really
-            # needs to be a float rather than np.float64. That is why here we turn float64 into a real float.
-            uses_numpy = new_mean.__class__ is np.float64
-            new_mean = new_mean.item() if uses_numpy else new_mean # type: ignore
+
+            # Data loaded from disk may have been saved before histograms were added
+            hist = per_key_dict.get(_stats_key_per_key_histogram)
+            if not hist:
+                hist = per_key_dict[_stats_key_per_key_histogram] = new_histogram()
+
+            changed_buckets = histogram_add(hist, current_duration)
 
             per_key_dict[_stats_key_per_key_last_duration] = current_duration
-            per_key_dict[_stats_key_per_key_min]  = new_min
-            per_key_dict[_stats_key_per_key_max]  = new_max
-            per_key_dict[_stats_key_per_key_mean] = new_mean
+            per_key_dict[_stats_key_per_key_min]  = hist['min']
+            per_key_dict[_stats_key_per_key_max]  = hist['max']
+            per_key_dict[_stats_key_per_key_mean] = hist['sum'] / hist['count']
+
+            if self.use_wal:
+                self._wal_log_update(key, per_key_dict, changed_buckets)
+                self.post_modify_state()
+
+# ################################################################################################################################
+
+    def get_summary(self, key:'str') -> 'anydict':
+        """ Returns the count, min, max, mean and percentiles of durations recorded for the key.
+        """
+        with self.update_lock:
+            per_key_dict = self.current_value.get(key) or {}
+            hist = per_key_dict.get(_stats_key_per_key_histogram) or new_histogram()
+            return histogram_summary(hist)
 
 # ################################################################################################################################
 # ################################################################################################################################
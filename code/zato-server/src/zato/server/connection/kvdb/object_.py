@@ -10,7 +10,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from logging import getLogger
 
 # Zato
-from zato.server.connection.kvdb.core import BaseRepo
+from zato.server.connection.kvdb.core import BaseRepo, WALOpCode
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -37,6 +37,15 @@ class ObjectRepo(BaseRepo):
 
         super().__init__(name, data_path)
 
+        self.wal_opcode_to_func[WALOpCode.Set]    = self.in_ram_store.__setitem__
+        self.wal_opcode_to_func[WALOpCode.Delete] = self._pop_object
+        self.wal_opcode_to_func[WALOpCode.Clear]  = self.in_ram_store.clear
+
+# ################################################################################################################################
+
+    def _pop_object(self, object_id:'str') -> 'None':
+        _ = self.in_ram_store.pop(object_id, None)
+
 # ################################################################################################################################
 
     def _get(self, object_id:'str', default:'any_'=None, raise_if_not_found:'bool'=False) -> 'any_':
@@ -52,6 +61,10 @@ class ObjectRepo(BaseRepo):
     def _set(self, object_id:'str', value:'any_') -> 'None':
         # type: (object, object) -> None
         self.in_ram_store[object_id] = value
+
+        if self.use_wal:
+            self._wal_log(WALOpCode.Set, object_id, value)
+
         self.post_modify_state()
 
 # ################################################################################################################################
@@ -60,10 +73,18 @@ class ObjectRepo(BaseRepo):
         # type: (str) -> None
         self.in_ram_store.pop(object_id, None)
 
+        if self.use_wal:
+            self._wal_log(WALOpCode.Delete, object_id)
+            self.post_modify_state()
+
 # ################################################################################################################################
 
     def _remove_all(self) -> 'None':
-        self.in_ram_store[:] = []
+        self.in_ram_store.clear()
+
+        if self.use_wal:
+            self._wal_log(WALOpCode.Clear)
+            self.post_modify_state()
 
 # ################################################################################################################################
 
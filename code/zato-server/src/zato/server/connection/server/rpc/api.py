@@ -6,9 +6,16 @@ Copyright (C) 2023, Zato Source s.r.o. https://zato.io
 Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
+# stdlib
+from logging import getLogger
+from time import monotonic
+from traceback import format_exc
+
 # Zato
+from zato.common.api import INVOKE_ALL, ZATO_NOT_GIVEN
 from zato.common.ext.dataclasses import dataclass
-from zato.common.typing_ import anylist, cast_, list_field
+from zato.common.typing_ import anydict, anylist, cast_, dict_field, list_field
+from zato.common.util.api import spawn_all
 from zato.server.connection.server.rpc.invoker import LocalServerInvoker, RemoteServerInvoker
 
 # ################################################################################################################################
@@ -28,6 +35,31 @@ if 0:
 # ################################################################################################################################
 # ################################################################################################################################
 
+logger = getLogger('zato')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+@dataclass
+class PerServerResult:
+
+    # Name of the server that was invoked
+    server_name: str = ''
+
+    # The same as in InvokeAllResult but for this server only
+    is_ok: bool = True
+
+    # Responses from each PID of this server
+    data: anylist = list_field()
+
+    # How long it took to invoke this server, in seconds
+    response_time: float = 0.0
+
+    # Details of what went wrong, if anything did
+    error_info: str = ''
+
+# ################################################################################################################################
+
 @dataclass
 class InvokeAllResult:
 
@@ -38,6 +70,9 @@ class InvokeAllResult:
     # This is a list of responses from each PID of each server
     data: anylist = list_field()
 
+    # Server name -> PerServerResult with that server's responses and response time
+    per_server: anydict = dict_field()
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -72,11 +107,20 @@ class ConfigCtx:
 class ServerRPC:
     """ A facade through which Zato servers can be invoked.
     """
-    def __init__(self, config_ctx:'ConfigCtx') -> 'None':
+    def __init__(
+        self,
+        config_ctx:'ConfigCtx',
+        max_concurrency:'int'=INVOKE_ALL.DEFAULT.MAX_CONCURRENCY,
+        deadline:'float'=INVOKE_ALL.DEFAULT.DEADLINE,
+    ) -> 'None':
         self.config_ctx = config_ctx
         self.current_cluster_name = self.config_ctx.config_source.current_cluster_name
         self._invokers = {}
 
+        # How many servers self.invoke_all invokes at a time and how long it waits for all of them, in seconds
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+
 # ################################################################################################################################
 
     def _get_invoker_by_server_name(self, server_name:'str') -> 'ServerInvoker':
@@ -107,27 +151,31 @@ class ServerRPC:
 
 # ################################################################################################################################
 
-    def invoke_all(
+    def _invoke_server(
         self,
-        service,        # type: str
-        request = None, # type: any_
-        *args,          # type: any_
-        **kwargs        # type: any_
-    ) -> 'InvokeAllResult':
+        invoker, # type: ServerInvoker
+        service, # type: str
+        request, # type: any_
+        *args,   # type: any_
+        **kwargs # type: any_
+    ) -> 'PerServerResult':
 
-        # First, make sure that we are aware of all the servers currently available
-        self.populate_invokers()
+        out = PerServerResult()
+        out.server_name = invoker.server_name
 
-        # Response to produce
-        out = InvokeAllResult()
+        start = monotonic()
 
-        # Now, invoke all the servers ..
-        for invoker in self._invokers.values():
-            invoker = cast_('ServerInvoker', invoker)
-
-            # .. this includes responses for all the PIDs ..
+        try:
+            # This includes responses for all the PIDs ..
             response = invoker.invoke_all_pids(service, request, *args, **kwargs)
 
+        except Exception:
+            out.is_ok = False
+            out.error_info = format_exc()
+            logger.warning('Could not invoke server `%s` (%s), e:`%s`', invoker.server_name, service, out.error_info)
+
+        else:
+
             # .. continue if we know we can find something ..
             if response and response.has_data:
 
@@ -139,10 +187,57 @@ class ServerRPC:
                         if per_pid_response.pid_data is not None:
                             out.data.append(per_pid_response.pid_data)
 
-                    # .. otherwise, just set the overall response's success flag to false ..
+                    # .. otherwise, just set this server's success flag to false.
                     else:
                         out.is_ok = False
 
+        finally:
+            out.response_time = monotonic() - start
+
+        return out
+
+# ################################################################################################################################
+
+    def invoke_all(
+        self,
+        service,        # type: str
+        request = None, # type: any_
+        *args,          # type: any_
+        **kwargs        # type: any_
+    ) -> 'InvokeAllResult':
+
+        # First, make sure that we are aware of all the servers currently available
+        self.populate_invokers()
+
+        # Response to produce
+        out = InvokeAllResult()
+
+        # Now, invoke all the servers concurrently ..
+        invokers = list(self._invokers.values())
+        results = spawn_all(self._invoke_server, invokers, self.max_concurrency, self.deadline, service, request,
+            *args, **kwargs)
+
+        # .. and collect their responses, in the same order that the servers were invoked in ..
+        for invoker, result in zip(invokers, results):
+            invoker = cast_('ServerInvoker', invoker)
+
+            # .. this server did not respond in time ..
+            if result is ZATO_NOT_GIVEN:
+                result = PerServerResult()
+                result.server_name = invoker.server_name
+                result.is_ok = False
+                result.response_time = self.deadline
+                result.error_info = 'Deadline of {}s exceeded'.format(self.deadline)
+                logger.warning('Server `%s` did not respond within %ss (%s)', invoker.server_name, self.deadline, service)
+
+            result = cast_('PerServerResult', result)
+            out.per_server[result.server_name] = result
+            out.data.extend(result.data)
+
+            # .. a single server's failure means that the overall invocation failed too.
+            if not result.is_ok:
+                out.is_ok = False
+
         # .. now we can return the result.
         return out
 
@@ -56,6 +56,7 @@ class PerPIDResponse:
     pid: 'int' = 0
     pid_data: 'strordictnone' = dict_field()
     error_info: 'any_' = ''
+    response_time: 'float' = 0.0 # In seconds
 
 # ################################################################################################################################
 # ################################################################################################################################
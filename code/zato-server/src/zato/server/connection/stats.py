@@ -71,14 +71,12 @@ class ServiceStatsClient:
             # .. ensure no updates to the backlog while we run ..
             with self.lock:
 
-                # .. get all enqueued events ..
-                for item in self.backlog[:]: # type: PushCtx
-
-                    # .. push each to the backend ..
+                # .. push each enqueued event to the backend, which only adds it to its current batch ..
+                for item in self.backlog: # type: PushCtx
                     self.impl.push(item)
 
-                    # .. and remove it from the queue ..
-                    self.backlog.remove(item)
+                # .. and empty the queue.
+                self.backlog.clear()
 
 # ################################################################################################################################
 
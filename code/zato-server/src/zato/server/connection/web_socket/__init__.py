@@ -38,12 +38,15 @@ from urllib.parse import urlparse
 from bunch import Bunch, bunchify
 
 # gevent
-from gevent import sleep, socket, spawn
+from gevent import sleep, socket, spawn, Timeout
+from gevent.event import AsyncResult
 from gevent.lock import RLock
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer as _Gevent_WSGIServer
 
 # ws4py
 from ws4py.exc import HandshakeError
+from ws4py.messaging import TextMessage
 from ws4py.websocket import WebSocket as _WebSocket
 from ws4py.server.geventserver import GEventWebSocketPool, WebSocketWSGIHandler
 from ws4py.server.wsgiutils import WebSocketWSGIApplication
@@ -71,7 +74,7 @@ if 0:
     from gevent._socketcommon import SocketMixin
     from zato.common.audit_log import DataEvent
     from zato.common.model.wsx import WSXConnectorConfig
-    from zato.common.typing_ import any_, anydict, anylist, boolnone, callable_, callnone, intnone, optional, stranydict, strset
+    from zato.common.typing_ import any_, anydict, anylist, anytuple, boolnone, callable_, callnone, intnone, optional, stranydict, strset
     from zato.server.base.parallel import ParallelServer
 
     DataEvent = DataEvent
@@ -115,6 +118,9 @@ code_pings_missed = 4002
 
 _missing = object()
 
+# Values of client attributes that cannot be hashed are all indexed under this one
+_unhashable = object()
+
 # ################################################################################################################################
 
 # Maps WSGI keys to our own
@@ -200,6 +206,18 @@ class TokenInfo:
 
 # ################################################################################################################################
 
+def get_attr_index_key(key:'str', value:'any_') -> 'anytuple':
+    """ Returns a key under which clients with a given attribute are indexed in WebSocketContainer.clients_by_attr.
+    """
+    try:
+        _ = hash(value)
+    except TypeError:
+        return key, _unhashable
+    else:
+        return key, value
+
+# ################################################################################################################################
+
 class WebSocket(_WebSocket):
     """ Encapsulates information about an individual connection from a WebSocket client.
     """
@@ -233,6 +251,12 @@ class WebSocket(_WebSocket):
         # A dictionary of attributes that each client can send across
         self.client_attrs = {}
 
+        # How many broadcast messages are being sent to this client right now
+        self.broadcasts_in_flight = 0
+
+        # Frames sent from different greenlets must not be interleaved
+        self._write_lock = RLock()
+
         # Zato parallel server this WebSocket runs on
         self.parallel_server = cast_('ParallelServer', self.config.parallel_server)
 
@@ -408,8 +432,9 @@ class WebSocket(_WebSocket):
         for name in _wsgi_drop_keys:
             _ = self.initial_http_wsgi_environ.pop(name, None)
 
-        # Responses to previously sent requests - keyed by request IDs
-        self.responses_received = {}
+        # Requests sent to the client that someone is waiting for responses to - request IDs -> AsyncResult objects.
+        # Each is removed by whoever is waiting once the response arrives or the wait times out.
+        self.pending_responses = {} # type: dict[str, AsyncResult]
 
         _local_address = self.sock.getsockname() # type: ignore
         self._local_address = '{}:{}'.format(_local_address[0], _local_address[1])
@@ -992,7 +1017,7 @@ class WebSocket(_WebSocket):
             if response:
 
                 # Assign any potential attributes sent across by the client WebSocket
-                self.client_attrs = request.client_attrs
+                self.set_client_attrs(request.client_attrs)
 
                 # Register the client for future use
                 self.register_auth_client()
@@ -1170,17 +1195,28 @@ class WebSocket(_WebSocket):
                 request['msg'] = msg
                 hook(**request)
 
-        # Regular synchronous response, simply enqueue it and someone else will take care of it
+        # Regular synchronous response, hand it over to whoever is waiting for it
         else:
-            self.responses_received[msg.in_reply_to] = msg
+            self._set_client_response(msg.in_reply_to, msg)
 
-    def _has_client_response(self, request_id:'str') -> 'any_':
-        return self.responses_received.get(request_id)
+    def _set_client_response(self, request_id:'str', response:'any_') -> 'None':
 
-    def _wait_for_client_response(self, request_id:'str', wait_time:'int'=5) -> 'any_':
+        # There will be no one waiting if the request has already timed out
+        result = self.pending_responses.get(request_id)
+        if result:
+            result.set(response)
+        else:
+            logger.info('Ignoring response to an unknown or timed out request `%s` (%s)', request_id, self.peer_conn_info_pretty)
+
+    def _wait_for_client_response(self, request_id:'str', result:'AsyncResult', wait_time:'int'=5) -> 'any_':
         """ Wait until a response from client arrives and return it or return None if there is no response up to wait_time.
         """
-        return self._wait_for_event(wait_time, self._has_client_response, request_id=request_id)
+        try:
+            return result.get(timeout=wait_time)
+        except Timeout:
+            return None
+        finally:
+            _ = self.pending_responses.pop(request_id, None)
 
 # ################################################################################################################################
 
@@ -1306,6 +1342,48 @@ class WebSocket(_WebSocket):
         # Call the super-class that will actually send the message.
         super().send(data)
 
+# ################################################################################################################################
+
+    def _write(self, data:'bytes') -> 'None':
+        with self._write_lock:
+            super()._write(data)
+
+# ################################################################################################################################
+
+    def send_broadcast_frame(self, frame:'bytes', data:'any_', cid:'str') -> 'None':
+        """ Sends a frame that was encoded once for all the clients a message is broadcast to.
+        """
+        try:
+            # The socket may have been closed after the list of clients to broadcast to was built
+            if self.terminated:
+                raise RuntimeError(_cannot_send)
+
+            if self.is_audit_log_sent_active:
+                self._store_audit_log_data(DataSent, data, cid)
+
+            self._write(frame)
+
+        # This is the same as in invoke_client - a client whose socket is terminated will not receive anything anymore
+        # and it needs to be disconnected, otherwise it would be kept among the ones that the next broadcasts are sent to.
+        except RuntimeError as e:
+            logger.info('Cannot send broadcast message `%s` to `%s` (socket terminated), e:`%s`', cid, self.peer_conn_info_pretty, e)
+            self.disconnect_client(cid, close_code.runtime_invoke_client, 'Client broadcast runtime error')
+
+        except Exception as e:
+            logger.info('Could not send broadcast message `%s` to `%s`, e:`%s`', cid, self.peer_conn_info_pretty, e)
+
+        finally:
+            self.broadcasts_in_flight -= 1
+
+# ################################################################################################################################
+
+    def set_client_attrs(self, client_attrs:'stranydict') -> 'None':
+        """ Assigns new attributes to the client, making sure that the container's index of them is up to date.
+        """
+        self.container.remove_client_attrs(self)
+        self.client_attrs = client_attrs
+        self.container.add_client_attrs(self)
+
 # ################################################################################################################################
 
     def _store_audit_log_data(
@@ -1424,6 +1502,13 @@ class WebSocket(_WebSocket):
             logger.info('Sending message `%s` from `%s` to `%s` `%s` `%s` `%s`', self._shorten_data(serialized),
                 self.python_id, self.pub_client_id, self.ext_client_id, self.ext_client_name, self.peer_conn_info_pretty)
 
+        # Pub/sub messages are always asynchronous and that channel's WSX hook will process the response, if any arrives,
+        # but in other cases we need to be able to receive the response before it is sent, in case it arrives immediately.
+        needs_response = wait_for_response and _Class is not InvokeClientPubSubRequest
+
+        if needs_response:
+            result = self.pending_responses[msg.id] = AsyncResult()
+
         try:
             if use_send:
                 self.send(serialized, cid, msg.in_reply_to)
@@ -1440,17 +1525,19 @@ class WebSocket(_WebSocket):
                 logger.info(data_msg, cid, serialized, self.peer_conn_info_pretty)
                 logger_zato.info(data_msg, cid, serialized, self.peer_conn_info_pretty)
 
+            _ = self.pending_responses.pop(msg.id, None)
+
             self.disconnect_client(cid, close_code.runtime_invoke_client, 'Client invocation runtime error')
             raise RuntimeInvocationError(cid, 'WSX client disconnected cid:`{}, peer:`{}`'.format(cid, self.peer_conn_info_pretty))
 
-        # Wait for response but only if it is not a pub/sub message,
-        # these are always asynchronous and that channel's WSX hook
-        # will process the response, if any arrives.
-        if _Class is not InvokeClientPubSubRequest:
-            if wait_for_response:
-                response = self._wait_for_client_response(msg.id, timeout)
-                if response:
-                    return response if isinstance(response, bool) else response.data # It will be bool in pong responses
+        except Exception:
+            _ = self.pending_responses.pop(msg.id, None)
+            raise
+
+        if needs_response:
+            response = self._wait_for_client_response(msg.id, result, timeout) # type: ignore
+            if response:
+                return response if isinstance(response, bool) else response.data # It will be bool in pong responses
 
 # ################################################################################################################################
 
@@ -1460,7 +1547,11 @@ class WebSocket(_WebSocket):
             self.pub_client_id, ' {})'.format(self.ext_client_name) if self.ext_client_name else ')')
 
         self.unregister_auth_client()
-        self.container.clients.pop(self.pub_client_id, None)
+        self.container.remove_client(self)
+
+        # No responses will be received anymore so there is no point in waiting for them
+        for result in list(self.pending_responses.values()):
+            result.set(None)
 
         # Unregister the client from audit log
         if self.is_audit_log_sent_active or self.is_audit_log_received_active:
@@ -1507,7 +1598,7 @@ class WebSocket(_WebSocket):
         # we cannot use in_reply_to because pong messages are 1:1 copies of ping ones.
         data = self._json_parser.parse(msg.data) # type: any_
         msg_id = data['meta']['id']
-        self.responses_received[msg_id] = True
+        self._set_client_response(msg_id, True)
 
         # Since we received a pong response, it means that the peer is connected,
         # in which case we update its pub/sub metadata.
@@ -1584,8 +1675,42 @@ class WebSocketContainer(WebSocketWSGIApplication):
     ) -> 'None':
         self.config = config
         self.clients = {}
+
+        # Maps (key, value) pairs from client_attrs to pub_client_id values of clients that have such attributes
+        self.clients_by_attr = {} # type: dict[anytuple, set[str]]
+
+        # How many clients at most are sent a broadcast message at a time ..
+        self.broadcast_concurrency = WEB_SOCKET.DEFAULT.BROADCAST_CONCURRENCY
+
+        # .. and how many broadcast messages a slow client may still be receiving before further ones are not sent to it.
+        self.broadcast_max_in_flight = WEB_SOCKET.DEFAULT.BROADCAST_MAX_IN_FLIGHT
+
         super(WebSocketContainer, self).__init__(*args, **kwargs)
 
+# ################################################################################################################################
+
+    def add_client_attrs(self, client:'WebSocket') -> 'None':
+        for key, value in client.client_attrs.items():
+            index_key = get_attr_index_key(key, value)
+            self.clients_by_attr.setdefault(index_key, set()).add(client.pub_client_id)
+
+# ################################################################################################################################
+
+    def remove_client_attrs(self, client:'WebSocket') -> 'None':
+        for key, value in client.client_attrs.items():
+            index_key = get_attr_index_key(key, value)
+            pub_client_ids = self.clients_by_attr.get(index_key)
+            if pub_client_ids is not None:
+                pub_client_ids.discard(client.pub_client_id)
+                if not pub_client_ids:
+                    del self.clients_by_attr[index_key]
+
+# ################################################################################################################################
+
+    def remove_client(self, client:'WebSocket') -> 'None':
+        _ = self.clients.pop(client.pub_client_id, None)
+        self.remove_client_attrs(client)
+
 # ################################################################################################################################
 
     def make_websocket(self, sock:'SocketMixin', protocols:'any_', extensions:'any_', wsgi_environ:'stranydict') -> 'any_':
@@ -1651,44 +1776,78 @@ class WebSocketContainer(WebSocketWSGIApplication):
 
 # ################################################################################################################################
 
-    def invoke_client_by_attrs(self, cid:'str', attrs:'stranydict', request:'any_', timeout:'int') -> 'any_':
+    def get_clients_by_attrs(self, attrs:'stranydict') -> 'list[WebSocket]':
+        """ Returns all the clients that have at least one of the attributes given on input.
+        """
+        pub_client_ids = set() # type: set[str]
 
-        # Iterate over all the currently connected WebSockets ..
-        for client in self.clients.values():
+        for key, value in attrs.items():
+            index_key = get_attr_index_key(key, value)
 
-            # .. by default, assume that we do not need to invoke this client ..
-            should_invoke = False
+            for pub_client_id in self.clients_by_attr.get(index_key, ()):
 
-            # .. add static typing ..
-            client = cast_('WebSocket', client)
+                # Values that cannot be hashed are all indexed under the same key so they need to be compared one by one
+                if index_key[1] is _unhashable:
+                    client = self.clients.get(pub_client_id)
+                    if not client or client.client_attrs.get(key, _missing) != value:
+                        continue
 
-            # .. go through each of the attrs that the client is expected to have ..
-            for expected_key, expected_value in attrs.items():
+                pub_client_ids.add(pub_client_id)
 
-                # .. check if the client has such a key at all ..
-                client_value = client.client_attrs.get(expected_key, _missing)
+        return [self.clients[pub_client_id] for pub_client_id in pub_client_ids if pub_client_id in self.clients]
 
-                # .. if not, we do not need to continue ..
-                if client_value is _missing:
-                    continue
+# ################################################################################################################################
 
-                # .. otherwise, confirm that the value is the same ..
-                # .. and iterate further if it is not ..
-                if client_value != expected_value:
-                    continue
+    def invoke_client_by_attrs(self, cid:'str', attrs:'stranydict', request:'any_', timeout:'int') -> 'any_':
+        clients = self.get_clients_by_attrs(attrs)
+        _ = spawn(self.send_to_clients, cid, request, clients)
 
-                # .. if we are here, it means that this client can be invoked ..
-                should_invoke = True
+# ################################################################################################################################
 
-            # .. do invoke it now in background ..
-            if should_invoke:
-                _ = spawn(client.invoke_client, cid, request, wait_for_response=False)
+    def broadcast(self, cid:'str', request:'any_') -> 'None':
+        _ = spawn(self.send_to_clients, cid, request, list(self.clients.values()))
 
 # ################################################################################################################################
 
-    def broadcast(self, cid:'str', request:'any_') -> 'None':
-        for client in self.clients.values():
-            _ = spawn(client.invoke_client, cid, request, wait_for_response=False)
+    def send_to_clients(self, cid:'str', request:'any_', clients:'list[WebSocket]') -> 'None':
+        """ Sends the same request to all the clients given on input without waiting for their responses.
+        The request is serialised and encoded as a WebSocket frame only once, no matter how many clients there are.
+        """
+        if not clients:
+            return
+
+        # If input request is a string, try to decode it from JSON, but leave as-is in case
+        # of an error or if it is not a string.
+        if isinstance(request, str):
+            try:
+                request = stdlib_loads(request)
+            except ValueError:
+                pass
+
+        # All the clients of a container use the same JSON library
+        msg = InvokeClientRequest(cid, request, None)
+        serialized = msg.serialize(clients[0]._json_dump_func)
+
+        # Frames sent by servers are never masked so they are the same for all clients
+        frame = TextMessage(serialized).single(mask=False)
+
+        pool = Pool(self.broadcast_concurrency)
+        skipped = 0
+
+        for client in clients:
+
+            # Do not queue up more messages for clients that cannot keep up with the ones already sent
+            if client.broadcasts_in_flight >= self.broadcast_max_in_flight:
+                skipped += 1
+                continue
+
+            client.broadcasts_in_flight += 1
+            _ = pool.spawn(client.send_broadcast_frame, frame, serialized, cid)
+
+        pool.join()
+
+        logger.info('Sent message `%s` to %d WSX client(s) of `%s`, skipped slow client(s): %d',
+            cid, len(clients) - skipped, self.config.name, skipped)
 
 # ################################################################################################################################
 
@@ -63,6 +63,8 @@ class ChannelHL7MLLPWrapper(Wrapper):
 
                 'max_msg_size': self.config.max_msg_size,
                 'read_buffer_size': self.config.read_buffer_size,
+                'pipeline_size': self.config.get('pipeline_size'),
+                'hl7_impl_class': self.config.get('hl7_impl_class'),
 
                 # Convert to seconds from milliseconds
                 'recv_timeout': self.config.recv_timeout / 100.0,
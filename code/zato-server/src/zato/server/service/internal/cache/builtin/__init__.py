@@ -8,9 +8,6 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-# dictalchemy
-from dictalchemy.utils import asdict
-
 # Python 2/3 compatibility
 from six import add_metaclass
 
@@ -19,6 +16,7 @@ from zato.common.api import CACHE as _COMMON_CACHE
 from zato.common.broker_message import CACHE
 from zato.common.odb.model import CacheBuiltin
 from zato.common.odb.query import cache_builtin_list
+from zato.common.util.sql import get_dict_with_opaque
 from zato.server.service import Bool, Int
 from zato.server.service.internal import AdminService, AdminSIO
 from zato.server.service.internal.cache import common_instance_hook
@@ -34,7 +32,8 @@ list_func = cache_builtin_list
 skip_create_integrity_error = True
 skip_if_exists = True
 skip_input_params = ['cache_id']
-output_optional_extra = ['current_size', 'cache_id']
+create_edit_input_optional_extra = [Int('max_bytes'), Bool('use_key_index')]
+output_optional_extra = ['current_size', 'cache_id', Int('max_bytes'), Int('current_bytes'), Bool('use_key_index')]
 
 # ################################################################################################################################
 
@@ -76,8 +75,10 @@ def response_hook(self, input, _ignored, attrs, service_type):
 
             try:
                 item.current_size = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, item.name)
+                item.current_bytes = self.cache.get_bytes(item.name)
             except KeyError:
                 item.current_size = 0
+                item.current_bytes = 0
 
 # ################################################################################################################################
 
@@ -95,10 +96,12 @@ class Get(AdminService):
         output_required = ('name', 'is_active', 'is_default', 'cache_type', Int('max_size'), Int('max_item_size'),
             Bool('extend_expiry_on_get'), Bool('extend_expiry_on_set'), 'sync_method', 'persistent_storage',
             Int('current_size'))
+        output_optional = (Int('max_bytes'), Int('current_bytes'), Bool('use_key_index'))
 
     def handle(self):
-        response = asdict(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
+        response = get_dict_with_opaque(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
         response['current_size'] = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+        response['current_bytes'] = self.cache.get_bytes(response['name'])
 
         self.response.payload = response
 
@@ -713,6 +713,14 @@ class ReloadWSDL(AdminService, _HTTPSOAPService):
 
 # ################################################################################################################################
 
+class GetURLPathCacheStats(AdminService):
+    """ Returns statistics of the cache of URL paths matched to channels in the current worker process.
+    """
+    def handle(self):
+        self.response.payload = self.server.worker_store.request_dispatcher.url_data.get_cache_stats()
+
+# ################################################################################################################################
+
 class GetURLSecurity(AdminService):
     """ Returns a JSON document describing the security configuration of all Zato channels.
     """
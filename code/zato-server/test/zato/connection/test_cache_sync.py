@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# Must come first
+from gevent.monkey import patch_all
+_ = patch_all()
+
+# stdlib
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch, bunchify
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common.api import CACHE
+from zato.common.broker_message import CACHE as CACHE_BROKER_MSG
+from zato.server.connection.cache import CacheAPI
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class _BrokerClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, msg):
+        self.published.append(msg)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class CacheSyncTestCase(TestCase):
+
+    def get_cache_api(self, worker_id, cache_name='my.cache', extend_expiry_on_get=True):
+
+        server = Bunch()
+        server.worker_id = worker_id
+        server.broker_client = _BrokerClient()
+
+        cache_api = CacheAPI(server)
+        cache_api.create(Bunch({
+            'name': cache_name,
+            'cache_type': CACHE.TYPE.BUILTIN,
+            'is_default': False,
+            'max_size': 100,
+            'max_item_size': 10000,
+            'extend_expiry_on_get': extend_expiry_on_get,
+            'extend_expiry_on_set': True,
+            'sync_method': CACHE.SYNC_METHOD.IN_BACKGROUND.id,
+        }))
+
+        return cache_api
+
+# ################################################################################################################################
+
+    def wait_for_batch(self, cache_api):
+        sleep(cache_api.sync_batch_interval * 4)
+        return cache_api.server.broker_client.published
+
+# ################################################################################################################################
+
+    def test_changes_are_sent_in_one_batch(self):
+
+        cache_api = self.get_cache_api(1)
+        cache = cache_api.builtin['my.cache']
+
+        cache.set('key1', 'value1')
+        cache.set('key3.1', 'value3')
+        cache.delete_by_prefix('key3', return_found=True)
+
+        published = self.wait_for_batch(cache_api)
+
+        self.assertEqual(len(published), 1)
+
+        msg = published[0]
+        self.assertEqual(msg['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value)
+        self.assertEqual(msg['source_worker_id'], 1)
+
+        data_list = msg['data_list']
+        self.assertEqual(len(data_list), 3)
+        self.assertEqual(data_list[0]['key'], 'key1')
+        self.assertEqual(data_list[1]['key'], 'key3.1')
+        self.assertEqual(data_list[2]['key'], 'key3')
+        self.assertEqual(data_list[2]['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_DELETE_BY_PREFIX.value)
+
+# ################################################################################################################################
+
+    def test_repeated_changes_are_coalesced(self):
+
+        cache_api = self.get_cache_api(1)
+        cache = cache_api.builtin['my.cache']
+
+        cache.set('key1', 'value1')
+        cache.set('key2', 'value2')
+        cache.expire('key2', 10)
+        cache.set('key1', 'value1.2')
+        cache.expire('key2', 20)
+        cache.delete('key1')
+
+        data_list = self.wait_for_batch(cache_api)[0]['data_list']
+
+        self.assertEqual(len(data_list), 3)
+
+        self.assertEqual(data_list[0]['key'], 'key2')
+        self.assertEqual(data_list[0]['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_SET.value)
+
+        self.assertEqual(data_list[1]['key'], 'key2')
+        self.assertEqual(data_list[1]['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_EXPIRE.value)
+        self.assertEqual(data_list[1]['expiry'], 20)
+
+        self.assertEqual(data_list[2]['key'], 'key1')
+        self.assertEqual(data_list[2]['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_DELETE.value)
+
+# ################################################################################################################################
+
+    def test_clear_drops_earlier_changes(self):
+
+        cache_api = self.get_cache_api(1)
+        cache = cache_api.builtin['my.cache']
+
+        cache.set('key1', 'value1')
+        cache.delete_by_suffix('1', return_found=True)
+        cache.clear()
+        cache.set('key2', 'value2')
+
+        data_list = self.wait_for_batch(cache_api)[0]['data_list']
+
+        self.assertEqual(len(data_list), 2)
+        self.assertEqual(data_list[0]['action'], CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_CLEAR.value)
+        self.assertEqual(data_list[1]['key'], 'key2')
+
+# ################################################################################################################################
+
+    def test_max_batch_size(self):
+
+        cache_api = self.get_cache_api(1)
+        cache_api.sync_batch_max_size = 10
+        cache = cache_api.builtin['my.cache']
+
+        for idx in range(25):
+            cache.set('key.{}'.format(idx), idx)
+
+        published = self.wait_for_batch(cache_api)
+
+        self.assertListEqual([len(msg['data_list']) for msg in published], [10, 10, 5])
+
+# ################################################################################################################################
+
+    def test_batch_is_applied(self):
+
+        source_api = self.get_cache_api(1)
+        source = source_api.builtin['my.cache']
+
+        target_api = self.get_cache_api(2)
+        target = target_api.builtin['my.cache']
+        target.impl.set('key3', 'value3', 0.0, False)
+        target.impl.set('key4', 'value4', 0.0, False)
+
+        source.impl.set('key3', 'value3', 0.0, False)
+        source.impl.set('key5', 'value5', 0.0, False)
+
+        source.set('key1', 'value1')
+        source.set('key2', 'value2')
+        source.delete('key3')
+        source.delete('key5') # There is no such key in the target cache but this must not stop the rest of the batch
+        source.set('key1', 'value1.2')
+
+        msg = bunchify(self.wait_for_batch(source_api)[0])
+        target_api.sync_batch(CACHE.TYPE.BUILTIN, msg.data_list)
+
+        self.assertEqual(len(msg.data_list), 4)
+
+        self.assertDictEqual({key: target.get(key) for key in target.keys()}, {
+            'key1': 'value1.2',
+            'key2': 'value2',
+            'key4': 'value4',
+        })
+
+# ################################################################################################################################
+
+    def test_expiry_is_kept_after_coalescing(self):
+
+        # Reading the keys below must not change their expiration times
+        source_api = self.get_cache_api(1, extend_expiry_on_get=False)
+        source = source_api.builtin['my.cache']
+
+        target_api = self.get_cache_api(2, extend_expiry_on_get=False)
+        target = target_api.builtin['my.cache']
+
+        # The .expire is superseded by the second .set, which keeps the expiration time set by the .expire ..
+        source.set('key1', 'value1')
+        source.expire('key1', 100)
+        source.set('key1', 'value1.2', 5)
+
+        # .. whereas a .set without any expiry removes it.
+        source.set('key2', 'value2', 5)
+        source.set('key2', 'value2.2')
+
+        msg = bunchify(self.wait_for_batch(source_api)[0])
+        self.assertEqual(len(msg.data_list), 2)
+
+        target_api.sync_batch(CACHE.TYPE.BUILTIN, msg.data_list)
+
+        for key in ('key1', 'key2'):
+            source_entry = source.get(key, details=True)
+            target_entry = target.get(key, details=True)
+
+            self.assertEqual(target_entry.value, source_entry.value)
+            self.assertEqual(target_entry.expiry, source_entry.expiry)
+            self.assertEqual(target_entry.expires_at, source_entry.expires_at)
+
+        self.assertEqual(target.get('key1', details=True).expiry, 100)
+        self.assertEqual(target.get('key2', details=True).expires_at, 0)
+
+# ################################################################################################################################
+
+    def test_set_without_entry_expiry(self):
+
+        source_api = self.get_cache_api(1)
+        source = source_api.builtin['my.cache']
+
+        target_api = self.get_cache_api(2)
+        target = target_api.builtin['my.cache']
+
+        source.set('key1', 'value1', 5)
+
+        # Workers that do not send entry_expiry yet still have their changes applied
+        msg = bunchify(self.wait_for_batch(source_api)[0])
+        for data in msg.data_list:
+            del data['entry_expiry']
+
+        with self.assertNoLogs('zato.server.connection.cache', 'WARNING'):
+            target_api.sync_batch(CACHE.TYPE.BUILTIN, msg.data_list)
+
+        self.assertEqual(target.get('key1'), 'value1')
+        self.assertEqual(target.get('key1', details=True).expiry, 5)
+
+# ################################################################################################################################
+
+    def test_batch_with_unknown_cache(self):
+
+        source_api = self.get_cache_api(1)
+        source_api.create(Bunch({
+            'name': 'my.cache.2',
+            'cache_type': CACHE.TYPE.BUILTIN,
+            'is_default': False,
+            'max_size': 100,
+            'max_item_size': 10000,
+            'extend_expiry_on_get': True,
+            'extend_expiry_on_set': True,
+            'sync_method': CACHE.SYNC_METHOD.IN_BACKGROUND.id,
+        }))
+
+        # There is no my.cache.2 in the target worker ..
+        target_api = self.get_cache_api(2)
+        target = target_api.builtin['my.cache']
+
+        source_api.builtin['my.cache.2'].set('key1', 'value1')
+        source_api.builtin['my.cache'].set('key2', 'value2')
+
+        data_list = []
+        for msg in self.wait_for_batch(source_api):
+            data_list.extend(bunchify(msg).data_list)
+
+        self.assertEqual(len(data_list), 2)
+
+        # .. which must not stop changes to the other caches from being applied.
+        target_api.sync_batch(CACHE.TYPE.BUILTIN, data_list)
+        self.assertDictEqual({key: target.get(key) for key in target.keys()}, {'key2': 'value2'})
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -205,6 +205,98 @@ class TransientRepositoryTestCase(TestCase):
         self.assertEqual(result1.id, id8)
         self.assertEqual(result2.id, id7)
 
+# ################################################################################################################################
+
+    def test_repo_evicts_oldest_first(self):
+
+        max_size = 3
+        repo = ListRepo(max_size=max_size)
+
+        id_list = [rand_string() for _ in range(5)]
+
+        for object_id in id_list:
+            ctx = ObjectCtx()
+            ctx.id = object_id
+            repo.append(ctx)
+
+        # Only the newest objects are kept ..
+        self.assertEqual(repo.get_size(), max_size)
+
+        for object_id in id_list[2:]:
+            self.assertEqual(repo.get(object_id).id, object_id)
+
+        # .. and the oldest ones can no longer be found.
+        for object_id in id_list[:2]:
+            with self.assertRaises(KeyError):
+                repo.get(object_id)
+
+# ################################################################################################################################
+
+    def test_repo_get_list_does_not_change_repo(self):
+
+        repo = ListRepo()
+        id_list = [str(idx) for idx in range(5)]
+
+        for object_id in id_list:
+            ctx = ObjectCtx()
+            ctx.id = object_id
+            repo.append(ctx)
+
+        # Reading the same page twice returns the same objects, newest first ..
+        for _ in range(2):
+            results = repo.get_list(1, 2)
+            self.assertListEqual([item.id for item in results['result']], ['4', '3'])
+            self.assertEqual(results['total'], 5)
+            self.assertEqual(results['num_pages'], 3)
+
+        # .. the last page may be shorter than the others ..
+        results = repo.get_list(3, 2)
+        self.assertListEqual([item.id for item in results['result']], ['0'])
+
+        # .. and a deleted object is skipped.
+        repo.delete('3')
+        results = repo.get_list(1, 2)
+        self.assertListEqual([item.id for item in results['result']], ['4', '2'])
+
+# ################################################################################################################################
+
+    def test_repo_append_same_id(self):
+
+        repo = ListRepo(max_size=3)
+
+        for object_id, value in (('1', 'a'), ('2', 'b'), ('1', 'c')):
+            ctx = ObjectCtx()
+            ctx.id = object_id
+            ctx.value = value
+            repo.append(ctx)
+
+        # The newer object replaces the older one ..
+        self.assertEqual(repo.get_size(), 2)
+        self.assertEqual(repo.get('1').value, 'c')
+
+        results = repo.get_list(1, 10)
+        self.assertListEqual([item.value for item in results['result']], ['c', 'b'])
+
+        # .. it is evicted only when it becomes the oldest one ..
+        for object_id in ('3', '4'):
+            ctx = ObjectCtx()
+            ctx.id = object_id
+            repo.append(ctx)
+
+        self.assertEqual(repo.get_size(), 3)
+        self.assertEqual(repo.get('1').value, 'c')
+
+        with self.assertRaises(KeyError):
+            repo.get('2')
+
+        # .. and once it is deleted, nothing is left under its ID.
+        self.assertEqual(repo.delete('1').value, 'c')
+        self.assertEqual(repo.get_size(), 2)
+
+        with self.assertRaises(KeyError):
+            repo.get('1')
+
+# ################################################################################################################################
 # ################################################################################################################################
 
 if __name__ == '__main__':
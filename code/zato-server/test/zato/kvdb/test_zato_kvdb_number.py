@@ -208,6 +208,36 @@ class NumberTestCase(TestCase):
 
         self.assertEqual(data[StatsKey.PerKeyLastDuration], last_duration)
 
+# ################################################################################################################################
+
+    def test_repo_duration_summary(self):
+
+        repo_name = rand_string()
+        key_name = rand_string()
+
+        repo = NumberRepo(repo_name, sync_threshold, sync_interval)
+        repo.incr(key_name)
+
+        for duration in range(1, 101):
+            repo.set_last_duration(key_name, duration)
+
+        data = repo.get(key_name) # type: dict
+
+        # The mean is computed over all the durations, not only the last two ..
+        self.assertEqual(data[StatsKey.PerKeyMin], 1)
+        self.assertEqual(data[StatsKey.PerKeyMax], 100)
+        self.assertEqual(data[StatsKey.PerKeyMean], 50.5)
+
+        # .. and percentiles are available too.
+        summary = repo.get_summary(key_name)
+
+        self.assertEqual(summary[StatsKey.PerKeyCount], 100)
+        self.assertAlmostEqual(summary[StatsKey.PerKeyP50], 50, delta=1)
+        self.assertAlmostEqual(summary[StatsKey.PerKeyP90], 90, delta=1)
+        self.assertAlmostEqual(summary[StatsKey.PerKeyP99], 99, delta=1)
+
+# ################################################################################################################################
+
 # ################################################################################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import os
+from functools import partial
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import main, TestCase
+from unittest.mock import patch
+
+# Zato
+from zato.common.test import benchmark, benchmark_logger, rand_string
+from zato.common.util.stats import _collapse_histogram
+from zato.server.connection.kvdb.api import ListRepo, NumberRepo, ObjectCtx
+from zato.server.connection.kvdb.object_ import ObjectRepo
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_ctx(object_id, data=None):
+    ctx = ObjectCtx()
+    ctx.id = object_id
+    ctx.data = data
+    return ctx
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class WALTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+# ################################################################################################################################
+
+    def get_repo(self, class_, data_path='', use_wal=True, compact_threshold=1000, sync_threshold=1):
+
+        data_path = data_path or os.path.join(self.tmp_dir.name, rand_string() + '.json')
+
+        if class_ is NumberRepo:
+            repo = NumberRepo(rand_string(), data_path, sync_threshold)
+        else:
+            repo = class_(rand_string(), data_path)
+            repo.sync_threshold = sync_threshold
+
+        if use_wal:
+            repo.enable_wal(compact_threshold)
+
+        return repo
+
+# ################################################################################################################################
+
+    def reload(self, repo):
+        new_repo = self.get_repo(repo.__class__, repo.data_path, repo.use_wal, repo.compact_threshold)
+        new_repo.load_data()
+        return new_repo
+
+# ################################################################################################################################
+
+    def get_wal_lines(self, repo):
+        with open(repo.get_wal_path(), 'rb') as f:
+            return f.read().splitlines()
+
+# ################################################################################################################################
+
+    def test_object_repo_replay(self):
+
+        repo = self.get_repo(ObjectRepo)
+
+        repo.set('key1', {'a': 1})
+        repo.set('key2', {'b': 2})
+        repo.set('key1', {'a': 11})
+        repo.delete('key2')
+
+        # Nothing has been compacted yet so everything is in the log ..
+        self.assertFalse(os.path.exists(repo.data_path))
+        self.assertEqual(len(self.get_wal_lines(repo)), 4)
+
+        # .. which is enough to recreate the repository.
+        new_repo = self.reload(repo)
+        self.assertDictEqual(new_repo.in_ram_store, {'key1': {'a': 11}})
+
+        repo.remove_all()
+        self.assertDictEqual(self.reload(repo).in_ram_store, {})
+
+# ################################################################################################################################
+
+    def test_number_repo_replay(self):
+
+        repo = self.get_repo(NumberRepo)
+
+        for _ in range(5):
+            repo.incr('key1')
+
+        repo.decr('key1')
+        repo.incr('key2', 10)
+        repo.set_last_duration('key2', 1.5)
+
+        new_repo = self.reload(repo)
+
+        self.assertEqual(new_repo.get('key1')['value'], 4)
+        self.assertEqual(new_repo.get('key2')['value'], 10)
+        self.assertEqual(new_repo.get('key2')['last_duration'], 1.5)
+
+        # The loaded data is in the same dict that the repository reads its values from
+        self.assertIs(new_repo.current_value, new_repo.in_ram_store['current_value'])
+
+# ################################################################################################################################
+
+    def test_number_repo_histogram_not_logged(self):
+
+        repo = self.get_repo(NumberRepo)
+        repo.incr('key1')
+
+        for idx in range(1, 501):
+            repo.set_last_duration('key1', idx)
+
+        # Only the histogram buckets that changed are in the log, rather than all of them each time ..
+        wal_lines = self.get_wal_lines(repo)
+        self.assertEqual(len(wal_lines), 501)
+        self.assertLess(max(len(line) for line in wal_lines), 400)
+
+        # .. yet the histogram is recreated from the log ..
+        new_repo = self.reload(repo)
+        self.assertEqual(new_repo._dumps(), repo._dumps())
+
+        # .. also on top of one that is in a snapshot.
+        repo.save_data()
+
+        for idx in range(1000, 1010):
+            repo.set_last_duration('key1', idx)
+
+        repo.incr('key1')
+
+        new_repo = self.reload(repo)
+        self.assertEqual(new_repo._dumps(), repo._dumps())
+        self.assertEqual(new_repo.get_summary('key1')['count'], 510)
+
+# ################################################################################################################################
+
+    def test_number_repo_histogram_collapsed(self):
+
+        # Buckets are collapsed when there are too many of them, which is reflected in the log too
+        with patch('zato.common.util.stats._collapse_histogram', partial(_collapse_histogram, max_buckets=5)):
+
+            repo = self.get_repo(NumberRepo)
+            repo.incr('key1')
+
+            for value in (1, 2, 4, 8, 16, 32, 64, 128):
+                repo.set_last_duration('key1', value)
+
+        hist = repo.get('key1')['histogram']
+        self.assertEqual(len(hist['buckets']), 5)
+
+        new_repo = self.reload(repo)
+        self.assertEqual(new_repo._dumps(), repo._dumps())
+
+# ################################################################################################################################
+
+    def test_list_repo_replay(self):
+
+        repo = self.get_repo(ListRepo)
+
+        for idx in range(3):
+            repo.append(get_ctx('id{}'.format(idx), {'idx': idx}))
+
+        repo.delete('id1')
+
+        new_repo = self.reload(repo)
+        self.assertListEqual([item['id'] for item in new_repo.in_ram_store.values()], ['id0', 'id2'])
+
+# ################################################################################################################################
+
+    def test_compaction(self):
+
+        repo = self.get_repo(ObjectRepo, compact_threshold=10)
+
+        for idx in range(25):
+            repo.set('key{}'.format(idx % 5), {'idx': idx})
+
+        # The log has been compacted twice, after which there were five more records ..
+        self.assertTrue(os.path.exists(repo.data_path))
+        self.assertEqual(len(self.get_wal_lines(repo)), 5)
+
+        # .. and the snapshot together with the log give the latest state.
+        new_repo = self.reload(repo)
+        self.assertDictEqual(new_repo.in_ram_store, {'key{}'.format(idx): {'idx': 20 + idx} for idx in range(5)})
+
+        # Saving data compacts the log too
+        repo.save_data()
+        self.assertListEqual(self.get_wal_lines(repo), [])
+        self.assertDictEqual(self.reload(repo).in_ram_store, new_repo.in_ram_store)
+
+# ################################################################################################################################
+
+    def test_replay_is_idempotent(self):
+
+        for class_, change_func in (
+            (ObjectRepo, lambda repo, idx: repo.set('key{}'.format(idx), idx)),
+            (NumberRepo, lambda repo, idx: repo.incr('key')),
+            (ListRepo,   lambda repo, idx: repo.append(get_ctx('id{}'.format(idx)))),
+        ):
+            repo = self.get_repo(class_)
+
+            for idx in range(3):
+                change_func(repo, idx)
+
+            # Save a snapshot but keep the log as though we were stopped before it was truncated ..
+            repo._save_snapshot()
+
+            # .. and the records already in the snapshot must not be applied twice.
+            new_repo = self.reload(repo)
+            self.assertEqual(new_repo._dumps(), repo._dumps(), class_)
+
+# ################################################################################################################################
+
+    def test_compaction_stopped_before_truncation(self):
+
+        for class_, change_func in (
+            (ObjectRepo, lambda repo, idx: repo.set('key1', idx)),
+            (ListRepo,   lambda repo, idx: repo.append(get_ctx('id{}'.format(idx)))),
+        ):
+            repo = self.get_repo(class_, sync_threshold=100)
+            repo.max_size = 2
+
+            # Two records are in the log and the third one is still pending ..
+            change_func(repo, 1)
+            change_func(repo, 2)
+            repo.sync_state()
+            change_func(repo, 3)
+
+            # .. when the log is compacted but we are stopped before it could be truncated ..
+            save_snapshot = repo._save_snapshot
+            wal_lines = []
+
+            def _save_snapshot(repo=repo, save_snapshot=save_snapshot, wal_lines=wal_lines):
+                save_snapshot()
+                wal_lines.extend(self.get_wal_lines(repo))
+
+            with patch.object(repo, '_save_snapshot', _save_snapshot):
+                repo._compact_wal()
+
+            with open(repo.get_wal_path(), 'wb') as f:
+                f.write(b'\n'.join(wal_lines) + b'\n')
+
+            # .. in which case the log is replayed on top of the snapshot, which results in the latest state.
+            new_repo = self.get_repo(class_, repo.data_path)
+            new_repo.max_size = 2
+            new_repo.load_data()
+
+            self.assertEqual(len(wal_lines), 3, class_)
+            self.assertEqual(new_repo._dumps(), repo._dumps(), class_)
+
+# ################################################################################################################################
+
+    def test_incomplete_last_record(self):
+
+        repo = self.get_repo(ObjectRepo)
+
+        repo.set('key1', 1)
+        repo.set('key2', 2)
+
+        # Simulate a record that was only partly written
+        with open(repo.get_wal_path(), 'ab') as f:
+            f.write(b'["set","key3"')
+
+        new_repo = self.reload(repo)
+        self.assertDictEqual(new_repo.in_ram_store, {'key1': 1, 'key2': 2})
+
+# ################################################################################################################################
+
+    def test_records_are_taken_when_changed(self):
+
+        repo = self.get_repo(ObjectRepo, sync_threshold=100)
+
+        # The value is changed in place after it was set, but before the log was synchronised ..
+        value = {'a': 1}
+        repo.set('key1', value)
+        value['a'] = 2
+
+        repo.sync_state()
+
+        # .. and what was set originally is what is in the log.
+        self.assertEqual(self.get_wal_lines(repo), [b'["set","key1",{"a":1}]'])
+
+# ################################################################################################################################
+
+    def test_without_wal(self):
+
+        repo = self.get_repo(ObjectRepo, use_wal=False)
+        repo.set('key1', 1)
+
+        # Without a log, the whole repository is saved each time
+        self.assertFalse(os.path.exists(repo.get_wal_path()))
+        self.assertDictEqual(self.reload(repo).in_ram_store, {'key1': 1})
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_sync_benchmark(self):
+
+        changes_per_sync = 100
+
+        for repo_size in (1_000, 10_000, 100_000):
+
+            results = []
+
+            for use_wal in (False, True):
+
+                repo = self.get_repo(ObjectRepo, use_wal=use_wal, compact_threshold=repo_size * 10,
+                    sync_threshold=changes_per_sync)
+
+                for idx in range(repo_size):
+                    repo.in_ram_store['key{}'.format(idx)] = {'idx': idx, 'data': rand_string()}
+
+                start = perf_counter()
+
+                # Each time a hundred changes are made, the repository is synchronised
+                for idx in range(changes_per_sync * 10):
+                    repo.set('key{}'.format(idx), {'idx': idx, 'data': 'updated'})
+
+                results.append((perf_counter() - start) / 10)
+
+            full, wal = results
+
+            benchmark_logger.info('KVDB sync of {} changes to {} objects; full rewrite: {:.2f} ms, log: {:.2f} ms'.format(
+                changes_per_sync, repo_size, full * 1000, wal * 1000))
+
+            self.assertLess(wal, full)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
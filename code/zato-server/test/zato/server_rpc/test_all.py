@@ -8,8 +8,12 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 from contextlib import closing
+from time import monotonic
 from unittest import main, TestCase
 
+# gevent
+from gevent import sleep
+
 # Zato
 from zato.common.ext.dataclasses import dataclass
 from zato.common.odb.model import Base, HTTPBasicAuth, Cluster, Server as ServerModel
@@ -447,6 +451,87 @@ class ServerRPCTestCase(TestCase):
         self.assertDictEqual(server3_pid_2_data, {'pong': 'zato-3332'})
         self.assertDictEqual(server3_pid_3_data, {'pong': 'zato-3333'})
 
+# ################################################################################################################################
+
+    def get_sleeping_server_rpc(self, sleep_time:'anydict') -> 'ServerRPC':
+        """ Returns an RPC client to servers that respond after the given number of seconds each.
+        """
+        class SleepingRemoteServerInvoker(RemoteServerInvoker):
+            def invoke_all_pids(self, *args:'any_', **kwargs:'any_') -> 'any_':
+                sleep(sleep_time[self.server_name])
+                return None
+
+        return self.get_server_rpc(self.odb, remote_server_invoker_class=SleepingRemoteServerInvoker)
+
+# ################################################################################################################################
+
+    def test_invoke_all_concurrently(self):
+
+        server_rpc = self.get_sleeping_server_rpc({
+            TestConfig.server1_name: 0.1,
+            TestConfig.server2_name: 0.2,
+            TestConfig.server3_name: 0.3,
+        })
+
+        start = monotonic()
+        response = server_rpc.invoke_all('zato.ping')
+        response_time = monotonic() - start
+
+        # All the servers are invoked at the same time so it takes as long as the slowest one does ..
+        self.assertTrue(response.is_ok)
+        self.assertLess(response_time, 0.45)
+
+        # .. and we know how long each of them took.
+        self.assertListEqual(sorted(response.per_server), [TestConfig.server1_name, TestConfig.server2_name,
+            TestConfig.server3_name])
+
+        for server_name, min_response_time in ((TestConfig.server1_name, 0.1), (TestConfig.server3_name, 0.3)):
+            result = response.per_server[server_name]
+            self.assertTrue(result.is_ok)
+            self.assertGreaterEqual(result.response_time, min_response_time)
+
+# ################################################################################################################################
+
+    def test_invoke_all_max_concurrency(self):
+
+        server_rpc = self.get_sleeping_server_rpc({
+            TestConfig.server1_name: 0.1,
+            TestConfig.server2_name: 0.1,
+            TestConfig.server3_name: 0.1,
+        })
+        server_rpc.max_concurrency = 1
+
+        start = monotonic()
+        response = server_rpc.invoke_all('zato.ping')
+
+        # With one server at a time, their response times add up
+        self.assertTrue(response.is_ok)
+        self.assertGreaterEqual(monotonic() - start, 0.3)
+
+# ################################################################################################################################
+
+    def test_invoke_all_deadline(self):
+
+        server_rpc = self.get_sleeping_server_rpc({
+            TestConfig.server1_name: 0.0,
+            TestConfig.server2_name: 5,
+            TestConfig.server3_name: 0.0,
+        })
+        server_rpc.deadline = 0.2
+
+        start = monotonic()
+        response = server_rpc.invoke_all('zato.ping')
+
+        # We do not wait for a server that is too slow ..
+        self.assertLess(monotonic() - start, 1)
+
+        # .. and it is the only one that is reported as having failed.
+        self.assertFalse(response.is_ok)
+        self.assertTrue(response.per_server[TestConfig.server1_name].is_ok)
+        self.assertFalse(response.per_server[TestConfig.server2_name].is_ok)
+        self.assertTrue(response.per_server[TestConfig.server3_name].is_ok)
+        self.assertIn('Deadline', response.per_server[TestConfig.server2_name].error_info)
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import logging
+import os
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import main, TestCase
+
+# Numpy
+import numpy as np
+
+# Pandas
+import pandas as pd
+
+# psutil
+import psutil
+
+# Zato
+from zato.common.api import Stats
+from zato.common.test import benchmark, benchmark_logger
+from zato.server.connection.connector.subprocess_.impl.events.database import ColumnarEventBuffer, EventsDatabase
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_events = 1_000_000
+benchmark_services = 500
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+utcnow = datetime.utcnow
+
+logger = logging.getLogger('zato')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_event(idx, timestamp=None):
+    return {
+        'id': 'id-{}'.format(idx),
+        'cid': 'cid-{}'.format(idx),
+        'timestamp': timestamp or utcnow().isoformat(),
+        'event_type': 1_000_001,
+        'object_type': 2_000_000,
+        'object_id': 'service-{}'.format(idx % benchmark_services),
+        'total_time_ms': idx % 100,
+    }
+
+# ################################################################################################################################
+
+def run_benchmark(name, queue):
+    """ Runs in a subprocess of its own so that memory used by one way of keeping events does not affect the other.
+    """
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    start = perf_counter()
+
+    # Events are kept as they are and turned into a DataFrame when the state is synchronised ..
+    if name == 'list':
+        in_ram_store = []
+        for idx in range(benchmark_events):
+            in_ram_store.append(get_event(idx, '2056-01-02T03:04:05.123456'))
+
+        pushed = perf_counter()
+        data = pd.DataFrame(in_ram_store)
+
+    # .. or they are kept in arrays that the DataFrame uses as they are.
+    else:
+        in_ram_store = ColumnarEventBuffer(benchmark_events)
+        for idx in range(benchmark_events):
+            in_ram_store.push(get_event(idx, '2056-01-02T03:04:05.123456'))
+
+        pushed = perf_counter()
+        data = in_ram_store.to_dataframe()
+
+    built = perf_counter()
+    rss_after = process.memory_info().rss
+
+    queue.put((len(data), pushed - start, built - pushed, rss_after - rss_before))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class ColumnarEventBufferTestCase(TestCase):
+
+    def test_push(self):
+
+        buffer = ColumnarEventBuffer(2)
+
+        buffer.push(get_event(1, '2056-01-02T03:04:05.123456'))
+        buffer.push({'timestamp': datetime(2056, 1, 2, 3, 4, 6), 'object_id': 'service-1', 'source_id': 'abc'})
+        buffer.push({'timestamp': 'invalid'})
+
+        # Events are staged until there are enough of them or until they are needed ..
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.size, 0)
+
+        data = buffer.to_dataframe()
+
+        # .. at which point the buffer grows beyond its initial capacity ..
+        self.assertEqual(buffer.size, 3)
+        self.assertEqual(buffer.capacity, 4)
+
+        # .. and all the values can be read from the DataFrame.
+
+        self.assertListEqual(data['id'].tolist(), ['id-1', None, None])
+        self.assertListEqual(data['object_id'].tolist()[:2], ['service-1', 'service-1'])
+        self.assertTrue(pd.isna(data['object_id'].iloc[2]))
+        self.assertTrue(pd.isna(data['source_id'].iloc[0]))
+        self.assertEqual(data['source_id'].iloc[1], 'abc')
+        self.assertListEqual(data['total_time_ms'].tolist(), [1, 0, 0])
+
+        self.assertEqual(data['timestamp'].iloc[0], pd.Timestamp('2056-01-02T03:04:05.123456'))
+        self.assertEqual(data['timestamp'].iloc[1], pd.Timestamp('2056-01-02T03:04:06'))
+        self.assertTrue(pd.isna(data['timestamp'].iloc[2]))
+
+# ################################################################################################################################
+
+    def test_dataframe_uses_arrays(self):
+
+        buffer = ColumnarEventBuffer(10)
+
+        # There are more services than a single byte can encode ..
+        for idx in range(300):
+            buffer.push(get_event(idx))
+
+        data = buffer.to_dataframe()
+
+        # .. and still, each column uses its array rather than a copy ..
+        for name in ('id', 'timestamp', 'total_time_ms'):
+            self.assertTrue(np.shares_memory(data[name].values, buffer.columns[name]), name)
+
+        self.assertTrue(np.shares_memory(data['object_id'].cat.codes.values, buffer.columns['object_id']))
+        self.assertEqual(data['object_id'].iloc[299], 'service-299')
+
+        # .. which is why clearing the buffer does not change the DataFrame.
+        buffer.clear()
+        buffer.push(get_event(1000))
+
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(data['id'].iloc[0], 'id-0')
+        self.assertEqual(len(data), 300)
+
+# ################################################################################################################################
+
+    def test_sync_state(self):
+
+        with TemporaryDirectory() as tmp_dir:
+
+            fs_data_path = os.path.join(tmp_dir, 'events')
+
+            # Previous versions saved timestamps as strings ..
+            old = (utcnow() - timedelta(days=1)).isoformat()
+            pd.DataFrame([get_event(0, old)]).to_parquet(fs_data_path)
+
+            events_db = EventsDatabase(logger, fs_data_path, 100_000, 100_000, Stats.MaxRetention)
+
+            # .. and, with new events and ones beyond the retention time ..
+            too_old = (utcnow() - timedelta(milliseconds=Stats.MaxRetention + 60_000)).isoformat()
+            events_db.push(get_event(1))
+            events_db.push(get_event(2, too_old))
+
+            events_db.sync_state()
+            self.assertEqual(len(events_db.in_ram_store), 0)
+
+            # .. all of them are combined into timestamps ..
+            data = events_db.load_data_from_storage()
+
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(data['timestamp']))
+            self.assertListEqual(sorted(data['id'].tolist()), ['id-0', 'id-1'])
+
+            # .. and the events that are no longer retained are gone, including their services.
+            events_db.push(get_event(3, too_old))
+            events_db.sync_state()
+
+            data = events_db.load_data_from_storage()
+            self.assertListEqual(sorted(data['object_id'].unique().tolist()), ['service-0', 'service-1'])
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_push_benchmark(self):
+
+        context = get_context('fork')
+
+        for name in ('list', 'columnar'):
+
+            queue = context.Queue()
+            process = context.Process(target=run_benchmark, args=(name, queue))
+            process.start()
+
+            len_data, push_time, build_time, rss = queue.get()
+            process.join()
+
+            self.assertEqual(len_data, benchmark_events)
+
+            benchmark_logger.info('Events DB, {} events kept as {}; push: {:.2f} s, build DF: {:.3f} s, '
+                'RSS increase: {:.1f} MB'.format(
+                benchmark_events, name, push_time, build_time, rss / 1024 / 1024))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
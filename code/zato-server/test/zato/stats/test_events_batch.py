@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import logging
+import os
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import main, TestCase
+
+# gevent
+from gevent import sleep, spawn
+
+# orjson
+from orjson import dumps
+
+# Zato
+from zato.common.events.client import Client as EventsClient
+from zato.common.events.common import Action, decode_batch, encode_event, EventInfo, PushCtx
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.typing_ import asdict
+from zato.common.util.tcp import get_free_port, ZatoStreamServer
+from zato.common.util.json_ import JSONParser
+from zato.server.connection.connector.subprocess_.impl.events.container import EventsConnectionContainer
+from zato.server.connection.connector.subprocess_.impl.events.database import EventsDatabase
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_events = 100_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+utcnow = datetime.utcnow
+
+logger = logging.getLogger('zato')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_ctx(idx):
+    ctx = PushCtx()
+    ctx.id = 'id-{}'.format(idx)
+    ctx.cid = 'cid-{}'.format(idx)
+    ctx.timestamp = utcnow().isoformat()
+    ctx.event_type = EventInfo.EventType.service_response
+    ctx.object_type = EventInfo.ObjectType.service
+    ctx.object_id = 'service-{}'.format(idx % 10)
+    ctx.total_time_ms = idx % 100
+    return ctx
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class SlowSocket:
+    """ Takes a while to send each piece of data, as though the server could not keep up.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+
+    def sendall(self, data):
+        sleep(self.delay)
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class EventsBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+
+        # We do not need a subprocess here, only what handles connections
+        self.container = EventsConnectionContainer.__new__(EventsConnectionContainer)
+        self.container.keep_running = True
+        self.container._json_parser = JSONParser()
+        self.container._action_map = {
+            Action.Ping: self.container._on_event_ping,
+            Action.Push: self.container._on_event_push,
+            Action.PushBatch: self.container._on_event_push_batch,
+        }
+        self.container.events_db = EventsDatabase(logger, os.path.join(self.tmp_dir.name, 'events'), 10_000_000, 3600)
+
+        self.port = get_free_port()
+        self.server = ZatoStreamServer(('127.0.0.1', self.port), self.container._on_new_connection)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+# ################################################################################################################################
+
+    def get_client(self):
+        client = EventsClient('127.0.0.1', self.port)
+        client.connect()
+        return client
+
+# ################################################################################################################################
+
+    def wait_for_events(self, total_events, timeout=30):
+        events_db = self.container.events_db
+        wait_until = perf_counter() + timeout
+
+        while events_db.total_events < total_events and perf_counter() < wait_until:
+            sleep(0.001)
+
+        return events_db.total_events
+
+# ################################################################################################################################
+
+    def test_encode_decode(self):
+
+        ctx1 = get_ctx(1)
+        ctx2 = get_ctx(2)
+        ctx2.object_id = 'zażółć.gęślą'
+        ctx2.total_time_ms = None
+
+        events = decode_batch(encode_event(ctx1) + encode_event(ctx2))
+
+        # All the fields are decoded, including ones that were not given ..
+        expected = asdict(ctx1)
+        self.assertDictEqual(events[0], expected)
+
+        self.assertIsNone(events[0]['source_id'])
+        self.assertEqual(events[1]['object_id'], 'zażółć.gęślą')
+
+        # .. and numbers that were not given are zeros.
+        self.assertEqual(events[1]['total_time_ms'], 0)
+
+# ################################################################################################################################
+
+    def test_push_batches(self):
+
+        client = self.get_client()
+        client.batch_size = 100
+
+        # Full batches are sent immediately ..
+        for idx in range(250):
+            client.push(get_ctx(idx))
+
+        self.assertEqual(self.wait_for_events(200), 200)
+        self.assertEqual(client.total_batches, 2)
+        self.assertEqual(client.buffered, 50)
+
+        # .. and the rest when they are flushed ..
+        client.flush()
+        self.assertEqual(self.wait_for_events(250), 250)
+
+        # .. and the server has all of them.
+        data = self.container.events_db.get_data_from_ram()
+        self.assertListEqual(data['id'].tolist(), ['id-{}'.format(idx) for idx in range(250)])
+        self.assertEqual(data['total_time_ms'].sum(), sum(idx % 100 for idx in range(250)))
+
+        self.assertEqual(client.total_pushed, 250)
+        self.assertEqual(client.total_sent, 250)
+        self.assertEqual(client.total_dropped, 0)
+
+        # Other actions can be still sent on the same connection
+        client.ping()
+
+        client.close()
+
+# ################################################################################################################################
+
+    def test_flush_interval(self):
+
+        client = self.get_client()
+        client.flush_interval = 0.05
+        _ = spawn(client._flush_in_background)
+
+        client.push(get_ctx(1))
+
+        # The batch is not full but it is sent anyway
+        self.assertEqual(self.wait_for_events(1, timeout=1), 1)
+
+        client.keep_running = False
+        client.close()
+
+# ################################################################################################################################
+
+    def test_drop_if_server_slow(self):
+
+        client = EventsClient('127.0.0.1', self.port)
+        client.socket = SlowSocket(0.1)
+        client.batch_size = 10
+        client.max_buffered = 20
+
+        # The first batch takes a while to send ..
+        for idx in range(9):
+            client.push(get_ctx(idx))
+
+        _ = spawn(client.push, get_ctx(9))
+        sleep(0.01)
+        self.assertTrue(client.is_flushing)
+
+        # .. so new events are buffered, but only up to max_buffered, and then they are dropped ..
+        for idx in range(10, 40):
+            client.push(get_ctx(idx))
+
+        self.assertEqual(client.buffered, 20)
+        self.assertEqual(client.total_dropped, 10)
+
+        # .. until the previous batch is sent.
+        sleep(0.2)
+        client.flush()
+
+        self.assertEqual(client.total_sent, 30)
+        self.assertEqual(client.total_pushed, 30)
+        self.assertEqual(len(client.socket.sent), 2)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_push_benchmark(self):
+
+        ctx_list = [get_ctx(idx) for idx in range(benchmark_events)]
+        client = self.get_client()
+
+        # Each event is sent on its own, as JSON ..
+        start = perf_counter()
+        for ctx in ctx_list:
+            client.send(Action.Push, dumps(asdict(ctx)))
+        pushed = perf_counter() - start
+
+        self.assertEqual(self.wait_for_events(benchmark_events, timeout=120), benchmark_events)
+        single = perf_counter() - start
+
+        # .. compared to events sent in batches.
+        start = perf_counter()
+        for ctx in ctx_list:
+            client.push(ctx)
+        client.flush()
+        batch_pushed = perf_counter() - start
+
+        self.assertEqual(self.wait_for_events(benchmark_events * 2, timeout=120), benchmark_events * 2)
+        batch = perf_counter() - start
+
+        benchmark_logger.info('Events push of {} events; one at a time: {:,.0f}/s (client {:.2f} us/event), '
+            'batches: {:,.0f}/s (client {:.2f} us/event)'.format(
+            benchmark_events,
+            benchmark_events / single, pushed / benchmark_events * 1_000_000,
+            benchmark_events / batch, batch_pushed / benchmark_events * 1_000_000))
+
+        self.assertLess(batch, single)
+
+        client.close()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import logging
+import os
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import main, TestCase
+
+# Numpy
+import numpy as np
+
+# Pandas
+import pandas as pd
+
+# Zato
+from zato.common.api import Stats
+from zato.common.test import benchmark, benchmark_logger
+from zato.server.connection.connector.subprocess_.impl.events.database import EventsDatabase, partition_name_format
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_history_sizes = (10_000, 100_000, 1_000_000, 10_000_000)
+benchmark_new_events = 10_000
+benchmark_history_hours = 100
+benchmark_services = 500
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+utcnow = datetime.utcnow
+
+logger = logging.getLogger('zato')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_event(idx, timestamp=None):
+    return {
+        'id': 'id-{}'.format(idx),
+        'cid': 'cid-{}'.format(idx),
+        'timestamp': (timestamp or utcnow()).isoformat(),
+        'event_type': 1_000_001,
+        'object_type': 2_000_000,
+        'object_id': 'service-{}'.format(idx % benchmark_services),
+        'total_time_ms': idx % 100,
+    }
+
+# ################################################################################################################################
+
+def get_history(size, now):
+    """ Returns a DataFrame with events spread evenly across benchmark_history_hours that ended an hour ago.
+    """
+    idx = np.arange(size)
+    end = np.datetime64(now - timedelta(hours=1))
+    step = np.timedelta64(benchmark_history_hours * 3600 * 1_000_000 // size, 'us')
+
+    return pd.DataFrame({
+        'id': pd.Categorical.from_codes(idx % 1000, ['id-{}'.format(elem) for elem in range(1000)]),
+        'cid': pd.Categorical.from_codes(idx % 1000, ['cid-{}'.format(elem) for elem in range(1000)]),
+        'timestamp': end - idx * step,
+        'event_type': np.full(size, 1_000_001, dtype=np.int32),
+        'object_type': np.full(size, 2_000_000, dtype=np.int32),
+        'object_id': pd.Categorical.from_codes(idx % benchmark_services,
+            ['service-{}'.format(elem) for elem in range(benchmark_services)]),
+        'total_time_ms': (idx % 100).astype(np.int32),
+    })
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class PartitionsTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.fs_data_path = os.path.join(self.tmp_dir.name, 'events')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+# ################################################################################################################################
+
+    def get_events_db(self, **kwargs):
+        return EventsDatabase(logger, self.fs_data_path, 100_000, 100_000, Stats.MaxRetention, **kwargs)
+
+# ################################################################################################################################
+
+    def get_files(self):
+        out = {}
+        for path, _, names in os.walk(self.fs_data_path):
+            for name in names:
+                file_path = os.path.join(path, name)
+                out[file_path] = os.stat(file_path).st_mtime_ns
+        return out
+
+# ################################################################################################################################
+
+    def test_sync_appends_files(self):
+
+        events_db = self.get_events_db()
+        now = utcnow()
+
+        # Events from two different hours go to two partitions ..
+        events_db.push(get_event(0, now - timedelta(hours=2)))
+        events_db.push(get_event(1, now))
+        events_db.sync_state()
+
+        files = self.get_files()
+        self.assertEqual(len(files), 2)
+        self.assertEqual(len(events_db.get_partitions()), 2)
+
+        # .. each sync writes new files only, leaving the existing ones as they were ..
+        events_db.push(get_event(2, now))
+        events_db.sync_state()
+
+        new_files = self.get_files()
+        self.assertEqual(len(new_files), 3)
+
+        for file_path, mtime in files.items():
+            self.assertEqual(new_files[file_path], mtime)
+
+        # .. and no partial files are left behind.
+        for file_path in new_files:
+            self.assertTrue(file_path.endswith('.parquet'), file_path)
+
+        data = events_db.load_data_from_storage()
+        self.assertListEqual(sorted(data['id'].tolist()), ['id-0', 'id-1', 'id-2'])
+
+# ################################################################################################################################
+
+    def test_time_range_pruning(self):
+
+        events_db = self.get_events_db()
+        now = utcnow().replace(minute=30)
+
+        for idx in range(5):
+            events_db.push(get_event(idx, now - timedelta(hours=idx)))
+        events_db.sync_state()
+
+        # Only the partitions that may contain events from the time range are read ..
+        start = now - timedelta(hours=2, minutes=10)
+        end = now - timedelta(minutes=50)
+
+        partitions = events_db.get_partitions(start, end)
+        self.assertListEqual([partition_start.strftime(partition_name_format) for partition_start, _ in partitions],
+            [(now - timedelta(hours=idx)).strftime(partition_name_format) for idx in (2, 1)])
+
+        # .. and events from these partitions that are outside of it are not returned.
+        data = events_db.load_data_from_storage(start, end - timedelta(minutes=20))
+        self.assertListEqual(sorted(data['id'].tolist()), ['id-2'])
+
+        data = events_db.load_data_from_storage(start, end)
+        self.assertListEqual(sorted(data['id'].tolist()), ['id-1', 'id-2'])
+
+        # Directories whose names are not partitions are ignored
+        os.mkdir(os.path.join(self.fs_data_path, 'not-a-partition'))
+        self.assertEqual(len(events_db.get_partitions()), 5)
+
+# ################################################################################################################################
+
+    def test_compact(self):
+
+        events_db = self.get_events_db(compact_min_files=3)
+        now = utcnow()
+
+        # One partition gets three files and the other one only one file ..
+        for idx in range(3):
+            events_db.push(get_event(idx, now))
+            events_db.sync_state()
+
+        events_db.push(get_event(3, now - timedelta(hours=1)))
+        events_db.sync_state()
+
+        before = events_db.load_data_from_storage()
+
+        # .. which is why only the former is compacted ..
+        self.assertEqual(events_db.compact(), 1)
+
+        for _, path in events_db.get_partitions():
+            self.assertEqual(len(events_db.get_partition_files(path)), 1)
+
+        # .. and the data is still the same.
+        after = events_db.load_data_from_storage()
+
+        before = before.sort_values('id').reset_index(drop=True).astype({'id': str, 'object_id': str})
+        after = after.sort_values('id').reset_index(drop=True).astype({'id': str, 'object_id': str})
+
+        pd.testing.assert_frame_equal(before[after.columns], after, check_dtype=False, check_categorical=False)
+        self.assertEqual(events_db.compact(), 0)
+
+# ################################################################################################################################
+
+    def test_expired_partitions(self):
+
+        events_db = self.get_events_db()
+
+        too_old = utcnow() - timedelta(milliseconds=Stats.MaxRetention, hours=2)
+        events_db.push(get_event(0, too_old))
+        events_db.push(get_event(1))
+
+        # Partitions with events that are no longer retained are deleted ..
+        events_db.save_data(pd.DataFrame([get_event(0, too_old)]).astype({'timestamp': 'datetime64[ns]'}))
+        self.assertEqual(len(events_db.get_partitions()), 1)
+
+        events_db.sync_state()
+
+        # .. and such events are not even written.
+        partitions = events_db.get_partitions()
+        self.assertEqual(len(partitions), 1)
+        self.assertListEqual(events_db.load_data_from_storage()['id'].tolist(), ['id-1'])
+
+# ################################################################################################################################
+
+    def test_migrate_single_file(self):
+
+        # Previous versions kept all the events in one file, with timestamps as strings ..
+        now = utcnow()
+        data = pd.DataFrame([get_event(idx, now - timedelta(hours=idx)) for idx in range(3)])
+        data.to_parquet(self.fs_data_path)
+
+        # .. which is converted to partitions ..
+        events_db = self.get_events_db()
+
+        self.assertTrue(os.path.isdir(self.fs_data_path))
+        self.assertEqual(len(events_db.get_partitions()), 3)
+
+        data = events_db.load_data_from_storage()
+        self.assertListEqual(sorted(data['id'].tolist()), ['id-0', 'id-1', 'id-2'])
+
+        # .. including if we were stopped after the file was deleted but before the partitions were moved.
+        os.rename(self.fs_data_path, self.fs_data_path + '.migration')
+
+        events_db = self.get_events_db()
+        self.assertEqual(len(events_db.get_partitions()), 3)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_sync_benchmark(self):
+
+        now = utcnow()
+
+        for size in benchmark_history_sizes:
+
+            with TemporaryDirectory() as tmp_dir:
+
+                fs_data_path = os.path.join(tmp_dir, 'events')
+                events_db = EventsDatabase(logger, fs_data_path, 100_000, 100_000, Stats.MaxRetention)
+                events_db.logger = logging.getLogger('zato.test.disabled')
+                events_db.logger.disabled = True
+
+                history = get_history(size, now)
+                events_db.save_data(history)
+
+                for idx in range(benchmark_new_events):
+                    events_db.push(get_event(idx, now))
+
+                # A sync writes new events only, no matter how many there are already ..
+                start = perf_counter()
+                events_db.sync_state()
+                sync_time = perf_counter() - start
+
+                # .. whereas previously all of them were read, combined with the new ones and written back.
+                new = pd.DataFrame([get_event(idx, now) for idx in range(benchmark_new_events)])
+                new['timestamp'] = pd.to_datetime(new['timestamp'])
+                full_path = os.path.join(tmp_dir, 'full.parquet')
+                history.to_parquet(full_path)
+
+                start = perf_counter()
+                existing = pd.read_parquet(full_path)
+                pd.concat([existing, new]).to_parquet(full_path)
+                rewrite_time = perf_counter() - start
+
+                benchmark_logger.info('Events sync of {} new events to {} existing ones; partitioned: {:.2f} ms, '
+                    'full rewrite: {:.2f} ms'.format(
+                    benchmark_new_events, size, sync_time * 1000, rewrite_time * 1000))
+
+                if size >= 1_000_000:
+                    self.assertLess(sync_time, rewrite_time)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+import logging
+import os
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import main, TestCase
+
+# Numpy
+import numpy as np
+
+# Pandas
+import pandas as pd
+
+# Zato
+from zato.common.api import Stats
+from zato.common.test import benchmark, benchmark_logger
+from zato.server.connection.connector.subprocess_.impl.events.database import EventsDatabase
+from zato.server.connection.connector.subprocess_.impl.events.rollup import Rollups, sketch_relative_accuracy
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_events = 10_000_000
+benchmark_days = 60
+benchmark_services = 500
+benchmark_queries = 20
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+utcnow = datetime.utcnow
+
+# Rollups are given this as the current time so that buckets that are expired are always the same ones
+test_now = datetime(2023, 6, 15, 12, 34, 56, 789_000)
+
+logger = logging.getLogger('zato')
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+def get_events(size, services, start, end, seed=0):
+    """ Returns a DataFrame with events at random times from start to end, taking random times each.
+    """
+    random = np.random.default_rng(seed)
+
+    start = np.datetime64(start, 'us').astype(np.int64)
+    end = np.datetime64(end, 'us').astype(np.int64)
+
+    # Some of the events take 0 ms, which is not counted as usage
+    total_time_ms = random.lognormal(3, 1.5, size).astype(np.int64)
+    total_time_ms[random.random(size) < 0.05] = 0
+
+    return pd.DataFrame({
+        'timestamp': random.integers(start, end, size).astype('datetime64[us]').astype('datetime64[ns]'),
+        'object_id': pd.Categorical.from_codes(random.integers(0, services, size),
+            ['service-{}'.format(idx) for idx in range(services)]),
+        'total_time_ms': total_time_ms,
+    })
+
+# ################################################################################################################################
+
+def get_events_at(timestamps, services):
+    """ Returns a DataFrame with events at exactly the given times, for all the services.
+    """
+    categories = ['service-{}'.format(idx) for idx in range(services)]
+    timestamps = [timestamp for timestamp in timestamps for _ in range(services)]
+
+    return pd.DataFrame({
+        'timestamp': pd.Series(timestamps, dtype='datetime64[ns]'),
+        'object_id': pd.Categorical.from_codes(list(range(services)) * (len(timestamps) // services), categories),
+        'total_time_ms': np.full(len(timestamps), 10, dtype=np.int64),
+    })
+
+# ################################################################################################################################
+
+def get_table(data):
+    """ Computes statistics out of individual events, the way EventsDatabase.get_table used to.
+    """
+    agg_by = {
+        'item_max':  pd.NamedAgg(column='total_time_ms', aggfunc=np.max),
+        'item_min':  pd.NamedAgg(column='total_time_ms', aggfunc=np.min),
+        'item_mean': pd.NamedAgg(column='total_time_ms', aggfunc=np.mean),
+        'item_total_time':  pd.NamedAgg(column='total_time_ms', aggfunc=np.sum),
+        'item_total_usage':  pd.NamedAgg(column='total_time_ms', aggfunc=np.count_nonzero),
+    }
+
+    return data.groupby(pd.Grouper(key=Stats.TabulateAggr), observed=True).agg(**agg_by).transpose()
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class RollupsTestCase(TestCase):
+
+    def assert_table_equal(self, rollups, data, start=None, end=None, now=None):
+
+        if start:
+            data = data[data['timestamp'] >= start]
+
+        if end:
+            data = data[data['timestamp'] < end]
+
+        expected = get_table(data)
+        expected.columns = expected.columns.astype(str)
+
+        table = rollups.get_table(start, end, now)
+
+        self.assertListEqual(sorted(table.columns), sorted(expected.columns))
+        pd.testing.assert_frame_equal(table[expected.columns], expected, check_dtype=False, check_names=False)
+
+# ################################################################################################################################
+
+    def test_get_table(self):
+
+        now = test_now
+        data = get_events(20_000, 20, now - timedelta(days=40), now)
+
+        # Events are added in batches, the same way they are synced ..
+        rollups = Rollups()
+
+        for batch in np.array_split(data.sample(frac=1, random_state=0), 7):
+            rollups.add(batch, now)
+
+        # .. which gives the same statistics as if they were computed out of all the events at once.
+        self.assert_table_equal(rollups, data, now=now)
+
+# ################################################################################################################################
+
+    def test_get_table_time_range(self):
+
+        now = test_now.replace(second=0, microsecond=0)
+        data = get_events(50_000, 10, now - timedelta(days=10), now)
+
+        rollups = Rollups(minute_retention=1000 * 60 * 60 * 6, hour_retention=1000 * 60 * 60 * 24 * 3)
+        rollups.add(data, now)
+
+        # Time ranges covered by minutes, hours and days ..
+        for start, end in (
+            (now - timedelta(hours=2, minutes=17), now - timedelta(minutes=3)),
+            (now - timedelta(hours=2, minutes=17), now - timedelta(minutes=2, seconds=10)),
+            (now - timedelta(days=2, hours=5), now - timedelta(hours=3, minutes=1)),
+            (now - timedelta(days=8), now - timedelta(days=4)),
+            (now - timedelta(days=8), None),
+            (None, now - timedelta(days=5)),
+        ):
+            ranges = rollups.get_ranges(start, end, now)
+
+            # .. are aligned to the finest tier that has all the buckets needed ..
+            aligned_start = datetime.utcfromtimestamp(min(elem[1] for elem in ranges) * 60) if start else None
+            aligned_end = datetime.utcfromtimestamp(max(elem[2] for elem in ranges) * 60) if end else None
+
+            for value, aligned in ((start, aligned_start), (end, aligned_end)):
+                if value:
+                    if value >= now - timedelta(hours=5):
+                        self.assertLess(abs(aligned - value), timedelta(minutes=1))
+                    elif value >= now - timedelta(days=2):
+                        self.assertLess(abs(aligned - value), timedelta(hours=1))
+
+            # .. and only as few buckets as possible are read.
+            self.assertLessEqual(len(ranges), 5)
+
+            self.assert_table_equal(rollups, data, aligned_start, aligned_end, now)
+
+# ################################################################################################################################
+
+    def test_expire(self):
+
+        now = test_now
+
+        # Each tier keeps buckets only up to its retention time, aligned to buckets of the next tier ..
+        minute_cutoff = (now - timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+        hour_cutoff = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        day_cutoff = (now - timedelta(days=3)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # .. and there are events right at each of the cutoffs as well as just before them.
+        boundaries = []
+        for cutoff in (minute_cutoff, hour_cutoff, day_cutoff):
+            boundaries.extend((cutoff, cutoff - timedelta(microseconds=1)))
+
+        data = pd.concat([get_events(10_000, 5, now - timedelta(days=5), now), get_events_at(boundaries, 5)],
+            ignore_index=True)
+
+        rollups = Rollups(max_retention=1000 * 60 * 60 * 24 * 3, minute_retention=1000 * 60 * 60,
+            hour_retention=1000 * 60 * 60 * 24)
+        rollups.add(data, now)
+
+        for tier, cutoff in ((rollups.minute, minute_cutoff), (rollups.hour, hour_cutoff), (rollups.day, day_cutoff)):
+            buckets = tier.bucket[:tier.size]
+            self.assertEqual(datetime.utcfromtimestamp(buckets.min() * 60), cutoff, tier.name)
+            self.assertEqual(len(tier.index), tier.size)
+
+        # Whatever is retained is what the statistics are built from
+        self.assert_table_equal(rollups, data, day_cutoff, now=now)
+
+# ################################################################################################################################
+
+    def test_get_quantiles(self):
+
+        now = test_now
+        data = get_events(30_000, 5, now - timedelta(days=3), now)
+
+        rollups = Rollups()
+
+        for batch in np.array_split(data, 3):
+            rollups.add(batch, now)
+
+        quantiles = [0, 0.5, 0.9, 0.99, 1]
+        estimated = rollups.get_quantiles(quantiles, now=now)
+
+        for object_id, values in data.groupby('object_id')['total_time_ms']:
+            for quantile in quantiles:
+                actual = np.quantile(values, quantile, method='lower')
+                self.assertLessEqual(abs(estimated.loc[quantile, object_id] - actual), actual * sketch_relative_accuracy,
+                    (object_id, quantile))
+
+# ################################################################################################################################
+
+    def test_events_database(self):
+
+        # Unlike rollups on their own, the database expires its events as of the actual current time
+        now = utcnow()
+        data = get_events(5_000, 5, now - timedelta(days=2), now)
+
+        # Events are saved in storage and statistics are updated with each sync ..
+        with TemporaryDirectory() as tmp_dir:
+
+            fs_data_path = os.path.join(tmp_dir, 'events')
+            events_db = EventsDatabase(logger, fs_data_path, 100_000, 100_000, Stats.MaxRetention)
+
+            for batch in np.array_split(data, 3):
+                for row in batch.itertuples():
+                    events_db.push({
+                        'id': 'id',
+                        'cid': 'cid',
+                        'timestamp': row.timestamp.isoformat(),
+                        'event_type': 1_000_001,
+                        'object_type': 2_000_000,
+                        'object_id': row.object_id,
+                        'total_time_ms': row.total_time_ms,
+                    })
+                events_db.sync_state()
+
+            table = events_db.get_table()
+            expected = get_table(events_db.load_data_from_storage())
+
+            pd.testing.assert_frame_equal(table[expected.columns], expected, check_dtype=False, check_names=False)
+
+            # .. and they are built again from storage when the database is started.
+            events_db = EventsDatabase(logger, fs_data_path, 100_000, 100_000, Stats.MaxRetention)
+            pd.testing.assert_frame_equal(events_db.get_table(), table)
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_get_table_benchmark(self):
+
+        now = test_now
+        data = get_events(benchmark_events, benchmark_services, now - timedelta(days=benchmark_days), now)
+
+        # Events are synced in the order they arrive in
+        data = data.sort_values('timestamp', ignore_index=True)
+
+        start = perf_counter()
+        rollups = Rollups()
+
+        for batch in np.array_split(data, benchmark_events // 30_000):
+            rollups.add(batch, now)
+
+        add_time = perf_counter() - start
+
+        # Statistics of all the events and of the last day, computed out of the events themselves ..
+        last_day = now - timedelta(days=1)
+
+        start = perf_counter()
+        for _ in range(benchmark_queries):
+            _ = get_table(data)
+            _ = get_table(data[data['timestamp'] >= last_day])
+        full_time = (perf_counter() - start) / benchmark_queries
+
+        # .. and read from rollups.
+        start = perf_counter()
+        for _ in range(benchmark_queries):
+            _ = rollups.get_table(now=now)
+            _ = rollups.get_table(last_day, now=now)
+        rollup_time = (perf_counter() - start) / benchmark_queries
+
+        benchmark_logger.info('Events statistics of {} events, {} services, {} days; full recomputation: {:.2f} ms, '
+            'rollups: {:.2f} ms, rollups updated in {:.2f} us per event'.format(
+            benchmark_events, benchmark_services, benchmark_days, full_time * 1000, rollup_time * 1000,
+            add_time / benchmark_events * 1_000_000))
+
+        self.assertLess(rollup_time, full_time)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
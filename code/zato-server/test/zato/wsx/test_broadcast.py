@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+from json import dumps, loads
+from time import perf_counter
+from unittest import main, TestCase
+
+# gevent
+from gevent import joinall, sleep, spawn, spawn_later
+from gevent.lock import RLock
+
+# ws4py
+from ws4py.streaming import Stream
+
+# Zato
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.util.api import new_cid
+from zato.server.connection.web_socket import WebSocket, WebSocketContainer
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if 0:
+    from zato.common.typing_ import any_
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_clients = 20_000
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class Config:
+    name = 'test.wsx.broadcast'
+
+# ################################################################################################################################
+
+class FakeSocket:
+    """ Collects everything that is sent through it, optionally taking a while to send each piece of data.
+    """
+    def __init__(self, delay:'float'=0) -> 'None':
+        self.delay = delay
+        self.sent = []
+
+    def sendall(self, data:'bytes') -> 'None':
+        if self.delay:
+            sleep(self.delay)
+        self.sent.append(data)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class BroadcastTestCase(TestCase):
+
+    def get_container(self) -> 'WebSocketContainer':
+
+        # We do not need a WSGI server here, only what broadcasts use
+        container = WebSocketContainer.__new__(WebSocketContainer)
+        container.config = Config()
+        container.clients = {}
+        container.clients_by_attr = {}
+        container.broadcast_concurrency = 100
+        container.broadcast_max_in_flight = 2
+
+        return container
+
+# ################################################################################################################################
+
+    def add_client(self, container:'WebSocketContainer', client_attrs:'any_'=None, delay:'float'=0) -> 'WebSocket':
+
+        # We do not need a network connection here, only what sending messages uses
+        client = WebSocket.__new__(WebSocket)
+        client.container = container
+        client.pub_client_id = 'ws.{}'.format(new_cid())
+        client.python_id = client.ext_client_id = client.ext_client_name = client.peer_conn_info_pretty = 'test'
+        client.client_attrs = {}
+        client.broadcasts_in_flight = 0
+        client.is_audit_log_sent_active = False
+        client.client_terminated = client.server_terminated = False
+        client.sock = FakeSocket(delay)
+        client.stream = Stream(always_mask=False)
+        client._write_lock = RLock()
+        client._json_dump_func = dumps
+
+        container.clients[client.pub_client_id] = client
+
+        if client_attrs:
+            client.set_client_attrs(client_attrs)
+
+        return client
+
+# ################################################################################################################################
+
+    def test_broadcast_same_frame(self):
+
+        container = self.get_container()
+        clients = [self.add_client(container) for _ in range(10)]
+
+        cid = new_cid()
+        container.send_to_clients(cid, '{"hello":"world"}', list(container.clients.values()))
+
+        # Each client receives the very same frame ..
+        frame = clients[0].sock.sent[0]
+
+        for client in clients:
+            self.assertEqual(len(client.sock.sent), 1)
+            self.assertIs(client.sock.sent[0], frame)
+            self.assertEqual(client.broadcasts_in_flight, 0)
+
+        # .. which is an unmasked text frame with the whole message in it.
+        self.assertEqual(frame[0], 0x81)
+
+        msg = loads(frame[frame.index(b'{'):])
+        self.assertEqual(msg['meta']['id'], cid)
+        self.assertDictEqual(msg['data'], {'hello': 'world'})
+
+# ################################################################################################################################
+
+    def test_broadcast_slow_client(self):
+
+        container = self.get_container()
+
+        fast = self.add_client(container)
+        slow = self.add_client(container, delay=0.2)
+
+        # Many messages are broadcast while the slow client is still receiving the first ones ..
+        greenlets = [spawn_later(idx * 0.02, container.send_to_clients, new_cid(), {'idx': idx}, [fast, slow])
+            for idx in range(5)]
+        joinall(greenlets)
+
+        # .. which is why it does not receive more than it can keep up with.
+        self.assertEqual(len(fast.sock.sent), 5)
+        self.assertEqual(len(slow.sock.sent), container.broadcast_max_in_flight)
+
+# ################################################################################################################################
+
+    def test_broadcast_terminated_client(self):
+
+        container = self.get_container()
+
+        client1 = self.add_client(container, {'region': 'eu'})
+        client2 = self.add_client(container, {'region': 'eu'})
+
+        # We do not need a network connection here, only what disconnecting clients uses
+        client2.config = Config()
+        client2._peer_address = client2._peer_fqdn = client2._local_address = 'test'
+        client2.pending_responses = {}
+        client2.is_audit_log_received_active = False
+        client2.unregister_auth_client = lambda: None
+
+        # The socket of one of the clients is closed ..
+        client2.client_terminated = client2.server_terminated = True
+
+        container.send_to_clients(new_cid(), {'hello': 'world'}, container.get_clients_by_attrs({'region': 'eu'}))
+
+        # .. which is why it receives nothing and it is disconnected ..
+        self.assertEqual(len(client1.sock.sent), 1)
+        self.assertEqual(len(client2.sock.sent), 0)
+        self.assertEqual(client2.broadcasts_in_flight, 0)
+
+        # .. so that next broadcasts are not sent to it.
+        self.assertListEqual(list(container.clients), [client1.pub_client_id])
+        self.assertListEqual(container.get_clients_by_attrs({'region': 'eu'}), [client1])
+
+# ################################################################################################################################
+
+    def test_clients_by_attrs(self):
+
+        container = self.get_container()
+
+        client1 = self.add_client(container, {'region': 'eu', 'tier': 1})
+        client2 = self.add_client(container, {'region': 'us', 'tier': 1})
+        client3 = self.add_client(container, {'region': 'eu', 'tags': ['a', 'b']})
+
+        def get_ids(attrs):
+            return sorted(client.pub_client_id for client in container.get_clients_by_attrs(attrs))
+
+        # Clients that have any of the attributes are returned ..
+        self.assertListEqual(get_ids({'region': 'eu'}), sorted([client1.pub_client_id, client3.pub_client_id]))
+        self.assertListEqual(get_ids({'region': 'us', 'tier': 1}), sorted([client1.pub_client_id, client2.pub_client_id]))
+
+        # .. including ones whose values cannot be hashed ..
+        self.assertListEqual(get_ids({'tags': ['a', 'b']}), [client3.pub_client_id])
+        self.assertListEqual(get_ids({'tags': ['c']}), [])
+
+        # .. the index follows changes to attributes ..
+        client2.set_client_attrs({'region': 'eu'})
+        self.assertListEqual(get_ids({'tier': 1}), [client1.pub_client_id])
+        self.assertEqual(len(get_ids({'region': 'eu'})), 3)
+
+        # .. and clients that are no longer connected.
+        container.remove_client(client1)
+        container.remove_client(client3)
+
+        self.assertListEqual(get_ids({'region': 'eu'}), [client2.pub_client_id])
+        self.assertListEqual(get_ids({'tier': 1}), [])
+        self.assertListEqual(list(container.clients_by_attr), [('region', 'eu')])
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_broadcast_benchmark(self):
+
+        container = self.get_container()
+        clients = [self.add_client(container) for _ in range(benchmark_clients)]
+        request = {'data': 'abc' * 100}
+
+        # Each client is invoked in a greenlet of its own and serialises the message itself ..
+        start = perf_counter()
+        joinall([spawn(client.invoke_client, new_cid(), request, wait_for_response=False) for client in clients])
+        per_client = perf_counter() - start
+
+        # .. compared to a message serialised and encoded once for all of them.
+        start = perf_counter()
+        container.send_to_clients(new_cid(), request, clients)
+        once = perf_counter() - start
+
+        benchmark_logger.info('WSX broadcast to {} clients; invoke_client per client: {:.2f} ms, '
+            'frame encoded once: {:.2f} ms'.format(
+            benchmark_clients, per_client * 1000, once * 1000))
+
+        self.assertLess(once, per_client)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2023, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# This needs to run as soon as possible
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+from json import dumps, loads
+from time import perf_counter
+from unittest import main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn
+from gevent.pool import Pool
+
+# Zato
+from zato.common.test import benchmark, benchmark_logger
+from zato.common.util.api import new_cid
+from zato.server.connection.web_socket import WebSocket
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+benchmark_in_flight = 1000
+benchmark_calls = 10_000
+benchmark_sequential_calls = 100
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class LoopbackClient:
+    """ Replies to each request received through a WebSocket's send method with the same data it was sent,
+    as if it were a remote client, optionally after a delay.
+    """
+    def __init__(self, wsx:'WebSocket', delay:'float'=0) -> 'None':
+        self.wsx = wsx
+        self.delay = delay
+        self.is_responding = True
+
+    def send(self, serialized:'str', cid:'str', in_reply_to:'str') -> 'None':
+        _ = spawn(self._respond, loads(serialized))
+
+    def _respond(self, request:'Bunch') -> 'None':
+
+        if self.delay:
+            sleep(self.delay)
+
+        if self.is_responding:
+            response = Bunch(in_reply_to=request['meta']['id'], data=request['data'])
+            self.wsx._handle_client_response(new_cid(), response)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+class InvokeClientTestCase(TestCase):
+
+    def get_wsx(self, delay:'float'=0) -> 'WebSocket':
+
+        # We do not need a network connection here, only what invoke_client uses
+        wsx = WebSocket.__new__(WebSocket)
+        wsx.pending_responses = {}
+        wsx.python_id = wsx.pub_client_id = wsx.ext_client_id = wsx.ext_client_name = 'test'
+        wsx.peer_conn_info_pretty = 'test'
+        wsx._json_dump_func = dumps
+
+        wsx.client = LoopbackClient(wsx, delay)
+        wsx.send = wsx.client.send
+
+        return wsx
+
+# ################################################################################################################################
+
+    def test_invoke_client_response(self):
+
+        wsx = self.get_wsx()
+
+        response = wsx.invoke_client(new_cid(), {'hello': 'world'})
+
+        self.assertDictEqual(response, {'hello': 'world'})
+        self.assertDictEqual(wsx.pending_responses, {})
+
+# ################################################################################################################################
+
+    def test_invoke_client_concurrent(self):
+
+        wsx = self.get_wsx(delay=0.01)
+        pool = Pool(100)
+
+        # Responses arrive in a different order than requests were sent in but each goes to its own caller
+        responses = pool.map(lambda idx: wsx.invoke_client(new_cid(), {'idx': idx}), range(500))
+
+        self.assertListEqual([response['idx'] for response in responses], list(range(500)))
+        self.assertDictEqual(wsx.pending_responses, {})
+
+# ################################################################################################################################
+
+    def test_invoke_client_timeout(self):
+
+        wsx = self.get_wsx(delay=0.2)
+
+        # No response in time ..
+        response = wsx.invoke_client(new_cid(), {'hello': 'world'}, timeout=0.05)
+        self.assertIsNone(response)
+
+        # .. and nothing is left behind, not even once the response arrives.
+        self.assertDictEqual(wsx.pending_responses, {})
+
+        sleep(0.3)
+        self.assertDictEqual(wsx.pending_responses, {})
+
+# ################################################################################################################################
+
+    def test_invoke_client_no_wait(self):
+
+        wsx = self.get_wsx()
+        wsx.client.is_responding = False
+
+        response = wsx.invoke_client(new_cid(), {'hello': 'world'}, wait_for_response=False)
+
+        self.assertIsNone(response)
+        self.assertDictEqual(wsx.pending_responses, {})
+
+# ################################################################################################################################
+
+    @benchmark
+    def test_invoke_client_benchmark(self):
+
+        wsx = self.get_wsx()
+        pool = Pool(benchmark_in_flight)
+
+        start = perf_counter()
+        _ = pool.map(lambda idx: wsx.invoke_client(new_cid(), {'idx': idx}), range(benchmark_calls))
+        taken = perf_counter() - start
+
+        benchmark_logger.info('WSX invoke_client with {} calls in flight; {} calls: {:.2f} ms, per call: {:.2f} us'.format(
+            benchmark_in_flight, benchmark_calls, taken * 1000, taken / benchmark_calls * 1_000_000))
+
+        # One call at a time shows how long each caller waits for its response
+        start = perf_counter()
+        for idx in range(benchmark_sequential_calls):
+            _ = wsx.invoke_client(new_cid(), {'idx': idx})
+        taken = perf_counter() - start
+
+        benchmark_logger.info('WSX invoke_client one call at a time; round trip: {:.2f} us'.format(
+            taken / benchmark_sequential_calls * 1_000_000))
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    _ = main()
+
+# ################################################################################################################################
+# ################################################################################################################################
@@ -17,7 +17,7 @@ $(document).ready(function() {
     $.fn.zato.data_table.new_row_func = $.fn.zato.cache.builtin.data_table.new_row;
     $.fn.zato.data_table.add_row_hook = $.fn.zato.cache.builtin.add_row_hook;
     $.fn.zato.data_table.parse();
-    $.fn.zato.data_table.setup_forms(['name', 'max_size', 'max_item_size', 'sync_method', 'persistent_storage']);
+    $.fn.zato.data_table.setup_forms(['name', 'max_size', 'max_item_size', 'max_bytes', 'sync_method', 'persistent_storage']);
 })
 
 // ///////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
@@ -63,6 +63,8 @@ $.fn.zato.cache.builtin.data_table.new_row = function(item, data, include_tr) {
     row += String.format('<td>{0}</td>', "<span class='form_hint'>(n/a)</span>");
     row += String.format('<td>{0}</td>', item.max_size);
     row += String.format('<td>{0}</td>', item.max_item_size);
+    row += String.format('<td>{0}</td>', "<span class='form_hint'>(n/a)</span>");
+    row += String.format('<td>{0}</td>', item.max_bytes || 0);
     row += String.format('<td>{0}</td>', extend_expiry_on_get ? "Yes":"No");
     row += String.format('<td>{0}</td>', extend_expiry_on_set ? "Yes":"No");
 
@@ -80,6 +82,7 @@ $.fn.zato.cache.builtin.data_table.new_row = function(item, data, include_tr) {
     row += String.format("<td class='ignore'>{0}</td>", is_default);
     row += String.format("<td class='ignore'>{0}</td>", item.extend_expiry_on_get);
     row += String.format("<td class='ignore'>{0}</td>", item.extend_expiry_on_set);
+    row += String.format("<td class='ignore'>{0}</td>", item.use_key_index == true);
     row += String.format("<td class='ignore'>{0}</td>", data.cache_id);
 
     if(include_tr) {
@@ -108,6 +111,7 @@ $.fn.zato.cache.builtin.clear = function(id) {
 
     var _callback = function() {
         $('#cache_current_size_' + id).html('0');
+        $('#cache_current_bytes_' + id).html('0');
     }
 
     $.fn.zato.data_table.delete_(id, 'td.item_id_',